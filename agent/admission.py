@@ -0,0 +1,145 @@
+﻿# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Iterator
+
+from .config import (
+    LLM_MAX_CONCURRENCY,
+    LLM_MAX_PER_USER,
+    LLM_QUEUE_SIZE,
+    LLM_QUEUE_TIMEOUT,
+)
+
+
+class AdmissionRejected(Exception):
+    '''
+    功能：
+    LLM 调用被准入控制拒绝（排队已满、等待超时或单用户并发超限）。
+    '''
+
+    def __init__(self, reason: str, status: int, retry_after: int) -> None:
+        super().__init__(reason)
+        self.reason = reason
+        self.status = status
+        self.retry_after = retry_after
+
+
+class ConcurrencyLimiter:
+    '''
+    功能：
+    全局 + 单用户并发限制，超出全局并发时进入有界等待队列；
+    队列已满或等待超时返回 503，单用户超限直接返回 429。
+    '''
+
+    def __init__(
+        self, max_concurrency: int, max_per_user: int, queue_size: int, queue_timeout: float
+    ) -> None:
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_per_user = max(1, max_per_user)
+        self.queue_size = max(0, queue_size)
+        self.queue_timeout = queue_timeout
+        self._cond = threading.Condition()
+        self._active = 0
+        self._waiting = 0
+        self._per_user: Dict[str, int] = {}
+        self._admitted = 0
+        self._rejected_user = 0
+        self._rejected_queue = 0
+        self._timeouts = 0
+        self._waits: Deque[float] = deque(maxlen=1024)
+        self._holds: Deque[float] = deque(maxlen=256)
+
+    def _retry_after(self) -> int:
+        avg_hold = sum(self._holds) / len(self._holds) if self._holds else 1.0
+        return max(1, math.ceil(avg_hold * (self._waiting / self.max_concurrency + 1)))
+
+    @contextmanager
+    def acquire(self, user_id: str) -> Iterator[None]:
+        '''
+        功能：
+        申请一个 LLM 调用名额，退出上下文时释放。
+
+        :param user_id: 用户唯一标识
+        :type user_id: str
+        :return: 上下文管理器
+        :rtype: Iterator[None]
+        '''
+        started = time.monotonic()
+        with self._cond:
+            if self._per_user.get(user_id, 0) >= self.max_per_user:
+                self._rejected_user += 1
+                raise AdmissionRejected("user_concurrency_exceeded", 429, self._retry_after())
+            if self._active >= self.max_concurrency and self._waiting >= self.queue_size:
+                self._rejected_queue += 1
+                raise AdmissionRejected("llm_queue_full", 503, self._retry_after())
+
+            self._per_user[user_id] = self._per_user.get(user_id, 0) + 1
+            self._waiting += 1
+            deadline = started + self.queue_timeout
+            try:
+                while self._active >= self.max_concurrency:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        self._release_user(user_id)
+                        raise AdmissionRejected("llm_queue_timeout", 503, self._retry_after())
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting -= 1
+            self._active += 1
+            self._admitted += 1
+            self._waits.append(time.monotonic() - started)
+
+        admitted_at = time.monotonic()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active -= 1
+                self._release_user(user_id)
+                self._holds.append(time.monotonic() - admitted_at)
+                self._cond.notify()
+
+    def _release_user(self, user_id: str) -> None:
+        count = self._per_user.get(user_id, 0) - 1
+        if count > 0:
+            self._per_user[user_id] = count
+        else:
+            self._per_user.pop(user_id, None)
+
+    def snapshot(self) -> Dict[str, Any]:
+        '''
+        功能：
+        返回当前并发、队列深度与等待时间等指标。
+
+        :return: 指标字典
+        :rtype: Dict[str, Any]
+        '''
+        with self._cond:
+            waits = sorted(self._waits)
+            holds = list(self._holds)
+            return {
+                "max_concurrency": self.max_concurrency,
+                "max_per_user": self.max_per_user,
+                "queue_size": self.queue_size,
+                "active": self._active,
+                "queue_depth": self._waiting,
+                "admitted": self._admitted,
+                "rejected_user": self._rejected_user,
+                "rejected_queue_full": self._rejected_queue,
+                "queue_timeouts": self._timeouts,
+                "wait_ms_avg": round(sum(waits) / len(waits) * 1000, 2) if waits else 0.0,
+                "wait_ms_p95": round(waits[int(len(waits) * 0.95)] * 1000, 2) if waits else 0.0,
+                "wait_ms_max": round(waits[-1] * 1000, 2) if waits else 0.0,
+                "llm_ms_avg": round(sum(holds) / len(holds) * 1000, 2) if holds else 0.0,
+            }
+
+
+llm_limiter = ConcurrencyLimiter(
+    LLM_MAX_CONCURRENCY, LLM_MAX_PER_USER, LLM_QUEUE_SIZE, LLM_QUEUE_TIMEOUT
+)
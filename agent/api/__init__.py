@@ -6,11 +6,21 @@ import os
 
 from flask import Flask
 
-from ..config import APP_VERSION
+from ..config import APP_VERSION, WARMUP_ASYNC
+from ..precompute import start_precompute_scheduler
+from ..warmup import start_warmup
+from .admin import register_admin_routes
 from .decision import register_decision_routes
+from .events import register_event_routes
+from .export import register_export_routes
 from .feedback import register_feedback_routes
+from .health import register_health_routes
+from .memory import register_memory_routes
+from .metrics import register_metrics_routes
 from .pages import register_page_routes
+from .precompute import register_precompute_routes
 from .qa import register_qa_routes
+from .usage import register_usage_routes
 
 logging.basicConfig(
     level=logging.INFO,
@@ -27,4 +37,18 @@ register_page_routes(app)
 register_decision_routes(app)
 register_feedback_routes(app)
 register_qa_routes(app)
+register_metrics_routes(app)
+register_admin_routes(app)
+register_export_routes(app)
+register_health_routes(app)
+register_usage_routes(app)
+register_memory_routes(app)
+register_precompute_routes(app)
+register_event_routes(app)
 logger.info("registered routes: %s", app.url_map)
+
+# 预热存储、决策表与模型客户端，完成后 /readyz 才返回 200
+start_warmup(background=WARMUP_ASYNC)
+
+# 低峰时段为活跃用户预生成次日决策（PRECOMPUTE_ENABLED）
+start_precompute_scheduler()
@@ -0,0 +1,92 @@
+﻿# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import hmac
+from typing import Any, Optional
+
+from flask import Flask, Response, jsonify, request
+
+from ..config import ADMIN_TOKEN, PROFILER_MAX_SECONDS
+from ..profiler import profiler
+from .routes import ADMIN_PROFILE_FLASK_API
+
+
+def admin_denied() -> Optional[Any]:
+    '''
+    功能：
+    校验管理接口令牌（请求头 X-Admin-Token），未配置 ADMIN_TOKEN 时管理接口整体关闭。
+
+    :return: 拒绝时返回 Flask Response，通过返回 None
+    :rtype: Optional[Any]
+    '''
+    if not ADMIN_TOKEN:
+        return jsonify({"error": "admin_disabled"}), 403
+    token = request.headers.get("X-Admin-Token", "")
+    if not hmac.compare_digest(token.encode("utf-8"), ADMIN_TOKEN.encode("utf-8")):
+        return jsonify({"error": "forbidden"}), 403
+    return None
+
+
+def register_admin_routes(app: Flask) -> None:
+    '''
+    功能：
+    注册管理接口路由（采样分析等）。
+
+    :param app: Flask 应用实例
+    :type app: Flask
+    :return: 无
+    :rtype: None
+    '''
+
+    @app.before_request
+    def _profiler_mark() -> None:
+        if profiler.active:
+            rule = request.url_rule.rule if request.url_rule is not None else ""
+            profiler.mark_request(rule, request.path)
+
+    @app.teardown_request
+    def _profiler_clear(_exc: Optional[BaseException]) -> None:
+        if profiler.active:
+            profiler.clear_request()
+
+    @app.post(ADMIN_PROFILE_FLASK_API)
+    def admin_profile() -> Any:
+        '''
+        功能：
+        在有限时间窗口内对请求线程做采样分析，返回 flamegraph collapsed 格式文本。
+        参数：seconds（默认 10）、interval_ms（默认 5）、route（只采样该路由）、all_threads。
+
+        :return: text/plain Response
+        :rtype: Any
+        '''
+        denied = admin_denied()
+        if denied is not None:
+            return denied
+        try:
+            seconds = float(request.args.get("seconds", "10"))
+            interval_ms = float(request.args.get("interval_ms", "5"))
+        except ValueError:
+            return jsonify({"error": "invalid_request"}), 400
+        seconds = min(max(seconds, 0.1), PROFILER_MAX_SECONDS)
+        interval_ms = min(max(interval_ms, 1.0), 1000.0)
+        route = request.args.get("route") or None
+        all_threads = request.args.get("all_threads", "false").lower() in ("1", "true", "yes")
+
+        try:
+            text, summary = profiler.run(seconds, interval_ms / 1000.0, route, all_threads)
+        except RuntimeError:
+            return jsonify({"error": "profiler_busy"}), 409
+
+        app.logger.info(
+            "profile seconds=%s interval_ms=%s route=%s ticks=%s samples=%s stacks=%s",
+            seconds,
+            interval_ms,
+            route,
+            summary["ticks"],
+            summary["samples"],
+            summary["stacks"],
+        )
+        resp = Response(text + ("\n" if text else ""), mimetype="text/plain")
+        resp.headers["X-Profile-Samples"] = str(summary["samples"])
+        resp.headers["X-Profile-Ticks"] = str(summary["ticks"])
+        return resp
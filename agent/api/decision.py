@@ -1,15 +1,38 @@
 ﻿# -*- coding: utf-8 -*-
 from __future__ import annotations
 
-from typing import Any, Dict
+import json
+import logging
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, stream_with_context, url_for
 
-from .routes import DECISION_FLASK_API
+from .idempotency import idempotency_error_response, idempotency_key, idempotent_response
+from .routes import (
+    DECISION_EVENTS_FLASK_API,
+    DECISION_FLASK_API,
+    DECISION_RECORD_FLASK_API,
+    DECISION_REFINEMENT_FLASK_API,
+)
+from ..admission import AdmissionRejected
+from ..config import LLM_DEGRADE_TO_DRAFT, PRECOMPUTE_ENABLED, PROGRESSIVE_SSE_TIMEOUT
 from ..decision_engine import rule_decision
+from ..decision_index import find_decision, index_decision, refresh_output
+from ..event_log import emit_event
+from ..idempotency import IdempotencyError, run_idempotent
 from ..llm_agent import run_langchain_agent
 from ..memory_store import get_state, set_state
 from ..models import DecisionRequest
+from ..precompute import reuse_precomputed, take_precomputed
+from ..progressive import refinements
+from ..singleflight import coalesce_decision, request_key
+
+logger = logging.getLogger("agent")
+
+_SSE_HEARTBEAT = 15.0
+# 润色由其他 worker 受理时轮询决策记录的间隔（秒）
+_STORE_POLL_INTERVAL = 0.5
 
 
 def _parse_pydantic(model_cls, payload: Dict[str, Any]):
@@ -30,6 +53,144 @@ def _parse_pydantic(model_cls, payload: Dict[str, Any]):
         return None, str(exc)
 
 
+def _rejected_response(exc: AdmissionRejected) -> Any:
+    '''
+    功能：
+    将准入拒绝转换为带 Retry-After 的 429/503 响应。
+
+    :param exc: 准入拒绝异常
+    :type exc: AdmissionRejected
+    :return: Flask Response
+    :rtype: Any
+    '''
+    resp = jsonify({"error": exc.reason, "retry_after": exc.retry_after})
+    resp.status_code = exc.status
+    resp.headers["Retry-After"] = str(exc.retry_after)
+    return resp
+
+
+def _keep_slate(draft: Dict[str, Any], final_output: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    功能：
+    组合的名额 ID 已写入用户状态，以规则层为准，避免 LLM 改写或遗漏。
+
+    :param draft: 规则草案
+    :type draft: Dict[str, Any]
+    :param final_output: LLM 输出的最终决策
+    :type final_output: Dict[str, Any]
+    :return: 最终决策
+    :rtype: Dict[str, Any]
+    '''
+    if "slate" in draft:
+        final_output["slate"] = draft["slate"]
+        final_output["decision_id"] = draft["decision_id"]
+    return final_output
+
+
+def _refine(draft: Dict[str, Any], user_id: str) -> Tuple[Dict[str, Any], List[str]]:
+    '''
+    功能：
+    后台润色：在已返回的草案上调用 LLM，准入被拒时以草案完成。
+    decision_id 已返回给调用方并写入状态，始终沿用草案的 ID。
+
+    :param draft: 规则草案
+    :type draft: Dict[str, Any]
+    :param user_id: 用户唯一标识
+    :type user_id: str
+    :return: (最终决策, agent 标记列表)
+    :rtype: Tuple[Dict[str, Any], List[str]]
+    '''
+    try:
+        final_output, agent_flags = run_langchain_agent(draft, user_id=user_id)
+    except AdmissionRejected as exc:
+        final_output, agent_flags = draft, [f"agent:degraded:{exc.reason}"]
+    except Exception as exc:
+        # 与 RefinementRegistry 的失败处理一致，同时写入决策记录供其他 worker 查询
+        refresh_output(
+            draft["decision_id"],
+            user_id,
+            draft,
+            {"status": "failed", "agent_flags": [f"agent:error:{type(exc).__name__}"]},
+        )
+        raise
+    final_output = _keep_slate(draft, final_output)
+    final_output["decision_id"] = draft["decision_id"]
+    refresh_output(
+        draft["decision_id"], user_id, final_output, {"status": "done", "agent_flags": agent_flags}
+    )
+    emit_event(
+        "decision_refined",
+        user_id=user_id,
+        decision_id=draft["decision_id"],
+        output=final_output,
+        agent_flags=agent_flags,
+    )
+    logger.info(
+        "decision refined user_id=%s decision_id=%s agent=%s", user_id, draft["decision_id"], agent_flags
+    )
+    return final_output, agent_flags
+
+
+def _refinement_view(entry: Dict[str, Any]) -> Dict[str, Any]:
+    view = {
+        "decision_id": entry["decision_id"],
+        "status": entry["status"],
+        "agent_flags": entry["agent_flags"],
+    }
+    if entry["status"] != "pending":
+        view["output"] = entry["output"]
+    return view
+
+
+def _stored_refinement(decision_id: str) -> Optional[Dict[str, Any]]:
+    '''
+    功能：
+    从决策记录读取润色状态（润色由其他 worker 受理，或本进程的结果已淘汰时使用）。
+
+    :param decision_id: 决策 ID
+    :type decision_id: str
+    :return: 与 RefinementRegistry 相同结构的任务状态，不是渐进式决策或记录不存在时返回 None
+    :rtype: Optional[Dict[str, Any]]
+    '''
+    record = find_decision(decision_id)
+    refinement = (record or {}).get("refinement")
+    if not refinement:
+        return None
+    return {
+        "decision_id": decision_id,
+        "status": refinement.get("status", "pending"),
+        "agent_flags": refinement.get("agent_flags") or [],
+        "output": record.get("output"),
+    }
+
+
+def _wait_refinement(decision_id: str, timeout: float) -> Optional[Dict[str, Any]]:
+    '''
+    功能：
+    等待润色完成（最多 timeout 秒）：本进程受理的任务等待进程内结果，否则轮询决策记录。
+
+    :param decision_id: 决策 ID
+    :type decision_id: str
+    :param timeout: 最长等待秒数
+    :type timeout: float
+    :return: 任务状态，未知返回 None
+    :rtype: Optional[Dict[str, Any]]
+    '''
+    if refinements.get(decision_id) is not None:
+        return refinements.wait(decision_id, timeout)
+    deadline = time.monotonic() + max(timeout, 0.0)
+    while True:
+        entry = _stored_refinement(decision_id)
+        remaining = deadline - time.monotonic()
+        if entry is None or entry["status"] != "pending" or remaining <= 0:
+            return entry
+        time.sleep(min(_STORE_POLL_INTERVAL, remaining))
+
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
 def register_decision_routes(app: Flask) -> None:
     '''
     功能：
@@ -55,21 +216,183 @@ def register_decision_routes(app: Flask) -> None:
         if err:
             return jsonify({"error": "invalid_request", "detail": err}), 400
 
-        state = get_state(req.user_id)
+        def compute() -> Dict[str, Any]:
+            state = get_state(req.user_id)
+            # 低峰预生成的结果：参数与状态版本一致时取出，草案也一致时直接复用，不再调用 LLM
+            precomputed = take_precomputed(req, state) if PRECOMPUTE_ENABLED and not req.progressive else None
 
-        draft, updated_state, rules_fired = rule_decision(req, state)
-        final_output, agent_flags = run_langchain_agent(draft)
+            draft, updated_state, rules_fired = rule_decision(req, state)
+            if req.progressive:
+                # 先落状态并返回草案，LLM 润色在后台完成后通过轮询/SSE 获取
+                set_state(updated_state)
+                index_decision(draft, updated_state, {"status": "pending", "agent_flags": []})
+                decision_id = draft["decision_id"]
+                emit_event(
+                    "decision",
+                    user_id=req.user_id,
+                    decision_id=decision_id,
+                    request=req.model_dump(),
+                    output=draft,
+                    agent_flags=[],
+                    rules=rules_fired,
+                )
+                job = refinements.submit(decision_id, req.user_id, draft, lambda: _refine(draft, req.user_id))
+                if job["rejected"]:
+                    # 排队已满时直接以草案完成，同样写入决策记录
+                    refresh_output(
+                        decision_id,
+                        req.user_id,
+                        draft,
+                        {"status": job["status"], "agent_flags": job["agent_flags"]},
+                    )
+                app.logger.info(
+                    "decision draft user_id=%s decision_id=%s rules=%s refinement=%s",
+                    req.user_id,
+                    decision_id,
+                    rules_fired,
+                    job["status"],
+                )
+                return dict(
+                    draft,
+                    refinement={
+                        "status": job["status"],
+                        "status_url": url_for("decision_refinement", decision_id=decision_id),
+                        "events_url": url_for("decision_events", decision_id=decision_id),
+                    },
+                )
 
-        set_state(updated_state)
+            reused = reuse_precomputed(precomputed, draft) if precomputed is not None else None
+            if reused is not None:
+                final_output, agent_flags = reused
+            else:
+                try:
+                    final_output, agent_flags = run_langchain_agent(draft, user_id=req.user_id)
+                except AdmissionRejected as exc:
+                    if not LLM_DEGRADE_TO_DRAFT:
+                        raise
+                    final_output, agent_flags = draft, [f"agent:degraded:{exc.reason}"]
+            final_output = _keep_slate(draft, final_output)
 
-        app.logger.info(
-            "decision user_id=%s decision_id=%s mode=%s confidence=%s rules=%s agent=%s",
-            req.user_id,
-            final_output.get("decision_id"),
-            final_output.get("meta", {}).get("mode"),
-            final_output.get("meta", {}).get("confidence_style"),
-            rules_fired,
-            agent_flags,
-        )
+            set_state(updated_state)
+            index_decision(final_output, updated_state)
+            emit_event(
+                "decision",
+                user_id=req.user_id,
+                decision_id=final_output.get("decision_id"),
+                request=req.model_dump(),
+                output=final_output,
+                agent_flags=agent_flags,
+                rules=rules_fired,
+            )
+
+            app.logger.info(
+                "decision user_id=%s decision_id=%s mode=%s confidence=%s rules=%s agent=%s",
+                req.user_id,
+                final_output.get("decision_id"),
+                final_output.get("meta", {}).get("mode"),
+                final_output.get("meta", {}).get("confidence_style"),
+                rules_fired,
+                agent_flags,
+            )
+            return final_output
+
+        def run() -> Tuple[int, Dict[str, Any]]:
+            key = request_key("decision", req.user_id, req.model_dump())
+            final_output, coalesced = coalesce_decision(key, compute)
+            if coalesced:
+                app.logger.info(
+                    "decision coalesced user_id=%s decision_id=%s",
+                    req.user_id,
+                    final_output.get("decision_id"),
+                )
+            return 200, final_output
+
+        # 带 Idempotency-Key 的重试直接返回首次的响应，不再推进状态或调用 LLM
+        try:
+            (status_code, body), replayed = run_idempotent(
+                "decision", req.user_id, idempotency_key(), req.model_dump(), run
+            )
+        except AdmissionRejected as exc:
+            app.logger.warning(
+                "decision rejected user_id=%s reason=%s", req.user_id, exc.reason
+            )
+            return _rejected_response(exc)
+        except IdempotencyError as exc:
+            return idempotency_error_response(exc)
+
+        return idempotent_response(status_code, body, replayed)
+
+    @app.get(DECISION_RECORD_FLASK_API)
+    def decision_record(decision_id: str) -> Any:
+        '''
+        功能：
+        按 decision_id 查询历史决策记录（含反馈结果与决策输出）；user_id 参数可选，
+        给出时只返回该用户的记录（分片部署下也只查询其所在分片）。
+
+        :param decision_id: 决策 ID
+        :type decision_id: str
+        :return: Flask JSON Response
+        :rtype: Any
+        '''
+        record = find_decision(decision_id, request.args.get("user_id") or None)
+        if record is None:
+            return jsonify({"error": "not_found"}), 404
+        return jsonify(record)
+
+    @app.get(DECISION_REFINEMENT_FLASK_API)
+    def decision_refinement(decision_id: str) -> Any:
+        '''
+        功能：
+        查询渐进式决策的 LLM 润色结果；wait 参数（秒，最多 30）为长轮询等待时间。
+        润色由其他 worker 受理时从决策记录读取。
+
+        :param decision_id: 决策 ID
+        :type decision_id: str
+        :return: Flask JSON Response
+        :rtype: Any
+        '''
+        try:
+            wait = min(max(float(request.args.get("wait", "0")), 0.0), 30.0)
+        except ValueError:
+            return jsonify({"error": "invalid_request"}), 400
+        entry = _wait_refinement(decision_id, wait)
+        if entry is None:
+            return jsonify({"error": "unknown_decision"}), 404
+        return jsonify(_refinement_view(entry))
+
+    @app.get(DECISION_EVENTS_FLASK_API)
+    def decision_events(decision_id: str) -> Any:
+        '''
+        功能：
+        以 SSE 推送渐进式决策的润色结果：完成时发送 refined 事件后关闭，等待期间定期发送心跳，
+        超过 PROGRESSIVE_SSE_TIMEOUT 发送 timeout 事件（客户端可改为轮询）。
+
+        :param decision_id: 决策 ID
+        :type decision_id: str
+        :return: text/event-stream Response
+        :rtype: Any
+        '''
+        if refinements.get(decision_id) is None and _stored_refinement(decision_id) is None:
+            return jsonify({"error": "unknown_decision"}), 404
+
+        def stream() -> Iterator[str]:
+            deadline = time.monotonic() + PROGRESSIVE_SSE_TIMEOUT
+            yield "retry: 3000\n\n"
+            while True:
+                remaining = deadline - time.monotonic()
+                entry = _wait_refinement(decision_id, min(_SSE_HEARTBEAT, max(remaining, 0.0)))
+                if entry is None:
+                    yield _sse("error", {"decision_id": decision_id, "error": "unknown_decision"})
+                    return
+                if entry["status"] != "pending":
+                    yield _sse("refined", _refinement_view(entry))
+                    return
+                if remaining <= 0:
+                    yield _sse("timeout", _refinement_view(entry))
+                    return
+                yield ": keep-alive\n\n"
 
-        return jsonify(final_output)
+        resp = Response(stream_with_context(stream()), mimetype="text/event-stream")
+        resp.headers["Cache-Control"] = "no-cache"
+        resp.headers["X-Accel-Buffering"] = "no"
+        return resp
@@ -0,0 +1,127 @@
+﻿# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import json
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional
+
+from flask import Flask, Response, jsonify, request, stream_with_context
+
+from ..config import EVENT_LOG_DIR
+from ..event_log import parse_cursor, scan_events, tail_events
+from .admin import admin_denied
+from .routes import ADMIN_EVENTS_FLASK_API, ADMIN_EVENTS_TAIL_FLASK_API
+
+_TAIL_POLL = 0.5
+
+
+def _parse_time(value: Optional[str]) -> Optional[str]:
+    '''
+    功能：
+    解析 ISO 时间参数，统一为无时区的 UTC ISO 字符串（与事件 ts 格式一致）。
+
+    :param value: ISO 时间字符串
+    :type value: Optional[str]
+    :return: ISO 时间字符串或 None
+    :rtype: Optional[str]
+    '''
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed.isoformat()
+
+
+def _types() -> Optional[List[str]]:
+    value = request.args.get("type")
+    return [t.strip() for t in value.split(",") if t.strip()] if value else None
+
+
+def _ndjson(events: Iterator[Dict[str, Any]], limit: int) -> Iterator[str]:
+    chunk: List[str] = []
+    size = 0
+    for count, event in enumerate(events, 1):
+        line = json.dumps(event, ensure_ascii=False) + "\n"
+        chunk.append(line)
+        size += len(line)
+        if size >= 64 * 1024:
+            yield "".join(chunk)
+            chunk, size = [], 0
+        if limit and count >= limit:
+            break
+    if chunk:
+        yield "".join(chunk)
+
+
+def register_event_routes(app: Flask) -> None:
+    '''
+    功能：
+    注册事件日志读取管理接口路由（只读本地分段日志，不访问线上存储）。
+
+    :param app: Flask 应用实例
+    :type app: Flask
+    :return: 无
+    :rtype: None
+    '''
+
+    @app.get(ADMIN_EVENTS_FLASK_API)
+    def admin_events() -> Any:
+        '''
+        功能：
+        按时间范围流式导出事件（NDJSON，各进程的流按 ts 归并）。
+        参数：since/until（ISO 时间，UTC）、type（decision/decision_refined/feedback/qa，逗号分隔）、
+        user_id、limit（默认不限制）。
+
+        :return: 流式 Response
+        :rtype: Any
+        '''
+        denied = admin_denied()
+        if denied is not None:
+            return denied
+        if not EVENT_LOG_DIR:
+            return jsonify({"error": "event_log_disabled"}), 404
+        try:
+            since = _parse_time(request.args.get("since"))
+            until = _parse_time(request.args.get("until"))
+            limit = max(int(request.args.get("limit", "0")), 0)
+        except ValueError:
+            return jsonify({"error": "invalid_request"}), 400
+        user_id = request.args.get("user_id") or None
+        events = scan_events(EVENT_LOG_DIR, since, until, _types(), user_id)
+        app.logger.info("events scan since=%s until=%s type=%s user_id=%s", since, until, _types(), user_id)
+        return Response(stream_with_context(_ndjson(events, limit)), mimetype="application/x-ndjson")
+
+    @app.get(ADMIN_EVENTS_TAIL_FLASK_API)
+    def admin_events_tail() -> Any:
+        '''
+        功能：
+        增量读取事件：返回 cursor 之后的事件（最多 limit 条，默认 100）与新的 cursor，
+        客户端下次带上 cursor 继续读取；无 cursor 时从 since（默认最早）开始。
+        wait（秒，最多 30）为没有新事件时的长轮询等待时间。
+
+        :return: Flask JSON Response
+        :rtype: Any
+        '''
+        denied = admin_denied()
+        if denied is not None:
+            return denied
+        if not EVENT_LOG_DIR:
+            return jsonify({"error": "event_log_disabled"}), 404
+        cursor = request.args.get("cursor") or None
+        try:
+            parse_cursor(cursor)
+            since = _parse_time(request.args.get("since"))
+            limit = min(max(int(request.args.get("limit", "100")), 1), 10000)
+            wait = min(max(float(request.args.get("wait", "0")), 0.0), 30.0)
+        except ValueError:
+            return jsonify({"error": "invalid_request"}), 400
+        user_id = request.args.get("user_id") or None
+        deadline = time.monotonic() + wait
+        while True:
+            events, cursor = tail_events(EVENT_LOG_DIR, cursor, limit, _types(), user_id, since)
+            if events or time.monotonic() >= deadline:
+                break
+            time.sleep(_TAIL_POLL)
+        return jsonify({"events": events, "cursor": cursor})
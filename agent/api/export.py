@@ -0,0 +1,225 @@
+﻿# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import csv
+import io
+import json
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional
+
+from flask import Flask, Response, jsonify, request, stream_with_context
+
+from ..decision_engine import normalize_pool
+from ..memory_store import iter_chat_history, iter_states
+from .admin import admin_denied
+from .routes import ADMIN_EXPORT_FLASK_API
+
+DECISION_FIELDS = [
+    "user_id",
+    "decision_id",
+    "ts",
+    "label",
+    "category",
+    "price_band",
+    "in_stock",
+    "decision",
+    "outcome",
+]
+POOL_FIELDS = ["user_id", "pool", "label", "reason", "first_seen", "last_seen", "hits"]
+CHAT_FIELDS = ["user_id", "role", "content", "ts"]
+
+
+def _parse_time(value: Optional[str]) -> Optional[datetime]:
+    '''
+    功能：
+    解析 ISO 时间参数（统一为无时区的 UTC 时间）。
+
+    :param value: ISO 时间字符串
+    :type value: Optional[str]
+    :return: datetime 或 None
+    :rtype: Optional[datetime]
+    '''
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def _in_range(ts: Optional[str], since: Optional[str], until: Optional[str]) -> bool:
+    if since is not None and (not ts or ts < since):
+        return False
+    if until is not None and (not ts or ts >= until):
+        return False
+    return True
+
+
+def iter_decision_rows(
+    user_id: Optional[str],
+    category: Optional[str],
+    since: Optional[datetime],
+    until: Optional[datetime],
+) -> Iterator[Dict[str, Any]]:
+    '''
+    功能：
+    从用户状态的决策历史中逐条生成决策记录（含反馈结果）。
+
+    :param user_id: 用户过滤
+    :type user_id: Optional[str]
+    :param category: 类目过滤
+    :type category: Optional[str]
+    :param since: 起始时间（含）
+    :type since: Optional[datetime]
+    :param until: 结束时间（不含）
+    :type until: Optional[datetime]
+    :return: 决策记录迭代器
+    :rtype: Iterator[Dict[str, Any]]
+    '''
+    since_s = since.isoformat() if since else None
+    until_s = until.isoformat() if until else None
+    for state in iter_states(user_id=user_id, updated_since=since):
+        for record in state.get("history", []):
+            if category and record.get("category") != category:
+                continue
+            if not _in_range(record.get("ts"), since_s, until_s):
+                continue
+            row = {field: record.get(field) for field in DECISION_FIELDS}
+            row["user_id"] = state.get("user_id")
+            yield row
+
+
+def iter_pool_rows(
+    user_id: Optional[str], since: Optional[datetime], until: Optional[datetime]
+) -> Iterator[Dict[str, Any]]:
+    '''
+    功能：
+    逐款式生成回避池/暂缓池条目（含首次/最近命中时间与命中次数，按最近命中时间过滤）。
+
+    :param user_id: 用户过滤
+    :type user_id: Optional[str]
+    :param since: 起始时间（含）
+    :type since: Optional[datetime]
+    :param until: 结束时间（不含）
+    :type until: Optional[datetime]
+    :return: 池条目迭代器
+    :rtype: Iterator[Dict[str, Any]]
+    '''
+    since_s = since.isoformat() if since else None
+    until_s = until.isoformat() if until else None
+    for state in iter_states(user_id=user_id, updated_since=since):
+        for pool in ("avoid_pool", "defer_pool"):
+            for label, entry in normalize_pool(state.get(pool)).items():
+                if not _in_range(entry.get("last_seen"), since_s, until_s):
+                    continue
+                yield {
+                    "user_id": state.get("user_id"),
+                    "pool": pool.replace("_pool", ""),
+                    "label": label,
+                    "reason": entry.get("reason"),
+                    "first_seen": entry.get("first_seen"),
+                    "last_seen": entry.get("last_seen"),
+                    "hits": entry.get("hits"),
+                }
+
+
+def _encode(rows: Iterator[Dict[str, Any]], fields: List[str], fmt: str) -> Iterator[str]:
+    '''
+    功能：
+    将记录流编码为 NDJSON 或 CSV 文本流（逐行输出）。
+
+    :param rows: 记录迭代器
+    :type rows: Iterator[Dict[str, Any]]
+    :param fields: CSV 列
+    :type fields: List[str]
+    :param fmt: ndjson/csv
+    :type fmt: str
+    :return: 文本块迭代器
+    :rtype: Iterator[str]
+    '''
+    if fmt == "csv":
+        buf = io.StringIO()
+        writer = csv.DictWriter(buf, fieldnames=fields, extrasaction="ignore")
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+            if buf.tell() >= 64 * 1024:
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+        yield buf.getvalue()
+        return
+
+    chunk: List[str] = []
+    size = 0
+    for row in rows:
+        line = json.dumps(row, ensure_ascii=False) + "\n"
+        chunk.append(line)
+        size += len(line)
+        if size >= 64 * 1024:
+            yield "".join(chunk)
+            chunk, size = [], 0
+    if chunk:
+        yield "".join(chunk)
+
+
+def register_export_routes(app: Flask) -> None:
+    '''
+    功能：
+    注册数据导出管理接口（决策、不拍池、聊天记录）。
+
+    :param app: Flask 应用实例
+    :type app: Flask
+    :return: 无
+    :rtype: None
+    '''
+
+    @app.get(f"{ADMIN_EXPORT_FLASK_API}/<kind>")
+    def admin_export(kind: str) -> Any:
+        '''
+        功能：
+        流式导出数据，kind 为 decisions/pools/chat。
+        参数：format（ndjson/csv）、since/until（ISO 时间，UTC）、category、user_id。
+
+        :param kind: 导出类型
+        :type kind: str
+        :return: 流式 Response
+        :rtype: Any
+        '''
+        denied = admin_denied()
+        if denied is not None:
+            return denied
+
+        fmt = request.args.get("format", "ndjson").lower()
+        if fmt not in ("ndjson", "csv"):
+            return jsonify({"error": "invalid_format"}), 400
+        try:
+            since = _parse_time(request.args.get("since"))
+            until = _parse_time(request.args.get("until"))
+        except ValueError:
+            return jsonify({"error": "invalid_time"}), 400
+        user_id = request.args.get("user_id") or None
+        category = request.args.get("category") or None
+
+        if kind == "decisions":
+            rows, fields = iter_decision_rows(user_id, category, since, until), DECISION_FIELDS
+        elif kind == "pools":
+            rows, fields = iter_pool_rows(user_id, since, until), POOL_FIELDS
+        elif kind == "chat":
+            rows, fields = iter_chat_history(user_id=user_id, since=since, until=until), CHAT_FIELDS
+        else:
+            return jsonify({"error": "not_found"}), 404
+
+        app.logger.info(
+            "export kind=%s format=%s user_id=%s category=%s since=%s until=%s",
+            kind,
+            fmt,
+            user_id,
+            category,
+            since,
+            until,
+        )
+        mimetype = "text/csv" if fmt == "csv" else "application/x-ndjson"
+        resp = Response(stream_with_context(_encode(rows, fields, fmt)), mimetype=mimetype)
+        resp.headers["Content-Disposition"] = f'attachment; filename="{kind}.{fmt}"'
+        return resp
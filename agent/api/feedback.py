@@ -1,14 +1,22 @@
 ﻿# -*- coding: utf-8 -*-
 from __future__ import annotations
 
-from typing import Any, Dict
+import io
+from typing import Any, Dict, Tuple
 
 from flask import Flask, jsonify, request
 
-from .routes import FEEDBACK_FLASK_API
-from ..memory_store import get_state, set_state
-from ..models import FeedbackRequest
+from .admin import admin_denied
+from .idempotency import idempotency_error_response, idempotency_key, idempotent_response
+from .routes import FEEDBACK_BULK_FLASK_API, FEEDBACK_FLASK_API
+from ..bulk_feedback import FORMATS, import_feedback
+from ..decision_index import find_decision
+from ..event_log import emit_event
+from ..feedback_engine import apply_feedback
+from ..idempotency import IdempotencyError, run_idempotent
+from ..memory_store import get_state, set_decision_outcome, set_state
 from ..state import utc_now
+from ..models import FeedbackRequest
 
 
 def _parse_pydantic(model_cls, payload: Dict[str, Any]):
@@ -54,56 +62,92 @@ def register_feedback_routes(app: Flask) -> None:
         if err:
             return jsonify({"error": "invalid_request", "detail": err}), 400
 
-        state = get_state(req.user_id)
-        if not state:
-            return jsonify({"error": "not_found"}), 404
-
-        decision_id = req.decision_id
-        if not decision_id:
-            if state.get("last_reco"):
-                decision_id = state["last_reco"].get("decision_id")
-                weak_link = True
+        def run() -> Tuple[int, Dict[str, Any]]:
+            state = get_state(req.user_id)
+            if not state:
+                return 404, {"error": "not_found"}
+
+            decision_id = req.decision_id
+            if not decision_id:
+                if state.get("last_reco"):
+                    decision_id = state["last_reco"].get("decision_id")
+                    weak_link = True
+                else:
+                    return 400, {"error": "decision_id_required"}
             else:
-                return jsonify({"error": "decision_id_required"}), 400
-        else:
-            weak_link = False
-
-        history = state.get("history", [])
-        for record in reversed(history):
-            if record.get("decision_id") == decision_id:
-                record["outcome"] = req.outcome
-                break
-
-        stats = state.get("stats", {})
-        if req.outcome in ("scaled", "some_volume"):
-            stats["success"] = stats.get("success", 0) + 1
-            stats["consecutive_fail"] = 0
-        else:
-            stats["fail"] = stats.get("fail", 0) + 1
-            stats["consecutive_fail"] = stats.get("consecutive_fail", 0) + 1
-
-        state["stats"] = stats
-        state["history"] = history[-30:]
-        state["updated_at"] = utc_now()
-
-        set_state(state)
-
-        app.logger.info(
-            "feedback user_id=%s decision_id=%s outcome=%s weak_link=%s",
-            req.user_id,
-            decision_id,
-            req.outcome,
-            weak_link,
-        )
-
-        return jsonify(
-            {
+                weak_link = False
+
+            # 按 decision_id 索引关联，已被截断出 history 的旧决策也能计入统计
+            record = find_decision(decision_id, req.user_id) if decision_id else None
+            matched = apply_feedback(state, decision_id, req.outcome, record)
+            stats = state["stats"]
+
+            set_state(state)
+            if record is not None:
+                set_decision_outcome(decision_id, req.user_id, req.outcome, utc_now())
+            emit_event(
+                "feedback",
+                user_id=req.user_id,
+                decision_id=decision_id,
+                outcome=req.outcome,
+                weak_link=weak_link,
+                linked=matched is not None,
+                source="api",
+            )
+
+            app.logger.info(
+                "feedback user_id=%s decision_id=%s outcome=%s weak_link=%s linked=%s",
+                req.user_id,
+                decision_id,
+                req.outcome,
+                weak_link,
+                matched is not None,
+            )
+
+            return 200, {
                 "ok": True,
                 "updated_state": {
                     "consecutive_fail": stats.get("consecutive_fail", 0),
                     "success": stats.get("success", 0),
                     "fail": stats.get("fail", 0),
                     "weak_link": weak_link,
+                    "linked": matched is not None,
                 },
             }
+
+        # 带 Idempotency-Key 的重试直接返回首次的响应，不会重复计入成功/失败统计
+        try:
+            (status_code, body), replayed = run_idempotent(
+                "feedback", req.user_id, idempotency_key(), req.model_dump(), run
+            )
+        except IdempotencyError as exc:
+            return idempotency_error_response(exc)
+        return idempotent_response(status_code, body, replayed)
+
+    @app.post(FEEDBACK_BULK_FLASK_API)
+    def feedback_bulk() -> Any:
+        '''
+        功能：
+        批量导入反馈文件（请求体为 CSV 或 NDJSON，流式读取）：按用户分组后每个用户只读写一次状态，
+        反馈按 ts 顺序应用。格式由 format 参数或 Content-Type（text/csv）决定，需要管理令牌。
+
+        :return: Flask JSON Response（导入报告）
+        :rtype: Any
+        '''
+        denied = admin_denied()
+        if denied is not None:
+            return denied
+        fmt = request.args.get("format") or ("csv" if request.mimetype == "text/csv" else "ndjson")
+        if fmt not in FORMATS:
+            return jsonify({"error": "invalid_request", "detail": f"format must be one of {FORMATS}"}), 400
+        stream = io.TextIOWrapper(request.stream, encoding="utf-8-sig", newline="")
+        report = import_feedback(stream, fmt)
+        app.logger.info(
+            "feedback bulk format=%s rows=%s rejected=%s users=%s rows_per_sec=%s",
+            fmt,
+            report["rows"],
+            report["rejected"],
+            report["users"],
+            report["rows_per_sec"],
         )
+        return jsonify(report)
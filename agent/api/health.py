@@ -0,0 +1,44 @@
+﻿# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+from typing import Any
+
+from flask import Flask, jsonify
+
+from ..warmup import is_ready, warmup_status
+from .routes import HEALTHZ_ROUTE, READYZ_ROUTE
+
+
+def register_health_routes(app: Flask) -> None:
+    '''
+    功能：
+    注册存活/就绪探针路由。
+
+    :param app: Flask 应用实例
+    :type app: Flask
+    :return: 无
+    :rtype: None
+    '''
+
+    @app.get(HEALTHZ_ROUTE)
+    def healthz() -> Any:
+        '''
+        功能：
+        存活探针：进程能处理请求即返回 200，不依赖外部服务。
+
+        :return: Flask JSON Response
+        :rtype: Any
+        '''
+        return jsonify({"status": "ok", "version": app.config.get("APP_VERSION")})
+
+    @app.get(READYZ_ROUTE)
+    def readyz() -> Any:
+        '''
+        功能：
+        就绪探针：启动预热（存储、决策表、模型客户端）完成前返回 503。
+
+        :return: Flask JSON Response
+        :rtype: Any
+        '''
+        status = warmup_status()
+        return jsonify(status), (200 if is_ready() else 503)
@@ -0,0 +1,57 @@
+﻿# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+from typing import Any, Dict, Optional
+
+from flask import jsonify, request
+
+from ..idempotency import IDEMPOTENCY_HEADER, REPLAYED_HEADER, IdempotencyError
+
+
+def idempotency_key() -> Optional[str]:
+    '''
+    功能：
+    读取请求头中的幂等键（Idempotency-Key），未提供返回 None。
+
+    :return: 幂等键
+    :rtype: Optional[str]
+    '''
+    return request.headers.get(IDEMPOTENCY_HEADER)
+
+
+def idempotent_response(status_code: int, body: Dict[str, Any], replayed: bool) -> Any:
+    '''
+    功能：
+    构造 JSON 响应，复用保存的响应时带 Idempotent-Replayed: true。
+
+    :param status_code: HTTP 状态码
+    :type status_code: int
+    :param body: 响应体
+    :type body: Dict[str, Any]
+    :param replayed: 是否为保存的响应
+    :type replayed: bool
+    :return: Flask Response
+    :rtype: Any
+    '''
+    resp = jsonify(body)
+    resp.status_code = status_code
+    if replayed:
+        resp.headers[REPLAYED_HEADER] = "true"
+    return resp
+
+
+def idempotency_error_response(exc: IdempotencyError) -> Any:
+    '''
+    功能：
+    将幂等键错误转换为 400/409/422 响应（等待超时带 Retry-After）。
+
+    :param exc: 幂等键错误
+    :type exc: IdempotencyError
+    :return: Flask Response
+    :rtype: Any
+    '''
+    resp = jsonify({"error": exc.reason})
+    resp.status_code = exc.status
+    if exc.retry_after:
+        resp.headers["Retry-After"] = str(exc.retry_after)
+    return resp
@@ -0,0 +1,105 @@
+﻿# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import time
+from typing import Any, Dict
+
+from flask import Flask, jsonify, request
+
+from ..memory_report import component_sizes, object_census, process_memory, store_footprint, tracer
+from .admin import admin_denied
+from .routes import ADMIN_MEMORY_FLASK_API, ADMIN_MEMORY_TRACE_FLASK_API
+
+TRACE_ACTIONS = ("status", "start", "snapshot", "diff", "stop")
+KEY_TYPES = ("lineno", "filename", "traceback")
+
+
+def _flag(name: str, default: str = "false") -> bool:
+    return request.args.get(name, default).lower() in ("1", "true", "yes", "on")
+
+
+def register_memory_routes(app: Flask) -> None:
+    '''
+    功能：
+    注册内存占用分析管理接口路由。
+
+    :param app: Flask 应用实例
+    :type app: Flask
+    :return: 无
+    :rtype: None
+    '''
+
+    @app.get(ADMIN_MEMORY_FLASK_API)
+    def admin_memory() -> Any:
+        '''
+        功能：
+        返回进程内存、存储占用（用户数、状态与聊天历史的总字节数与人均字节数、占用最大的用户）
+        与其他进程内组件的估算大小。参数：top（默认 20）、components（默认 true）、
+        objects（按类型统计对象数，默认 false）。只在调用时测量，不影响正常请求。
+
+        :return: Flask JSON Response
+        :rtype: Any
+        '''
+        denied = admin_denied()
+        if denied is not None:
+            return denied
+        try:
+            top_n = min(max(int(request.args.get("top", "20")), 0), 1000)
+        except ValueError:
+            return jsonify({"error": "invalid_request"}), 400
+
+        started = time.perf_counter()
+        report: Dict[str, Any] = {
+            "process": process_memory(),
+            "store": store_footprint(top_n),
+            "tracemalloc": tracer.status(),
+        }
+        if _flag("components", "true"):
+            report["components"] = component_sizes()
+        if _flag("objects"):
+            report["objects"] = object_census(top_n or 30)
+        report["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        app.logger.info("memory report elapsed_ms=%s", report["elapsed_ms"])
+        return jsonify(report)
+
+    @app.post(ADMIN_MEMORY_TRACE_FLASK_API)
+    def admin_memory_trace() -> Any:
+        '''
+        功能：
+        按需控制 tracemalloc：action=start（nframes）、snapshot（label）、diff（base，可选 target，
+        为空时与当前对比）、stop、status；snapshot/diff 支持 top 与 key_type（lineno/filename/traceback）。
+        开启后超过 MEMORY_TRACE_AUTO_STOP 秒自动关闭。
+
+        :return: Flask JSON Response
+        :rtype: Any
+        '''
+        denied = admin_denied()
+        if denied is not None:
+            return denied
+        params = dict(request.get_json(silent=True) or {})
+        params.update(request.args.to_dict())
+        action = params.get("action", "status")
+        key_type = params.get("key_type", "lineno")
+        if action not in TRACE_ACTIONS or key_type not in KEY_TYPES:
+            return jsonify({"error": "invalid_request"}), 400
+        try:
+            top_n = min(max(int(params.get("top", 20)), 1), 500)
+            if action == "start":
+                result = tracer.start(min(max(int(params.get("nframes", 10)), 1), 100))
+            elif action == "snapshot":
+                result = tracer.snapshot(params.get("label") or None, top_n, key_type)
+            elif action == "diff":
+                if not params.get("base"):
+                    return jsonify({"error": "base_required"}), 400
+                result = tracer.diff(params["base"], params.get("target") or None, top_n, key_type)
+            elif action == "stop":
+                result = tracer.stop()
+            else:
+                result = tracer.status()
+        except ValueError:
+            return jsonify({"error": "invalid_request"}), 400
+        except KeyError as exc:
+            return jsonify({"error": "snapshot_not_found", "label": exc.args[0]}), 404
+        except RuntimeError as exc:
+            return jsonify({"error": str(exc)}), 409
+        return jsonify(result)
@@ -0,0 +1,51 @@
+﻿# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+from typing import Any
+
+from flask import Flask, jsonify
+
+from ..admission import llm_limiter
+from ..event_log import event_log_stats
+from ..idempotency import idempotency_stats
+from ..llm_agent import llm_routing_stats
+from ..memory_store import cache_stats, coalesce_stats, persistence_stats, pg_pool_stats
+from ..precompute import scheduler as precompute_scheduler
+from ..progressive import refinements
+from ..usage import usage_stats
+from .routes import METRICS_FLASK_API
+
+
+def register_metrics_routes(app: Flask) -> None:
+    '''
+    功能：
+    注册运行指标 API 路由。
+
+    :param app: Flask 应用实例
+    :type app: Flask
+    :return: 无
+    :rtype: None
+    '''
+
+    @app.get(METRICS_FLASK_API)
+    def metrics() -> Any:
+        '''
+        功能：
+        返回 LLM 准入控制（并发、队列深度、等待时间）、LLM 用量、模型路由（各端点 p95 延迟与错误率）、渐进式决策后台润色、低峰预生成、幂等键、存储读缓存、跨进程合并专用连接、memory 后端持久化与事件日志写入等运行指标。
+
+        :return: Flask JSON Response
+        :rtype: Any
+        '''
+        return jsonify({
+            "llm_admission": llm_limiter.snapshot(),
+            "llm_usage": usage_stats(),
+            "llm_routing": llm_routing_stats(),
+            "progressive": refinements.snapshot(),
+            "precompute": precompute_scheduler.snapshot(),
+            "idempotency": idempotency_stats(),
+            "store_cache": cache_stats(),
+            "memory_persistence": persistence_stats(),
+            "pg_pool": pg_pool_stats(),
+            "singleflight_pg": coalesce_stats(),
+            "event_log": event_log_stats(),
+        })
@@ -1,63 +1,180 @@
 ﻿# -*- coding: utf-8 -*-
 from __future__ import annotations
 
-from flask import Flask, render_template
+import gzip
+import hashlib
+import os
+import threading
+from typing import Dict
 
+from flask import Flask, Response, render_template, request
+
+from ..config import PAGE_CACHE_CONTROL, PAGE_DEV_RELOAD
 from .routes import CHAT_ROUTE, DECISION_PAGE_ROUTE, INDEX_ROUTE
 
+try:
+    import brotli
+except ImportError:  # brotli 为可选依赖，缺失时只提供 gzip
+    brotli = None
+
+_page_lock = threading.Lock()
+_pages: Dict[str, dict] = {}
+
+
+def _template_path(app: Flask, name: str) -> str:
+    return os.path.join(app.root_path, app.template_folder or "templates", name)
+
+
+def _render_page(app: Flask, name: str) -> dict:
+    '''
+    功能：
+    渲染静态页面并预先生成 gzip/brotli 压缩版本与强 ETag。
+
+    :param app: Flask 应用实例
+    :type app: Flask
+    :param name: 模板文件名
+    :type name: str
+    :return: 页面缓存条目
+    :rtype: dict
+    '''
+    path = _template_path(app, name)
+    mtime = os.path.getmtime(path) if os.path.exists(path) else 0.0
+    with app.app_context():
+        body = render_template(name).encode("utf-8")
+    digest = hashlib.sha256(body).hexdigest()[:32]
+    variants = {"identity": (body, f'"{digest}"')}
+    variants["gzip"] = (gzip.compress(body, compresslevel=9, mtime=0), f'"{digest}-gzip"')
+    if brotli is not None:
+        variants["br"] = (brotli.compress(body, quality=11), f'"{digest}-br"')
+    return {"mtime": mtime, "variants": variants}
+
+
+def _get_page(app: Flask, name: str) -> dict:
+    '''
+    功能：
+    获取页面缓存；开发模式下模板文件有改动时重新渲染。
+
+    :param app: Flask 应用实例
+    :type app: Flask
+    :param name: 模板文件名
+    :type name: str
+    :return: 页面缓存条目
+    :rtype: dict
+    '''
+    entry = _pages.get(name)
+    if entry is not None and (PAGE_DEV_RELOAD or app.debug):
+        path = _template_path(app, name)
+        if os.path.exists(path) and os.path.getmtime(path) != entry["mtime"]:
+            entry = None
+    if entry is None:
+        with _page_lock:
+            entry = _render_page(app, name)
+            _pages[name] = entry
+    return entry
+
+
+def _choose_encoding(variants: dict) -> str:
+    '''
+    功能：
+    按 Accept-Encoding（含 q 值）选择压缩格式，优先 br，其次 gzip。
+
+    :param variants: 可用的压缩版本
+    :type variants: dict
+    :return: 编码名（br/gzip/identity）
+    :rtype: str
+    '''
+    accept = request.accept_encodings
+    best, best_q = "identity", 0.0
+    for encoding in ("br", "gzip"):
+        if encoding not in variants:
+            continue
+        q = accept[encoding]
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def _serve_page(app: Flask, name: str) -> Response:
+    '''
+    功能：
+    从内存返回预渲染页面，支持压缩协商、强 ETag 与 304。
+
+    :param app: Flask 应用实例
+    :type app: Flask
+    :param name: 模板文件名
+    :type name: str
+    :return: Flask Response
+    :rtype: Response
+    '''
+    entry = _get_page(app, name)
+    encoding = _choose_encoding(entry["variants"])
+    body, etag = entry["variants"][encoding]
+    headers = {
+        "ETag": etag,
+        "Cache-Control": PAGE_CACHE_CONTROL,
+        "Vary": "Accept-Encoding",
+    }
+    if request.if_none_match.contains(etag.strip('"')):
+        return Response(status=304, headers=headers)
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return Response(body, mimetype="text/html", headers=headers)
+
 
 def register_page_routes(app: Flask) -> None:
     '''
     功能：
-    注册页面路由（本地操作台）。
+    注册页面路由（本地操作台），页面在启动时预渲染并常驻内存。
 
     :param app: Flask 应用实例
     :type app: Flask
     :return: 无
     :rtype: None
     '''
+    for name in ("index.html", "decision.html", "chat.html"):
+        _get_page(app, name)
 
     @app.get(INDEX_ROUTE)
-    def index() -> str:
+    def index() -> Response:
         '''
         功能：
         返回导航主页。
 
-        :return: HTML 页面字符串
-        :rtype: str
+        :return: HTML 页面
+        :rtype: Response
         '''
-        return render_template("index.html")
+        return _serve_page(app, "index.html")
 
     @app.get(DECISION_PAGE_ROUTE)
-    def decision_page() -> str:
+    def decision_page() -> Response:
         '''
         功能：
         返回选品操作台页面。
 
-        :return: HTML 页面字符串
-        :rtype: str
+        :return: HTML 页面
+        :rtype: Response
         '''
-        return render_template("decision.html")
+        return _serve_page(app, "decision.html")
 
     @app.get(CHAT_ROUTE)
-    def chat() -> str:
+    def chat() -> Response:
         '''
         功能：
         返回 AI 对话页面。
 
-        :return: HTML 页面字符串
-        :rtype: str
+        :return: HTML 页面
+        :rtype: Response
         '''
-        return render_template("chat.html")
+        return _serve_page(app, "chat.html")
 
     if INDEX_ROUTE != "/":
         @app.get("/")
-        def index_root() -> str:
+        def index_root() -> Response:
             '''
             功能：
             提供根路径回退，确保访问 / 时也能打开导航页。
 
-            :return: HTML 页面字符串
-            :rtype: str
+            :return: HTML 页面
+            :rtype: Response
             '''
-            return render_template("index.html")
+            return _serve_page(app, "index.html")
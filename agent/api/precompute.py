@@ -0,0 +1,40 @@
+﻿# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+from typing import Any
+
+from flask import Flask, jsonify, request
+
+from ..precompute import scheduler
+from .admin import admin_denied
+from .routes import ADMIN_PRECOMPUTE_FLASK_API
+
+
+def register_precompute_routes(app: Flask) -> None:
+    '''
+    功能：
+    注册低峰预生成管理接口路由。
+
+    :param app: Flask 应用实例
+    :type app: Flask
+    :return: 无
+    :rtype: None
+    '''
+
+    @app.route(ADMIN_PRECOMPUTE_FLASK_API, methods=["GET", "POST"])
+    def admin_precompute() -> Any:
+        '''
+        功能：
+        GET 返回预生成调度状态与最近一轮统计；POST 立即在后台执行一轮预生成（忽略低峰时段），返回 202。
+
+        :return: Flask JSON Response
+        :rtype: Any
+        '''
+        denied = admin_denied()
+        if denied is not None:
+            return denied
+        if request.method == "GET":
+            return jsonify(scheduler.snapshot())
+        result = scheduler.trigger()
+        app.logger.info("precompute triggered status=%s", result.get("status"))
+        return jsonify(result), 202
@@ -5,6 +5,8 @@ from typing import Any, Dict
 
 from flask import Flask, jsonify, request
 
+from ..admission import AdmissionRejected
+from ..event_log import emit_event
 from ..llm_agent import run_qa
 from ..memory_store import append_chat_history, get_chat_history
 from .routes import QA_FLASK_API
@@ -37,7 +39,15 @@ def register_qa_routes(app: Flask) -> None:
             return jsonify({"error": "question_required"}), 400
 
         history = get_chat_history(user_id)
-        answer = run_qa(question, history=history)
+        try:
+            answer = run_qa(question, history=history, user_id=user_id)
+        except AdmissionRejected as exc:
+            app.logger.warning("qa rejected user_id=%s reason=%s", user_id, exc.reason)
+            resp = jsonify({"error": exc.reason, "retry_after": exc.retry_after})
+            resp.status_code = exc.status
+            resp.headers["Retry-After"] = str(exc.retry_after)
+            return resp
         append_chat_history(user_id, "user", question)
         append_chat_history(user_id, "ai", answer)
+        emit_event("qa", user_id=user_id, question=question, answer=answer)
         return jsonify({"question": question, "answer": answer, "user_id": user_id})
@@ -34,5 +34,22 @@ INDEX_ROUTE = _routes.get("INDEX_ROUTE", "/")
 DECISION_PAGE_ROUTE = _routes.get("DECISION_PAGE_ROUTE", "/decision")
 CHAT_ROUTE = _routes.get("CHAT_ROUTE", "/chat")
 DECISION_FLASK_API = _routes.get("DECISION_FLASK_API", "/v1/decision")
+DECISION_RECORD_FLASK_API = _routes.get("DECISION_RECORD_FLASK_API", "/v1/decision/<decision_id>")
+DECISION_REFINEMENT_FLASK_API = _routes.get(
+    "DECISION_REFINEMENT_FLASK_API", "/v1/decision/<decision_id>/refinement"
+)
+DECISION_EVENTS_FLASK_API = _routes.get("DECISION_EVENTS_FLASK_API", "/v1/decision/<decision_id>/events")
 FEEDBACK_FLASK_API = _routes.get("FEEDBACK_FLASK_API", "/v1/feedback")
+FEEDBACK_BULK_FLASK_API = _routes.get("FEEDBACK_BULK_FLASK_API", "/v1/feedback/bulk")
 QA_FLASK_API = _routes.get("QA_FLASK_API", "/v1/qa")
+METRICS_FLASK_API = _routes.get("METRICS_FLASK_API", "/v1/metrics")
+ADMIN_PROFILE_FLASK_API = _routes.get("ADMIN_PROFILE_FLASK_API", "/v1/admin/profile")
+ADMIN_EXPORT_FLASK_API = _routes.get("ADMIN_EXPORT_FLASK_API", "/v1/admin/export")
+ADMIN_USAGE_FLASK_API = _routes.get("ADMIN_USAGE_FLASK_API", "/v1/admin/usage")
+ADMIN_MEMORY_FLASK_API = _routes.get("ADMIN_MEMORY_FLASK_API", "/v1/admin/memory")
+ADMIN_MEMORY_TRACE_FLASK_API = _routes.get("ADMIN_MEMORY_TRACE_FLASK_API", "/v1/admin/memory/tracemalloc")
+ADMIN_PRECOMPUTE_FLASK_API = _routes.get("ADMIN_PRECOMPUTE_FLASK_API", "/v1/admin/precompute")
+ADMIN_EVENTS_FLASK_API = _routes.get("ADMIN_EVENTS_FLASK_API", "/v1/admin/events")
+ADMIN_EVENTS_TAIL_FLASK_API = _routes.get("ADMIN_EVENTS_TAIL_FLASK_API", "/v1/admin/events/tail")
+HEALTHZ_ROUTE = _routes.get("HEALTHZ_ROUTE", "/healthz")
+READYZ_ROUTE = _routes.get("READYZ_ROUTE", "/readyz")
@@ -0,0 +1,92 @@
+﻿# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional
+
+from flask import Flask, jsonify, request
+
+from ..memory_store import USAGE_KEY_FIELDS, merge_usage_row
+from ..usage import query_usage
+from .admin import admin_denied
+from .routes import ADMIN_USAGE_FLASK_API
+
+ORDER_FIELDS = ("total_tokens", "cost", "calls", "latency_ms", "latency_ms_avg", "errors", "retries")
+
+
+def _parse_day(value: Optional[str]) -> Optional[str]:
+    '''
+    功能：
+    校验日期参数（YYYY-MM-DD），非法时抛出 ValueError。
+
+    :param value: 日期字符串
+    :type value: Optional[str]
+    :return: 日期字符串或 None
+    :rtype: Optional[str]
+    '''
+    if not value:
+        return None
+    return datetime.strptime(value, "%Y-%m-%d").date().isoformat()
+
+
+def register_usage_routes(app: Flask) -> None:
+    '''
+    功能：
+    注册 LLM 用量查询管理接口路由。
+
+    :param app: Flask 应用实例
+    :type app: Flask
+    :return: 无
+    :rtype: None
+    '''
+
+    @app.get(ADMIN_USAGE_FLASK_API)
+    def admin_usage() -> Any:
+        '''
+        功能：
+        按维度汇总 LLM 用量（tokens、费用、延迟、重试、错误与回退原因）。
+        参数：since/until（YYYY-MM-DD，默认最近 7 天）、user_id、route、model、
+        group_by（day/user_id/route/model 逗号分隔，默认 route,model）、order_by（默认 total_tokens）、limit（默认 100）。
+
+        :return: Flask JSON Response
+        :rtype: Any
+        '''
+        denied = admin_denied()
+        if denied is not None:
+            return denied
+        try:
+            until = _parse_day(request.args.get("until")) or datetime.now(timezone.utc).date().isoformat()
+            since = _parse_day(request.args.get("since")) or (
+                datetime.strptime(until, "%Y-%m-%d").date() - timedelta(days=6)
+            ).isoformat()
+            limit = int(request.args.get("limit", "100"))
+        except ValueError:
+            return jsonify({"error": "invalid_request"}), 400
+        group_by = tuple(
+            f.strip() for f in request.args.get("group_by", "route,model").split(",") if f.strip()
+        )
+        order_by = request.args.get("order_by", "total_tokens")
+        if not group_by or any(f not in USAGE_KEY_FIELDS for f in group_by) or order_by not in ORDER_FIELDS:
+            return jsonify({"error": "invalid_request"}), 400
+
+        rows = query_usage(
+            since=since,
+            until=until,
+            user_id=request.args.get("user_id") or None,
+            route=request.args.get("route") or None,
+            model=request.args.get("model") or None,
+            group_by=group_by,
+        )
+        totals: Dict[str, Any] = {}
+        for row in rows:
+            merge_usage_row(totals, row)
+        rows.sort(key=lambda row: row.get(order_by) or 0, reverse=True)
+        return jsonify({
+            "since": since,
+            "until": until,
+            "group_by": list(group_by),
+            "order_by": order_by,
+            "total_groups": len(rows),
+            "totals": totals,
+            "rows": rows[: max(limit, 0)],
+        })
@@ -0,0 +1,293 @@
+﻿# -*- coding: utf-8 -*-
+"""
+批量导入反馈（抖音后台每日导出的 CSV/NDJSON）。
+
+    python -m agent.bulk_feedback outcomes.csv [--format csv|ndjson] [--chunk-rows 50000]
+
+每行字段：user_id、decision_id（可空，空时关联该用户最近一次推荐）、outcome、ts（可选，ISO 时间）。
+逐行流式读取并校验，每 chunk-rows 行按 (user_id, ts, 行号) 排序写成一个临时有序段，
+最后归并各段并按用户分组：每个用户只读写一次状态，反馈按时间顺序应用（无 ts 的行排在最前，
+同一时间按文件顺序），内存占用与文件大小无关。
+命令行直接读写配置的存储，适用于 postgres/shm 后端；memory 后端请使用 POST /v1/feedback/bulk。
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import heapq
+import io
+import itertools
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import IO, Any, Dict, Iterator, List, Optional, Tuple
+
+from pydantic import ValidationError
+
+from .config import BULK_FEEDBACK_CHUNK_ROWS
+from .decision_index import find_decision
+from .event_log import emit_event
+from .feedback_engine import apply_feedback
+from .memory_store import get_state, set_decision_outcome, set_state
+from .models import FeedbackRequest
+from .state import utc_now
+
+logger = logging.getLogger("agent")
+
+FORMATS = ("csv", "ndjson")
+_REJECTED_SAMPLES = 100
+
+# (user_id, ts, 行号, decision_id, outcome)
+_Row = Tuple[str, str, int, Optional[str], str]
+
+
+def _normalize_ts(value: Any) -> str:
+    '''
+    功能：
+    将 ts 统一为无时区的 UTC ISO 字符串（便于按字符串排序），空值返回 ""，非法时抛出 ValueError。
+
+    :param value: 原始时间值
+    :type value: Any
+    :return: ISO 时间字符串
+    :rtype: str
+    '''
+    if value is None or str(value).strip() == "":
+        return ""
+    parsed = datetime.fromisoformat(str(value).strip().replace("Z", "+00:00"))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed.isoformat()
+
+
+def iter_raw_rows(stream: IO[str], fmt: str) -> Iterator[Tuple[int, Any]]:
+    '''
+    功能：
+    逐行读取 CSV（首行为表头）或 NDJSON，返回 (行号, 原始行)；NDJSON 解析失败的行原样返回字符串。
+
+    :param stream: 文本流
+    :type stream: IO[str]
+    :param fmt: 文件格式（csv/ndjson）
+    :type fmt: str
+    :return: (行号, 原始行) 迭代器
+    :rtype: Iterator[Tuple[int, Any]]
+    '''
+    if fmt == "csv":
+        for line_no, row in enumerate(csv.DictReader(stream), start=2):
+            yield line_no, row
+        return
+    for line_no, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield line_no, json.loads(line)
+        except ValueError:
+            yield line_no, line
+
+
+class BulkFeedbackImporter:
+    '''
+    功能：
+    批量反馈导入：校验 → 分段排序 → 归并后按用户一次性应用。
+    '''
+
+    def __init__(self, chunk_rows: int = BULK_FEEDBACK_CHUNK_ROWS) -> None:
+        self.chunk_rows = max(1, chunk_rows)
+        self.report: Dict[str, Any] = {
+            "rows": 0,
+            "accepted": 0,
+            "rejected": 0,
+            "rejected_samples": [],
+            "users": 0,
+            "applied": 0,
+            "linked": 0,
+            "weak_link": 0,
+            "runs": 0,
+        }
+
+    def _reject(self, line_no: int, reason: str) -> None:
+        self.report["rejected"] += 1
+        if len(self.report["rejected_samples"]) < _REJECTED_SAMPLES:
+            self.report["rejected_samples"].append({"line": line_no, "error": reason})
+
+    def _parse(self, line_no: int, raw: Any) -> Optional[_Row]:
+        if not isinstance(raw, dict):
+            self._reject(line_no, "invalid_row")
+            return None
+        payload = {
+            key: (value.strip() if isinstance(value, str) else value)
+            for key, value in raw.items()
+            if key in ("user_id", "decision_id", "outcome")
+        }
+        if not payload.get("decision_id"):
+            payload["decision_id"] = None
+        try:
+            req = FeedbackRequest(**payload)
+            ts = _normalize_ts(raw.get("ts"))
+        except ValidationError as exc:
+            self._reject(line_no, "; ".join(f"{'.'.join(map(str, e['loc']))}: {e['msg']}" for e in exc.errors()))
+            return None
+        except ValueError as exc:
+            self._reject(line_no, f"ts: {exc}")
+            return None
+        if not req.user_id:
+            self._reject(line_no, "user_id_required")
+            return None
+        return req.user_id, ts, line_no, req.decision_id, req.outcome
+
+    def _spill(self, chunk: List[_Row], tmp_dir: str) -> str:
+        chunk.sort()
+        fd, path = tempfile.mkstemp(prefix="feedback-run-", suffix=".ndjson", dir=tmp_dir)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            for row in chunk:
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+        self.report["runs"] += 1
+        return path
+
+    @staticmethod
+    def _read_run(path: str) -> Iterator[_Row]:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                yield tuple(json.loads(line))
+
+    def _reject_applied(self, line_no: int, reason: str) -> None:
+        # 校验通过但应用时被拒绝（与 /v1/feedback 的 404/400 一致），从 accepted 移到 rejected
+        self.report["accepted"] -= 1
+        self._reject(line_no, reason)
+
+    def _apply_user(self, user_id: str, rows: Iterator[_Row]) -> None:
+        state = get_state(user_id)
+        linked: List[Tuple[str, str]] = []
+        events: List[Dict[str, Any]] = []
+        for _, ts, line_no, decision_id, outcome in rows:
+            if not state:
+                self._reject_applied(line_no, "not_found")
+                continue
+            weak_link = not decision_id
+            if weak_link:
+                if not state.get("last_reco"):
+                    self._reject_applied(line_no, "decision_id_required")
+                    continue
+                decision_id = state["last_reco"].get("decision_id")
+                self.report["weak_link"] += 1
+            record = find_decision(decision_id, user_id) if decision_id else None
+            matched = apply_feedback(state, decision_id, outcome, record)
+            self.report["applied"] += 1
+            if matched is not None:
+                self.report["linked"] += 1
+            if record is not None:
+                linked.append((decision_id, outcome))
+            events.append({
+                "outcome_ts": ts,
+                "decision_id": decision_id,
+                "outcome": outcome,
+                "weak_link": weak_link,
+                "linked": matched is not None,
+            })
+        if not events:
+            return
+        set_state(state)
+        now = utc_now()
+        for decision_id, outcome in linked:
+            set_decision_outcome(decision_id, user_id, outcome, now)
+        for event in events:
+            emit_event("feedback", user_id=user_id, source="bulk", **event)
+        self.report["users"] += 1
+
+    def run(self, stream: IO[str], fmt: str) -> Dict[str, Any]:
+        '''
+        功能：
+        导入一个反馈文件，返回统计报告（含 rows_per_sec 与被拒绝行样例）。
+
+        :param stream: 文本流
+        :type stream: IO[str]
+        :param fmt: 文件格式（csv/ndjson）
+        :type fmt: str
+        :return: 导入报告
+        :rtype: Dict[str, Any]
+        '''
+        if fmt not in FORMATS:
+            raise ValueError(f"format must be one of {FORMATS}")
+        started = time.perf_counter()
+        runs: List[str] = []
+        chunk: List[_Row] = []
+        with tempfile.TemporaryDirectory(prefix="bulk-feedback-") as tmp_dir:
+            for line_no, raw in iter_raw_rows(stream, fmt):
+                self.report["rows"] += 1
+                row = self._parse(line_no, raw)
+                if row is None:
+                    continue
+                self.report["accepted"] += 1
+                chunk.append(row)
+                if len(chunk) >= self.chunk_rows:
+                    runs.append(self._spill(chunk, tmp_dir))
+                    chunk = []
+
+            if runs:
+                if chunk:
+                    runs.append(self._spill(chunk, tmp_dir))
+                merged: Iterator[_Row] = heapq.merge(*(self._read_run(path) for path in runs))
+            else:
+                chunk.sort()
+                merged = iter(chunk)
+            for user_id, rows in itertools.groupby(merged, key=lambda row: row[0]):
+                self._apply_user(user_id, rows)
+
+        elapsed = time.perf_counter() - started
+        self.report["elapsed_sec"] = round(elapsed, 3)
+        self.report["rows_per_sec"] = round(self.report["rows"] / elapsed, 1) if elapsed > 0 else 0.0
+        logger.info(
+            "bulk feedback rows=%s accepted=%s rejected=%s users=%s linked=%s runs=%s rows_per_sec=%s",
+            self.report["rows"],
+            self.report["accepted"],
+            self.report["rejected"],
+            self.report["users"],
+            self.report["linked"],
+            self.report["runs"],
+            self.report["rows_per_sec"],
+        )
+        return self.report
+
+
+def import_feedback(stream: IO[str], fmt: str, chunk_rows: int = BULK_FEEDBACK_CHUNK_ROWS) -> Dict[str, Any]:
+    '''
+    功能：
+    批量导入反馈文件。
+
+    :param stream: 文本流
+    :type stream: IO[str]
+    :param fmt: 文件格式（csv/ndjson）
+    :type fmt: str
+    :param chunk_rows: 每个有序段的行数（决定内存占用）
+    :type chunk_rows: int
+    :return: 导入报告
+    :rtype: Dict[str, Any]
+    '''
+    return BulkFeedbackImporter(chunk_rows).run(stream, fmt)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="批量导入反馈（CSV/NDJSON）")
+    parser.add_argument("path", help="反馈文件路径，- 表示标准输入")
+    parser.add_argument("--format", choices=FORMATS, help="文件格式，默认按扩展名判断")
+    parser.add_argument("--chunk-rows", type=int, default=BULK_FEEDBACK_CHUNK_ROWS)
+    args = parser.parse_args(argv)
+
+    fmt = args.format or ("csv" if args.path.lower().endswith(".csv") else "ndjson")
+    if args.path == "-":
+        stream = io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8-sig")
+        report = import_feedback(stream, fmt, args.chunk_rows)
+    else:
+        with open(args.path, "r", encoding="utf-8-sig", newline="") as stream:
+            report = import_feedback(stream, fmt, args.chunk_rows)
+    json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+    sys.stdout.write("\n")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
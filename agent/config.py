@@ -12,6 +12,43 @@ LLM_BASE_URL = os.getenv("BASE_URL", "")
 LLM_MODEL = os.getenv("MODEL", "")
 LLM_MODEL_API = os.getenv("MODEL_API", "")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
+LLM_TEMPERATURE = float(os.getenv("LLM_TEMPERATURE", "0.2"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "0"))
+# 按路由的模型配置：决策定稿只是复述草案，可配置更小更快的模型；问答可配置更强的模型。
+# 未配置的项沿用 MODEL/BASE_URL/OPENAI_API_KEY/LLM_TEMPERATURE/LLM_TIMEOUT（TIMEOUT 为 0 表示使用客户端默认值）
+LLM_DECISION_MODEL = os.getenv("LLM_DECISION_MODEL", LLM_MODEL)
+LLM_DECISION_BASE_URL = os.getenv("LLM_DECISION_BASE_URL", LLM_BASE_URL)
+LLM_DECISION_API_KEY = os.getenv("LLM_DECISION_API_KEY", OPENAI_API_KEY)
+LLM_DECISION_TEMPERATURE = float(os.getenv("LLM_DECISION_TEMPERATURE", str(LLM_TEMPERATURE)))
+LLM_DECISION_TIMEOUT = float(os.getenv("LLM_DECISION_TIMEOUT", str(LLM_TIMEOUT)))
+LLM_DECISION_ENDPOINTS = os.getenv("LLM_DECISION_ENDPOINTS", "")
+LLM_QA_MODEL = os.getenv("LLM_QA_MODEL", LLM_MODEL)
+LLM_QA_BASE_URL = os.getenv("LLM_QA_BASE_URL", LLM_BASE_URL)
+LLM_QA_API_KEY = os.getenv("LLM_QA_API_KEY", OPENAI_API_KEY)
+LLM_QA_TEMPERATURE = float(os.getenv("LLM_QA_TEMPERATURE", str(LLM_TEMPERATURE)))
+LLM_QA_TIMEOUT = float(os.getenv("LLM_QA_TIMEOUT", str(LLM_TIMEOUT)))
+LLM_QA_ENDPOINTS = os.getenv("LLM_QA_ENDPOINTS", "")
+LLM_PROFILES = {
+    "decision": {
+        "model": LLM_DECISION_MODEL,
+        "base_url": LLM_DECISION_BASE_URL,
+        "api_key": LLM_DECISION_API_KEY,
+        "temperature": LLM_DECISION_TEMPERATURE,
+        "timeout": LLM_DECISION_TIMEOUT,
+        "endpoints": LLM_DECISION_ENDPOINTS,
+    },
+    "qa": {
+        "model": LLM_QA_MODEL,
+        "base_url": LLM_QA_BASE_URL,
+        "api_key": LLM_QA_API_KEY,
+        "temperature": LLM_QA_TEMPERATURE,
+        "timeout": LLM_QA_TIMEOUT,
+        "endpoints": LLM_QA_ENDPOINTS,
+    },
+}
+LLM_ROUTING_WINDOW = int(os.getenv("LLM_ROUTING_WINDOW", "200"))
+LLM_ROUTING_MIN_SAMPLES = int(os.getenv("LLM_ROUTING_MIN_SAMPLES", "20"))
+LLM_ROUTING_EXPLORE = float(os.getenv("LLM_ROUTING_EXPLORE", "0.05"))
 STORE_BACKEND = os.getenv("STORE_BACKEND", "memory")
 POSTGRES_DSN = os.getenv("POSTGRES_DSN", "")
 POSTGRES_HOST = os.getenv("POSTGRES_HOST", "")
@@ -23,7 +60,74 @@ POSTGRES_ADMIN_DB = os.getenv("POSTGRES_ADMIN_DB", "postgres")
 POSTGRES_AUTO_CREATE_DB = os.getenv("POSTGRES_AUTO_CREATE_DB", "true").lower() in ("1", "true", "yes", "on")
 POSTGRES_SCHEMA = os.getenv("POSTGRES_SCHEMA", "public")
 POSTGRES_CONNECT_TIMEOUT = int(os.getenv("POSTGRES_CONNECT_TIMEOUT", "5"))
+POSTGRES_SHARD_DSNS = os.getenv("POSTGRES_SHARD_DSNS", "")
+POSTGRES_SHARD_PREVIOUS_DSNS = os.getenv("POSTGRES_SHARD_PREVIOUS_DSNS", "")
+POSTGRES_POOL_MIN = int(os.getenv("POSTGRES_POOL_MIN", "2"))
+POSTGRES_POOL_MAX = int(os.getenv("POSTGRES_POOL_MAX", "20"))
+POSTGRES_POOL_TIMEOUT = float(os.getenv("POSTGRES_POOL_TIMEOUT", "10"))
 CHAT_MAX_TURNS = int(os.getenv("CHAT_MAX_TURNS", "12"))
+DECISION_RECORD_MAX = int(os.getenv("DECISION_RECORD_MAX", "1000000"))
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", "86400"))
+IDEMPOTENCY_WAIT_TIMEOUT = float(os.getenv("IDEMPOTENCY_WAIT_TIMEOUT", "60"))
+IDEMPOTENCY_PENDING_TIMEOUT = float(os.getenv("IDEMPOTENCY_PENDING_TIMEOUT", "300"))
+IDEMPOTENCY_POLL_INTERVAL = float(os.getenv("IDEMPOTENCY_POLL_INTERVAL", "0.2"))
+IDEMPOTENCY_MAX_KEYS = int(os.getenv("IDEMPOTENCY_MAX_KEYS", "100000"))
+BULK_FEEDBACK_CHUNK_ROWS = int(os.getenv("BULK_FEEDBACK_CHUNK_ROWS", "50000"))
+STATE_CACHE_ENABLED = os.getenv("STATE_CACHE_ENABLED", "true").lower() in ("1", "true", "yes", "on")
+STATE_CACHE_SIZE = int(os.getenv("STATE_CACHE_SIZE", "10000"))
+STATE_CACHE_TTL = float(os.getenv("STATE_CACHE_TTL", "30"))
+LABEL_STATS_HALF_LIFE_DAYS = float(os.getenv("LABEL_STATS_HALF_LIFE_DAYS", "14"))
+LABEL_STATS_SEGMENT_REFRESH = float(os.getenv("LABEL_STATS_SEGMENT_REFRESH", "5"))
+POOL_TTL_DAYS = float(os.getenv("POOL_TTL_DAYS", "30"))
+POOL_MAX_ITEMS = int(os.getenv("POOL_MAX_ITEMS", "30"))
+MEMORY_PERSIST_DIR = os.getenv("MEMORY_PERSIST_DIR", "")
+MEMORY_FSYNC = os.getenv("MEMORY_FSYNC", "everysec").lower()
+MEMORY_SNAPSHOT_INTERVAL = float(os.getenv("MEMORY_SNAPSHOT_INTERVAL", "300"))
+MEMORY_SNAPSHOT_MIN_OPS = int(os.getenv("MEMORY_SNAPSHOT_MIN_OPS", "1000"))
+SHM_STORE_PATH = os.getenv("SHM_STORE_PATH", "/dev/shm/dysmartselect.store")
+SHM_STORE_SLOTS = int(os.getenv("SHM_STORE_SLOTS", "4096"))
+SHM_STATE_BYTES = int(os.getenv("SHM_STATE_BYTES", "16384"))
+SHM_CHAT_BYTES = int(os.getenv("SHM_CHAT_BYTES", "49152"))
+SINGLEFLIGHT_ENABLED = os.getenv("SINGLEFLIGHT_ENABLED", "true").lower() in ("1", "true", "yes", "on")
+SINGLEFLIGHT_WAIT_TIMEOUT = float(os.getenv("SINGLEFLIGHT_WAIT_TIMEOUT", "60"))
+SINGLEFLIGHT_PG_MAX_CONNECTIONS = int(os.getenv("SINGLEFLIGHT_PG_MAX_CONNECTIONS", "8"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+LLM_MAX_PER_USER = int(os.getenv("LLM_MAX_PER_USER", "2"))
+LLM_QUEUE_SIZE = int(os.getenv("LLM_QUEUE_SIZE", "64"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "10"))
+LLM_WARMUP_PING = os.getenv("LLM_WARMUP_PING", "false").lower() in ("1", "true", "yes", "on")
+WARMUP_ASYNC = os.getenv("WARMUP_ASYNC", "true").lower() in ("1", "true", "yes", "on")
+WARMUP_RETRY_INTERVAL = float(os.getenv("WARMUP_RETRY_INTERVAL", "5"))
+PROGRESSIVE_WORKERS = int(os.getenv("PROGRESSIVE_WORKERS", "4"))
+PROGRESSIVE_MAX_PENDING = int(os.getenv("PROGRESSIVE_MAX_PENDING", "256"))
+PROGRESSIVE_RESULT_TTL = float(os.getenv("PROGRESSIVE_RESULT_TTL", "600"))
+PROGRESSIVE_SSE_TIMEOUT = float(os.getenv("PROGRESSIVE_SSE_TIMEOUT", "120"))
+LLM_DEGRADE_TO_DRAFT = os.getenv("LLM_DEGRADE_TO_DRAFT", "true").lower() in ("1", "true", "yes", "on")
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+LLM_PRICING = os.getenv("LLM_PRICING", "")
+LLM_USAGE_FLUSH_INTERVAL = float(os.getenv("LLM_USAGE_FLUSH_INTERVAL", "60"))
+PROFILER_MAX_SECONDS = float(os.getenv("PROFILER_MAX_SECONDS", "60"))
+MEMORY_TRACE_FRAMES = int(os.getenv("MEMORY_TRACE_FRAMES", "10"))
+MEMORY_TRACE_AUTO_STOP = float(os.getenv("MEMORY_TRACE_AUTO_STOP", "600"))
+MEMORY_TRACE_MAX_SNAPSHOTS = int(os.getenv("MEMORY_TRACE_MAX_SNAPSHOTS", "8"))
+MEMORY_REPORT_SAMPLE = int(os.getenv("MEMORY_REPORT_SAMPLE", "2000"))
+PRECOMPUTE_ENABLED = os.getenv("PRECOMPUTE_ENABLED", "false").lower() in ("1", "true", "yes", "on")
+# 低峰时段（UTC，HH:MM-HH:MM，可跨零点），默认对应北京时间 02:00-05:00
+PRECOMPUTE_WINDOW = os.getenv("PRECOMPUTE_WINDOW", "18:00-21:00")
+PRECOMPUTE_ACTIVE_DAYS = float(os.getenv("PRECOMPUTE_ACTIVE_DAYS", "3"))
+PRECOMPUTE_TTL = float(os.getenv("PRECOMPUTE_TTL", "86400"))
+PRECOMPUTE_WORKERS = int(os.getenv("PRECOMPUTE_WORKERS", "2"))
+PRECOMPUTE_CHECK_INTERVAL = float(os.getenv("PRECOMPUTE_CHECK_INTERVAL", "60"))
+PRECOMPUTE_MAX_USERS = int(os.getenv("PRECOMPUTE_MAX_USERS", "100000"))
+EVENT_LOG_DIR = os.getenv("EVENT_LOG_DIR", "")
+EVENT_LOG_SEGMENT_BYTES = int(os.getenv("EVENT_LOG_SEGMENT_BYTES", str(64 * 1024 * 1024)))
+EVENT_LOG_SEGMENT_SECONDS = float(os.getenv("EVENT_LOG_SEGMENT_SECONDS", "3600"))
+EVENT_LOG_QUEUE_SIZE = int(os.getenv("EVENT_LOG_QUEUE_SIZE", "10000"))
+EVENT_LOG_FLUSH_INTERVAL = float(os.getenv("EVENT_LOG_FLUSH_INTERVAL", "1"))
+EVENT_LOG_COMPRESS = os.getenv("EVENT_LOG_COMPRESS", "true").lower() in ("1", "true", "yes", "on")
+EVENT_LOG_RETENTION_DAYS = float(os.getenv("EVENT_LOG_RETENTION_DAYS", "0"))
+PAGE_CACHE_CONTROL = os.getenv("PAGE_CACHE_CONTROL", "public, max-age=300")
+PAGE_DEV_RELOAD = os.getenv("PAGE_DEV_RELOAD", "false").lower() in ("1", "true", "yes", "on")
 
 TEMPLATES = {
     "headline": {
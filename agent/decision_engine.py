@@ -1,13 +1,18 @@
 ﻿# -*- coding: utf-8 -*-
 from __future__ import annotations
 
+import heapq
+import threading
 import uuid
 from datetime import datetime, timedelta
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
 
-from .config import CANDIDATE_POOL, TEMPLATES
+from .config import CANDIDATE_POOL, POOL_MAX_ITEMS, POOL_TTL_DAYS, TEMPLATES
+from .label_stats import outcome_bonus, to_epoch
 from .models import DecisionRequest
-from .state import utc_now
+from .state import utc_now, utc_now_dt
+
+_CANDIDATE_BY_LABEL: Dict[str, Dict[str, Any]] = {c["label"]: c for c in CANDIDATE_POOL}
 
 
 def parse_price_mid(price_band: str) -> int:
@@ -29,15 +34,45 @@ def parse_price_mid(price_band: str) -> int:
         return 100
 
 
+def price_tier(price_mid: int) -> str:
+    '''
+    功能：
+    将中位价划分为价位档（low/mid/high）。
+
+    :param price_mid: 中位价
+    :type price_mid: int
+    :return: 价位档
+    :rtype: str
+    '''
+    if price_mid < 100:
+        return "low"
+    if price_mid < 160:
+        return "mid"
+    return "high"
+
+
+def find_candidate(label: str) -> Optional[Dict[str, Any]]:
+    '''
+    功能：
+    按款式标签查找候选方向。
+
+    :param label: 款式标签
+    :type label: str
+    :return: 候选方向信息，不存在返回 None
+    :rtype: Optional[Dict[str, Any]]
+    '''
+    return _CANDIDATE_BY_LABEL.get(label)
+
+
 def season_now() -> str:
     '''
     功能：
-    根据当前 UTC 月份返回季节标签。
+    根据当前 UTC 月份返回季节标签（受 set_clock 控制）。
 
     :return: 季节标签（winter/spring/summer/autumn）
     :rtype: str
     '''
-    month = datetime.utcnow().month
+    month = utc_now_dt().month
     if month in (12, 1, 2):
         return "winter"
     if month in (3, 4, 5):
@@ -89,7 +124,9 @@ def timing_heuristic(candidate: Dict[str, Any]) -> Tuple[Optional[str], Optional
     return None, None
 
 
-def score_candidate(req: DecisionRequest, candidate: Dict[str, Any]) -> int:
+def score_candidate(
+    req: DecisionRequest, candidate: Dict[str, Any], feedback_bonus: int = 0
+) -> int:
     '''
     功能：
     对候选方向进行规则打分，用于排序选择。
@@ -98,6 +135,8 @@ def score_candidate(req: DecisionRequest, candidate: Dict[str, Any]) -> int:
     :type req: DecisionRequest
     :param candidate: 候选方向信息
     :type candidate: Dict[str, Any]
+    :param feedback_bonus: 历史反馈加减分（见 label_stats.outcome_bonus）
+    :type feedback_bonus: int
     :return: 分数（越高越优）
     :rtype: int
     '''
@@ -123,7 +162,7 @@ def score_candidate(req: DecisionRequest, candidate: Dict[str, Any]) -> int:
     if "homogeneous" in candidate["risk_tags"]:
         score -= 3
 
-    return score
+    return score + feedback_bonus
 
 
 def choose_primary_risk(candidate: Dict[str, Any], env_trigger: bool) -> str:
@@ -161,7 +200,7 @@ def env_unfavorable(state: Dict[str, Any]) -> bool:
     if not history:
         return False
 
-    seven_days_ago = datetime.utcnow() - timedelta(days=7)
+    seven_days_ago = utc_now_dt() - timedelta(days=7)
     recent = [
         r
         for r in history
@@ -182,81 +221,452 @@ def env_unfavorable(state: Dict[str, Any]) -> bool:
     return True
 
 
-def apply_pool_item(pool: List[Dict[str, Any]], item: Dict[str, Any]) -> None:
+def normalize_pool(pool: Any) -> Dict[str, Dict[str, Any]]:
     '''
     功能：
-    将条目追加到回避池/暂缓池。
+    将回避池/暂缓池规范为按款式去重的字典 {label: {reason, first_seen, last_seen, hits}}，
+    兼容旧版列表格式（重复条目合并计数）。最近命中顺序以 last_seen 为准，不依赖字典顺序
+    （Postgres JSONB 不保留键顺序）。
+
+    :param pool: 池（字典或旧版列表）
+    :type pool: Any
+    :return: 按款式去重的池
+    :rtype: Dict[str, Dict[str, Any]]
+    '''
+    if isinstance(pool, dict):
+        return pool
+    keyed: Dict[str, Dict[str, Any]] = {}
+    for item in pool or []:
+        apply_pool_item(keyed, item)
+    return keyed
 
-    :param pool: 池列表
-    :type pool: List[Dict[str, Any]]
-    :param item: 要追加的条目
+
+def load_pool(state: Dict[str, Any], name: str) -> Dict[str, Dict[str, Any]]:
+    '''
+    功能：
+    读取用户状态中的池并剔除超过 POOL_TTL_DAYS 未再命中的条目。
+
+    :param state: 用户状态
+    :type state: Dict[str, Any]
+    :param name: avoid_pool/defer_pool
+    :type name: str
+    :return: 按款式去重的池
+    :rtype: Dict[str, Dict[str, Any]]
+    '''
+    pool = normalize_pool(state.get(name))
+    if pool and POOL_TTL_DAYS > 0:
+        cutoff = utc_now_dt() - timedelta(days=POOL_TTL_DAYS)
+        expired = [
+            label
+            for label, entry in pool.items()
+            if not entry.get("last_seen") or datetime.fromisoformat(entry["last_seen"]) < cutoff
+        ]
+        for label in expired:
+            del pool[label]
+    return pool
+
+
+def _last_seen_key(item: Tuple[str, Dict[str, Any]]) -> Tuple[str, str]:
+    # 同一时钟生成的 ISO 时间字符串可直接比较；时间相同时按款式排序，保证各存储后端结果一致
+    label, entry = item
+    return entry.get("last_seen") or "", label
+
+
+def trim_pool(pool: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    '''
+    功能：
+    只保留 last_seen 最近的 POOL_MAX_ITEMS 个款式（按 last_seen 升序排列）。
+
+    :param pool: 按款式去重的池
+    :type pool: Dict[str, Dict[str, Any]]
+    :return: 裁剪后的池
+    :rtype: Dict[str, Dict[str, Any]]
+    '''
+    if len(pool) <= POOL_MAX_ITEMS:
+        return pool
+    return dict(heapq.nlargest(POOL_MAX_ITEMS, pool.items(), key=_last_seen_key)[::-1])
+
+
+def apply_pool_item(pool: Dict[str, Dict[str, Any]], item: Dict[str, Any]) -> None:
+    '''
+    功能：
+    将条目合并进回避池/暂缓池：同款式只保留一条，更新原因、最近命中时间与命中次数。
+
+    :param pool: 按款式去重的池
+    :type pool: Dict[str, Dict[str, Any]]
+    :param item: 条目（label/reason/ts）
     :type item: Dict[str, Any]
     :return: 无
     :rtype: None
     '''
-    pool.append(item)
+    entry = pool.get(item["label"])
+    if entry is None:
+        entry = {"reason": item["reason"], "first_seen": item["ts"], "last_seen": item["ts"], "hits": 0}
+    entry["reason"] = item["reason"]
+    entry["last_seen"] = item["ts"]
+    entry["hits"] = entry.get("hits", 0) + item.get("hits", 1)
+    pool[item["label"]] = entry
+
+
+def _recent(pool: Dict[str, Dict[str, Any]], k: int) -> List[Tuple[str, Dict[str, Any]]]:
+    # last_seen 最近的 k 个条目，按时间升序
+    return heapq.nlargest(k, pool.items(), key=_last_seen_key)[::-1]
 
 
 def ensure_dont_do(
-    avoid_pool: List[Dict[str, Any]],
-    defer_pool: List[Dict[str, Any]],
+    avoid_pool: Dict[str, Dict[str, Any]],
+    defer_pool: Dict[str, Dict[str, Any]],
     candidates: List[Dict[str, Any]],
 ) -> List[Dict[str, Any]]:
     '''
     功能：
-    构造不拍清单，优先使用历史回避/暂缓池补足到 2~3 项。
+    构造不拍清单，优先使用最近命中的回避/暂缓款式补足到 2~3 项（款式不重复）。
 
     :param avoid_pool: 回避池
-    :type avoid_pool: List[Dict[str, Any]]
+    :type avoid_pool: Dict[str, Dict[str, Any]]
     :param defer_pool: 暂缓池
-    :type defer_pool: List[Dict[str, Any]]
+    :type defer_pool: Dict[str, Dict[str, Any]]
     :param candidates: 候选方向列表
     :type candidates: List[Dict[str, Any]]
     :return: 不拍清单条目列表
     :rtype: List[Dict[str, Any]]
     '''
     items: List[Dict[str, Any]] = []
-    for it in avoid_pool[-2:]:
-        items.append({
-            "label": it["label"],
-            "status": "avoid",
-            "reason": it["reason"],
-        })
-    for it in defer_pool[-2:]:
+    labels = set()
+
+    def add(label: str, status: str, reason: str) -> None:
+        if label not in labels:
+            labels.add(label)
+            items.append({"label": label, "status": status, "reason": reason})
+
+    for label, entry in _recent(avoid_pool, 2):
+        add(label, "avoid", entry["reason"])
+    for label, entry in _recent(defer_pool, 2):
         if len(items) >= 3:
             break
-        items.append({
-            "label": it["label"],
-            "status": "defer",
-            "reason": it["reason"],
-        })
+        add(label, "defer", entry["reason"])
 
     if len(items) < 2:
         for c in candidates:
             if len(items) >= 2:
                 break
-            items.append({
-                "label": c["label"],
-                "status": "defer",
-                "reason": TEMPLATES["dont_do"]["defer"],
-            })
+            add(c["label"], "defer", TEMPLATES["dont_do"]["defer"])
 
     if len(items) < 3 and candidates:
-        items.append({
-            "label": candidates[-1]["label"],
-            "status": "avoid",
-            "reason": TEMPLATES["dont_do"]["avoid"],
-        })
+        add(candidates[-1]["label"], "avoid", TEMPLATES["dont_do"]["avoid"])
 
     return items[:3]
 
 
+class _TableEntry(NamedTuple):
+    rejected: Tuple[Tuple[str, Dict[str, Any], str, str], ...]
+    passed: Tuple[Dict[str, Any], ...]
+    scored: Tuple[Tuple[int, Dict[str, Any]], ...]
+    ranked: Tuple[Tuple[int, Dict[str, Any]], ...]
+    fallback: bool
+
+
+class DecisionTable:
+    '''
+    功能：
+    规则引擎无状态部分的预计算表：按 (范围, 类目, 阶段, 名额, 库存, 价位签名) 缓存
+    硬规则/时机过滤结果、基础分与排序；表对应一个季节与一份候选目录，变化时整体重建。
+    价位签名为各候选价位扣分的组合，同签名的中位价得分完全一致。
+    '''
+
+    def __init__(self, candidates: List[Dict[str, Any]], season: str) -> None:
+        self.season = season
+        self.candidates = list(candidates)
+        prices = [c["price_mid"] for c in self.candidates] or [0]
+        # 价差超过 100 时扣分封顶，区间外的中位价与边界同签名
+        self._price_lo = min(prices) - 100
+        self._price_hi = max(prices) + 100
+        signatures: Dict[Tuple[int, ...], int] = {}
+        self._price_sig: List[int] = []
+        for price_mid in range(self._price_lo, self._price_hi + 1):
+            sig = tuple(min(abs(c["price_mid"] - price_mid) // 10, 10) for c in self.candidates)
+            self._price_sig.append(signatures.setdefault(sig, len(signatures)))
+        self._entries: Dict[Tuple[Any, ...], _TableEntry] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _key(self, req: DecisionRequest, scope: str) -> Tuple[Any, ...]:
+        price_mid = min(max(parse_price_mid(req.price_band), self._price_lo), self._price_hi)
+        return (
+            scope,
+            req.category,
+            req.account_stage,
+            req.daily_slots,
+            req.in_stock,
+            self._price_sig[price_mid - self._price_lo],
+        )
+
+    def _build_entry(self, req: DecisionRequest, scope: str) -> _TableEntry:
+        candidates = self.candidates
+        if scope == "category":
+            candidates = [c for c in self.candidates if req.category in c["categories"]] or self.candidates
+
+        rejected: List[Tuple[str, Dict[str, Any], str, str]] = []
+        passed: List[Dict[str, Any]] = []
+        for c in candidates:
+            status, reason = hard_filters(req, c)
+            if status:
+                rejected.append((status, c, reason, f"hard_filter:{status}"))
+                continue
+            t_status, t_reason = timing_heuristic(c)
+            if t_status:
+                rejected.append((t_status, c, t_reason, f"timing:{t_status}"))
+                continue
+            passed.append(c)
+
+        fallback = not passed
+        scored = tuple((score_candidate(req, c), c) for c in (candidates if fallback else passed))
+        ranked = tuple(sorted(scored, key=lambda x: x[0], reverse=True))
+        return _TableEntry(tuple(rejected), tuple(passed), scored, ranked, fallback)
+
+    def lookup(self, req: DecisionRequest, scope: str = "category") -> _TableEntry:
+        '''
+        功能：
+        查表获取无状态部分的结果，未命中时计算并写入。
+
+        :param req: 用户请求参数
+        :type req: DecisionRequest
+        :param scope: category（本类目候选）或 all（全部候选，组合模式）
+        :type scope: str
+        :return: 表项
+        :rtype: _TableEntry
+        '''
+        key = self._key(req, scope)
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._build_entry(req, scope)
+            self._entries[key] = entry
+        return entry
+
+    def warm(self) -> None:
+        '''
+        功能：
+        预先填充候选目录涉及的全部类目、阶段、名额、库存与价位签名组合。
+
+        :return: 无
+        :rtype: None
+        '''
+        categories = sorted({cat for c in self.candidates for cat in c["categories"]})
+        seen_sig: Dict[int, int] = {}
+        for price_mid in range(max(self._price_lo, 0), self._price_hi + 1):
+            seen_sig.setdefault(self._price_sig[price_mid - self._price_lo], price_mid)
+        for category in categories:
+            for stage in ("explore", "converge"):
+                for slots in (1, 2, 3):
+                    for in_stock in (True, False):
+                        for price_mid in seen_sig.values():
+                            req = DecisionRequest.model_construct(
+                                user_id="",
+                                category=category,
+                                price_band=f"{price_mid}-{price_mid}",
+                                account_stage=stage,
+                                daily_slots=slots,
+                                in_stock=in_stock,
+                            )
+                            self.lookup(req, "category")
+                            self.lookup(req, "all")
+
+
+_table_lock = threading.RLock()
+_table: Optional[DecisionTable] = None
+
+
+def build_decision_table(warm: bool = True) -> DecisionTable:
+    '''
+    功能：
+    按当前候选目录与季节重建决策表（启动、季节切换或目录更新时调用）。
+
+    :param warm: 是否预先填充全部组合
+    :type warm: bool
+    :return: 新的决策表
+    :rtype: DecisionTable
+    '''
+    global _table
+    with _table_lock:
+        table = DecisionTable(CANDIDATE_POOL, season_now())
+        if warm:
+            table.warm()
+        _table = table
+    return table
+
+
+def decision_table() -> DecisionTable:
+    '''
+    功能：
+    返回当前季节的决策表，季节变化时自动重建。
+
+    :return: 决策表
+    :rtype: DecisionTable
+    '''
+    table = _table
+    if table is None or table.season != season_now():
+        with _table_lock:
+            table = _table
+            if table is None or table.season != season_now():
+                table = build_decision_table()
+    return table
+
+
+def set_catalog(candidates: List[Dict[str, Any]]) -> None:
+    '''
+    功能：
+    原地替换候选目录并重建决策表。
+
+    :param candidates: 新的候选方向列表
+    :type candidates: List[Dict[str, Any]]
+    :return: 无
+    :rtype: None
+    '''
+    CANDIDATE_POOL[:] = candidates
+    _CANDIDATE_BY_LABEL.clear()
+    _CANDIDATE_BY_LABEL.update({c["label"]: c for c in CANDIDATE_POOL})
+    build_decision_table()
+
+
+def _filter_and_score(
+    req: DecisionRequest,
+    state: Dict[str, Any],
+    scope: str,
+    avoid_pool: Dict[str, Dict[str, Any]],
+    defer_pool: Dict[str, Dict[str, Any]],
+    rules_fired: List[str],
+) -> Tuple[List[Tuple[int, Dict[str, Any]]], List[Dict[str, Any]]]:
+    '''
+    功能：
+    查决策表得到过滤与基础分，再叠加与用户状态相关的部分：被过滤项写入回避池/暂缓池，
+    反馈加减分非零时重新排序。
+
+    :param req: 用户请求参数
+    :type req: DecisionRequest
+    :param state: 当前用户状态
+    :type state: Dict[str, Any]
+    :param scope: category（本类目候选）或 all（全部候选）
+    :type scope: str
+    :param avoid_pool: 回避池（原地合并）
+    :type avoid_pool: Dict[str, Dict[str, Any]]
+    :param defer_pool: 暂缓池（原地合并）
+    :type defer_pool: Dict[str, Dict[str, Any]]
+    :param rules_fired: 触发规则列表（原地追加）
+    :type rules_fired: List[str]
+    :return: (排序后的 (分数, 候选) 列表, 通过过滤的候选列表（全部被过滤时为参与打分的候选）)
+    :rtype: Tuple[List[Tuple[int, Dict[str, Any]]], List[Dict[str, Any]]]
+    '''
+    entry = decision_table().lookup(req, scope)
+
+    for status, c, reason, rule in entry.rejected:
+        rules_fired.append(rule)
+        apply_pool_item(avoid_pool if status == "avoid" else defer_pool, {
+            "label": c["label"],
+            "reason": reason,
+            "ts": utc_now(),
+        })
+    if entry.fallback:
+        rules_fired.append("fallback:no_filtered")
+
+    now_ts = to_epoch(utc_now_dt())
+    bonuses = [
+        outcome_bonus(state, c["label"], req.category, price_tier(c["price_mid"]), now_ts)
+        for _, c in entry.scored
+    ]
+    if any(bonuses):
+        scored = [(score + b, c) for (score, c), b in zip(entry.scored, bonuses)]
+        scored.sort(key=lambda x: x[0], reverse=True)
+    else:
+        scored = list(entry.ranked)
+    return scored, list(entry.passed) or [c for _, c in entry.scored]
+
+
+def _commit_state(
+    req: DecisionRequest,
+    state: Dict[str, Any],
+    picks: List[Tuple[str, Dict[str, Any], str]],
+    env_trigger: bool,
+    avoid_pool: Dict[str, Dict[str, Any]],
+    defer_pool: Dict[str, Dict[str, Any]],
+) -> None:
+    '''
+    功能：
+    一次决策（单款或组合）完成后统一更新用户状态：引导步数、最近推荐与请求参数、历史、环境计数与不拍池。
+
+    :param req: 用户请求参数
+    :type req: DecisionRequest
+    :param state: 用户状态（原地修改）
+    :type state: Dict[str, Any]
+    :param picks: [(decision_id, 候选, confidence_style)]，第一项为主推
+    :type picks: List[Tuple[str, Dict[str, Any], str]]
+    :param env_trigger: 是否触发环境不利
+    :type env_trigger: bool
+    :param avoid_pool: 回避池
+    :type avoid_pool: Dict[str, Dict[str, Any]]
+    :param defer_pool: 暂缓池
+    :type defer_pool: Dict[str, Dict[str, Any]]
+    :return: 无
+    :rtype: None
+    '''
+    state["onboarding_step"] = state.get("onboarding_step", 0) + 1
+    state["account_stage"] = req.account_stage
+    state["daily_slots"] = req.daily_slots
+    state["updated_at"] = utc_now()
+
+    decision_id, top_candidate, _ = picks[0]
+    last_reco = {
+        "decision_id": decision_id,
+        "label": top_candidate["label"],
+        "ts": utc_now(),
+        "category": req.category,
+        "price_band": req.price_band,
+        "in_stock": req.in_stock,
+    }
+    if len(picks) > 1:
+        last_reco["slate_ids"] = [pick[0] for pick in picks]
+    state["last_reco"] = last_reco
+    # 完整的请求参数，低峰预生成次日决策时沿用
+    state["last_request"] = req.model_dump(exclude={"user_id", "progressive"})
+
+    history = state.get("history", [])
+    for pick_id, candidate, confidence_style in picks:
+        history.append({
+            "ts": utc_now(),
+            "decision_id": pick_id,
+            "label": candidate["label"],
+            "category": req.category,
+            "price_band": req.price_band,
+            "in_stock": req.in_stock,
+            "decision": confidence_style,
+            "outcome": None,
+        })
+    state["history"] = history[-30:]
+
+    if env_trigger:
+        state.setdefault("stats", {}).setdefault("env_trigger_count", 0)
+        state["stats"]["env_trigger_count"] += 1
+    else:
+        if "stats" in state:
+            state["stats"]["env_trigger_count"] = 0
+
+    state["avoid_pool"] = trim_pool(avoid_pool)
+    state["defer_pool"] = trim_pool(defer_pool)
+
+
+def _confidence(gap: int, in_stock: bool) -> str:
+    if not in_stock:
+        return "conservative"
+    return "strong" if gap >= 8 else "conservative"
+
+
 def rule_decision(
     req: DecisionRequest, state: Dict[str, Any]
 ) -> Tuple[Dict[str, Any], Dict[str, Any], List[str]]:
     '''
     功能：
     按规则完成候选筛选、评分选择与输出组装，并更新用户状态。
+    请求 slate=true 时转为 rule_slate，一次返回多个名额的组合。
 
     :param req: 用户请求参数
     :type req: DecisionRequest
@@ -265,61 +675,20 @@ def rule_decision(
     :return: (决策输出, 更新后的状态, 触发规则列表)
     :rtype: Tuple[Dict[str, Any], Dict[str, Any], List[str]]
     '''
+    if getattr(req, "slate", False):
+        return rule_slate(req, state)
+
     mode = "best" if state["onboarding_step"] < 2 else "only"
     rules_fired: List[str] = []
 
-    candidates = [c for c in CANDIDATE_POOL if req.category in c["categories"]]
-    if not candidates:
-        candidates = CANDIDATE_POOL[:]
-
-    avoid_pool = state.get("avoid_pool", [])
-    defer_pool = state.get("defer_pool", [])
-
-    scored: List[Tuple[int, Dict[str, Any]]] = []
-    filtered: List[Dict[str, Any]] = []
-
-    for c in candidates:
-        status, reason = hard_filters(req, c)
-        if status:
-            rules_fired.append(f"hard_filter:{status}")
-            if status == "avoid":
-                apply_pool_item(avoid_pool, {
-                    "label": c["label"],
-                    "reason": reason,
-                    "ts": utc_now(),
-                })
-            else:
-                apply_pool_item(defer_pool, {
-                    "label": c["label"],
-                    "reason": reason,
-                    "ts": utc_now(),
-                })
-            continue
+    avoid_pool = load_pool(state, "avoid_pool")
+    defer_pool = load_pool(state, "defer_pool")
 
-        t_status, t_reason = timing_heuristic(c)
-        if t_status:
-            rules_fired.append(f"timing:{t_status}")
-            apply_pool_item(defer_pool, {
-                "label": c["label"],
-                "reason": t_reason,
-                "ts": utc_now(),
-            })
-            continue
-
-        filtered.append(c)
-        scored.append((score_candidate(req, c), c))
-
-    if not scored:
-        scored = [(score_candidate(req, c), c) for c in candidates]
-        rules_fired.append("fallback:no_filtered")
-
-    scored.sort(key=lambda x: x[0], reverse=True)
+    scored, filtered = _filter_and_score(req, state, "category", avoid_pool, defer_pool, rules_fired)
     top_score, top_candidate = scored[0]
     second_score = scored[1][0] if len(scored) > 1 else top_score
 
-    confidence_style = "strong" if (top_score - second_score) >= 8 else "conservative"
-    if not req.in_stock:
-        confidence_style = "conservative"
+    confidence_style = _confidence(top_score - second_score, req.in_stock)
 
     env_trigger = env_unfavorable(state)
     if env_trigger:
@@ -335,7 +704,7 @@ def rule_decision(
     if env_trigger:
         reason_one_line = "最近环境偏冷，先稳住节奏"
 
-    dont_do = ensure_dont_do(avoid_pool, defer_pool, filtered or candidates)
+    dont_do = ensure_dont_do(avoid_pool, defer_pool, filtered)
 
     output = {
         "decision_id": decision_id,
@@ -361,42 +730,135 @@ def rule_decision(
         },
     }
 
-    state["onboarding_step"] = state.get("onboarding_step", 0) + 1
-    state["account_stage"] = req.account_stage
-    state["daily_slots"] = req.daily_slots
-    state["updated_at"] = utc_now()
+    _commit_state(
+        req, state, [(decision_id, top_candidate, confidence_style)], env_trigger, avoid_pool, defer_pool
+    )
+    return output, state, rules_fired
 
-    last_reco = {
-        "decision_id": decision_id,
-        "label": top_candidate["label"],
-        "ts": utc_now(),
-        "category": req.category,
-        "price_band": req.price_band,
-        "in_stock": req.in_stock,
-    }
-    state["last_reco"] = last_reco
 
-    history = state.get("history", [])
-    history.append({
-        "ts": utc_now(),
-        "decision_id": decision_id,
-        "label": top_candidate["label"],
-        "category": req.category,
-        "price_band": req.price_band,
-        "in_stock": req.in_stock,
-        "decision": confidence_style,
-        "outcome": None,
-    })
-    state["history"] = history[-30:]
+def select_slate(
+    req: DecisionRequest, scored: List[Tuple[int, Dict[str, Any]]], slots: int
+) -> List[Tuple[int, Dict[str, Any]]]:
+    '''
+    功能：
+    从已排序的候选中贪心选出至多 slots 个，保证 (类目, 价位档) 组合不重复。
+
+    :param req: 用户请求参数
+    :type req: DecisionRequest
+    :param scored: 按分数降序的 (分数, 候选) 列表
+    :type scored: List[Tuple[int, Dict[str, Any]]]
+    :param slots: 名额数
+    :type slots: int
+    :return: 入选的 (分数, 候选) 列表
+    :rtype: List[Tuple[int, Dict[str, Any]]]
+    '''
+    picked: List[Tuple[int, Dict[str, Any]]] = []
+    seen = set()
+    for score, c in scored:
+        category = req.category if req.category in c["categories"] else c["categories"][0]
+        key = (category, price_tier(c["price_mid"]))
+        if key in seen:
+            continue
+        seen.add(key)
+        picked.append((score, c))
+        if len(picked) >= slots:
+            break
+    return picked
+
+
+def rule_slate(
+    req: DecisionRequest, state: Dict[str, Any]
+) -> Tuple[Dict[str, Any], Dict[str, Any], List[str]]:
+    '''
+    功能：
+    组合模式：一次筛选打分，选出 daily_slots 个互不重复 (类目, 价位档) 的方向，
+    每个名额有独立 decision_id，用户状态只更新一次。顶层字段与单款模式一致（对应第 1 名额）。
+
+    :param req: 用户请求参数
+    :type req: DecisionRequest
+    :param state: 当前用户状态
+    :type state: Dict[str, Any]
+    :return: (决策输出, 更新后的状态, 触发规则列表)
+    :rtype: Tuple[Dict[str, Any], Dict[str, Any], List[str]]
+    '''
+    mode = "best" if state["onboarding_step"] < 2 else "only"
+    rules_fired: List[str] = ["slate"]
+
+    avoid_pool = load_pool(state, "avoid_pool")
+    defer_pool = load_pool(state, "defer_pool")
 
+    # 组合模式在全部候选上打分，类目匹配的 +15 使本类目优先，其余类目用于补足多样性
+    scored, filtered = _filter_and_score(req, state, "all", avoid_pool, defer_pool, rules_fired)
+    picked = select_slate(req, scored, req.daily_slots)
+    if len(picked) < req.daily_slots:
+        rules_fired.append("slate:short")
+
+    env_trigger = env_unfavorable(state)
     if env_trigger:
-        state.setdefault("stats", {}).setdefault("env_trigger_count", 0)
-        state["stats"]["env_trigger_count"] += 1
-    else:
-        if "stats" in state:
-            state["stats"]["env_trigger_count"] = 0
+        rules_fired.append("env_unfavorable")
 
-    state["avoid_pool"] = avoid_pool[-30:]
-    state["defer_pool"] = defer_pool[-30:]
+    slate: List[Dict[str, Any]] = []
+    picks: List[Tuple[str, Dict[str, Any], str]] = []
+    for idx, (score, c) in enumerate(picked):
+        next_score = picked[idx + 1][0] if idx + 1 < len(picked) else None
+        if next_score is None:
+            rest = [s for s, other in scored if other is not c and s <= score]
+            next_score = rest[0] if rest else score
+        confidence_style = _confidence(score - next_score, req.in_stock)
+        risk = choose_primary_risk(c, env_trigger)
+        decision_id = uuid.uuid4().hex
+        picks.append((decision_id, c, confidence_style))
+        slate.append({
+            "slot": idx + 1,
+            "decision_id": decision_id,
+            "label": c["label"],
+            "category": req.category if req.category in c["categories"] else c["categories"][0],
+            "price_tier": price_tier(c["price_mid"]),
+            "score": score,
+            "confidence_style": confidence_style,
+            "action": TEMPLATES["action"][confidence_style],
+            "primary_risk": TEMPLATES["risk"][risk],
+            "failure_next": TEMPLATES["failure_next"][risk],
+        })
+
+    top = slate[0]
+    top_risk = choose_primary_risk(picked[0][1], env_trigger)
+    reason_one_line = TEMPLATES["reason"][top["confidence_style"]]
+    if env_trigger:
+        reason_one_line = "最近环境偏冷，先稳住节奏"
+
+    slate_labels = {item["label"] for item in slate}
+    dont_do = ensure_dont_do(
+        avoid_pool,
+        defer_pool,
+        [c for c in filtered if c["label"] not in slate_labels],
+    )
+
+    output = {
+        "decision_id": top["decision_id"],
+        "headline": TEMPLATES["headline"][mode],
+        "action": top["action"],
+        "reason_one_line": reason_one_line,
+        "primary_risk": top["primary_risk"],
+        "why_it": [
+            f"类目匹配：{req.category}",
+            f"价位贴近：{req.price_band}",
+            f"阶段匹配：{req.account_stage}",
+        ],
+        "dont_do": dont_do,
+        "failure_expectation": {
+            "likely": top_risk,
+            "next_action": TEMPLATES["failure_next"][top_risk],
+        },
+        "slate": slate,
+        "meta": {
+            "mode": mode,
+            "confidence_style": top["confidence_style"],
+            "rules_fired": rules_fired,
+            "state_snapshot_version": state["onboarding_step"],
+            "slots": req.daily_slots,
+        },
+    }
 
+    _commit_state(req, state, picks, env_trigger, avoid_pool, defer_pool)
     return output, state, rules_fired
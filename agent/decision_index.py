@@ -0,0 +1,113 @@
+﻿# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+from typing import Any, Dict, List, Optional
+
+from .memory_store import get_decision_record, put_decision_records, update_decision_record
+
+
+def build_records(
+    output: Dict[str, Any], state: Dict[str, Any], refinement: Optional[Dict[str, Any]] = None
+) -> List[Dict[str, Any]]:
+    '''
+    功能：
+    根据决策输出与已更新的用户状态生成决策记录：每个名额一条（字段同 history），
+    第一条为主推并保存完整输出（渐进式决策还保存润色状态），组合的其余名额通过 group_id 指向主推。
+
+    :param output: 决策输出（单款或组合）
+    :type output: Dict[str, Any]
+    :param state: 已写入本次决策的用户状态
+    :type state: Dict[str, Any]
+    :param refinement: 渐进式决策的润色状态 {status, agent_flags}
+    :type refinement: Optional[Dict[str, Any]]
+    :return: 决策记录列表
+    :rtype: List[Dict[str, Any]]
+    '''
+    if output.get("slate"):
+        ids = [slot["decision_id"] for slot in output["slate"]]
+    else:
+        ids = [output["decision_id"]]
+    history = {item.get("decision_id"): item for item in state.get("history", [])[-len(ids):]}
+    records = []
+    for slot, decision_id in enumerate(ids):
+        record = dict(history.get(decision_id) or {"decision_id": decision_id, "outcome": None})
+        record.update(user_id=state["user_id"], group_id=ids[0], slot=slot)
+        if slot == 0:
+            record["output"] = output
+            if refinement is not None:
+                record["refinement"] = refinement
+        records.append(record)
+    return records
+
+
+def index_decision(
+    output: Dict[str, Any], state: Dict[str, Any], refinement: Optional[Dict[str, Any]] = None
+) -> List[Dict[str, Any]]:
+    '''
+    功能：
+    写入本次决策的记录，供按 decision_id 查询与反馈关联。
+
+    :param output: 决策输出
+    :type output: Dict[str, Any]
+    :param state: 已写入本次决策的用户状态
+    :type state: Dict[str, Any]
+    :param refinement: 渐进式决策的润色状态 {status, agent_flags}
+    :type refinement: Optional[Dict[str, Any]]
+    :return: 写入的决策记录
+    :rtype: List[Dict[str, Any]]
+    '''
+    records = build_records(output, state, refinement)
+    put_decision_records(state["user_id"], records)
+    return records
+
+
+def refresh_output(
+    decision_id: str,
+    user_id: str,
+    output: Dict[str, Any],
+    refinement: Optional[Dict[str, Any]] = None,
+) -> bool:
+    '''
+    功能：
+    更新主推记录中保存的输出与润色状态（渐进式决策完成 LLM 润色后调用）：只覆盖这两个字段，
+    润色期间并发回填的反馈结果保持不变。
+
+    :param decision_id: 主推决策 ID
+    :type decision_id: str
+    :param user_id: 用户唯一标识
+    :type user_id: str
+    :param output: 最终决策输出
+    :type output: Dict[str, Any]
+    :param refinement: 润色状态 {status, agent_flags}
+    :type refinement: Optional[Dict[str, Any]]
+    :return: 是否找到并更新
+    :rtype: bool
+    '''
+    fields: Dict[str, Any] = {"output": output}
+    if refinement is not None:
+        fields["refinement"] = refinement
+    return update_decision_record(decision_id, user_id, fields)
+
+
+def find_decision(decision_id: str, user_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    '''
+    功能：
+    按 decision_id 查询决策记录；组合中的非主推名额附带主推记录保存的完整输出。
+    给出 user_id 时只返回属于该用户的记录。
+
+    :param decision_id: 决策 ID
+    :type decision_id: str
+    :param user_id: 用户唯一标识（可选）
+    :type user_id: Optional[str]
+    :return: 决策记录，不存在返回 None
+    :rtype: Optional[Dict[str, Any]]
+    '''
+    record = get_decision_record(decision_id, user_id)
+    if record is None or (user_id and record.get("user_id") != user_id):
+        return None
+    group_id = record.get("group_id")
+    if "output" not in record and group_id and group_id != decision_id:
+        primary = get_decision_record(group_id, record.get("user_id"))
+        if primary is not None:
+            record["output"] = primary.get("output")
+    return record
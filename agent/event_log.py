@@ -0,0 +1,817 @@
+﻿# -*- coding: utf-8 -*-
+"""
+决策、反馈与问答事件的本地追加日志（NDJSON 分段，轮转后 gzip 压缩），供离线分析与回放读取，
+不再查询线上存储。
+
+- 写入不阻塞请求：emit_event 在调用线程编码为一行 JSON 放入有界队列，后台线程批量写入；
+  队列满时丢弃并计数（dropped）。写入只 flush 到操作系统，不 fsync。
+- 每个进程写自己的流目录 <EVENT_LOG_DIR>/<stream>/（多 worker 与命令行导入互不冲突），
+  持有流目录下 .lock 的文件锁；启动时清理已退出进程遗留的流（封存活动段、压缩、截断半行）。
+- 段文件按首条事件序号命名：活动段 <首序号>.ndjson；达到 EVENT_LOG_SEGMENT_BYTES 字节或
+  EVENT_LOG_SEGMENT_SECONDS 秒后封存为 <首序号>_<最早时间>_<最晚时间>.ndjson 并压缩为 .ndjson.gz，
+  按时间范围读取时据此跳过整段。事件序号 = 段首序号 + 行号，不写入文件。
+- 读取：scan_events 按时间范围合并各流（按 ts 排序）；tail_events 按游标（流:序号）增量读取。
+
+事件格式与 agent.replay 兼容（decision 带 request，feedback 带 user_id/decision_id/outcome）：
+
+    python -m agent.event_log scan --since 2026-10-01 --type decision,feedback | python -m agent.replay -
+    python -m agent.event_log tail --follow --type qa
+"""
+from __future__ import annotations
+
+import argparse
+import atexit
+import gzip
+import heapq
+import json
+import logging
+import os
+import queue
+import shutil
+import socket
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import IO, Any, Dict, Iterator, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+try:
+    import fcntl
+except ImportError:  # 非 POSIX 平台不做跨进程的流清理
+    fcntl = None
+
+from .config import (
+    EVENT_LOG_COMPRESS,
+    EVENT_LOG_DIR,
+    EVENT_LOG_FLUSH_INTERVAL,
+    EVENT_LOG_QUEUE_SIZE,
+    EVENT_LOG_RETENTION_DAYS,
+    EVENT_LOG_SEGMENT_BYTES,
+    EVENT_LOG_SEGMENT_SECONDS,
+)
+from .state import utc_now, utc_now_dt
+
+logger = logging.getLogger("agent")
+
+EVENT_TYPES = ("decision", "decision_refined", "feedback", "qa")
+_LOCK_NAME = ".lock"
+_BATCH = 1000
+_STOP = object()
+
+
+def _compact(ts: str) -> str:
+    # "2026-10-19T23:40:00.123" -> "20261019T234000"，可按字符串比较
+    return ts[:19].replace("-", "").replace(":", "")
+
+
+class Segment(NamedTuple):
+    stream: str
+    first_seq: int
+    path: str
+    min_ts: Optional[str]
+    max_ts: Optional[str]
+    active: bool
+
+
+def _parse_segment(stream_dir: str, name: str) -> Optional[Segment]:
+    if name.endswith(".ndjson.gz"):
+        base = name[:-len(".ndjson.gz")]
+    elif name.endswith(".ndjson"):
+        base = name[:-len(".ndjson")]
+    else:
+        return None
+    parts = base.split("_")
+    try:
+        first_seq = int(parts[0])
+    except ValueError:
+        return None
+    path = os.path.join(stream_dir, name)
+    stream = os.path.basename(stream_dir)
+    if len(parts) == 1 and name.endswith(".ndjson"):
+        return Segment(stream, first_seq, path, None, None, True)
+    if len(parts) == 3:
+        return Segment(stream, first_seq, path, parts[1], parts[2], False)
+    return None
+
+
+def list_segments(directory: str) -> Dict[str, List[Segment]]:
+    '''
+    功能：
+    列出日志目录下各流的段（按首序号排序；压缩过程中同一段的原文件与 .gz 同时存在时取 .gz）。
+
+    :param directory: 日志目录
+    :type directory: str
+    :return: {流名: [段]}
+    :rtype: Dict[str, List[Segment]]
+    '''
+    result: Dict[str, List[Segment]] = {}
+    if not os.path.isdir(directory):
+        return result
+    for stream in sorted(os.listdir(directory)):
+        stream_dir = os.path.join(directory, stream)
+        if not os.path.isdir(stream_dir):
+            continue
+        by_seq: Dict[int, Segment] = {}
+        for name in os.listdir(stream_dir):
+            segment = _parse_segment(stream_dir, name)
+            if segment is None:
+                continue
+            current = by_seq.get(segment.first_seq)
+            if current is None or segment.path.endswith(".gz"):
+                by_seq[segment.first_seq] = segment
+        result[stream] = [by_seq[seq] for seq in sorted(by_seq)]
+    return result
+
+
+def _open_text(path: str) -> IO[str]:
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    return open(path, "r", encoding="utf-8")
+
+
+def _read_segment(segment: Segment) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    '''
+    功能：
+    逐行读取一个段，返回 (事件序号, 事件)。段在读取前被封存或压缩（文件改名）时按首序号重新定位；
+    活动段末尾尚未写完的半行跳过。
+
+    :param segment: 段
+    :type segment: Segment
+    :return: 迭代器
+    :rtype: Iterator[Tuple[int, Dict[str, Any]]]
+    '''
+    path = segment.path
+    try:
+        f = _open_text(path)
+    except FileNotFoundError:
+        stream_dir = os.path.dirname(path)
+        moved = [
+            s for s in (list_segments(os.path.dirname(stream_dir)).get(segment.stream) or [])
+            if s.first_seq == segment.first_seq
+        ]
+        if not moved:
+            return
+        f = _open_text(moved[0].path)
+    with f:
+        try:
+            for offset, line in enumerate(f):
+                if not line.endswith("\n"):
+                    break
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue
+                yield segment.first_seq + offset, event
+        except EOFError:
+            # 压缩文件被截断（异常退出时）
+            logger.warning("event log segment truncated path=%s", f.name if hasattr(f, "name") else path)
+
+
+def _iter_stream(
+    segments: List[Segment],
+    after_seq: int,
+    since: Optional[str],
+    until: Optional[str],
+) -> Iterator[Dict[str, Any]]:
+    since_c = _compact(since) if since else None
+    until_c = _compact(until) if until else None
+    for i, segment in enumerate(segments):
+        next_first = segments[i + 1].first_seq if i + 1 < len(segments) else None
+        if next_first is not None and next_first <= after_seq + 1:
+            continue
+        if not segment.active:
+            if since_c is not None and segment.max_ts < since_c:
+                continue
+            if until_c is not None and segment.min_ts > until_c:
+                continue
+        for seq, event in _read_segment(segment):
+            if seq <= after_seq:
+                continue
+            event["stream"] = segment.stream
+            event["seq"] = seq
+            yield event
+
+
+def _matches(
+    event: Dict[str, Any],
+    since: Optional[str],
+    until: Optional[str],
+    types: Optional[Set[str]],
+    user_id: Optional[str],
+) -> bool:
+    ts = event.get("ts") or ""
+    if since is not None and ts < since:
+        return False
+    if until is not None and ts >= until:
+        return False
+    if types and event.get("type") not in types:
+        return False
+    if user_id and event.get("user_id") != user_id:
+        return False
+    return True
+
+
+def scan_events(
+    directory: str,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    types: Optional[Sequence[str]] = None,
+    user_id: Optional[str] = None,
+) -> Iterator[Dict[str, Any]]:
+    '''
+    功能：
+    按时间范围流式读取事件：跳过时间范围之外的已封存段，各流按 ts 归并。
+    事件附带 stream 与 seq（可作为 tail_events 的游标）。
+
+    :param directory: 日志目录
+    :type directory: str
+    :param since: 起始时间（含，UTC ISO 字符串）
+    :type since: Optional[str]
+    :param until: 结束时间（不含，UTC ISO 字符串）
+    :type until: Optional[str]
+    :param types: 事件类型过滤
+    :type types: Optional[Sequence[str]]
+    :param user_id: 用户过滤
+    :type user_id: Optional[str]
+    :return: 事件迭代器
+    :rtype: Iterator[Dict[str, Any]]
+    '''
+    type_set = set(types) if types else None
+    streams = [
+        (e for e in _iter_stream(segments, 0, since, until) if _matches(e, since, until, type_set, user_id))
+        for segments in list_segments(directory).values()
+    ]
+    return heapq.merge(*streams, key=lambda e: e.get("ts") or "")
+
+
+def parse_cursor(cursor: Optional[str]) -> Dict[str, int]:
+    '''
+    功能：
+    解析游标 "流:序号,流:序号"（各流已读到的序号），非法时抛出 ValueError。
+
+    :param cursor: 游标字符串
+    :type cursor: Optional[str]
+    :return: {流名: 序号}
+    :rtype: Dict[str, int]
+    '''
+    positions: Dict[str, int] = {}
+    for item in (cursor or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        stream, _, seq = item.rpartition(":")
+        if not stream:
+            raise ValueError(f"invalid cursor item: {item}")
+        positions[stream] = int(seq)
+    return positions
+
+
+def format_cursor(positions: Dict[str, int]) -> str:
+    '''
+    功能：
+    生成游标字符串。
+
+    :param positions: {流名: 序号}
+    :type positions: Dict[str, int]
+    :return: 游标
+    :rtype: str
+    '''
+    return ",".join(f"{stream}:{seq}" for stream, seq in sorted(positions.items()))
+
+
+def tail_events(
+    directory: str,
+    cursor: Optional[str] = None,
+    limit: int = 1000,
+    types: Optional[Sequence[str]] = None,
+    user_id: Optional[str] = None,
+    since: Optional[str] = None,
+) -> Tuple[List[Dict[str, Any]], str]:
+    '''
+    功能：
+    增量读取游标之后的事件（各流按 ts 归并，最多 limit 条），返回新的游标；
+    无游标时从 since（默认最早的事件）开始。过滤掉的事件同样推进游标。
+
+    :param directory: 日志目录
+    :type directory: str
+    :param cursor: 上次返回的游标
+    :type cursor: Optional[str]
+    :param limit: 最多返回条数
+    :type limit: int
+    :param types: 事件类型过滤
+    :type types: Optional[Sequence[str]]
+    :param user_id: 用户过滤
+    :type user_id: Optional[str]
+    :param since: 无游标时的起始时间（含）
+    :type since: Optional[str]
+    :return: (事件列表, 新游标)
+    :rtype: Tuple[List[Dict[str, Any]], str]
+    '''
+    positions = parse_cursor(cursor)
+    start = None if positions else since
+    type_set = set(types) if types else None
+    streams = [
+        _iter_stream(segments, positions.get(stream, 0), start, None)
+        for stream, segments in list_segments(directory).items()
+    ]
+    events: List[Dict[str, Any]] = []
+    scanned = 0
+    for event in heapq.merge(*streams, key=lambda e: e.get("ts") or ""):
+        scanned += 1
+        if scanned > limit * 10:
+            # 大部分事件被过滤时也限制单次读取量，游标已推进，调用方继续读取即可
+            break
+        positions[event["stream"]] = event["seq"]
+        if _matches(event, start, None, type_set, user_id):
+            events.append(event)
+            if len(events) >= limit:
+                break
+    return events, format_cursor(positions)
+
+
+def _lock(path: str) -> Optional[IO[bytes]]:
+    '''
+    功能：
+    以非阻塞方式获取文件锁，成功返回持有锁的文件对象，已被其他进程持有返回 None。
+
+    :param path: 锁文件路径
+    :type path: str
+    :return: 文件对象或 None
+    :rtype: Optional[IO[bytes]]
+    '''
+    f = open(path, "a+b")
+    if fcntl is None:
+        return f
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return None
+    return f
+
+
+def _sealed_name(first_seq: int, min_ts: str, max_ts: str) -> str:
+    return f"{first_seq:012d}_{_compact(min_ts)}_{_compact(max_ts)}.ndjson"
+
+
+def _seal_orphan(path: str, first_seq: int) -> Optional[str]:
+    '''
+    功能：
+    封存已退出进程遗留的活动段：截断末尾的半行，按首末事件时间改名；空段直接删除。
+
+    :param path: 活动段路径
+    :type path: str
+    :param first_seq: 段首序号
+    :type first_seq: int
+    :return: 封存后的路径，删除时返回 None
+    :rtype: Optional[str]
+    '''
+    min_ts: Optional[str] = None
+    max_ts: Optional[str] = None
+    valid = 0
+    with open(path, "r+b") as f:
+        offset = 0
+        for raw in f:
+            if not raw.endswith(b"\n"):
+                break
+            offset += len(raw)
+            try:
+                ts = json.loads(raw).get("ts") or ""
+            except ValueError:
+                continue
+            valid = offset
+            if ts:
+                min_ts = ts if min_ts is None or ts < min_ts else min_ts
+                max_ts = ts if max_ts is None or ts > max_ts else max_ts
+        f.truncate(valid)
+    if min_ts is None or max_ts is None:
+        os.remove(path)
+        return None
+    sealed = os.path.join(os.path.dirname(path), _sealed_name(first_seq, min_ts, max_ts))
+    os.replace(path, sealed)
+    return sealed
+
+
+def compress_segment(path: str) -> str:
+    '''
+    功能：
+    将已封存的段压缩为 .gz（写临时文件后原子改名，再删除原文件）。
+
+    :param path: 已封存段路径（.ndjson）
+    :type path: str
+    :return: 压缩后的路径
+    :rtype: str
+    '''
+    target = f"{path}.gz"
+    tmp = f"{target}.tmp"
+    with open(path, "rb") as src, gzip.open(tmp, "wb", compresslevel=6) as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+    os.replace(tmp, target)
+    os.remove(path)
+    return target
+
+
+class EventLogWriter:
+    '''
+    功能：
+    本进程的事件日志写入器：有界队列 + 后台写线程（批量写入、按大小/时间轮转），
+    封存的段交给压缩线程 gzip，并按 EVENT_LOG_RETENTION_DAYS 清理过期段。
+    '''
+
+    def __init__(
+        self,
+        directory: str,
+        segment_bytes: int,
+        segment_seconds: float,
+        queue_size: int,
+        flush_interval: float,
+        compress: bool,
+        retention_days: float,
+        stream: Optional[str] = None,
+    ) -> None:
+        self.directory = directory
+        self.stream = stream or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.stream_dir = os.path.join(directory, self.stream)
+        self.segment_bytes = max(1, segment_bytes)
+        self.segment_seconds = segment_seconds
+        self.flush_interval = max(0.05, flush_interval)
+        self.compress = compress
+        self.retention_days = retention_days
+        self._queue: "queue.Queue[Any]" = queue.Queue(maxsize=max(1, queue_size))
+        self._sealed: "queue.Queue[Any]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._lock_file: Optional[IO[bytes]] = None
+        self._file: Optional[IO[bytes]] = None
+        self._path: Optional[str] = None
+        self._first_seq = 0
+        self._seq = 0
+        self._opened_at = 0.0
+        self._bytes = 0
+        self._min_ts: Optional[str] = None
+        self._max_ts: Optional[str] = None
+        self._threads: List[threading.Thread] = []
+        self._counts = {
+            "emitted": 0,
+            "written": 0,
+            "dropped": 0,
+            "bytes": 0,
+            "segments": 0,
+            "compressed": 0,
+            "expired": 0,
+            "errors": 0,
+        }
+
+    def start(self) -> None:
+        '''
+        功能：
+        创建本进程的流目录并加锁，清理已退出进程遗留的流，启动写线程与压缩线程。
+
+        :return: 无
+        :rtype: None
+        '''
+        os.makedirs(self.stream_dir, exist_ok=True)
+        self._lock_file = _lock(os.path.join(self.stream_dir, _LOCK_NAME))
+        if self._lock_file is None:
+            raise RuntimeError(f"event log stream is locked: {self.stream_dir}")
+        try:
+            self._recover_orphans()
+        except Exception:
+            logger.exception("event log orphan recovery failed")
+        for name, target in (("event-log-writer", self._write_loop), ("event-log-compress", self._compress_loop)):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info("event log started dir=%s stream=%s", self.directory, self.stream)
+
+    def _recover_orphans(self) -> None:
+        if fcntl is None:
+            return
+        for stream, segments in list_segments(self.directory).items():
+            if stream == self.stream:
+                continue
+            stream_dir = os.path.join(self.directory, stream)
+            held = _lock(os.path.join(stream_dir, _LOCK_NAME))
+            if held is None:
+                continue
+            try:
+                for segment in segments:
+                    path: Optional[str] = segment.path
+                    if segment.active:
+                        path = _seal_orphan(segment.path, segment.first_seq)
+                        if path is not None:
+                            logger.info("event log sealed orphan segment path=%s", path)
+                    if path is not None and self.compress and not path.endswith(".gz"):
+                        self._sealed.put(path)
+            finally:
+                held.close()
+        self._expire()
+
+    def emit(self, event: Dict[str, Any]) -> bool:
+        '''
+        功能：
+        编码一条事件并放入写入队列（不阻塞），队列满时丢弃。
+
+        :param event: 事件（需含 ts）
+        :type event: Dict[str, Any]
+        :return: 是否已入队
+        :rtype: bool
+        '''
+        line = (json.dumps(event, ensure_ascii=False, separators=(",", ":"), default=str) + "\n").encode("utf-8")
+        try:
+            self._queue.put_nowait((event["ts"], line))
+        except queue.Full:
+            with self._lock:
+                self._counts["dropped"] += 1
+            return False
+        with self._lock:
+            self._counts["emitted"] += 1
+        return True
+
+    def _write_loop(self) -> None:
+        stopping = False
+        while not stopping:
+            batch: List[Tuple[str, bytes]] = []
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+                while True:
+                    if item is _STOP:
+                        stopping = True
+                        break
+                    batch.append(item)
+                    if len(batch) >= _BATCH:
+                        break
+                    item = self._queue.get_nowait()
+            except queue.Empty:
+                pass
+            try:
+                if batch:
+                    self._write(batch)
+                if self._file is not None and (
+                    stopping
+                    or self._bytes >= self.segment_bytes
+                    or (self.segment_seconds > 0 and time.monotonic() - self._opened_at >= self.segment_seconds)
+                ):
+                    self._seal()
+            except OSError as exc:
+                with self._lock:
+                    self._counts["errors"] += 1
+                logger.warning("event log write failed events=%s: %s", len(batch), exc)
+        self._sealed.put(_STOP)
+
+    def _open(self) -> None:
+        self._first_seq = self._seq + 1
+        self._path = os.path.join(self.stream_dir, f"{self._first_seq:012d}.ndjson")
+        self._file = open(self._path, "ab")
+        self._opened_at = time.monotonic()
+        self._bytes = 0
+        self._min_ts = self._max_ts = None
+
+    def _write(self, batch: List[Tuple[str, bytes]]) -> None:
+        if self._file is None:
+            self._open()
+        data = b"".join(line for _, line in batch)
+        self._file.write(data)
+        self._file.flush()
+        for ts, _ in batch:
+            if self._min_ts is None or ts < self._min_ts:
+                self._min_ts = ts
+            if self._max_ts is None or ts > self._max_ts:
+                self._max_ts = ts
+        self._seq += len(batch)
+        self._bytes += len(data)
+        with self._lock:
+            self._counts["written"] += len(batch)
+            self._counts["bytes"] += len(data)
+
+    def _seal(self) -> None:
+        self._file.close()
+        self._file = None
+        sealed = os.path.join(self.stream_dir, _sealed_name(self._first_seq, self._min_ts, self._max_ts))
+        os.replace(self._path, sealed)
+        with self._lock:
+            self._counts["segments"] += 1
+        logger.info("event log segment sealed path=%s bytes=%s", sealed, self._bytes)
+        if self.compress:
+            self._sealed.put(sealed)
+        else:
+            self._expire()
+
+    def _compress_loop(self) -> None:
+        while True:
+            path = self._sealed.get()
+            if path is _STOP:
+                return
+            try:
+                compress_segment(path)
+                with self._lock:
+                    self._counts["compressed"] += 1
+            except OSError as exc:
+                with self._lock:
+                    self._counts["errors"] += 1
+                logger.warning("event log compress failed path=%s: %s", path, exc)
+            self._expire()
+
+    def _expire(self) -> None:
+        if self.retention_days <= 0:
+            return
+        cutoff = _compact((utc_now_dt() - timedelta(days=self.retention_days)).isoformat())
+        for stream, segments in list_segments(self.directory).items():
+            for segment in segments:
+                if not segment.active and segment.max_ts < cutoff:
+                    try:
+                        os.remove(segment.path)
+                    except OSError:
+                        continue
+                    with self._lock:
+                        self._counts["expired"] += 1
+            stream_dir = os.path.join(self.directory, stream)
+            if fcntl is None or stream == self.stream:
+                continue
+            if not any(n.endswith((".ndjson", ".gz")) for n in os.listdir(stream_dir)):
+                held = _lock(os.path.join(stream_dir, _LOCK_NAME))
+                if held is not None:
+                    held.close()
+                    shutil.rmtree(stream_dir, ignore_errors=True)
+
+    def stats(self) -> Dict[str, Any]:
+        '''
+        功能：
+        返回写入统计（入队、写入、丢弃、字节数、封存/压缩/过期段数、错误数）与当前活动段。
+
+        :return: 统计字典
+        :rtype: Dict[str, Any]
+        '''
+        with self._lock:
+            return dict(
+                self._counts,
+                directory=self.directory,
+                stream=self.stream,
+                queued=self._queue.qsize(),
+                active_segment=os.path.basename(self._path) if self._file is not None and self._path else None,
+            )
+
+    def close(self, timeout: float = 5.0) -> None:
+        '''
+        功能：
+        写完队列中的事件、封存活动段并等待压缩完成。
+
+        :param timeout: 最长等待秒数
+        :type timeout: float
+        :return: 无
+        :rtype: None
+        '''
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            logger.warning("event log queue full on close, pending events dropped")
+            return
+        for thread in self._threads:
+            thread.join(timeout=timeout)
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+
+_writer: Optional[EventLogWriter] = None
+_writer_lock = threading.Lock()
+_writer_failed = False
+
+
+def event_log() -> Optional[EventLogWriter]:
+    '''
+    功能：
+    返回本进程的事件日志写入器（首次调用时启动，未配置 EVENT_LOG_DIR 或启动失败时返回 None）。
+
+    :return: 写入器
+    :rtype: Optional[EventLogWriter]
+    '''
+    global _writer, _writer_failed
+    if _writer is not None or not EVENT_LOG_DIR or _writer_failed:
+        return _writer
+    with _writer_lock:
+        if _writer is None and not _writer_failed:
+            writer = EventLogWriter(
+                EVENT_LOG_DIR,
+                EVENT_LOG_SEGMENT_BYTES,
+                EVENT_LOG_SEGMENT_SECONDS,
+                EVENT_LOG_QUEUE_SIZE,
+                EVENT_LOG_FLUSH_INTERVAL,
+                EVENT_LOG_COMPRESS,
+                EVENT_LOG_RETENTION_DAYS,
+            )
+            try:
+                writer.start()
+            except Exception:
+                _writer_failed = True
+                logger.exception("event log start failed dir=%s", EVENT_LOG_DIR)
+                return None
+            _writer = writer
+    return _writer
+
+
+def emit_event(kind: str, **fields: Any) -> None:
+    '''
+    功能：
+    记录一条事件（未配置 EVENT_LOG_DIR 时不做任何事）。ts 固定为写入时的 UTC 时间，
+    保证每个流内按 ts 有序（scan_events 据此归并）；业务时间需放在其他字段（如 outcome_ts）。
+
+    :param kind: 事件类型（decision/decision_refined/feedback/qa）
+    :type kind: str
+    :param fields: 事件字段
+    :type fields: Any
+    :return: 无
+    :rtype: None
+    '''
+    writer = event_log()
+    if writer is None:
+        return
+    fields.pop("ts", None)
+    event = {"type": kind, "ts": utc_now()}
+    event.update(fields)
+    try:
+        writer.emit(event)
+    except Exception:
+        logger.exception("event log emit failed type=%s", kind)
+
+
+def event_log_stats() -> Optional[Dict[str, Any]]:
+    '''
+    功能：
+    返回事件日志写入统计，未启用时返回 None。
+
+    :return: 统计字典
+    :rtype: Optional[Dict[str, Any]]
+    '''
+    return _writer.stats() if _writer is not None else None
+
+
+def close_event_log() -> None:
+    '''
+    功能：
+    进程退出时写完队列并封存活动段。
+
+    :return: 无
+    :rtype: None
+    '''
+    global _writer
+    with _writer_lock:
+        writer, _writer = _writer, None
+    if writer is not None:
+        writer.close()
+
+
+atexit.register(close_event_log)
+
+
+def _normalize_time(value: Optional[str]) -> Optional[str]:
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed.isoformat()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="读取事件日志（NDJSON 输出到标准输出）")
+    parser.add_argument("command", choices=("scan", "tail"))
+    parser.add_argument("--dir", default=EVENT_LOG_DIR, help="日志目录（默认 EVENT_LOG_DIR）")
+    parser.add_argument("--since", help="起始时间（含，ISO，UTC）")
+    parser.add_argument("--until", help="结束时间（不含，ISO，UTC，仅 scan）")
+    parser.add_argument("--type", help="事件类型，逗号分隔")
+    parser.add_argument("--user-id")
+    parser.add_argument("--cursor", help="tail 起始游标")
+    parser.add_argument("--follow", action="store_true", help="tail 持续输出新事件")
+    parser.add_argument("--interval", type=float, default=1.0, help="--follow 轮询间隔（秒）")
+    args = parser.parse_args(argv)
+    if not args.dir:
+        parser.error("--dir 或 EVENT_LOG_DIR 必须指定")
+    types = [t.strip() for t in args.type.split(",") if t.strip()] if args.type else None
+    try:
+        since = _normalize_time(args.since)
+        until = _normalize_time(args.until)
+    except ValueError:
+        parser.error("时间格式应为 ISO 8601")
+
+    out = sys.stdout
+    if args.command == "scan":
+        for event in scan_events(args.dir, since, until, types, args.user_id):
+            out.write(json.dumps(event, ensure_ascii=False) + "\n")
+        return 0
+
+    cursor = args.cursor
+    while True:
+        events, cursor = tail_events(args.dir, cursor, 1000, types, args.user_id, since)
+        for event in events:
+            out.write(json.dumps(event, ensure_ascii=False) + "\n")
+        out.flush()
+        if not args.follow:
+            sys.stderr.write(f"cursor={cursor}\n")
+            return 0
+        if not events:
+            time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,80 @@
+﻿# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+from typing import Any, Dict, Optional
+
+from .decision_engine import find_candidate, price_tier
+from .label_stats import record_outcome
+from .state import utc_now, utc_now_dt
+
+
+def is_success(outcome: str) -> bool:
+    '''
+    功能：
+    判断反馈结果是否计为成功（起量/放量）。
+
+    :param outcome: 反馈结果（no_volume/some_volume/scaled）
+    :type outcome: str
+    :return: 是否成功
+    :rtype: bool
+    '''
+    return outcome in ("scaled", "some_volume")
+
+
+def apply_feedback(
+    state: Dict[str, Any],
+    decision_id: Optional[str],
+    outcome: str,
+    record: Optional[Dict[str, Any]] = None,
+) -> Optional[Dict[str, Any]]:
+    '''
+    功能：
+    将一条反馈写入用户状态：回填历史决策的 outcome，更新成功/失败与连续失败统计，
+    并增量更新款式/类目价位档的反馈统计（供 score_candidate 使用）。
+    决策已被截断出 history 时，使用按 decision_id 查到的决策记录关联。
+
+    :param state: 用户状态（原地修改）
+    :type state: Dict[str, Any]
+    :param decision_id: 决策 ID
+    :type decision_id: Optional[str]
+    :param outcome: 反馈结果
+    :type outcome: str
+    :param record: 决策索引中查到的记录
+    :type record: Optional[Dict[str, Any]]
+    :return: 命中的历史决策记录，未命中返回 None
+    :rtype: Optional[Dict[str, Any]]
+    '''
+    history = state.get("history", [])
+    matched: Optional[Dict[str, Any]] = None
+    for item in reversed(history):
+        if item.get("decision_id") == decision_id:
+            item["outcome"] = outcome
+            matched = item
+            break
+    if matched is None and record is not None:
+        matched = record
+
+    stats = state.get("stats", {})
+    if is_success(outcome):
+        stats["success"] = stats.get("success", 0) + 1
+        stats["consecutive_fail"] = 0
+    else:
+        stats["fail"] = stats.get("fail", 0) + 1
+        stats["consecutive_fail"] = stats.get("consecutive_fail", 0) + 1
+
+    if matched is not None and matched.get("label"):
+        candidate = find_candidate(matched["label"])
+        if candidate is not None:
+            record_outcome(
+                state,
+                matched["label"],
+                matched.get("category") or candidate["categories"][0],
+                price_tier(candidate["price_mid"]),
+                is_success(outcome),
+                utc_now_dt(),
+            )
+
+    state["stats"] = stats
+    state["history"] = history[-30:]
+    state["updated_at"] = utc_now()
+    return matched
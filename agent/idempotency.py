@@ -0,0 +1,158 @@
+﻿# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from .config import (
+    IDEMPOTENCY_PENDING_TIMEOUT,
+    IDEMPOTENCY_POLL_INTERVAL,
+    IDEMPOTENCY_TTL,
+    IDEMPOTENCY_WAIT_TIMEOUT,
+)
+from .memory_store import (
+    claim_idempotency_key,
+    complete_idempotency_key,
+    get_idempotency_key,
+    release_idempotency_key,
+)
+
+logger = logging.getLogger("agent")
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+_MAX_KEY_LENGTH = 255
+
+_cond = threading.Condition()
+_counts = {"executed": 0, "replayed": 0, "waited": 0, "conflicts": 0, "timeouts": 0}
+
+
+class IdempotencyError(Exception):
+    '''
+    功能：
+    幂等键无法使用：格式非法（400）、同一个键对应不同的请求参数（422）或等待原请求超时（409）。
+    '''
+
+    def __init__(self, reason: str, status: int, retry_after: int = 0) -> None:
+        super().__init__(reason)
+        self.reason = reason
+        self.status = status
+        self.retry_after = retry_after
+
+
+def _fingerprint(payload: Dict[str, Any]) -> str:
+    return hashlib.sha1(
+        json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str).encode("utf-8")
+    ).hexdigest()
+
+
+def _cacheable(status_code: int) -> bool:
+    # 5xx 与限流（429）是暂时性失败，客户端带同一个键重试时应重新执行
+    return status_code < 500 and status_code != 429
+
+
+def _count(name: str) -> None:
+    with _cond:
+        _counts[name] += 1
+
+
+def _wait(store_key: str, user_id: str) -> Optional[Dict[str, Any]]:
+    deadline = time.monotonic() + IDEMPOTENCY_WAIT_TIMEOUT
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            _count("timeouts")
+            raise IdempotencyError("idempotency_key_in_progress", 409, 1)
+        # 同进程内完成时立即唤醒，跨进程（Postgres）按轮询间隔检查
+        with _cond:
+            _cond.wait(min(remaining, IDEMPOTENCY_POLL_INTERVAL))
+        record = get_idempotency_key(store_key, user_id)
+        if record is None or record["status"] != "pending":
+            return record
+
+
+def run_idempotent(
+    route: str,
+    user_id: str,
+    key: Optional[str],
+    payload: Dict[str, Any],
+    compute: Callable[[], Tuple[int, Dict[str, Any]]],
+) -> Tuple[Tuple[int, Dict[str, Any]], bool]:
+    '''
+    功能：
+    按 Idempotency-Key 执行请求：首个请求执行 compute 并保存响应（TTL 为 IDEMPOTENCY_TTL），
+    之后同一个键直接返回保存的响应；原请求仍在处理中时等待其结果（最多 IDEMPOTENCY_WAIT_TIMEOUT 秒）。
+    compute 抛出异常或返回 5xx/429 时释放键，重试会重新执行。未提供键时直接执行。
+
+    :param route: 接口名（键前缀）
+    :type route: str
+    :param user_id: 用户唯一标识（键按用户隔离，也用于分片路由）
+    :type user_id: str
+    :param key: 请求头中的幂等键
+    :type key: Optional[str]
+    :param payload: 已校验的请求参数（用于检测同一个键被不同请求复用）
+    :type payload: Dict[str, Any]
+    :param compute: 执行函数，返回 (HTTP 状态码, 响应体)
+    :type compute: Callable[[], Tuple[int, Dict[str, Any]]]
+    :return: ((HTTP 状态码, 响应体), 是否为保存的响应)
+    :rtype: Tuple[Tuple[int, Dict[str, Any]], bool]
+    '''
+    if key is None:
+        return compute(), False
+    key = key.strip()
+    if not key or len(key) > _MAX_KEY_LENGTH:
+        raise IdempotencyError("invalid_idempotency_key", 400)
+
+    store_key = f"{route}:{user_id}:{key}"
+    fingerprint = _fingerprint(payload)
+    while True:
+        record = claim_idempotency_key(store_key, user_id, fingerprint, IDEMPOTENCY_TTL, IDEMPOTENCY_PENDING_TIMEOUT)
+        if record is None:
+            break
+        if record["fingerprint"] != fingerprint:
+            _count("conflicts")
+            raise IdempotencyError("idempotency_key_reused", 422)
+        if record["status"] == "pending":
+            _count("waited")
+            record = _wait(store_key, user_id)
+            if record is None:
+                # 原请求失败并释放了键，由本请求重新执行
+                continue
+            if record["fingerprint"] != fingerprint:
+                _count("conflicts")
+                raise IdempotencyError("idempotency_key_reused", 422)
+        _count("replayed")
+        logger.info("idempotent replay route=%s user_id=%s key=%s", route, user_id, key)
+        return (record["status_code"], record["response"]), True
+
+    _count("executed")
+    try:
+        status_code, body = compute()
+    except BaseException:
+        release_idempotency_key(store_key, user_id)
+        with _cond:
+            _cond.notify_all()
+        raise
+    if _cacheable(status_code):
+        complete_idempotency_key(store_key, user_id, status_code, body, IDEMPOTENCY_TTL)
+    else:
+        release_idempotency_key(store_key, user_id)
+    with _cond:
+        _cond.notify_all()
+    return (status_code, body), False
+
+
+def idempotency_stats() -> Dict[str, Any]:
+    '''
+    功能：
+    返回幂等键指标（执行、复用、等待、冲突、等待超时次数）。
+
+    :return: 指标字典
+    :rtype: Dict[str, Any]
+    '''
+    with _cond:
+        return dict(_counts)
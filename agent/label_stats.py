@@ -0,0 +1,306 @@
+﻿# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from array import array
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+from .config import LABEL_STATS_HALF_LIFE_DAYS, LABEL_STATS_SEGMENT_REFRESH
+from .memory_store import add_segment_outcome, load_segment_outcomes
+
+logger = logging.getLogger("agent")
+
+_EPOCH = datetime(1970, 1, 1)
+_HALF_LIFE_SEC = max(LABEL_STATS_HALF_LIFE_DAYS, 0.01) * 86400.0
+USER_BONUS_MAX = 6
+SEGMENT_BONUS_MAX = 3
+
+
+def to_epoch(now: datetime) -> float:
+    '''
+    功能：
+    将 UTC datetime 转为秒级时间戳。
+
+    :param now: UTC 时间
+    :type now: datetime
+    :return: 秒级时间戳
+    :rtype: float
+    '''
+    return (now.replace(tzinfo=None) - _EPOCH).total_seconds()
+
+
+def _decay(value: float, since: float, now: float) -> float:
+    if value == 0.0 or now <= since:
+        return value
+    return value * 0.5 ** ((now - since) / _HALF_LIFE_SEC)
+
+
+def _bonus(success: float, fail: float, max_bonus: int) -> int:
+    '''
+    功能：
+    将衰减后的成功/失败计数换算为整数加减分（拉普拉斯平滑，样本不足时按比例收缩）。
+    '''
+    n = success + fail
+    if n < 0.5:
+        return 0
+    rate = (success + 1.0) / (n + 2.0)
+    confidence = min(n, 3.0) / 3.0
+    return int(round((rate - 0.5) * 2.0 * confidence * max_bonus))
+
+
+class SegmentStats:
+    '''
+    功能：
+    (类目, 价位档) 维度的衰减成功/失败计数，存放在定长紧凑数组中，更新与读取均为 O(1)。
+    仅在进程内维护（离线回放为每个引擎隔离统计时直接使用）。
+    '''
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._index: Dict[Tuple[str, str], int] = {}
+        self._success = array("d")
+        self._fail = array("d")
+        self._ts = array("d")
+
+    def _slot(self, key: Tuple[str, str]) -> int:
+        idx = self._index.get(key)
+        if idx is None:
+            idx = len(self._success)
+            self._index[key] = idx
+            self._success.append(0.0)
+            self._fail.append(0.0)
+            self._ts.append(0.0)
+        return idx
+
+    def record(self, key: Tuple[str, str], success: bool, now: float) -> None:
+        '''
+        功能：
+        记录一次反馈结果（先按时间衰减再累加）。
+
+        :param key: (类目, 价位档)
+        :type key: Tuple[str, str]
+        :param success: 是否成功
+        :type success: bool
+        :param now: 当前时间戳（秒）
+        :type now: float
+        :return: 无
+        :rtype: None
+        '''
+        with self._lock:
+            idx = self._slot(key)
+            self._success[idx] = _decay(self._success[idx], self._ts[idx], now) + (1.0 if success else 0.0)
+            self._fail[idx] = _decay(self._fail[idx], self._ts[idx], now) + (0.0 if success else 1.0)
+            self._ts[idx] = now
+
+    def get(self, key: Tuple[str, str], now: float) -> Tuple[float, float]:
+        '''
+        功能：
+        读取衰减到当前时间的 (成功, 失败) 计数。
+
+        :param key: (类目, 价位档)
+        :type key: Tuple[str, str]
+        :param now: 当前时间戳（秒）
+        :type now: float
+        :return: (成功, 失败)
+        :rtype: Tuple[float, float]
+        '''
+        idx = self._index.get(key)
+        if idx is None:
+            return 0.0, 0.0
+        ts = self._ts[idx]
+        return _decay(self._success[idx], ts, now), _decay(self._fail[idx], ts, now)
+
+
+class StoredSegmentStats(SegmentStats):
+    '''
+    功能：
+    以存储为准的 (类目, 价位档) 统计：反馈写入存储（所有 worker 共享、重启后保留），
+    读取使用进程内紧凑数组副本，每 refresh 秒从存储整体重新加载一次。
+    '''
+
+    def __init__(self, refresh: float) -> None:
+        super().__init__()
+        self.refresh = max(refresh, 0.0)
+        self._refresh_lock = threading.Lock()
+        self._loaded_at: Optional[float] = None
+
+    def load(self) -> int:
+        '''
+        功能：
+        从存储重新加载全部计数，替换本地副本。
+
+        :return: 加载的 (类目, 价位档) 数量
+        :rtype: int
+        '''
+        rows = load_segment_outcomes()
+        index: Dict[Tuple[str, str], int] = {}
+        success, fail, ts = array("d"), array("d"), array("d")
+        for key, (success_n, fail_n, since) in rows.items():
+            index[key] = len(success)
+            success.append(success_n)
+            fail.append(fail_n)
+            ts.append(since)
+        with self._lock:
+            self._index, self._success, self._fail, self._ts = index, success, fail, ts
+        self._loaded_at = time.monotonic()
+        return len(index)
+
+    def _ensure_fresh(self) -> None:
+        loaded_at = self._loaded_at
+        if loaded_at is not None and time.monotonic() - loaded_at < self.refresh:
+            return
+        # 只让一个线程加载，其余线程继续使用当前副本
+        if not self._refresh_lock.acquire(blocking=loaded_at is None):
+            return
+        try:
+            if self._loaded_at == loaded_at:
+                self.load()
+        except Exception as exc:
+            # 统计只影响加减分，存储暂时不可用时沿用旧副本，稍后再试
+            logger.warning("segment stats reload failed: %s", exc)
+            self._loaded_at = time.monotonic()
+        finally:
+            self._refresh_lock.release()
+
+    def record(self, key: Tuple[str, str], success: bool, now: float) -> None:
+        '''
+        功能：
+        将反馈结果写入存储，并同步累加到本地副本。
+
+        :param key: (类目, 价位档)
+        :type key: Tuple[str, str]
+        :param success: 是否成功
+        :type success: bool
+        :param now: 当前时间戳（秒）
+        :type now: float
+        :return: 无
+        :rtype: None
+        '''
+        add_segment_outcome(key[0], key[1], success, now, _HALF_LIFE_SEC)
+        super().record(key, success, now)
+
+    def get(self, key: Tuple[str, str], now: float) -> Tuple[float, float]:
+        '''
+        功能：
+        读取衰减到当前时间的 (成功, 失败) 计数，本地副本过期时先从存储重新加载。
+
+        :param key: (类目, 价位档)
+        :type key: Tuple[str, str]
+        :param now: 当前时间戳（秒）
+        :type now: float
+        :return: (成功, 失败)
+        :rtype: Tuple[float, float]
+        '''
+        self._ensure_fresh()
+        return super().get(key, now)
+
+
+_segment_stats: SegmentStats = StoredSegmentStats(LABEL_STATS_SEGMENT_REFRESH)
+
+
+def warm_segment_stats() -> Dict[str, Any]:
+    '''
+    功能：
+    启动预热：从存储加载 (类目, 价位档) 统计。
+
+    :return: 预热结果
+    :rtype: Dict[str, Any]
+    '''
+    stats = _segment_stats
+    if isinstance(stats, StoredSegmentStats):
+        return {"segments": stats.load()}
+    return {"segments": "in-process"}
+
+
+def get_segment_stats() -> SegmentStats:
+    '''
+    功能：
+    返回当前生效的 (类目, 价位档) 统计。
+
+    :return: 统计对象
+    :rtype: SegmentStats
+    '''
+    return _segment_stats
+
+
+def set_segment_stats(stats: Optional[SegmentStats]) -> SegmentStats:
+    '''
+    功能：
+    替换当前生效的 (类目, 价位档) 统计（离线回放为每个引擎隔离统计时使用）。
+
+    :param stats: 新的统计对象，None 表示新建空统计
+    :type stats: Optional[SegmentStats]
+    :return: 被替换的统计对象
+    :rtype: SegmentStats
+    '''
+    global _segment_stats
+    previous = _segment_stats
+    _segment_stats = stats or SegmentStats()
+    return previous
+
+
+def record_outcome(
+    state: Dict[str, Any], label: str, category: str, tier: str, success: bool, now: datetime
+) -> None:
+    '''
+    功能：
+    反馈时增量更新统计：用户×款式计数写入 state["label_stats"]（[成功, 失败, 时间戳]），
+    类目×价位档计数写入存储并同步到进程内紧凑数组副本。
+
+    :param state: 用户状态（原地修改）
+    :type state: Dict[str, Any]
+    :param label: 款式标签
+    :type label: str
+    :param category: 类目
+    :type category: str
+    :param tier: 价位档
+    :type tier: str
+    :param success: 是否成功
+    :type success: bool
+    :param now: 当前 UTC 时间
+    :type now: datetime
+    :return: 无
+    :rtype: None
+    '''
+    ts = to_epoch(now)
+    stats = state.setdefault("label_stats", {})
+    success_n, fail_n, since = stats.get(label) or (0.0, 0.0, ts)
+    stats[label] = [
+        round(_decay(success_n, since, ts) + (1.0 if success else 0.0), 4),
+        round(_decay(fail_n, since, ts) + (0.0 if success else 1.0), 4),
+        ts,
+    ]
+    _segment_stats.record((category, tier), success, ts)
+
+
+def outcome_bonus(
+    state: Dict[str, Any], label: str, category: str, tier: str, now: float
+) -> int:
+    '''
+    功能：
+    计算候选方向的反馈加减分：用户×款式（±6）+ 类目×价位档（±3），O(1) 读取。
+
+    :param state: 用户状态
+    :type state: Dict[str, Any]
+    :param label: 款式标签
+    :type label: str
+    :param category: 类目
+    :type category: str
+    :param tier: 价位档
+    :type tier: str
+    :param now: 当前时间戳（秒）
+    :type now: float
+    :return: 加减分
+    :rtype: int
+    '''
+    bonus = 0
+    entry = (state.get("label_stats") or {}).get(label)
+    if entry:
+        success_n, fail_n, since = entry
+        bonus += _bonus(_decay(success_n, since, now), _decay(fail_n, since, now), USER_BONUS_MAX)
+    segment_success, segment_fail = _segment_stats.get((category, tier), now)
+    bonus += _bonus(segment_success, segment_fail, SEGMENT_BONUS_MAX)
+    return bonus
@@ -2,7 +2,10 @@
 from __future__ import annotations
 
 import json
-from typing import Any, Dict, List, Tuple
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 from langchain.agents import create_openai_functions_agent
 try:
@@ -13,36 +16,189 @@ from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
 from langchain_openai import ChatOpenAI
 
-from .config import LLM_BASE_URL, LLM_MODEL, LLM_MODEL_API, OPENAI_API_KEY
+from .admission import llm_limiter
+from .config import LLM_PROFILES, LLM_ROUTING_EXPLORE, LLM_ROUTING_MIN_SAMPLES, LLM_ROUTING_WINDOW
+from .llm_router import LatencyRouter, parse_endpoints
 from .tools import get_draft_decision
+from .usage import track_usage, usage_http_client
 
 
-def _build_llm() -> ChatOpenAI:
+def _build_llm(profile: Dict[str, Any], endpoint: Dict[str, str]) -> ChatOpenAI:
     '''
     功能：
-    构建 OpenAI 兼容的 Chat 模型客户端。
+    按路由配置与端点构建 OpenAI 兼容的 Chat 模型客户端。
 
+    :param profile: 路由配置（temperature/timeout/api_key）
+    :type profile: Dict[str, Any]
+    :param endpoint: 端点（base_url/model）
+    :type endpoint: Dict[str, str]
     :return: ChatOpenAI 实例
     :rtype: ChatOpenAI
     '''
-    base_url = LLM_BASE_URL or ""
     # ChatOpenAI 会自动使用 /chat/completions，
     # 这里不再拼接 MODEL_API，避免重复路径。
     return ChatOpenAI(
-        model=LLM_MODEL or "",
-        base_url=base_url or None,
-        api_key=OPENAI_API_KEY or None,
-        temperature=0.2,
+        model=endpoint["model"] or "",
+        base_url=endpoint["base_url"] or None,
+        api_key=profile["api_key"] or None,
+        temperature=profile["temperature"],
+        timeout=profile["timeout"] or None,
+        # 挂载请求计数钩子，用于统计客户端内部重试
+        http_client=usage_http_client(),
     )
 
 
-def run_langchain_agent(draft: Dict[str, Any]) -> Tuple[Dict[str, Any], List[str]]:
+_llm_lock = threading.Lock()
+_clients: Dict[Tuple[str, str], ChatOpenAI] = {}
+_routers: Dict[str, Tuple[Dict[str, Dict[str, str]], LatencyRouter]] = {}
+
+
+def _route(route: str) -> Tuple[Dict[str, Dict[str, str]], LatencyRouter]:
+    entry = _routers.get(route)
+    if entry is None:
+        with _llm_lock:
+            entry = _routers.get(route)
+            if entry is None:
+                profile = LLM_PROFILES[route]
+                endpoints = parse_endpoints(profile["endpoints"], profile["model"], profile["base_url"])
+                router = LatencyRouter(
+                    [e["name"] for e in endpoints], LLM_ROUTING_WINDOW, LLM_ROUTING_MIN_SAMPLES, LLM_ROUTING_EXPLORE
+                )
+                entry = ({e["name"]: e for e in endpoints}, router)
+                _routers[route] = entry
+    return entry
+
+
+def get_llm(route: str = "decision", endpoint: Optional[str] = None) -> ChatOpenAI:
+    '''
+    功能：
+    返回进程内复用的模型客户端（按路由与端点首次调用时构建，复用底层 HTTP 连接）。
+
+    :param route: 路由（decision/qa，见 LLM_PROFILES）
+    :type route: str
+    :param endpoint: 端点名称，为空时取该路由的第一个端点
+    :type endpoint: Optional[str]
+    :return: ChatOpenAI 实例
+    :rtype: ChatOpenAI
+    '''
+    endpoints, router = _route(route)
+    name = endpoint or router.names[0]
+    llm = _clients.get((route, name))
+    if llm is None:
+        with _llm_lock:
+            llm = _clients.get((route, name))
+            if llm is None:
+                llm = _build_llm(LLM_PROFILES[route], endpoints[name])
+                _clients[(route, name)] = llm
+    return llm
+
+
+def select_llm(route: str) -> Tuple[str, ChatOpenAI]:
+    '''
+    功能：
+    按路由选择端点（配置多个端点时按观测到的 p95 延迟与错误率选择）并返回其客户端。
+
+    :param route: 路由（decision/qa）
+    :type route: str
+    :return: (端点名称, ChatOpenAI 实例)
+    :rtype: Tuple[str, ChatOpenAI]
+    '''
+    name = _route(route)[1].choose()
+    return name, get_llm(route, name)
+
+
+@contextmanager
+def _routed_call(route: str, endpoint: str) -> Iterator[None]:
+    # 只记录实际发往模型服务的调用耗时（准入排队不计入），异常计为失败
+    started = time.perf_counter()
+    ok = False
+    try:
+        yield
+        ok = True
+    finally:
+        _route(route)[1].record(endpoint, (time.perf_counter() - started) * 1000, ok)
+
+
+def warm_llm_clients() -> Dict[str, str]:
+    '''
+    功能：
+    构建全部路由与端点的模型客户端。
+
+    :return: {路由:端点: 模型名}
+    :rtype: Dict[str, str]
+    '''
+    built = {}
+    for route in LLM_PROFILES:
+        endpoints, _ = _route(route)
+        for name, endpoint in endpoints.items():
+            get_llm(route, name)
+            built[f"{route}:{name}"] = endpoint["model"]
+    return built
+
+
+def llm_clients() -> Dict[str, Any]:
+    '''
+    功能：
+    返回已构建的模型客户端（不触发构建），供内存占用分析使用。
+
+    :return: {路由:端点: 客户端}
+    :rtype: Dict[str, Any]
+    '''
+    return {f"{route}:{name}": llm for (route, name), llm in list(_clients.items())}
+
+
+def llm_routing_stats() -> Dict[str, Any]:
+    '''
+    功能：
+    返回各路由的端点配置与路由指标（样本数、p95 延迟、错误率、被选次数）。
+
+    :return: {路由: {端点名称: 指标}}
+    :rtype: Dict[str, Any]
+    '''
+    result = {}
+    for route, (endpoints, router) in list(_routers.items()):
+        stats = router.snapshot()
+        result[route] = {
+            name: dict(stats[name], model=endpoint["model"], base_url=endpoint["base_url"])
+            for name, endpoint in endpoints.items()
+        }
+    return result
+
+
+def ping_llm(route: str = "decision", endpoint: Optional[str] = None) -> str:
+    '''
+    功能：
+    发送一条极短请求，预热与模型服务之间的连接（TLS 握手、DNS）。
+
+    :param route: 路由（decision/qa）
+    :type route: str
+    :param endpoint: 端点名称，为空时取该路由的第一个端点
+    :type endpoint: Optional[str]
+    :return: 模型回复文本
+    :rtype: str
+    '''
+    with track_usage("warmup") as usage:
+        usage.admitted()
+        response = get_llm(route, endpoint).invoke(
+            [HumanMessage(content="ping")], max_tokens=1, config={"callbacks": [usage]}
+        )
+    return getattr(response, "content", str(response))
+
+
+def run_langchain_agent(
+    draft: Dict[str, Any], user_id: str = "", usage_route: str = "decision"
+) -> Tuple[Dict[str, Any], List[str]]:
     '''
     功能：
     调用 LangChain Agent 在规则草案上生成最终决策，解析失败则回退草案。
+    调用受全局/单用户并发限制，超限时抛出 AdmissionRejected。
 
     :param draft: 规则层生成的决策草案
     :type draft: Dict[str, Any]
+    :param user_id: 用户唯一标识（用于单用户并发限制）
+    :type user_id: str
+    :param usage_route: 用量统计中的路由名（低峰预生成为 precompute），模型仍按 decision 路由选择
+    :type usage_route: str
     :return: (最终决策, agent 标记列表)
     :rtype: Tuple[Dict[str, Any], List[str]]
     '''
@@ -58,19 +214,24 @@ def run_langchain_agent(draft: Dict[str, Any]) -> Tuple[Dict[str, Any], List[str
         ]
     )
 
-    llm = _build_llm()
+    endpoint, llm = select_llm("decision")
     tool_instance = get_draft_decision.bind(payload=draft)
     agent = create_openai_functions_agent(llm, [tool_instance], prompt)
     executor = AgentExecutor(agent=agent, tools=[tool_instance], verbose=False)
 
-    result = executor.invoke({"input": "generate"})
-    text = result.get("output", "")
+    with track_usage(usage_route, user_id) as usage:
+        with llm_limiter.acquire(user_id):
+            usage.admitted()
+            with _routed_call("decision", endpoint):
+                result = executor.invoke({"input": "generate"}, config={"callbacks": [usage]})
+        text = result.get("output", "")
 
-    try:
-        parsed = json.loads(text)
-        return parsed, ["agent:ok"]
-    except Exception:
-        return draft, ["agent:fallback"]
+        try:
+            parsed = json.loads(text)
+            return parsed, ["agent:ok"]
+        except Exception:
+            usage.fallback = "parse_error"
+            return draft, ["agent:fallback"]
 
 
 def _build_qa_messages(question: str, history: List[Dict[str, str]]) -> List[Any]:
@@ -103,20 +264,28 @@ def _build_qa_messages(question: str, history: List[Dict[str, str]]) -> List[Any
     return messages
 
 
-def run_qa(question: str, history: List[Dict[str, str]] | None = None) -> str:
+def run_qa(
+    question: str, history: List[Dict[str, str]] | None = None, user_id: str = ""
+) -> str:
     '''
     功能：
-    执行简单问答，返回模型文本回答。
+    执行简单问答，返回模型文本回答。调用受并发限制，超限时抛出 AdmissionRejected。
 
     :param question: 用户问题
     :type question: str
     :param history: 历史消息列表
     :type history: List[Dict[str, str]] | None
+    :param user_id: 用户唯一标识（用于单用户并发限制）
+    :type user_id: str
     :return: 模型回答文本
     :rtype: str
     '''
-    llm = _build_llm()
+    endpoint, llm = select_llm("qa")
     history = history or []
     messages = _build_qa_messages(question, history)
-    response = llm.invoke(messages)
+    with track_usage("qa", user_id) as usage:
+        with llm_limiter.acquire(user_id):
+            usage.admitted()
+            with _routed_call("qa", endpoint):
+                response = llm.invoke(messages, config={"callbacks": [usage]})
     return getattr(response, "content", str(response))
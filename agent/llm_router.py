@@ -0,0 +1,148 @@
+﻿# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import random
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+# 错误率接近 100% 时的评分上限系数，避免除零
+_MIN_SUCCESS_RATE = 0.05
+
+
+def parse_endpoints(spec: str, model: str, base_url: str) -> List[Dict[str, str]]:
+    '''
+    功能：
+    解析一个路由的候选模型端点：分号分隔，每项为 "名称|BASE_URL|MODEL"，BASE_URL 或 MODEL 为空时沿用路由配置。
+    未配置时只有一个名为 primary 的端点（即路由配置本身）。
+
+    :param spec: 端点配置字符串
+    :type spec: str
+    :param model: 路由配置的模型名
+    :type model: str
+    :param base_url: 路由配置的 BASE_URL
+    :type base_url: str
+    :return: [{name, base_url, model}]
+    :rtype: List[Dict[str, str]]
+    '''
+    endpoints: List[Dict[str, str]] = []
+    seen = set()
+    for item in (spec or "").split(";"):
+        item = item.strip()
+        if not item:
+            continue
+        parts = [part.strip() for part in item.split("|")]
+        name = parts[0]
+        if not name:
+            raise RuntimeError(f"llm endpoint name is required: {item}")
+        if name in seen:
+            raise RuntimeError(f"duplicate llm endpoint name: {name}")
+        seen.add(name)
+        endpoints.append({
+            "name": name,
+            "base_url": (parts[1] if len(parts) > 1 else "") or base_url,
+            "model": (parts[2] if len(parts) > 2 else "") or model,
+        })
+    return endpoints or [{"name": "primary", "base_url": base_url, "model": model}]
+
+
+class _EndpointStats:
+    def __init__(self, window: int) -> None:
+        self.calls: Deque[Tuple[float, bool]] = deque(maxlen=max(1, window))
+        self.selected = 0
+
+    def p95(self) -> Optional[float]:
+        if not self.calls:
+            return None
+        latencies = sorted(latency for latency, _ in self.calls)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+
+    def error_rate(self) -> float:
+        if not self.calls:
+            return 0.0
+        return sum(1 for _, ok in self.calls if not ok) / len(self.calls)
+
+    def score(self) -> float:
+        # p95 按成功率放大：约等于拿到一次成功响应的尾部延迟
+        return (self.p95() or 0.0) / max(1.0 - self.error_rate(), _MIN_SUCCESS_RATE)
+
+
+class LatencyRouter:
+    '''
+    功能：
+    按最近 window 次调用的 p95 延迟与错误率在多个端点间选择：样本不足 min_samples 的端点优先（预热），
+    之后以 explore 的概率随机选择（让变慢或出错后恢复的端点有机会被重新评估），其余选评分最低的端点。
+    '''
+
+    def __init__(self, names: List[str], window: int, min_samples: int, explore: float) -> None:
+        if not names:
+            raise RuntimeError("latency router requires at least one endpoint")
+        self.names = list(names)
+        self.min_samples = max(0, min_samples)
+        self.explore = min(max(explore, 0.0), 1.0)
+        self._lock = threading.Lock()
+        self._stats = {name: _EndpointStats(window) for name in self.names}
+        self._random = random.Random()
+
+    def choose(self) -> str:
+        '''
+        功能：
+        选择本次调用使用的端点。
+
+        :return: 端点名称
+        :rtype: str
+        '''
+        if len(self.names) == 1:
+            name = self.names[0]
+        else:
+            with self._lock:
+                warming = [n for n in self.names if len(self._stats[n].calls) < self.min_samples]
+                if warming:
+                    name = min(warming, key=lambda n: (len(self._stats[n].calls), self._stats[n].selected))
+                elif self._random.random() < self.explore:
+                    name = self._random.choice(self.names)
+                else:
+                    name = min(self.names, key=lambda n: self._stats[n].score())
+        with self._lock:
+            self._stats[name].selected += 1
+        return name
+
+    def record(self, name: str, latency_ms: float, ok: bool) -> None:
+        '''
+        功能：
+        记录一次调用结果。
+
+        :param name: 端点名称
+        :type name: str
+        :param latency_ms: 调用耗时（毫秒）
+        :type latency_ms: float
+        :param ok: 是否成功
+        :type ok: bool
+        :return: 无
+        :rtype: None
+        '''
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is not None:
+                stats.calls.append((latency_ms, ok))
+
+    def snapshot(self) -> Dict[str, Any]:
+        '''
+        功能：
+        返回各端点的样本数、p95 延迟、错误率、评分与被选次数。
+
+        :return: {端点名称: 指标}
+        :rtype: Dict[str, Any]
+        '''
+        with self._lock:
+            result = {}
+            for name, stats in self._stats.items():
+                p95 = stats.p95()
+                result[name] = {
+                    "samples": len(stats.calls),
+                    "p95_ms": round(p95, 1) if p95 is not None else None,
+                    "error_rate": round(stats.error_rate(), 4),
+                    "score": round(stats.score(), 1),
+                    "selected": stats.selected,
+                }
+            return result
@@ -0,0 +1,421 @@
+﻿# -*- coding: utf-8 -*-
+"""
+运行中服务的内存占用分析（仅在调用管理接口时执行，不影响正常请求）：
+存储按用户统计状态与聊天历史的字节数、占用最大的用户、其他进程内组件（决策记录、读缓存、
+LLM 客户端、决策表等）的估算大小、进程 RSS 与对象类型统计，以及按需开启的 tracemalloc 快照与对比。
+进程内对象按递归 sys.getsizeof 估算（同一对象在一次测量内只计一次）；shm 与 Postgres 按序列化后的字节数统计。
+"""
+from __future__ import annotations
+
+import gc
+import heapq
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import tracemalloc
+import types
+import weakref
+from collections import Counter, OrderedDict, deque
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .config import (
+    MEMORY_REPORT_SAMPLE,
+    MEMORY_TRACE_AUTO_STOP,
+    MEMORY_TRACE_FRAMES,
+    MEMORY_TRACE_MAX_SNAPSHOTS,
+    STORE_BACKEND,
+)
+from .memory_store import memory_store_items, pg_footprint, shm_slot_sizes
+
+logger = logging.getLogger("agent")
+
+_ATOMIC = (str, bytes, bytearray, int, float, complex, bool, type(None), memoryview)
+_SKIP = (
+    type,
+    types.ModuleType,
+    types.FunctionType,
+    types.BuiltinFunctionType,
+    types.MethodType,
+    types.CodeType,
+    types.FrameType,
+    weakref.ref,
+)
+# 测量时每处理这么多个条目让出一次 GIL，避免长时间阻塞请求线程
+_YIELD_EVERY = 500
+
+
+def deep_sizeof(obj: Any) -> int:
+    '''
+    功能：
+    递归估算对象占用的字节数（容器、__dict__ 与 __slots__ 成员），跳过类型、模块与函数，
+    同一次测量内共享的对象只计一次。
+
+    :param obj: 待测对象
+    :type obj: Any
+    :return: 字节数
+    :rtype: int
+    '''
+    seen = set()
+    total = 0
+    stack = [obj]
+    while stack:
+        item = stack.pop()
+        if id(item) in seen or isinstance(item, _SKIP):
+            continue
+        seen.add(id(item))
+        try:
+            total += sys.getsizeof(item)
+        except TypeError:
+            continue
+        if isinstance(item, _ATOMIC):
+            continue
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset, deque)):
+            stack.extend(item)
+        else:
+            attrs = getattr(item, "__dict__", None)
+            if isinstance(attrs, dict):
+                stack.append(attrs)
+            for cls in type(item).__mro__:
+                for slot in cls.__dict__.get("__slots__", ()):
+                    if isinstance(slot, str) and hasattr(item, slot):
+                        stack.append(getattr(item, slot))
+    return total
+
+
+def _pause(i: int) -> None:
+    if i % _YIELD_EVERY == _YIELD_EVERY - 1:
+        time.sleep(0)
+
+
+def _summary(sizes: Dict[Any, int], top_n: int) -> Dict[str, Any]:
+    total = sum(sizes.values())
+    count = len(sizes)
+    summary = {
+        "count": count,
+        "bytes": total,
+        "avg_bytes": round(total / count, 1) if count else 0,
+        "max_bytes": max(sizes.values()) if sizes else 0,
+    }
+    if top_n:
+        summary["top"] = [
+            {"key": key, "bytes": size} for key, size in heapq.nlargest(top_n, sizes.items(), key=lambda x: x[1])
+        ]
+    return summary
+
+
+def _measure(items: List[Tuple[Any, Any]]) -> Dict[Any, int]:
+    sizes: Dict[Any, int] = {}
+    for i, (key, value) in enumerate(items):
+        sizes[key] = deep_sizeof(value)
+        _pause(i)
+    return sizes
+
+
+def _sampled(items: List[Tuple[Any, Any]], sample: int) -> Dict[str, Any]:
+    '''
+    功能：
+    条目较多时随机抽样测量并按平均值外推总字节数。
+    '''
+    count = len(items)
+    picked = items if count <= sample else random.sample(items, sample)
+    sizes = _measure(picked)
+    measured = sum(sizes.values())
+    avg = measured / len(picked) if picked else 0.0
+    return {
+        "count": count,
+        "bytes": int(avg * count),
+        "avg_bytes": round(avg, 1),
+        "sampled": len(picked) < count,
+    }
+
+
+def _per_user(state: Dict[str, int], chat: Dict[str, int], top_n: int) -> Dict[str, Any]:
+    users = set(state) | set(chat)
+    totals = {user: state.get(user, 0) + chat.get(user, 0) for user in users}
+    return {
+        "users": len(users),
+        "state": _summary(state, 0),
+        "chat": _summary(chat, 0),
+        "total_bytes": sum(totals.values()),
+        "avg_bytes_per_user": round(sum(totals.values()) / len(users), 1) if users else 0,
+        "top_users": [
+            {"user_id": user, "bytes": size, "state_bytes": state.get(user, 0), "chat_bytes": chat.get(user, 0)}
+            for user, size in heapq.nlargest(top_n, totals.items(), key=lambda x: x[1])
+        ],
+    }
+
+
+def store_footprint(top_n: int = 20, sample: int = MEMORY_REPORT_SAMPLE) -> Dict[str, Any]:
+    '''
+    功能：
+    统计存储占用：memory 后端按用户递归测量状态与聊天历史；shm 后端读取槽位头中的序列化字节数；
+    Postgres 统计各分片表大小与列存储字节数。进程内的决策记录、LLM 用量、幂等键、预生成决策与读缓存按抽样估算。
+
+    :param top_n: 返回的最大用户数
+    :type top_n: int
+    :param sample: 辅助存储每项最多测量的条目数
+    :type sample: int
+    :return: 存储占用报告
+    :rtype: Dict[str, Any]
+    '''
+    backend = str(STORE_BACKEND or "memory").lower()
+    items = memory_store_items()
+    report: Dict[str, Any] = {"backend": backend}
+    if backend == "shm":
+        state: Dict[str, int] = {}
+        chat: Dict[str, int] = {}
+        for i, (user_id, state_len, chat_len) in enumerate(shm_slot_sizes()):
+            state[user_id] = state_len
+            chat[user_id] = chat_len
+            _pause(i)
+        report["users"] = _per_user(state, chat, top_n)
+    elif backend == "postgres":
+        report["postgres"] = pg_footprint(top_n)
+    else:
+        report["users"] = _per_user(_measure(items["state"]), _measure(items["chat"]), top_n)
+    report["in_process"] = {
+        name: _sampled(items[name], sample)
+        for name in ("decision_record", "llm_usage", "idempotency", "precomputed", "state_cache", "chat_cache")
+    }
+    return report
+
+
+def component_sizes(sample: int = MEMORY_REPORT_SAMPLE) -> Dict[str, Any]:
+    '''
+    功能：
+    估算其他进程内组件的占用：LLM 客户端（LangChain/OpenAI/httpx 对象）、渐进式决策结果、
+    决策表。
+
+    :param sample: 每项最多测量的条目数
+    :type sample: int
+    :return: {组件名: 统计}
+    :rtype: Dict[str, Any]
+    '''
+    from .decision_engine import decision_table
+    from .llm_agent import llm_clients
+    from .progressive import refinements
+
+    components: Dict[str, Any] = {
+        "llm_clients": {name: {"bytes": deep_sizeof(client)} for name, client in llm_clients().items()},
+        "refinements": _sampled(refinements.items(), sample),
+    }
+    table = decision_table()
+    components["decision_table"] = {"entries": len(table), "bytes": deep_sizeof(table)}
+    return components
+
+
+def process_memory() -> Dict[str, Any]:
+    '''
+    功能：
+    返回进程内存指标（Linux 读取 /proc/self/status，其他平台只有峰值 RSS）与 GC 计数。
+
+    :return: 进程内存指标
+    :rtype: Dict[str, Any]
+    '''
+    info: Dict[str, Any] = {"pid": os.getpid(), "threads": threading.active_count(), "gc_counts": gc.get_count()}
+    try:
+        with open("/proc/self/status", "r", encoding="utf-8") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("VmRSS", "VmHWM", "VmSize", "RssAnon", "RssFile"):
+                    info[key.lower() + "_bytes"] = int(value.split()[0]) * 1024
+    except OSError:
+        import resource
+
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # macOS 以字节为单位，Linux 以 KB 为单位
+        info["vmhwm_bytes"] = maxrss if sys.platform == "darwin" else maxrss * 1024
+    return info
+
+
+def object_census(top_n: int = 30) -> List[Dict[str, Any]]:
+    '''
+    功能：
+    按类型统计 GC 跟踪的对象数量（遍历全部对象，耗时与对象数成正比）。
+
+    :param top_n: 返回的类型数
+    :type top_n: int
+    :return: [{type, count}]
+    :rtype: List[Dict[str, Any]]
+    '''
+    counts = Counter(type(obj).__qualname__ for obj in gc.get_objects())
+    return [{"type": name, "count": count} for name, count in counts.most_common(top_n)]
+
+
+def _frames(stat: Any) -> List[str]:
+    return [f"{frame.filename}:{frame.lineno}" for frame in stat.traceback]
+
+
+def _format_stats(stats: Iterable[Any], top_n: int) -> List[Dict[str, Any]]:
+    rows = []
+    for stat in list(stats)[:top_n]:
+        row = {"where": _frames(stat), "size": stat.size, "count": stat.count}
+        if hasattr(stat, "size_diff"):
+            row.update(size_diff=stat.size_diff, count_diff=stat.count_diff)
+        rows.append(row)
+    return rows
+
+
+class MemoryTracer:
+    '''
+    功能：
+    按需开启的 tracemalloc 会话：保存命名快照并对比两次快照（或快照与当前）的分配差异，
+    用于定位泄漏。开启期间所有分配都有额外开销，超过 auto_stop 秒自动关闭。
+    '''
+
+    def __init__(self, max_snapshots: int, auto_stop: float) -> None:
+        self.max_snapshots = max(1, max_snapshots)
+        self.auto_stop = auto_stop
+        self._lock = threading.Lock()
+        self._snapshots: "OrderedDict[str, Tuple[float, tracemalloc.Snapshot]]" = OrderedDict()
+        self._started_at: Optional[float] = None
+        self._timer: Optional[threading.Timer] = None
+
+    def _filtered(self, snapshot: tracemalloc.Snapshot) -> tracemalloc.Snapshot:
+        return snapshot.filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        ))
+
+    def status(self) -> Dict[str, Any]:
+        '''
+        功能：
+        返回 tracemalloc 状态与已保存的快照。
+
+        :return: 状态字典
+        :rtype: Dict[str, Any]
+        '''
+        with self._lock:
+            return self._status_locked()
+
+    def _status_locked(self) -> Dict[str, Any]:
+        tracing = tracemalloc.is_tracing()
+        current, peak = tracemalloc.get_traced_memory() if tracing else (0, 0)
+        return {
+            "tracing": tracing,
+            "started_at": self._started_at,
+            "auto_stop_sec": self.auto_stop,
+            "traced_current_bytes": current,
+            "traced_peak_bytes": peak,
+            "overhead_bytes": tracemalloc.get_tracemalloc_memory() if tracing else 0,
+            "snapshots": [{"label": label, "ts": ts} for label, (ts, _) in self._snapshots.items()],
+        }
+
+    def start(self, nframes: int = MEMORY_TRACE_FRAMES) -> Dict[str, Any]:
+        '''
+        功能：
+        开始跟踪分配（已在跟踪时保持不变）。
+
+        :param nframes: 每次分配记录的调用栈深度
+        :type nframes: int
+        :return: 状态字典
+        :rtype: Dict[str, Any]
+        '''
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(max(1, nframes))
+                self._started_at = time.time()
+                self._snapshots.clear()
+                if self.auto_stop > 0:
+                    self._timer = threading.Timer(self.auto_stop, self._expire)
+                    self._timer.daemon = True
+                    self._timer.start()
+                logger.info("tracemalloc started nframes=%s auto_stop=%s", nframes, self.auto_stop)
+            return self._status_locked()
+
+    def _expire(self) -> None:
+        logger.warning("tracemalloc auto-stopped after %ss", self.auto_stop)
+        self.stop()
+
+    def stop(self) -> Dict[str, Any]:
+        '''
+        功能：
+        停止跟踪并丢弃已保存的快照。
+
+        :return: 状态字典
+        :rtype: Dict[str, Any]
+        '''
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if tracemalloc.is_tracing():
+                tracemalloc.stop()
+            self._snapshots.clear()
+            self._started_at = None
+            return self._status_locked()
+
+    def snapshot(self, label: Optional[str] = None, top_n: int = 20, key_type: str = "lineno") -> Dict[str, Any]:
+        '''
+        功能：
+        保存一份命名快照（最多 max_snapshots 份，超出淘汰最早的），返回占用最大的分配位置。
+
+        :param label: 快照名，默认按时间生成
+        :type label: Optional[str]
+        :param top_n: 返回条数
+        :type top_n: int
+        :param key_type: 分组方式（lineno/filename/traceback）
+        :type key_type: str
+        :return: 快照摘要
+        :rtype: Dict[str, Any]
+        '''
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                raise RuntimeError("tracemalloc_not_started")
+            snapshot = self._filtered(tracemalloc.take_snapshot())
+            label = label or time.strftime("%Y%m%dT%H%M%S")
+            self._snapshots.pop(label, None)
+            self._snapshots[label] = (time.time(), snapshot)
+            while len(self._snapshots) > self.max_snapshots:
+                self._snapshots.popitem(last=False)
+            stats = snapshot.statistics(key_type)
+        return {
+            "label": label,
+            "total_bytes": sum(stat.size for stat in stats),
+            "top": _format_stats(stats, top_n),
+        }
+
+    def diff(
+        self, base: str, target: Optional[str] = None, top_n: int = 20, key_type: str = "lineno"
+    ) -> Dict[str, Any]:
+        '''
+        功能：
+        对比两份快照（target 为空时与当前分配对比），按增长字节数降序返回。
+
+        :param base: 基准快照名
+        :type base: str
+        :param target: 对比快照名，为空时现取一份（不保存）
+        :type target: Optional[str]
+        :param top_n: 返回条数
+        :type top_n: int
+        :param key_type: 分组方式（lineno/filename/traceback）
+        :type key_type: str
+        :return: 差异摘要
+        :rtype: Dict[str, Any]
+        '''
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                raise RuntimeError("tracemalloc_not_started")
+            if base not in self._snapshots or (target and target not in self._snapshots):
+                raise KeyError(target if base in self._snapshots else base)
+            base_snapshot = self._snapshots[base][1]
+            target_snapshot = self._snapshots[target][1] if target else self._filtered(tracemalloc.take_snapshot())
+            stats = target_snapshot.compare_to(base_snapshot, key_type)
+        return {
+            "base": base,
+            "target": target or "now",
+            "size_diff_bytes": sum(stat.size_diff for stat in stats),
+            "count_diff": sum(stat.count_diff for stat in stats),
+            "top": _format_stats(stats, top_n),
+        }
+
+
+tracer = MemoryTracer(MEMORY_TRACE_MAX_SNAPSHOTS, MEMORY_TRACE_AUTO_STOP)
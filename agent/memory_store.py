@@ -2,42 +2,490 @@
 from __future__ import annotations
 
 import json
+import logging
 import os
 import threading
-from typing import Dict, List
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 
 from .config import (
     CHAT_MAX_TURNS,
+    DECISION_RECORD_MAX,
+    IDEMPOTENCY_MAX_KEYS,
+    MEMORY_FSYNC,
+    MEMORY_PERSIST_DIR,
+    MEMORY_SNAPSHOT_INTERVAL,
+    MEMORY_SNAPSHOT_MIN_OPS,
     POSTGRES_CONNECT_TIMEOUT,
     POSTGRES_DSN,
     POSTGRES_DB,
     POSTGRES_HOST,
     POSTGRES_PASSWORD,
+    POSTGRES_POOL_MAX,
+    POSTGRES_POOL_MIN,
+    POSTGRES_POOL_TIMEOUT,
     POSTGRES_PORT,
     POSTGRES_ADMIN_DB,
     POSTGRES_AUTO_CREATE_DB,
     POSTGRES_SCHEMA,
+    POSTGRES_SHARD_DSNS,
+    POSTGRES_SHARD_PREVIOUS_DSNS,
     POSTGRES_USER,
+    PRECOMPUTE_MAX_USERS,
+    SHM_CHAT_BYTES,
+    SINGLEFLIGHT_PG_MAX_CONNECTIONS,
+    SHM_STATE_BYTES,
+    SHM_STORE_PATH,
+    SHM_STORE_SLOTS,
+    STATE_CACHE_ENABLED,
+    STATE_CACHE_SIZE,
+    STATE_CACHE_TTL,
     STORE_BACKEND,
 )
-from .state import clone_state, default_state
+from .persistence import KIND_CHAT, KIND_DECISION, KIND_SEGMENT, KIND_STATE
+from .sharding import build_ring, parse_shards
+from .state import clone_state, default_state, utc_now
 
 _store_lock = threading.Lock()
 _store: Dict[str, dict] = {}
 _chat_store: Dict[str, List[dict]] = {}
+_decision_store: Dict[str, Any] = {}
+_idempotency_lock = threading.Lock()
+_idempotency_store: "OrderedDict[str, dict]" = OrderedDict()
+_precompute_lock = threading.Lock()
+_precompute_store: "OrderedDict[str, dict]" = OrderedDict()
+_usage_lock = threading.Lock()
+# 跨进程合并的专用连接预算（持锁连接在计算期间一直占用）
+_COALESCE_MAX = max(1, SINGLEFLIGHT_PG_MAX_CONNECTIONS)
+_coalesce_slots = threading.BoundedSemaphore(_COALESCE_MAX)
+_coalesce_lock = threading.Lock()
+_coalesce_counts = {"in_use": 0, "budget_exhausted": 0}
+_usage_store: Dict[Tuple[str, str, str, str], dict] = {}
+# 类目×价位档统计：{json([类目, 价位档]): [成功, 失败, 时间戳]}，与状态共用 _store_lock 以便快照一致
+_segment_store: Dict[str, Any] = {}
 _CHAT_MAX_TURNS = CHAT_MAX_TURNS
 
 _pg_lock = threading.Lock()
-_pg_inited = False
+_pg_inited: set = set()
+
+# 分片：未配置 POSTGRES_SHARD_DSNS 时只有默认分片 ""（POSTGRES_DSN 或 HOST/DB/USER）
+_SHARDS = parse_shards(POSTGRES_SHARD_DSNS)
+_PREVIOUS_SHARDS = parse_shards(POSTGRES_SHARD_PREVIOUS_DSNS)
+_SHARD_DSN: Dict[str, str] = {**dict(_PREVIOUS_SHARDS), **dict(_SHARDS)}
+_ring = build_ring(_SHARDS)
+_previous_ring = build_ring(_PREVIOUS_SHARDS)
+
+_shm_lock = threading.Lock()
+_shm_store = None
+_SHM_WORKERS_META = "workers"
+
+_persist_lock = threading.Lock()
+_persist_ready = False
+_persist = None
+
+logger = logging.getLogger("agent")
+
+_CACHE_CHANNEL = "agent_cache_invalidate"
+_instance_id = uuid.uuid4().hex[:12]
+_cache_listener_lock = threading.Lock()
+_cache_listener_started = False
+_cache_listening: Dict[str, threading.Event] = {}
+
+
+def _shard_for(key: str) -> str:
+    '''
+    功能：
+    按一致性哈希返回 key（user_id）归属的分片名称，未分片时返回默认分片 ""。
+
+    :param key: 路由键
+    :type key: str
+    :return: 分片名称
+    :rtype: str
+    '''
+    return _ring.node_for(key) if _ring is not None else ""
+
+
+def _previous_shard_for(key: str) -> Optional[str]:
+    '''
+    功能：
+    迁移期间（配置了 POSTGRES_SHARD_PREVIOUS_DSNS）返回 key 在旧分片环上的归属，
+    与当前归属相同或未在迁移时返回 None。
+
+    :param key: 路由键
+    :type key: str
+    :return: 旧分片名称或 None
+    :rtype: Optional[str]
+    '''
+    if _previous_ring is None:
+        return None
+    previous = _previous_ring.node_for(key)
+    return previous if previous != _shard_for(key) else None
+
+
+def _all_shards() -> List[str]:
+    '''
+    功能：
+    返回全部分片（当前环 + 迁移中的旧分片，去重）。
+
+    :return: 分片名称列表
+    :rtype: List[str]
+    '''
+    if not _SHARDS:
+        return [""]
+    names = [name for name, _ in _SHARDS]
+    names += [name for name, _ in _PREVIOUS_SHARDS if name not in names]
+    return names
 
 
 def _use_postgres() -> bool:
     return str(STORE_BACKEND or "").lower() == "postgres"
 
 
-def _pg_connect():
+def _use_shm() -> bool:
+    return str(STORE_BACKEND or "").lower() == "shm"
+
+
+def _shm():
+    global _shm_store
+    if _shm_store is None:
+        with _shm_lock:
+            if _shm_store is None:
+                from .shm_store import ShmStore
+
+                _shm_store = ShmStore(
+                    SHM_STORE_PATH,
+                    SHM_STORE_SLOTS,
+                    SHM_STATE_BYTES,
+                    SHM_CHAT_BYTES,
+                    _CHAT_MAX_TURNS * 2,
+                )
+    return _shm_store
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def shm_workers() -> List[int]:
+    '''
+    功能：
+    把当前进程登记为 shm 后端的 worker，并返回仍存活的 worker 进程号（顺带清理已退出的进程）；
+    非 shm 后端只返回当前进程号。
+
+    :return: 存活的 worker 进程号
+    :rtype: List[int]
+    '''
+    pid = os.getpid()
+    if not _use_shm():
+        return [pid]
+    live: List[int] = []
+
+    def mutate(current: Optional[List[int]]) -> List[int]:
+        live[:] = [p for p in (current or []) if p != pid and _pid_alive(p)] + [pid]
+        return live
+
+    _shm().update_meta(_SHM_WORKERS_META, mutate)
+    return sorted(live)
+
+
+def _memory_persistence():
+    '''
+    功能：
+    memory 后端首次访问时按 MEMORY_PERSIST_DIR 恢复快照与日志并启动后台快照；未配置时返回 None。
+
+    :return: MemoryPersistence 实例或 None
+    :rtype: Any
+    '''
+    global _persist, _persist_ready
+    if not _persist_ready:
+        with _persist_lock:
+            if not _persist_ready:
+                if MEMORY_PERSIST_DIR:
+                    from .persistence import MemoryPersistence
+
+                    persist = MemoryPersistence(MEMORY_PERSIST_DIR, MEMORY_FSYNC)
+                    with _store_lock:
+                        persist.recover(
+                            _store, _chat_store, _CHAT_MAX_TURNS * 2, _decision_store, _segment_store
+                        )
+                    persist.start(_snapshot_source, MEMORY_SNAPSHOT_INTERVAL, MEMORY_SNAPSHOT_MIN_OPS)
+                    _persist = persist
+                _persist_ready = True
+    return _persist
+
+
+def _persisted_write(kind: int, key: str, apply: Callable[[], Any], value: Any = None) -> Any:
+    '''
+    功能：
+    memory 后端写入：开启持久化时经日志锁执行 apply 并追加日志（编码与 fsync 不占用存储锁），否则直接执行 apply。
+
+    :param kind: 日志记录类型
+    :type kind: int
+    :param key: 记录键
+    :type key: str
+    :param apply: 内存更新函数（内部持有存储锁；value 为 None 时返回要记录的值，返回 None 表示不记录）
+    :type apply: Callable[[], Any]
+    :param value: 预先确定的记录值
+    :type value: Any
+    :return: apply 的返回值
+    :rtype: Any
+    '''
+    persist = _memory_persistence()
+    if persist is None:
+        return apply()
+    return persist.write(kind, key, apply, value)
+
+
+def _snapshot_source() -> Tuple[int, Dict[str, Any], Dict[str, Any], Dict[str, Any], Dict[str, Any]]:
+    def copy() -> Tuple[Dict[str, Any], ...]:
+        with _store_lock:
+            return dict(_store), dict(_chat_store), dict(_decision_store), dict(_segment_store)
+
+    generation, data = _persist.rotate(copy)
+    return (generation, *data)
+
+
+def snapshot_memory_store() -> Optional[Dict[str, Any]]:
+    '''
+    功能：
+    立即为 memory 后端生成一次快照（未开启持久化时返回 None）。
+
+    :return: 快照统计
+    :rtype: Optional[Dict[str, Any]]
+    '''
+    persist = _memory_persistence()
+    if persist is None:
+        return None
+    return persist.snapshot(_snapshot_source)
+
+
+def persistence_stats() -> Optional[Dict[str, Any]]:
+    '''
+    功能：
+    返回 memory 后端持久化状态（未开启时返回 None）。
+
+    :return: 统计字典
+    :rtype: Optional[Dict[str, Any]]
+    '''
+    return _persist.stats() if _persist is not None else None
+
+
+def _state_locked(user_id: str) -> Optional[dict]:
+    # 恢复后的值保留为原始 JSON 字节，首次访问时解码（调用方持有 _store_lock）
+    state = _store.get(user_id)
+    if isinstance(state, bytes):
+        state = json.loads(state)
+        _store[user_id] = state
+    return state
+
+
+def _chat_locked(user_id: str) -> List[dict]:
+    history = _chat_store.get(user_id)
+    if isinstance(history, bytes):
+        history = json.loads(history)
+        _chat_store[user_id] = history
+    return history or []
+
+
+class _ReadCache:
+    '''
+    功能：
+    有界 LRU + TTL 读缓存。失效时递增 key 所在分桶的代数，
+    读库前取 token、写缓存时校验，避免并发读把失效前的旧值写回缓存。
+    '''
+
+    _GEN_BUCKETS = 4096
+
+    def __init__(self, max_size: int, ttl: float) -> None:
+        self.max_size = max(1, max_size)
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._data: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._gens = [0] * self._GEN_BUCKETS
+        self._epoch = 0
+        self.hits = 0
+        self.misses = 0
+
+    def token(self, key: str) -> Tuple[int, int]:
+        with self._lock:
+            return self._epoch, self._gens[hash(key) % self._GEN_BUCKETS]
+
+    def get(self, key: str) -> Any:
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] < now:
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def put(self, key: str, value: Any, token: Optional[Tuple[int, int]] = None) -> None:
+        with self._lock:
+            if token is not None and token != (
+                self._epoch,
+                self._gens[hash(key) % self._GEN_BUCKETS],
+            ):
+                return
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+            self._gens[hash(key) % self._GEN_BUCKETS] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._epoch += 1
+
+    def size(self) -> int:
+        with self._lock:
+            return len(self._data)
+
+
+_state_cache = _ReadCache(STATE_CACHE_SIZE, STATE_CACHE_TTL)
+_chat_cache = _ReadCache(STATE_CACHE_SIZE, STATE_CACHE_TTL)
+
+
+def _cache_active() -> bool:
+    '''
+    功能：
+    判断读缓存是否可用：仅 Postgres 后端启用，且失效监听连接正常时才读写缓存。
+
+    :return: 是否使用缓存
+    :rtype: bool
+    '''
+    if not (STATE_CACHE_ENABLED and _use_postgres()):
+        return False
+    _ensure_cache_listener()
+    return _cache_listening_all()
+
+
+def _cache_listening_all() -> bool:
+    return bool(_cache_listening) and all(event.is_set() for event in _cache_listening.values())
+
+
+def _ensure_cache_listener() -> None:
+    global _cache_listener_started
+    if _cache_listener_started:
+        return
+    with _cache_listener_lock:
+        if _cache_listener_started:
+            return
+        _cache_listener_started = True
+        # 写入通知在各自分片库内投递，每个分片一个监听线程
+        for shard in _all_shards():
+            _cache_listening[shard] = threading.Event()
+        for shard in _all_shards():
+            threading.Thread(
+                target=_cache_listen_loop,
+                args=(shard,),
+                name=f"pg-cache-listener{'-' + shard if shard else ''}",
+                daemon=True,
+            ).start()
+
+
+def _handle_notify(payload: str) -> None:
+    instance, kind, user_id = (payload.split(":", 2) + ["", ""])[:3]
+    if instance == _instance_id:
+        return
+    if kind == "state":
+        _state_cache.invalidate(user_id)
+    elif kind == "chat":
+        _chat_cache.invalidate(user_id)
+
+
+def _cache_listen_loop(shard: str) -> None:
+    '''
+    功能：
+    后台线程：在指定分片上 LISTEN 缓存失效频道，收到其他进程的写入通知后失效本地缓存；
+    任一分片连接断开期间缓存停用并清空，重连后恢复。
+
+    :param shard: 分片名称
+    :type shard: str
+    '''
+    import select
+
+    listening = _cache_listening[shard]
+    while True:
+        conn = None
+        try:
+            _pg_init(shard)
+            conn = _pg_connect(shard)
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute(f"LISTEN {_CACHE_CHANNEL}")
+            _state_cache.clear()
+            _chat_cache.clear()
+            listening.set()
+            while True:
+                select.select([conn], [], [], 5.0)
+                conn.poll()
+                while conn.notifies:
+                    _handle_notify(conn.notifies.pop(0).payload)
+        except Exception as exc:
+            logger.warning("cache listener disconnected shard=%s: %s", shard or "default", exc)
+        finally:
+            listening.clear()
+            _state_cache.clear()
+            _chat_cache.clear()
+            if conn is not None:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+        time.sleep(1.0)
+
+
+def _notify_write(cur, kind: str, user_id: str) -> None:
+    # 在写事务内发送，提交后才会投递给其他进程
+    if STATE_CACHE_ENABLED:
+        cur.execute(
+            "SELECT pg_notify(%s, %s)", (_CACHE_CHANNEL, f"{_instance_id}:{kind}:{user_id}")
+        )
+
+
+def cache_stats() -> Dict[str, Any]:
+    '''
+    功能：
+    返回读缓存的命中统计与当前条目数。
+
+    :return: 统计字典
+    :rtype: Dict[str, Any]
+    '''
+    return {
+        "enabled": bool(STATE_CACHE_ENABLED and _use_postgres()),
+        "listening": _cache_listening_all(),
+        "state": {"size": _state_cache.size(), "hits": _state_cache.hits, "misses": _state_cache.misses},
+        "chat": {"size": _chat_cache.size(), "hits": _chat_cache.hits, "misses": _chat_cache.misses},
+    }
+
+
+def _pg_connect(shard: str = ""):
     os.environ.setdefault("PGCLIENTENCODING", "UTF8")
-    dsn = POSTGRES_DSN
+    if shard:
+        dsn = _SHARD_DSN.get(shard)
+        if dsn is None:
+            raise RuntimeError(f"unknown postgres shard: {shard}")
+    else:
+        dsn = POSTGRES_DSN
     use_kwargs = False
     if not dsn:
         if not all([POSTGRES_HOST, POSTGRES_DB, POSTGRES_USER]):
@@ -111,12 +559,148 @@ def _pg_connect():
         return conn
 
 
-def _pg_init() -> None:
-    global _pg_inited
-    if _pg_inited:
+class _PgPool:
+    '''
+    功能：
+    线程安全的 Postgres 连接池（LIFO 复用空闲连接，超过上限时等待）。
+    连接通过 _pg_connect 创建，保留自动建库逻辑。
+    '''
+
+    def __init__(self, shard: str, minconn: int, maxconn: int, timeout: float) -> None:
+        self.shard = shard
+        self.minconn = max(0, minconn)
+        self.maxconn = max(1, maxconn, self.minconn)
+        self.timeout = timeout
+        self._cond = threading.Condition()
+        self._idle: List[Any] = []
+        self._total = 0
+
+    def prefill(self) -> int:
+        '''
+        功能：
+        预先建立 minconn 个连接。
+
+        :return: 当前空闲连接数
+        :rtype: int
+        '''
+        while True:
+            with self._cond:
+                if self._total >= self.minconn:
+                    return len(self._idle)
+                self._total += 1
+            try:
+                conn = _pg_connect(self.shard)
+            except Exception:
+                with self._cond:
+                    self._total -= 1
+                raise
+            with self._cond:
+                self._idle.append(conn)
+                self._cond.notify()
+
+    def getconn(self):
+        deadline = time.monotonic() + self.timeout
+        with self._cond:
+            while True:
+                while self._idle:
+                    conn = self._idle.pop()
+                    if not conn.closed:
+                        return conn
+                    self._total -= 1
+                if self._total < self.maxconn:
+                    self._total += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise RuntimeError(f"postgres pool exhausted (max={self.maxconn})")
+                self._cond.wait(remaining)
+        try:
+            return _pg_connect(self.shard)
+        except Exception:
+            with self._cond:
+                self._total -= 1
+                self._cond.notify()
+            raise
+
+    def putconn(self, conn) -> None:
+        reusable = not conn.closed
+        if reusable:
+            try:
+                from psycopg2 import extensions
+
+                if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception:
+                reusable = False
+        if not reusable:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        with self._cond:
+            if reusable:
+                self._idle.append(conn)
+            else:
+                self._total -= 1
+            self._cond.notify()
+
+    def stats(self) -> Dict[str, int]:
+        with self._cond:
+            return {"total": self._total, "idle": len(self._idle), "max": self.maxconn}
+
+
+_pg_pool_lock = threading.Lock()
+_pg_pools: Dict[str, _PgPool] = {}
+
+
+def _pg_pool(shard: str = "") -> _PgPool:
+    pool = _pg_pools.get(shard)
+    if pool is None:
+        with _pg_pool_lock:
+            pool = _pg_pools.get(shard)
+            if pool is None:
+                pool = _PgPool(shard, POSTGRES_POOL_MIN, POSTGRES_POOL_MAX, POSTGRES_POOL_TIMEOUT)
+                _pg_pools[shard] = pool
+    return pool
+
+
+@contextmanager
+def _pg_conn(shard: str = "") -> Iterator[Any]:
+    '''
+    功能：
+    从指定分片的连接池借出连接，退出时归还（未结束的事务回滚，已断开的连接丢弃）。
+
+    :param shard: 分片名称
+    :type shard: str
+    :return: psycopg2 连接
+    :rtype: Iterator[Any]
+    '''
+    pool = _pg_pool(shard)
+    conn = pool.getconn()
+    try:
+        yield conn
+    finally:
+        pool.putconn(conn)
+
+
+def pg_pool_stats() -> Optional[Dict[str, Dict[str, int]]]:
+    '''
+    功能：
+    返回各分片 Postgres 连接池状态（未创建时返回 None）。
+
+    :return: {分片名称: 连接池状态}
+    :rtype: Optional[Dict[str, Dict[str, int]]]
+    '''
+    if not _pg_pools:
+        return None
+    return {(shard or "default"): pool.stats() for shard, pool in list(_pg_pools.items())}
+
+
+def _pg_init(shard: str = "") -> None:
+    if shard in _pg_inited:
         return
     with _pg_lock:
-        if _pg_inited:
+        if shard in _pg_inited:
             return
         try:
             import psycopg2
@@ -124,46 +708,241 @@ def _pg_init() -> None:
         except ImportError as exc:
             raise RuntimeError("psycopg2-binary is not installed") from exc
 
-        conn = _pg_connect()
+        with _pg_conn(shard) as conn:
+            with conn:
+                with conn.cursor() as cur:
+                    cur.execute(sql.SQL("CREATE SCHEMA IF NOT EXISTS {}").format(
+                        sql.Identifier(POSTGRES_SCHEMA)
+                    ))
+                    cur.execute(
+                        sql.SQL(
+                            """
+                            CREATE TABLE IF NOT EXISTS {}.user_state (
+                                user_id TEXT PRIMARY KEY,
+                                state JSONB NOT NULL,
+                                updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+                            )
+                            """
+                        ).format(sql.Identifier(POSTGRES_SCHEMA))
+                    )
+                    cur.execute(
+                        sql.SQL(
+                            """
+                            CREATE TABLE IF NOT EXISTS {}.chat_history (
+                                id BIGSERIAL PRIMARY KEY,
+                                user_id TEXT NOT NULL,
+                                role TEXT NOT NULL,
+                                content TEXT NOT NULL,
+                                created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+                            )
+                            """
+                        ).format(sql.Identifier(POSTGRES_SCHEMA))
+                    )
+                    cur.execute(
+                        sql.SQL(
+                            """
+                            CREATE INDEX IF NOT EXISTS chat_history_user_id_id
+                            ON {}.chat_history (user_id, id DESC)
+                            """
+                        ).format(sql.Identifier(POSTGRES_SCHEMA))
+                    )
+                    cur.execute(
+                        sql.SQL(
+                            """
+                            CREATE TABLE IF NOT EXISTS {}.inflight_result (
+                                key TEXT PRIMARY KEY,
+                                response JSONB NOT NULL,
+                                created_at TIMESTAMPTZ NOT NULL DEFAULT clock_timestamp()
+                            )
+                            """
+                        ).format(sql.Identifier(POSTGRES_SCHEMA))
+                    )
+                    cur.execute(
+                        sql.SQL(
+                            """
+                            CREATE TABLE IF NOT EXISTS {}.decision_record (
+                                decision_id TEXT PRIMARY KEY,
+                                user_id TEXT NOT NULL,
+                                record JSONB NOT NULL,
+                                outcome TEXT,
+                                created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                                updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+                            )
+                            """
+                        ).format(sql.Identifier(POSTGRES_SCHEMA))
+                    )
+                    cur.execute(
+                        sql.SQL(
+                            """
+                            CREATE INDEX IF NOT EXISTS decision_record_user_id_created
+                            ON {}.decision_record (user_id, created_at DESC)
+                            """
+                        ).format(sql.Identifier(POSTGRES_SCHEMA))
+                    )
+                    cur.execute(
+                        sql.SQL(
+                            """
+                            CREATE TABLE IF NOT EXISTS {}.idempotency_key (
+                                key TEXT PRIMARY KEY,
+                                user_id TEXT NOT NULL,
+                                fingerprint TEXT NOT NULL,
+                                status TEXT NOT NULL,
+                                status_code INTEGER,
+                                response JSONB,
+                                created_at TIMESTAMPTZ NOT NULL DEFAULT clock_timestamp(),
+                                expires_at TIMESTAMPTZ NOT NULL
+                            )
+                            """
+                        ).format(sql.Identifier(POSTGRES_SCHEMA))
+                    )
+                    cur.execute(
+                        sql.SQL(
+                            """
+                            CREATE INDEX IF NOT EXISTS idempotency_key_expires_at
+                            ON {}.idempotency_key (expires_at)
+                            """
+                        ).format(sql.Identifier(POSTGRES_SCHEMA))
+                    )
+                    cur.execute(
+                        sql.SQL(
+                            """
+                            CREATE TABLE IF NOT EXISTS {}.precomputed_decision (
+                                user_id TEXT PRIMARY KEY,
+                                entry JSONB NOT NULL,
+                                created_at TIMESTAMPTZ NOT NULL DEFAULT clock_timestamp(),
+                                expires_at TIMESTAMPTZ NOT NULL
+                            )
+                            """
+                        ).format(sql.Identifier(POSTGRES_SCHEMA))
+                    )
+                    cur.execute(
+                        sql.SQL(
+                            """
+                            CREATE INDEX IF NOT EXISTS precomputed_decision_expires_at
+                            ON {}.precomputed_decision (expires_at)
+                            """
+                        ).format(sql.Identifier(POSTGRES_SCHEMA))
+                    )
+                    cur.execute(
+                        sql.SQL(
+                            """
+                            CREATE TABLE IF NOT EXISTS {}.segment_stats (
+                                category TEXT NOT NULL,
+                                tier TEXT NOT NULL,
+                                success DOUBLE PRECISION NOT NULL DEFAULT 0,
+                                fail DOUBLE PRECISION NOT NULL DEFAULT 0,
+                                ts DOUBLE PRECISION NOT NULL,
+                                PRIMARY KEY (category, tier)
+                            )
+                            """
+                        ).format(sql.Identifier(POSTGRES_SCHEMA))
+                    )
+                    cur.execute(
+                        sql.SQL(
+                            """
+                            CREATE TABLE IF NOT EXISTS {}.llm_usage (
+                                day DATE NOT NULL,
+                                user_id TEXT NOT NULL,
+                                route TEXT NOT NULL,
+                                model TEXT NOT NULL,
+                                calls BIGINT NOT NULL DEFAULT 0,
+                                llm_calls BIGINT NOT NULL DEFAULT 0,
+                                prompt_tokens BIGINT NOT NULL DEFAULT 0,
+                                completion_tokens BIGINT NOT NULL DEFAULT 0,
+                                total_tokens BIGINT NOT NULL DEFAULT 0,
+                                cost DOUBLE PRECISION NOT NULL DEFAULT 0,
+                                latency_ms DOUBLE PRECISION NOT NULL DEFAULT 0,
+                                latency_ms_max DOUBLE PRECISION NOT NULL DEFAULT 0,
+                                queue_ms DOUBLE PRECISION NOT NULL DEFAULT 0,
+                                retries BIGINT NOT NULL DEFAULT 0,
+                                errors BIGINT NOT NULL DEFAULT 0,
+                                fallbacks JSONB NOT NULL DEFAULT '{{}}'::jsonb,
+                                updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                                PRIMARY KEY (day, user_id, route, model)
+                            )
+                            """
+                        ).format(sql.Identifier(POSTGRES_SCHEMA))
+                    )
+        _pg_inited.add(shard)
+
+
+def warm_store() -> Dict[str, Any]:
+    '''
+    功能：
+    启动预热：Postgres 建表并预建连接池连接、启动缓存失效监听；shm 映射共享内存文件；
+    memory 恢复持久化数据。
+
+    :return: 预热结果
+    :rtype: Dict[str, Any]
+    '''
+    if _use_postgres():
+        for shard in _all_shards():
+            _pg_init(shard)
+            _pg_pool(shard).prefill()
+        if STATE_CACHE_ENABLED:
+            _ensure_cache_listener()
+        return {"backend": "postgres", "shards": len(_all_shards()), "pool": pg_pool_stats()}
+    if _use_shm():
+        workers = shm_workers()
+        if len(workers) > 1:
+            # 决策记录与幂等键不在共享内存里：按 decision_id 回填反馈、读取润色状态、
+            # 带 Idempotency-Key 的重试都需要落到写入它的 worker
+            logger.warning(
+                "shm store shared by %d workers: decision records and idempotency keys are per process, "
+                "use sticky routing or STORE_BACKEND=postgres",
+                len(workers),
+            )
+        return {"backend": "shm", "path": SHM_STORE_PATH, "workers": len(workers)}
+    persist = _memory_persistence()
+    return {
+        "backend": "memory",
+        "recovery": persist.last_recovery if persist is not None else None,
+    }
+
+
+def _pg_fetch_state(shard: str, user_id: str) -> Optional[dict]:
+    _pg_init(shard)
+    try:
+        from psycopg2 import sql
+    except ImportError as exc:
+        raise RuntimeError("psycopg2-binary is not installed") from exc
+    with _pg_conn(shard) as conn:
         with conn:
             with conn.cursor() as cur:
-                cur.execute(sql.SQL("CREATE SCHEMA IF NOT EXISTS {}").format(
-                    sql.Identifier(POSTGRES_SCHEMA)
-                ))
-                cur.execute(
-                    sql.SQL(
-                        """
-                        CREATE TABLE IF NOT EXISTS {}.user_state (
-                            user_id TEXT PRIMARY KEY,
-                            state JSONB NOT NULL,
-                            updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
-                        )
-                        """
-                    ).format(sql.Identifier(POSTGRES_SCHEMA))
-                )
                 cur.execute(
-                    sql.SQL(
-                        """
-                        CREATE TABLE IF NOT EXISTS {}.chat_history (
-                            id BIGSERIAL PRIMARY KEY,
-                            user_id TEXT NOT NULL,
-                            role TEXT NOT NULL,
-                            content TEXT NOT NULL,
-                            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
-                        )
-                        """
-                    ).format(sql.Identifier(POSTGRES_SCHEMA))
+                    sql.SQL("SELECT state FROM {}.user_state WHERE user_id=%s").format(
+                        sql.Identifier(POSTGRES_SCHEMA)
+                    ),
+                    (user_id,),
                 )
+                row = cur.fetchone()
+    return row[0] if row and row[0] else None
+
+
+def _pg_fetch_chat(shard: str, user_id: str) -> List[Tuple[str, str, datetime]]:
+    _pg_init(shard)
+    try:
+        from psycopg2 import sql
+    except ImportError as exc:
+        raise RuntimeError("psycopg2-binary is not installed") from exc
+    with _pg_conn(shard) as conn:
+        with conn:
+            with conn.cursor() as cur:
                 cur.execute(
                     sql.SQL(
                         """
-                        CREATE INDEX IF NOT EXISTS chat_history_user_id_id
-                        ON {}.chat_history (user_id, id DESC)
+                        SELECT role, content, created_at
+                        FROM {}.chat_history
+                        WHERE user_id=%s
+                        ORDER BY id DESC
+                        LIMIT %s
                         """
-                    ).format(sql.Identifier(POSTGRES_SCHEMA))
+                    ).format(sql.Identifier(POSTGRES_SCHEMA)),
+                    (user_id, _CHAT_MAX_TURNS * 2),
                 )
-        conn.close()
-        _pg_inited = True
+                rows = cur.fetchall() or []
+    rows.reverse()
+    return rows
 
 
 def get_state(user_id: str) -> dict:
@@ -177,29 +956,30 @@ def get_state(user_id: str) -> dict:
     :rtype: dict
     '''
     if _use_postgres():
-        _pg_init()
-        conn = _pg_connect()
-        try:
-            from psycopg2 import sql
-        except ImportError as exc:
-            conn.close()
-            raise RuntimeError("psycopg2-binary is not installed") from exc
-        with conn:
-            with conn.cursor() as cur:
-                cur.execute(
-                    sql.SQL("SELECT state FROM {}.user_state WHERE user_id=%s").format(
-                        sql.Identifier(POSTGRES_SCHEMA)
-                    ),
-                    (user_id,),
-                )
-                row = cur.fetchone()
-        conn.close()
-        if row and row[0]:
-            return clone_state(row[0])
+        use_cache = _cache_active()
+        if use_cache:
+            cached = _state_cache.get(user_id)
+            if cached is not None:
+                return clone_state(cached)
+            token = _state_cache.token(user_id)
+        state = _pg_fetch_state(_shard_for(user_id), user_id)
+        if state is None:
+            previous = _previous_shard_for(user_id)
+            if previous is not None:
+                state = _pg_fetch_state(previous, user_id)
+        if state:
+            if use_cache:
+                _state_cache.put(user_id, state, token)
+            return clone_state(state)
         return default_state(user_id)
 
+    if _use_shm():
+        return _shm().get_state(user_id) or default_state(user_id)
+
+    _memory_persistence()
     with _store_lock:
-        return clone_state(_store.get(user_id, default_state(user_id)))
+        state = _state_locked(user_id)
+        return clone_state(state) if state is not None else default_state(user_id)
 
 
 def set_state(state: dict) -> None:
@@ -213,32 +993,44 @@ def set_state(state: dict) -> None:
     :rtype: None
     '''
     if _use_postgres():
-        _pg_init()
-        conn = _pg_connect()
+        shard = _shard_for(state["user_id"])
+        _pg_init(shard)
         try:
             from psycopg2 import sql
             from psycopg2.extras import Json
         except ImportError as exc:
-            conn.close()
             raise RuntimeError("psycopg2-binary is not installed") from exc
-        with conn:
-            with conn.cursor() as cur:
-                cur.execute(
-                    sql.SQL(
-                        """
-                        INSERT INTO {}.user_state (user_id, state, updated_at)
-                        VALUES (%s, %s, NOW())
-                        ON CONFLICT (user_id)
-                        DO UPDATE SET state=EXCLUDED.state, updated_at=NOW()
-                        """
-                    ).format(sql.Identifier(POSTGRES_SCHEMA)),
-                    (state["user_id"], Json(state)),
-                )
-        conn.close()
+        with _pg_conn(shard) as conn:
+            with conn:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        sql.SQL(
+                            """
+                            INSERT INTO {}.user_state (user_id, state, updated_at)
+                            VALUES (%s, %s, NOW())
+                            ON CONFLICT (user_id)
+                            DO UPDATE SET state=EXCLUDED.state, updated_at=NOW()
+                            """
+                        ).format(sql.Identifier(POSTGRES_SCHEMA)),
+                        (state["user_id"], Json(state)),
+                    )
+                    _notify_write(cur, "state", state["user_id"])
+        if _cache_active():
+            _state_cache.invalidate(state["user_id"])
+            _state_cache.put(state["user_id"], clone_state(state))
         return
 
-    with _store_lock:
-        _store[state["user_id"]] = state.copy()
+    if _use_shm():
+        _shm().set_state(state)
+        return
+
+    stored = state.copy()
+
+    def apply() -> None:
+        with _store_lock:
+            _store[state["user_id"]] = stored
+
+    _persisted_write(KIND_STATE, state["user_id"], apply, state)
 
 
 def get_chat_history(user_id: str) -> List[dict]:
@@ -252,35 +1044,28 @@ def get_chat_history(user_id: str) -> List[dict]:
     :rtype: List[dict]
     '''
     if _use_postgres():
-        _pg_init()
-        conn = _pg_connect()
-        try:
-            from psycopg2 import sql
-        except ImportError as exc:
-            conn.close()
-            raise RuntimeError("psycopg2-binary is not installed") from exc
-        with conn:
-            with conn.cursor() as cur:
-                cur.execute(
-                    sql.SQL(
-                        """
-                        SELECT role, content
-                        FROM {}.chat_history
-                        WHERE user_id=%s
-                        ORDER BY id DESC
-                        LIMIT %s
-                        """
-                    ).format(sql.Identifier(POSTGRES_SCHEMA)),
-                    (user_id, _CHAT_MAX_TURNS * 2),
-                )
-                rows = cur.fetchall() or []
-        conn.close()
+        use_cache = _cache_active()
+        if use_cache:
+            cached = _chat_cache.get(user_id)
+            if cached is not None:
+                return [dict(item) for item in cached]
+            token = _chat_cache.token(user_id)
+        rows = _pg_fetch_chat(_shard_for(user_id), user_id)
+        if not rows:
+            previous = _previous_shard_for(user_id)
+            if previous is not None:
+                rows = _pg_fetch_chat(previous, user_id)
         history = [{"role": row[0], "content": row[1]} for row in rows]
-        history.reverse()
+        if use_cache:
+            _chat_cache.put(user_id, [dict(item) for item in history], token)
         return history
 
+    if _use_shm():
+        return _shm().get_chat_history(user_id)
+
+    _memory_persistence()
     with _store_lock:
-        return list(_chat_store.get(user_id, []))
+        return list(_chat_locked(user_id))
 
 
 def append_chat_history(user_id: str, role: str, content: str) -> None:
@@ -298,42 +1083,1417 @@ def append_chat_history(user_id: str, role: str, content: str) -> None:
     :rtype: None
     '''
     if _use_postgres():
-        _pg_init()
-        conn = _pg_connect()
+        shard = _shard_for(user_id)
+        previous = _previous_shard_for(user_id)
+        _pg_init(shard)
         try:
             from psycopg2 import sql
         except ImportError as exc:
-            conn.close()
             raise RuntimeError("psycopg2-binary is not installed") from exc
-        with conn:
-            with conn.cursor() as cur:
-                cur.execute(
-                    sql.SQL(
-                        "INSERT INTO {}.chat_history (user_id, role, content) VALUES (%s, %s, %s)"
-                    ).format(sql.Identifier(POSTGRES_SCHEMA)),
-                    (user_id, role, content),
+        with _pg_conn(shard) as conn:
+            with conn:
+                with conn.cursor() as cur:
+                    if previous is not None:
+                        # 迁移期间首次在新分片写聊天记录时，先把旧分片上的记录搬过来，保持顺序
+                        cur.execute(
+                            sql.SQL("SELECT 1 FROM {}.chat_history WHERE user_id=%s LIMIT 1").format(
+                                sql.Identifier(POSTGRES_SCHEMA)
+                            ),
+                            (user_id,),
+                        )
+                        if cur.fetchone() is None:
+                            for old_role, old_content, created_at in _pg_fetch_chat(previous, user_id):
+                                cur.execute(
+                                    sql.SQL(
+                                        "INSERT INTO {}.chat_history (user_id, role, content, created_at) "
+                                        "VALUES (%s, %s, %s, %s)"
+                                    ).format(sql.Identifier(POSTGRES_SCHEMA)),
+                                    (user_id, old_role, old_content, created_at),
+                                )
+                    cur.execute(
+                        sql.SQL(
+                            "INSERT INTO {}.chat_history (user_id, role, content) VALUES (%s, %s, %s)"
+                        ).format(sql.Identifier(POSTGRES_SCHEMA)),
+                        (user_id, role, content),
+                    )
+                    cur.execute(
+                        sql.SQL(
+                            """
+                            DELETE FROM {}.chat_history
+                            WHERE user_id=%s AND id NOT IN (
+                                SELECT id FROM {}.chat_history
+                                WHERE user_id=%s
+                                ORDER BY id DESC
+                                LIMIT %s
+                            )
+                            """
+                        ).format(sql.Identifier(POSTGRES_SCHEMA), sql.Identifier(POSTGRES_SCHEMA)),
+                        (user_id, user_id, _CHAT_MAX_TURNS * 2),
+                    )
+                    _notify_write(cur, "chat", user_id)
+        _chat_cache.invalidate(user_id)
+        return
+
+    item = {"role": role, "content": content, "ts": utc_now()}
+    if _use_shm():
+        _shm().append_chat_history(user_id, item)
+        return
+
+    def apply() -> None:
+        with _store_lock:
+            # 写时复制：快照线程持有的旧列表不会被修改
+            history = _chat_locked(user_id) + [item]
+            if len(history) > _CHAT_MAX_TURNS * 2:
+                history = history[-_CHAT_MAX_TURNS * 2 :]
+            _chat_store[user_id] = history
+
+    _persisted_write(KIND_CHAT, user_id, apply, item)
+
+
+def _naive_utc(value: datetime) -> datetime:
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _route_shards(user_id: Optional[str]) -> List[str]:
+    '''
+    功能：
+    批量读取时需要访问的分片：指定用户时为其当前分片（迁移期间再加旧分片），否则为全部分片。
+
+    :param user_id: 用户唯一标识
+    :type user_id: Optional[str]
+    :return: 分片名称列表
+    :rtype: List[str]
+    '''
+    if not user_id:
+        return _all_shards()
+    shards = [_shard_for(user_id)]
+    previous = _previous_shard_for(user_id)
+    if previous is not None:
+        shards.append(previous)
+    return shards
+
+
+def iter_states(
+    user_id: Optional[str] = None,
+    updated_since: Optional[datetime] = None,
+    batch_size: int = 500,
+) -> Iterator[dict]:
+    '''
+    功能：
+    流式遍历用户状态（导出/离线分析用）：Postgres 使用服务端游标分批拉取（分片时逐个分片遍历；
+    迁移期间尚未删除的旧副本可能重复出现），内存/共享内存后端逐个生成，内存占用与数据量无关。
+
+    :param user_id: 只遍历该用户
+    :type user_id: Optional[str]
+    :param updated_since: 只遍历在该时间（UTC）之后更新过的用户（仅 Postgres 下推过滤）
+    :type updated_since: Optional[datetime]
+    :param batch_size: 服务端游标每批行数
+    :type batch_size: int
+    :return: 用户状态迭代器
+    :rtype: Iterator[dict]
+    '''
+    if _use_postgres():
+        try:
+            from psycopg2 import sql
+        except ImportError as exc:
+            raise RuntimeError("psycopg2-binary is not installed") from exc
+        found = False
+        for shard in _route_shards(user_id):
+            if found and user_id:
+                break
+            _pg_init(shard)
+            with _pg_conn(shard) as conn:
+                clauses = []
+                params: List[Any] = []
+                if user_id:
+                    clauses.append(sql.SQL("user_id=%s"))
+                    params.append(user_id)
+                if updated_since is not None:
+                    clauses.append(sql.SQL("updated_at >= %s"))
+                    params.append(updated_since.replace(tzinfo=timezone.utc))
+                query = sql.SQL("SELECT state FROM {}.user_state").format(sql.Identifier(POSTGRES_SCHEMA))
+                if clauses:
+                    query = query + sql.SQL(" WHERE ") + sql.SQL(" AND ").join(clauses)
+                with conn:
+                    with conn.cursor(name=f"iter_states_{uuid.uuid4().hex[:8]}") as cur:
+                        cur.itersize = batch_size
+                        cur.execute(query, params)
+                        for row in cur:
+                            if row[0]:
+                                found = True
+                                yield row[0]
+        return
+
+    if _use_shm():
+        store = _shm()
+        user_ids = [user_id] if user_id else store.iter_user_ids()
+        for uid in user_ids:
+            state = store.get_state(uid)
+            if state:
+                yield state
+        return
+
+    _memory_persistence()
+    with _store_lock:
+        user_ids = [user_id] if user_id else list(_store.keys())
+    for uid in user_ids:
+        with _store_lock:
+            state = _state_locked(uid)
+        if state is not None:
+            yield clone_state(state)
+
+
+def iter_chat_history(
+    user_id: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    batch_size: int = 500,
+) -> Iterator[dict]:
+    '''
+    功能：
+    流式遍历聊天记录（按用户、时间顺序），每条含 user_id/role/content/ts。
+
+    :param user_id: 只遍历该用户
+    :type user_id: Optional[str]
+    :param since: 起始时间（UTC，含）
+    :type since: Optional[datetime]
+    :param until: 结束时间（UTC，不含）
+    :type until: Optional[datetime]
+    :param batch_size: 服务端游标每批行数
+    :type batch_size: int
+    :return: 聊天记录迭代器
+    :rtype: Iterator[dict]
+    '''
+    if _use_postgres():
+        try:
+            from psycopg2 import sql
+        except ImportError as exc:
+            raise RuntimeError("psycopg2-binary is not installed") from exc
+        found = False
+        for shard in _route_shards(user_id):
+            if found and user_id:
+                break
+            _pg_init(shard)
+            with _pg_conn(shard) as conn:
+                clauses = []
+                params: List[Any] = []
+                if user_id:
+                    clauses.append(sql.SQL("user_id=%s"))
+                    params.append(user_id)
+                if since is not None:
+                    clauses.append(sql.SQL("created_at >= %s"))
+                    params.append(since.replace(tzinfo=timezone.utc))
+                if until is not None:
+                    clauses.append(sql.SQL("created_at < %s"))
+                    params.append(until.replace(tzinfo=timezone.utc))
+                query = sql.SQL("SELECT user_id, role, content, created_at FROM {}.chat_history").format(
+                    sql.Identifier(POSTGRES_SCHEMA)
                 )
+                if clauses:
+                    query = query + sql.SQL(" WHERE ") + sql.SQL(" AND ").join(clauses)
+                query = query + sql.SQL(" ORDER BY user_id, id")
+                with conn:
+                    with conn.cursor(name=f"iter_chat_{uuid.uuid4().hex[:8]}") as cur:
+                        cur.itersize = batch_size
+                        cur.execute(query, params)
+                        for row in cur:
+                            found = True
+                            yield {
+                                "user_id": row[0],
+                                "role": row[1],
+                                "content": row[2],
+                                "ts": _naive_utc(row[3]).isoformat(),
+                            }
+        return
+
+    if _use_shm():
+        store = _shm()
+        user_ids = [user_id] if user_id else store.iter_user_ids()
+        histories = ((uid, store.get_chat_history(uid)) for uid in user_ids)
+    else:
+        _memory_persistence()
+        with _store_lock:
+            user_ids = [user_id] if user_id else list(_chat_store.keys())
+
+        def _memory_histories() -> Iterator[Tuple[str, List[dict]]]:
+            for uid in user_ids:
+                with _store_lock:
+                    history = list(_chat_locked(uid))
+                yield uid, history
+
+        histories = _memory_histories()
+
+    since_s = since.isoformat() if since is not None else None
+    until_s = until.isoformat() if until is not None else None
+    for uid, history in histories:
+        for item in history:
+            ts = item.get("ts")
+            if since_s is not None and (not ts or ts < since_s):
+                continue
+            if until_s is not None and (not ts or ts >= until_s):
+                continue
+            yield {"user_id": uid, "role": item.get("role"), "content": item.get("content"), "ts": ts}
+
+
+def pg_coalesce(
+    key: str, compute: Callable[[], dict], wait_timeout: float
+) -> Tuple[dict, bool]:
+    '''
+    功能：
+    跨进程合并相同请求（仅 Postgres 后端生效，其他后端直接计算）。
+    先记录到达时间，再用 advisory lock 排队；拿到锁后若发现到达之后已有其他进程写入的结果，
+    直接复用，否则自己计算并写入结果表供排队者读取。等锁超时（wait_timeout <= 0 时不等待）则不合并、直接计算。
+    advisory lock 为会话级，持锁连接在计算期间一直占用：使用独立于连接池的专用连接，
+    每个进程最多 SINGLEFLIGHT_PG_MAX_CONNECTIONS 个，用满时不做跨进程合并、直接计算，不影响普通读写。
+
+    :param key: 合并键
+    :type key: str
+    :param compute: 计算函数，返回可 JSON 序列化的字典
+    :type compute: Callable[[], dict]
+    :param wait_timeout: 等待其他进程的最长秒数
+    :type wait_timeout: float
+    :return: (结果, 是否复用了其他进程的结果)
+    :rtype: Tuple[dict, bool]
+    '''
+    if not _use_postgres():
+        return compute(), False
+    if not _coalesce_slots.acquire(blocking=False):
+        with _coalesce_lock:
+            _coalesce_counts["budget_exhausted"] += 1
+        return compute(), False
+    with _coalesce_lock:
+        _coalesce_counts["in_use"] += 1
+    try:
+        return _pg_coalesce_locked(key, compute, wait_timeout)
+    finally:
+        with _coalesce_lock:
+            _coalesce_counts["in_use"] -= 1
+        _coalesce_slots.release()
+
+
+def _pg_coalesce_locked(
+    key: str, compute: Callable[[], dict], wait_timeout: float
+) -> Tuple[dict, bool]:
+    shard = _shard_for(key)
+    _pg_init(shard)
+    try:
+        import psycopg2
+        from psycopg2 import sql
+        from psycopg2.extras import Json
+    except ImportError as exc:
+        raise RuntimeError("psycopg2-binary is not installed") from exc
+    conn = _pg_connect(shard)
+    conn.autocommit = True
+    locked = False
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT clock_timestamp()")
+            arrived = cur.fetchone()[0]
+            if wait_timeout > 0:
+                cur.execute("SET lock_timeout = %s", (f"{max(int(wait_timeout * 1000), 1)}ms",))
+                try:
+                    cur.execute("SELECT pg_advisory_lock(hashtextextended(%s, 0))", (key,))
+                    locked = True
+                except psycopg2.errors.LockNotAvailable:
+                    pass
+            else:
+                # lock_timeout=0 表示无限等待，不等待时改用 try 版本
+                cur.execute("SELECT pg_try_advisory_lock(hashtextextended(%s, 0))", (key,))
+                locked = bool(cur.fetchone()[0])
+
+            if locked:
                 cur.execute(
                     sql.SQL(
-                        """
-                        DELETE FROM {}.chat_history
-                        WHERE user_id=%s AND id NOT IN (
-                            SELECT id FROM {}.chat_history
-                            WHERE user_id=%s
-                            ORDER BY id DESC
-                            LIMIT %s
-                        )
-                        """
-                    ).format(sql.Identifier(POSTGRES_SCHEMA), sql.Identifier(POSTGRES_SCHEMA)),
-                    (user_id, user_id, _CHAT_MAX_TURNS * 2),
+                        "SELECT response FROM {}.inflight_result WHERE key=%s AND created_at >= %s"
+                    ).format(sql.Identifier(POSTGRES_SCHEMA)),
+                    (key, arrived),
                 )
+                row = cur.fetchone()
+                if row and row[0] is not None:
+                    return row[0], True
+    except Exception:
+        conn.close()
+        raise
+    if not locked:
+        # 未拿到锁：先归还专用连接再计算
         conn.close()
+        return compute(), False
+
+    try:
+        result = compute()
+        with conn.cursor() as cur:
+            cur.execute(
+                sql.SQL(
+                    """
+                    INSERT INTO {}.inflight_result (key, response, created_at)
+                    VALUES (%s, %s, clock_timestamp())
+                    ON CONFLICT (key)
+                    DO UPDATE SET response=EXCLUDED.response, created_at=EXCLUDED.created_at
+                    """
+                ).format(sql.Identifier(POSTGRES_SCHEMA)),
+                (key, Json(result)),
+            )
+            cur.execute(
+                sql.SQL(
+                    "DELETE FROM {}.inflight_result WHERE created_at < NOW() - INTERVAL '10 minutes'"
+                ).format(sql.Identifier(POSTGRES_SCHEMA))
+            )
+        return result, False
+    finally:
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_advisory_unlock(hashtextextended(%s, 0))", (key,))
+        finally:
+            conn.close()
+
+
+def coalesce_stats() -> Optional[Dict[str, int]]:
+    '''
+    功能：
+    返回跨进程合并专用连接的使用情况（非 Postgres 后端返回 None）。
+
+    :return: {max_connections, in_use, budget_exhausted}
+    :rtype: Optional[Dict[str, int]]
+    '''
+    if not _use_postgres():
+        return None
+    with _coalesce_lock:
+        return dict(_coalesce_counts, max_connections=_COALESCE_MAX)
+
+
+@contextmanager
+def leader_lock(name: str) -> Iterator[Optional[Callable[[], bool]]]:
+    '''
+    功能：
+    跨 worker 的互斥锁，用于同一时刻只应由一个进程执行的后台任务（不等待）。
+    Postgres 在 name 所在分片用专用连接取会话级 pg_try_advisory_lock，持锁期间连接保持打开，退出或连接断开即释放；
+    shm 在元数据槽位登记持有者进程号，持有者进程退出后视为已释放；memory 后端各进程数据独立，总能拿到锁。
+
+    :param name: 锁名称
+    :type name: str
+    :return: 拿到锁时为检查锁是否仍然持有的函数，否则为 None
+    :rtype: Iterator[Optional[Callable[[], bool]]]
+    '''
+    key = f"leader:{name}"
+    if _use_postgres():
+        shard = _shard_for(key)
+        _pg_init(shard)
+        conn = _pg_connect(shard)
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_try_advisory_lock(hashtextextended(%s, 0))", (key,))
+                locked = bool(cur.fetchone()[0])
+
+            def held() -> bool:
+                try:
+                    with conn.cursor() as cur:
+                        cur.execute("SELECT 1")
+                    return True
+                except Exception:
+                    return False
+
+            yield held if locked else None
+        finally:
+            # 关闭连接即释放会话级咨询锁
+            conn.close()
+        return
+
+    if _use_shm():
+        pid = os.getpid()
+        owners: List[int] = []
+
+        def acquire(current: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+            owner = (current or {}).get("pid")
+            if owner and owner != pid and _pid_alive(owner):
+                owners.append(owner)
+                return current
+            return {"pid": pid}
+
+        def release(current: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+            return None if (current or {}).get("pid") == pid else current
+
+        _shm().update_meta(key, acquire)
+        if owners:
+            yield None
+            return
+        try:
+            yield lambda: (_shm().get_meta(key) or {}).get("pid") == pid
+        finally:
+            _shm().update_meta(key, release)
+        return
+
+    yield lambda: True
+
+
+# LLM 用量按 (日期, 用户, 路由, 模型) 聚合：累加字段与取最大值字段
+USAGE_SUM_FIELDS = (
+    "calls",
+    "llm_calls",
+    "prompt_tokens",
+    "completion_tokens",
+    "total_tokens",
+    "cost",
+    "latency_ms",
+    "queue_ms",
+    "retries",
+    "errors",
+)
+USAGE_MAX_FIELDS = ("latency_ms_max",)
+USAGE_KEY_FIELDS = ("day", "user_id", "route", "model")
+
+
+def merge_usage_row(target: Dict[str, Any], row: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    功能：
+    将一行用量累加到目标行（计数求和、最大延迟取最大、回退原因逐项求和）。
+
+    :param target: 目标行（原地修改）
+    :type target: Dict[str, Any]
+    :param row: 待合并的行
+    :type row: Dict[str, Any]
+    :return: 目标行
+    :rtype: Dict[str, Any]
+    '''
+    for field in USAGE_SUM_FIELDS:
+        target[field] = target.get(field, 0) + (row.get(field) or 0)
+    for field in USAGE_MAX_FIELDS:
+        target[field] = max(target.get(field, 0), row.get(field) or 0)
+    fallbacks = target.setdefault("fallbacks", {})
+    for reason, count in (row.get("fallbacks") or {}).items():
+        fallbacks[reason] = fallbacks.get(reason, 0) + count
+    return target
+
+
+def add_usage_rows(rows: List[Dict[str, Any]]) -> None:
+    '''
+    功能：
+    累加写入 LLM 用量聚合行。Postgres 写入用户所在分片的 llm_usage 表（按主键 upsert 累加）；
+    memory/shm 后端保存在进程内（多 worker 时各自统计）。
+
+    :param rows: 用量行（含 day/user_id/route/model 与计数字段）
+    :type rows: List[Dict[str, Any]]
+    :return: 无
+    :rtype: None
+    '''
+    if not rows:
+        return
+    if _use_postgres():
+        try:
+            from psycopg2 import sql
+            from psycopg2.extras import Json
+        except ImportError as exc:
+            raise RuntimeError("psycopg2-binary is not installed") from exc
+        by_shard: Dict[str, List[Dict[str, Any]]] = {}
+        for row in rows:
+            by_shard.setdefault(_shard_for(row["user_id"]), []).append(row)
+        fields = USAGE_KEY_FIELDS + USAGE_SUM_FIELDS + USAGE_MAX_FIELDS
+        updates = [
+            sql.SQL("{0}=u.{0}+EXCLUDED.{0}").format(sql.Identifier(f)) for f in USAGE_SUM_FIELDS
+        ] + [
+            sql.SQL("{0}=GREATEST(u.{0}, EXCLUDED.{0})").format(sql.Identifier(f)) for f in USAGE_MAX_FIELDS
+        ]
+        query = sql.SQL(
+            """
+            INSERT INTO {schema}.llm_usage AS u ({fields}, fallbacks)
+            VALUES ({values}, %s)
+            ON CONFLICT (day, user_id, route, model)
+            DO UPDATE SET {updates},
+                fallbacks=(
+                    SELECT COALESCE(jsonb_object_agg(
+                        k, COALESCE((u.fallbacks->>k)::bigint, 0) + COALESCE((EXCLUDED.fallbacks->>k)::bigint, 0)
+                    ), '{{}}'::jsonb)
+                    FROM jsonb_object_keys(u.fallbacks || EXCLUDED.fallbacks) AS k
+                ),
+                updated_at=NOW()
+            """
+        ).format(
+            schema=sql.Identifier(POSTGRES_SCHEMA),
+            fields=sql.SQL(", ").join(sql.Identifier(f) for f in fields),
+            values=sql.SQL(", ").join(sql.Placeholder() for _ in fields),
+            updates=sql.SQL(", ").join(updates),
+        )
+        for shard, shard_rows in by_shard.items():
+            _pg_init(shard)
+            with _pg_conn(shard) as conn:
+                with conn:
+                    with conn.cursor() as cur:
+                        for row in shard_rows:
+                            cur.execute(
+                                query,
+                                [row[f] for f in USAGE_KEY_FIELDS]
+                                + [row.get(f) or 0 for f in USAGE_SUM_FIELDS + USAGE_MAX_FIELDS]
+                                + [Json(row.get("fallbacks") or {})],
+                            )
+        return
+
+    with _usage_lock:
+        for row in rows:
+            key = tuple(row[f] for f in USAGE_KEY_FIELDS)
+            target = _usage_store.get(key)
+            if target is None:
+                target = {f: row[f] for f in USAGE_KEY_FIELDS}
+                _usage_store[key] = target
+            merge_usage_row(target, row)
+
+
+def iter_usage_rows(
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    user_id: Optional[str] = None,
+) -> Iterator[Dict[str, Any]]:
+    '''
+    功能：
+    遍历已写入存储的 LLM 用量聚合行（分片时逐个分片读取）。
+
+    :param since: 起始日期（含，YYYY-MM-DD）
+    :type since: Optional[str]
+    :param until: 结束日期（含，YYYY-MM-DD）
+    :type until: Optional[str]
+    :param user_id: 只读取该用户
+    :type user_id: Optional[str]
+    :return: 用量行迭代器
+    :rtype: Iterator[Dict[str, Any]]
+    '''
+    if _use_postgres():
+        try:
+            from psycopg2 import sql
+        except ImportError as exc:
+            raise RuntimeError("psycopg2-binary is not installed") from exc
+        fields = USAGE_KEY_FIELDS + USAGE_SUM_FIELDS + USAGE_MAX_FIELDS + ("fallbacks",)
+        conditions = [sql.SQL("TRUE")]
+        params: List[Any] = []
+        if since:
+            conditions.append(sql.SQL("day >= %s"))
+            params.append(since)
+        if until:
+            conditions.append(sql.SQL("day <= %s"))
+            params.append(until)
+        if user_id:
+            conditions.append(sql.SQL("user_id = %s"))
+            params.append(user_id)
+        query = sql.SQL("SELECT {} FROM {}.llm_usage WHERE {}").format(
+            sql.SQL(", ").join(sql.Identifier(f) for f in fields),
+            sql.Identifier(POSTGRES_SCHEMA),
+            sql.SQL(" AND ").join(conditions),
+        )
+        for shard in _route_shards(user_id):
+            _pg_init(shard)
+            with _pg_conn(shard) as conn:
+                with conn:
+                    with conn.cursor() as cur:
+                        cur.execute(query, params)
+                        rows = cur.fetchall() or []
+            for values in rows:
+                row = dict(zip(fields, values))
+                row["day"] = row["day"].isoformat()
+                row["fallbacks"] = row["fallbacks"] or {}
+                yield row
+        return
+
+    with _usage_lock:
+        rows = [dict(row, fallbacks=dict(row.get("fallbacks") or {})) for row in _usage_store.values()]
+    for row in rows:
+        if since and row["day"] < since:
+            continue
+        if until and row["day"] > until:
+            continue
+        if user_id and row["user_id"] != user_id:
+            continue
+        yield row
+
+
+_SEGMENT_META = "segment_stats"
+
+
+def _segment_key(category: str, tier: str) -> str:
+    return json.dumps([category, tier], ensure_ascii=False, separators=(",", ":"))
+
+
+def _segment_locked(key: str) -> Optional[List[float]]:
+    counters = _segment_store.get(key)
+    if isinstance(counters, bytes):
+        counters = json.loads(counters)
+        _segment_store[key] = counters
+    return counters
+
+
+def _segment_merge(
+    counters: Optional[List[float]], success: bool, ts: float, half_life_sec: float
+) -> List[float]:
+    # 与 label_stats 相同的衰减：先衰减到 ts 再累加；ts 早于已有时间戳时不衰减
+    success_n, fail_n, since = counters or (0.0, 0.0, ts)
+    if ts > since:
+        factor = 0.5 ** ((ts - since) / half_life_sec)
+        success_n, fail_n = success_n * factor, fail_n * factor
+    return [
+        success_n + (1.0 if success else 0.0),
+        fail_n + (0.0 if success else 1.0),
+        max(ts, since),
+    ]
+
+
+def add_segment_outcome(category: str, tier: str, success: bool, ts: float, half_life_sec: float) -> None:
+    '''
+    功能：
+    累加一次类目×价位档反馈结果（先按半衰期衰减到 ts 再累加），所有 worker 共享同一份计数：
+    Postgres 写入 segment_stats 表（单条 upsert 内完成衰减与累加）；shm 写入共享内存的保留槽位；
+    memory 后端保存在进程内并随持久化日志落盘。
+
+    :param category: 类目
+    :type category: str
+    :param tier: 价位档
+    :type tier: str
+    :param success: 是否成功
+    :type success: bool
+    :param ts: 反馈时间戳（秒）
+    :type ts: float
+    :param half_life_sec: 衰减半衰期（秒）
+    :type half_life_sec: float
+    :return: 无
+    :rtype: None
+    '''
+    if _use_postgres():
+        shard = _shard_for(_SEGMENT_META)
+        _pg_init(shard)
+        try:
+            from psycopg2 import sql
+        except ImportError as exc:
+            raise RuntimeError("psycopg2-binary is not installed") from exc
+        with _pg_conn(shard) as conn:
+            with conn:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        sql.SQL(
+                            """
+                            INSERT INTO {}.segment_stats AS s (category, tier, success, fail, ts)
+                            VALUES (%s, %s, %s, %s, %s)
+                            ON CONFLICT (category, tier)
+                            DO UPDATE SET
+                                success=s.success * power(0.5, GREATEST(EXCLUDED.ts - s.ts, 0) / %s) + EXCLUDED.success,
+                                fail=s.fail * power(0.5, GREATEST(EXCLUDED.ts - s.ts, 0) / %s) + EXCLUDED.fail,
+                                ts=GREATEST(s.ts, EXCLUDED.ts)
+                            """
+                        ).format(sql.Identifier(POSTGRES_SCHEMA)),
+                        (
+                            category,
+                            tier,
+                            1.0 if success else 0.0,
+                            0.0 if success else 1.0,
+                            ts,
+                            half_life_sec,
+                            half_life_sec,
+                        ),
+                    )
+        return
+
+    key = _segment_key(category, tier)
+    if _use_shm():
+        def mutate(current: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+            segments = current or {}
+            segments[key] = _segment_merge(segments.get(key), success, ts, half_life_sec)
+            return segments
+
+        _shm().update_meta(_SEGMENT_META, mutate)
+        return
+
+    def apply() -> List[float]:
+        with _store_lock:
+            counters = _segment_merge(_segment_locked(key), success, ts, half_life_sec)
+            _segment_store[key] = counters
+            return counters
+
+    _persisted_write(KIND_SEGMENT, key, apply)
+
+
+def load_segment_outcomes() -> Dict[Tuple[str, str], Tuple[float, float, float]]:
+    '''
+    功能：
+    读取全部类目×价位档计数（未衰减到当前时间）。
+
+    :return: {(类目, 价位档): (成功, 失败, 时间戳)}
+    :rtype: Dict[Tuple[str, str], Tuple[float, float, float]]
+    '''
+    if _use_postgres():
+        shard = _shard_for(_SEGMENT_META)
+        _pg_init(shard)
+        try:
+            from psycopg2 import sql
+        except ImportError as exc:
+            raise RuntimeError("psycopg2-binary is not installed") from exc
+        with _pg_conn(shard) as conn:
+            with conn:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        sql.SQL("SELECT category, tier, success, fail, ts FROM {}.segment_stats").format(
+                            sql.Identifier(POSTGRES_SCHEMA)
+                        )
+                    )
+                    rows = cur.fetchall() or []
+        return {(category, tier): (success, fail, ts) for category, tier, success, fail, ts in rows}
+
+    if _use_shm():
+        raw = _shm().get_meta(_SEGMENT_META) or {}
+    else:
+        _memory_persistence()
+        with _store_lock:
+            raw = {key: _segment_locked(key) for key in list(_segment_store)}
+    result: Dict[Tuple[str, str], Tuple[float, float, float]] = {}
+    for key, (success, fail, ts) in raw.items():
+        category, tier = json.loads(key)
+        result[(category, tier)] = (success, fail, ts)
+    return result
+
+
+def _decision_locked(decision_id: str) -> Optional[dict]:
+    record = _decision_store.get(decision_id)
+    if isinstance(record, bytes):
+        record = json.loads(record)
+        _decision_store[decision_id] = record
+    return record
+
+
+def put_decision_records(user_id: str, records: List[Dict[str, Any]]) -> None:
+    '''
+    功能：
+    写入（或整条覆盖）决策记录，按 decision_id 建索引。Postgres 写入用户所在分片的 decision_record 表；
+    memory 后端随持久化日志落盘，超过 DECISION_RECORD_MAX 条时淘汰最早的记录；
+    shm 后端保存在进程内（多 worker 时各自可见，反馈时仍可回退到状态中的历史）。
+
+    :param user_id: 用户唯一标识
+    :type user_id: str
+    :param records: 决策记录列表（需含 decision_id）
+    :type records: List[Dict[str, Any]]
+    :return: 无
+    :rtype: None
+    '''
+    if not records:
         return
+    if _use_postgres():
+        shard = _shard_for(user_id)
+        _pg_init(shard)
+        try:
+            from psycopg2 import sql
+            from psycopg2.extras import Json
+        except ImportError as exc:
+            raise RuntimeError("psycopg2-binary is not installed") from exc
+        with _pg_conn(shard) as conn:
+            with conn:
+                with conn.cursor() as cur:
+                    for record in records:
+                        cur.execute(
+                            sql.SQL(
+                                """
+                                INSERT INTO {}.decision_record (decision_id, user_id, record, outcome)
+                                VALUES (%s, %s, %s, %s)
+                                ON CONFLICT (decision_id)
+                                DO UPDATE SET record=EXCLUDED.record, outcome=EXCLUDED.outcome, updated_at=NOW()
+                                """
+                            ).format(sql.Identifier(POSTGRES_SCHEMA)),
+                            (record["decision_id"], user_id, Json(record), record.get("outcome")),
+                        )
+        return
+
+    if _use_shm():
+        with _store_lock:
+            for record in records:
+                _decision_store[record["decision_id"]] = record
+            while len(_decision_store) > DECISION_RECORD_MAX:
+                _decision_store.pop(next(iter(_decision_store)))
+        return
+
+    for record in records:
+        def apply(record: dict = record) -> None:
+            with _store_lock:
+                _decision_store[record["decision_id"]] = record
+                while len(_decision_store) > DECISION_RECORD_MAX:
+                    _decision_store.pop(next(iter(_decision_store)))
+
+        _persisted_write(KIND_DECISION, record["decision_id"], apply, record)
+
 
-    item = {"role": role, "content": content}
+def _pg_fetch_decision(shard: str, decision_id: str) -> Optional[dict]:
+    _pg_init(shard)
+    try:
+        from psycopg2 import sql
+    except ImportError as exc:
+        raise RuntimeError("psycopg2-binary is not installed") from exc
+    with _pg_conn(shard) as conn:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    sql.SQL("SELECT record FROM {}.decision_record WHERE decision_id=%s").format(
+                        sql.Identifier(POSTGRES_SCHEMA)
+                    ),
+                    (decision_id,),
+                )
+                row = cur.fetchone()
+    return row[0] if row and row[0] else None
+
+
+def get_decision_record(decision_id: str, user_id: Optional[str] = None) -> Optional[dict]:
+    '''
+    功能：
+    按 decision_id 读取决策记录（主键查询）。Postgres 分片时给出 user_id 只查其所在分片，否则逐个分片查找。
+
+    :param decision_id: 决策 ID
+    :type decision_id: str
+    :param user_id: 用户唯一标识（用于分片路由，可选）
+    :type user_id: Optional[str]
+    :return: 决策记录，不存在返回 None
+    :rtype: Optional[dict]
+    '''
+    if _use_postgres():
+        for shard in _route_shards(user_id):
+            record = _pg_fetch_decision(shard, decision_id)
+            if record is not None:
+                return record
+        return None
+
+    if not _use_shm():
+        _memory_persistence()
     with _store_lock:
-        history = _chat_store.get(user_id, [])
-        history.append(item)
-        if len(history) > _CHAT_MAX_TURNS * 2:
-            history = history[-_CHAT_MAX_TURNS * 2 :]
-        _chat_store[user_id] = history
+        record = _decision_locked(decision_id)
+        return json.loads(json.dumps(record)) if record is not None else None
+
+
+def set_decision_outcome(decision_id: str, user_id: str, outcome: str, ts: str) -> bool:
+    '''
+    功能：
+    回填决策记录的反馈结果与反馈时间。
+
+    :param decision_id: 决策 ID
+    :type decision_id: str
+    :param user_id: 用户唯一标识
+    :type user_id: str
+    :param outcome: 反馈结果
+    :type outcome: str
+    :param ts: 反馈时间（ISO 字符串）
+    :type ts: str
+    :return: 是否更新到记录
+    :rtype: bool
+    '''
+    if _use_postgres():
+        try:
+            from psycopg2 import sql
+        except ImportError as exc:
+            raise RuntimeError("psycopg2-binary is not installed") from exc
+        for shard in _route_shards(user_id):
+            _pg_init(shard)
+            with _pg_conn(shard) as conn:
+                with conn:
+                    with conn.cursor() as cur:
+                        cur.execute(
+                            sql.SQL(
+                                """
+                                UPDATE {}.decision_record
+                                SET record=record || jsonb_build_object('outcome', %s::text, 'outcome_at', %s::text),
+                                    outcome=%s,
+                                    updated_at=NOW()
+                                WHERE decision_id=%s AND user_id=%s
+                                """
+                            ).format(sql.Identifier(POSTGRES_SCHEMA)),
+                            (outcome, ts, outcome, decision_id, user_id),
+                        )
+                        if cur.rowcount:
+                            return True
+        return False
+
+    return _update_decision_local(decision_id, user_id, {"outcome": outcome, "outcome_at": ts})
+
+
+def update_decision_record(decision_id: str, user_id: str, fields: Dict[str, Any]) -> bool:
+    '''
+    功能：
+    只覆盖决策记录的指定顶层字段（如润色后的 output），其余字段与反馈结果保持不变；
+    Postgres 在单条 UPDATE 内合并 JSONB，不会覆盖并发回填的反馈结果。
+
+    :param decision_id: 决策 ID
+    :type decision_id: str
+    :param user_id: 用户唯一标识
+    :type user_id: str
+    :param fields: 需要覆盖的字段
+    :type fields: Dict[str, Any]
+    :return: 是否更新到记录
+    :rtype: bool
+    '''
+    if _use_postgres():
+        try:
+            from psycopg2 import sql
+            from psycopg2.extras import Json
+        except ImportError as exc:
+            raise RuntimeError("psycopg2-binary is not installed") from exc
+        for shard in _route_shards(user_id):
+            _pg_init(shard)
+            with _pg_conn(shard) as conn:
+                with conn:
+                    with conn.cursor() as cur:
+                        cur.execute(
+                            sql.SQL(
+                                """
+                                UPDATE {}.decision_record
+                                SET record=record || %s, updated_at=NOW()
+                                WHERE decision_id=%s AND user_id=%s
+                                """
+                            ).format(sql.Identifier(POSTGRES_SCHEMA)),
+                            (Json(fields), decision_id, user_id),
+                        )
+                        if cur.rowcount:
+                            return True
+        return False
+
+    return _update_decision_local(decision_id, user_id, fields)
+
+
+def _update_decision_local(decision_id: str, user_id: str, fields: Dict[str, Any]) -> bool:
+    def apply() -> Optional[dict]:
+        with _store_lock:
+            record = _decision_locked(decision_id)
+            if record is None or record.get("user_id") != user_id:
+                return None
+            record = dict(record, **fields)
+            _decision_store[decision_id] = record
+            return record
+
+    if _use_shm():
+        return apply() is not None
+    return _persisted_write(KIND_DECISION, decision_id, apply) is not None
+
+
+def _idempotency_alive_locked(key: str, now: float) -> Optional[dict]:
+    record = _idempotency_store.get(key)
+    if record is not None and record["expires_at"] <= now:
+        _idempotency_store.pop(key, None)
+        record = None
+    return record
+
+
+def claim_idempotency_key(
+    key: str, user_id: str, fingerprint: str, ttl: float, pending_timeout: float
+) -> Optional[dict]:
+    '''
+    功能：
+    原子地占用幂等键：键不存在、已过期或处理中超过 pending_timeout（原请求进程已退出）时
+    写入处理中记录并返回 None，由调用方执行请求；否则返回已有记录。
+    Postgres 写入用户所在分片的 idempotency_key 表；memory/shm 后端保存在进程内
+    （最多 IDEMPOTENCY_MAX_KEYS 个，超出时淘汰最早的键）。
+
+    :param key: 幂等键（含接口与用户前缀）
+    :type key: str
+    :param user_id: 用户唯一标识（用于分片路由）
+    :type user_id: str
+    :param fingerprint: 请求参数指纹
+    :type fingerprint: str
+    :param ttl: 记录保留秒数
+    :type ttl: float
+    :param pending_timeout: 处理中记录视为失效的秒数
+    :type pending_timeout: float
+    :return: 已有记录（fingerprint/status/status_code/response），占用成功返回 None
+    :rtype: Optional[dict]
+    '''
+    if _use_postgres():
+        shard = _shard_for(user_id)
+        _pg_init(shard)
+        try:
+            from psycopg2 import sql
+        except ImportError as exc:
+            raise RuntimeError("psycopg2-binary is not installed") from exc
+        with _pg_conn(shard) as conn:
+            with conn:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        sql.SQL(
+                            """
+                            INSERT INTO {0}.idempotency_key AS t (key, user_id, fingerprint, status, expires_at)
+                            VALUES (%s, %s, %s, 'pending', clock_timestamp() + %s * INTERVAL '1 second')
+                            ON CONFLICT (key) DO UPDATE
+                            SET fingerprint=EXCLUDED.fingerprint, status='pending', status_code=NULL, response=NULL,
+                                created_at=clock_timestamp(), expires_at=EXCLUDED.expires_at
+                            WHERE t.expires_at <= clock_timestamp()
+                               OR (t.status='pending' AND t.created_at < clock_timestamp() - %s * INTERVAL '1 second')
+                            RETURNING key
+                            """
+                        ).format(sql.Identifier(POSTGRES_SCHEMA)),
+                        (key, user_id, fingerprint, ttl, pending_timeout),
+                    )
+                    if cur.fetchone():
+                        return None
+                    cur.execute(
+                        sql.SQL(
+                            "SELECT fingerprint, status, status_code, response FROM {}.idempotency_key WHERE key=%s"
+                        ).format(sql.Identifier(POSTGRES_SCHEMA)),
+                        (key,),
+                    )
+                    row = cur.fetchone()
+        if row is None:
+            # 刚被其他请求释放，重新占用
+            return claim_idempotency_key(key, user_id, fingerprint, ttl, pending_timeout)
+        return {"fingerprint": row[0], "status": row[1], "status_code": row[2], "response": row[3]}
+
+    now = time.time()
+    with _idempotency_lock:
+        record = _idempotency_alive_locked(key, now)
+        if record is not None and not (record["status"] == "pending" and record["created_at"] < now - pending_timeout):
+            return dict(record)
+        _idempotency_store.pop(key, None)
+        _idempotency_store[key] = {
+            "fingerprint": fingerprint,
+            "status": "pending",
+            "status_code": None,
+            "response": None,
+            "created_at": now,
+            "expires_at": now + ttl,
+        }
+        while len(_idempotency_store) > IDEMPOTENCY_MAX_KEYS:
+            _idempotency_store.popitem(last=False)
+    return None
+
+
+def get_idempotency_key(key: str, user_id: str) -> Optional[dict]:
+    '''
+    功能：
+    读取未过期的幂等记录。
+
+    :param key: 幂等键
+    :type key: str
+    :param user_id: 用户唯一标识（用于分片路由）
+    :type user_id: str
+    :return: 记录（fingerprint/status/status_code/response），不存在返回 None
+    :rtype: Optional[dict]
+    '''
+    if _use_postgres():
+        shard = _shard_for(user_id)
+        _pg_init(shard)
+        try:
+            from psycopg2 import sql
+        except ImportError as exc:
+            raise RuntimeError("psycopg2-binary is not installed") from exc
+        with _pg_conn(shard) as conn:
+            with conn:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        sql.SQL(
+                            """
+                            SELECT fingerprint, status, status_code, response FROM {}.idempotency_key
+                            WHERE key=%s AND expires_at > clock_timestamp()
+                            """
+                        ).format(sql.Identifier(POSTGRES_SCHEMA)),
+                        (key,),
+                    )
+                    row = cur.fetchone()
+        if row is None:
+            return None
+        return {"fingerprint": row[0], "status": row[1], "status_code": row[2], "response": row[3]}
+
+    with _idempotency_lock:
+        record = _idempotency_alive_locked(key, time.time())
+        return dict(record) if record is not None else None
+
+
+def complete_idempotency_key(key: str, user_id: str, status_code: int, response: dict, ttl: float) -> None:
+    '''
+    功能：
+    保存幂等键对应的响应（状态改为 done），TTL 从完成时重新计算；Postgres 顺带清理已过期的键。
+
+    :param key: 幂等键
+    :type key: str
+    :param user_id: 用户唯一标识（用于分片路由）
+    :type user_id: str
+    :param status_code: HTTP 状态码
+    :type status_code: int
+    :param response: 响应体
+    :type response: dict
+    :param ttl: 记录保留秒数
+    :type ttl: float
+    :return: 无
+    :rtype: None
+    '''
+    if _use_postgres():
+        shard = _shard_for(user_id)
+        _pg_init(shard)
+        try:
+            from psycopg2 import sql
+            from psycopg2.extras import Json
+        except ImportError as exc:
+            raise RuntimeError("psycopg2-binary is not installed") from exc
+        with _pg_conn(shard) as conn:
+            with conn:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        sql.SQL(
+                            """
+                            UPDATE {}.idempotency_key
+                            SET status='done', status_code=%s, response=%s,
+                                expires_at=clock_timestamp() + %s * INTERVAL '1 second'
+                            WHERE key=%s
+                            """
+                        ).format(sql.Identifier(POSTGRES_SCHEMA)),
+                        (status_code, Json(response), ttl, key),
+                    )
+                    cur.execute(
+                        sql.SQL("DELETE FROM {}.idempotency_key WHERE expires_at <= clock_timestamp()").format(
+                            sql.Identifier(POSTGRES_SCHEMA)
+                        )
+                    )
+        return
+
+    with _idempotency_lock:
+        record = _idempotency_store.get(key)
+        if record is not None:
+            record.update(status="done", status_code=status_code, response=response, expires_at=time.time() + ttl)
+
+
+def release_idempotency_key(key: str, user_id: str) -> None:
+    '''
+    功能：
+    删除处理中的幂等记录（请求失败或结果不应复用时调用），之后同一个键可以重新执行。
+
+    :param key: 幂等键
+    :type key: str
+    :param user_id: 用户唯一标识（用于分片路由）
+    :type user_id: str
+    :return: 无
+    :rtype: None
+    '''
+    if _use_postgres():
+        shard = _shard_for(user_id)
+        _pg_init(shard)
+        try:
+            from psycopg2 import sql
+        except ImportError as exc:
+            raise RuntimeError("psycopg2-binary is not installed") from exc
+        with _pg_conn(shard) as conn:
+            with conn:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        sql.SQL("DELETE FROM {}.idempotency_key WHERE key=%s AND status='pending'").format(
+                            sql.Identifier(POSTGRES_SCHEMA)
+                        ),
+                        (key,),
+                    )
+        return
+
+    with _idempotency_lock:
+        record = _idempotency_store.get(key)
+        if record is not None and record["status"] == "pending":
+            _idempotency_store.pop(key, None)
+
+
+def _precompute_alive_locked(user_id: str, now: float) -> Optional[dict]:
+    record = _precompute_store.get(user_id)
+    if record is not None and record["expires_at"] <= now:
+        _precompute_store.pop(user_id, None)
+        record = None
+    return record
+
+
+def put_precomputed_decision(user_id: str, entry: dict, ttl: float) -> None:
+    '''
+    功能：
+    保存为用户预生成的决策（每个用户只保留最新一条，ttl 秒后过期）。
+    Postgres 写入用户所在分片的 precomputed_decision 表并顺带清理已过期的记录；
+    memory/shm 后端保存在进程内（最多 PRECOMPUTE_MAX_USERS 个，超出时淘汰最早写入的）。
+
+    :param user_id: 用户唯一标识
+    :type user_id: str
+    :param entry: 预生成结果（请求参数指纹、状态版本、草案指纹、最终决策等）
+    :type entry: dict
+    :param ttl: 保留秒数
+    :type ttl: float
+    :return: 无
+    :rtype: None
+    '''
+    if _use_postgres():
+        shard = _shard_for(user_id)
+        _pg_init(shard)
+        try:
+            from psycopg2 import sql
+            from psycopg2.extras import Json
+        except ImportError as exc:
+            raise RuntimeError("psycopg2-binary is not installed") from exc
+        with _pg_conn(shard) as conn:
+            with conn:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        sql.SQL(
+                            """
+                            INSERT INTO {0}.precomputed_decision (user_id, entry, created_at, expires_at)
+                            VALUES (%s, %s, clock_timestamp(), clock_timestamp() + %s * INTERVAL '1 second')
+                            ON CONFLICT (user_id) DO UPDATE
+                            SET entry=EXCLUDED.entry, created_at=EXCLUDED.created_at, expires_at=EXCLUDED.expires_at
+                            """
+                        ).format(sql.Identifier(POSTGRES_SCHEMA)),
+                        (user_id, Json(entry), ttl),
+                    )
+                    cur.execute(
+                        sql.SQL("DELETE FROM {}.precomputed_decision WHERE expires_at <= clock_timestamp()").format(
+                            sql.Identifier(POSTGRES_SCHEMA)
+                        )
+                    )
+        return
+
+    now = time.time()
+    with _precompute_lock:
+        _precompute_store.pop(user_id, None)
+        _precompute_store[user_id] = {"entry": entry, "created_at": now, "expires_at": now + ttl}
+        while len(_precompute_store) > PRECOMPUTE_MAX_USERS:
+            _precompute_store.popitem(last=False)
+
+
+def get_precomputed_decision(user_id: str, consume: bool = False) -> Optional[dict]:
+    '''
+    功能：
+    读取用户未过期的预生成决策；consume=True 时同时删除（原子地取出，只会被一个请求使用）。
+
+    :param user_id: 用户唯一标识
+    :type user_id: str
+    :param consume: 是否取出后删除
+    :type consume: bool
+    :return: 预生成结果，不存在或已过期返回 None
+    :rtype: Optional[dict]
+    '''
+    if _use_postgres():
+        shard = _shard_for(user_id)
+        _pg_init(shard)
+        try:
+            from psycopg2 import sql
+        except ImportError as exc:
+            raise RuntimeError("psycopg2-binary is not installed") from exc
+        if consume:
+            query = """
+                DELETE FROM {}.precomputed_decision
+                WHERE user_id=%s AND expires_at > clock_timestamp()
+                RETURNING entry
+                """
+        else:
+            query = """
+                SELECT entry FROM {}.precomputed_decision
+                WHERE user_id=%s AND expires_at > clock_timestamp()
+                """
+        with _pg_conn(shard) as conn:
+            with conn:
+                with conn.cursor() as cur:
+                    cur.execute(sql.SQL(query).format(sql.Identifier(POSTGRES_SCHEMA)), (user_id,))
+                    row = cur.fetchone()
+        return row[0] if row else None
+
+    with _precompute_lock:
+        record = _precompute_alive_locked(user_id, time.time())
+        if record is None:
+            return None
+        if consume:
+            _precompute_store.pop(user_id, None)
+        return record["entry"]
+
+
+def memory_store_items() -> Dict[str, List[Tuple[Any, Any]]]:
+    '''
+    功能：
+    返回进程内各存储的 (键, 值) 浅拷贝列表（内存占用分析用）：memory 后端的状态、聊天历史，
+    以及决策记录、LLM 用量、幂等键、预生成决策与 Postgres 读缓存。只在持锁期间复制引用，测量在锁外进行；
+    值写入后只整体替换、不原地修改，测量期间的并发写入不影响结果的一致性。
+
+    :return: {存储名: [(键, 值)]}
+    :rtype: Dict[str, List[Tuple[Any, Any]]]
+    '''
+    with _store_lock:
+        items: Dict[str, List[Tuple[Any, Any]]] = {
+            "state": list(_store.items()),
+            "chat": list(_chat_store.items()),
+            "decision_record": list(_decision_store.items()),
+            "segment_stats": list(_segment_store.items()),
+        }
+    with _usage_lock:
+        items["llm_usage"] = list(_usage_store.items())
+    with _idempotency_lock:
+        items["idempotency"] = list(_idempotency_store.items())
+    with _precompute_lock:
+        items["precomputed"] = list(_precompute_store.items())
+    for name, cache in (("state_cache", _state_cache), ("chat_cache", _chat_cache)):
+        with cache._lock:
+            items[name] = [(key, value) for key, (_, value) in cache._data.items()]
+    return items
+
+
+def shm_slot_sizes() -> Iterator[Tuple[str, int, int]]:
+    '''
+    功能：
+    遍历 shm 后端已占用槽位的 (用户 ID, 状态字节数, 聊天字节数)。
+
+    :return: 迭代器
+    :rtype: Iterator[Tuple[str, int, int]]
+    '''
+    return _shm().iter_slot_sizes()
+
+
+def pg_footprint(top_n: int) -> Dict[str, Any]:
+    '''
+    功能：
+    统计各分片的表大小（含索引与 TOAST）、用户数、状态与聊天历史的存储字节数，以及占用最大的 top_n 个用户。
+
+    :param top_n: 返回的最大用户数
+    :type top_n: int
+    :return: {分片名: 统计}
+    :rtype: Dict[str, Any]
+    '''
+    try:
+        from psycopg2 import sql
+    except ImportError as exc:
+        raise RuntimeError("psycopg2-binary is not installed") from exc
+    tables = (
+        "user_state",
+        "chat_history",
+        "decision_record",
+        "llm_usage",
+        "idempotency_key",
+        "precomputed_decision",
+        "inflight_result",
+    )
+    schema = sql.Identifier(POSTGRES_SCHEMA)
+    result: Dict[str, Any] = {}
+    for shard in _all_shards():
+        _pg_init(shard)
+        with _pg_conn(shard) as conn:
+            with conn:
+                with conn.cursor() as cur:
+                    table_bytes = {}
+                    for table in tables:
+                        cur.execute(
+                            "SELECT pg_total_relation_size(%s::regclass)", (f"{POSTGRES_SCHEMA}.{table}",)
+                        )
+                        table_bytes[table] = cur.fetchone()[0]
+                    cur.execute(
+                        sql.SQL("SELECT COUNT(*), COALESCE(SUM(pg_column_size(state)), 0) FROM {}.user_state").format(
+                            schema
+                        )
+                    )
+                    users, state_bytes = cur.fetchone()
+                    cur.execute(
+                        sql.SQL(
+                            "SELECT COUNT(DISTINCT user_id), COALESCE(SUM(pg_column_size(content)), 0) FROM {}.chat_history"
+                        ).format(schema)
+                    )
+                    chat_users, chat_bytes = cur.fetchone()
+                    cur.execute(
+                        sql.SQL(
+                            """
+                            SELECT user_id, SUM(bytes) AS total FROM (
+                                SELECT user_id, pg_column_size(state) AS bytes FROM {0}.user_state
+                                UNION ALL
+                                SELECT user_id, pg_column_size(content) AS bytes FROM {0}.chat_history
+                            ) t
+                            GROUP BY user_id ORDER BY total DESC LIMIT %s
+                            """
+                        ).format(schema),
+                        (top_n,),
+                    )
+                    top = [{"user_id": row[0], "bytes": int(row[1])} for row in cur.fetchall()]
+        result[shard or "default"] = {
+            "tables": table_bytes,
+            "state": {"users": users, "bytes": int(state_bytes)},
+            "chat": {"users": chat_users, "bytes": int(chat_bytes)},
+            "top_users": top,
+        }
+    return result
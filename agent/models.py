@@ -14,6 +14,8 @@ class DecisionRequest(BaseModel):
     daily_slots: int = Field(..., ge=1, le=3)
     in_stock: bool
     notes: Optional[str] = None
+    slate: bool = False
+    progressive: bool = False
 
 
 class FeedbackRequest(BaseModel):
@@ -0,0 +1,318 @@
+﻿# -*- coding: utf-8 -*-
+"""
+大目录并行打分：候选目录按列（中位价、阶段、风险位、类目位、季节）一次性写入共享内存，
+常驻进程池各自挂载后按分片计算过滤与打分，只回传每个分片的 top-k，由主进程归并。
+分数与过滤规则和 score_candidate / hard_filters / timing_heuristic 完全一致（不含反馈加减分），
+同分按目录顺序排列，结果与 DecisionTable 的稳定排序相同。需要 numpy。
+
+只用于基准与离线批量排序（bench/scoring_bench.py），服务内的规则决策不经过这里：
+rule_decision / rule_slate 需要每个被过滤候选（写入回避池/暂缓池）与全部参与打分候选的反馈加减分，
+只回传 top-k 的分片结果无法提供，预计算决策表已覆盖线上目录规模。
+"""
+from __future__ import annotations
+
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from .decision_engine import parse_price_mid, season_now
+from .models import DecisionRequest
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - 仅在创建并行打分器时需要
+    np = None
+
+SEASONS = ("winter", "spring", "summer", "autumn")
+STAGES = ("explore", "converge")
+_RISK_RETURN = 1
+_RISK_HOMOGENEOUS = 2
+_MAX_CATEGORIES = 64
+# 排序键 (_SCORE_CEIL - 分数) << 32 | 目录下标：升序即分数降序、同分按目录顺序
+_SCORE_CEIL = 1 << 20
+# (列名, dtype)
+_COLUMNS = (("price_mid", "int64"), ("stage", "int8"), ("risk", "uint8"), ("season", "int8"), ("categories", "uint64"))
+
+# (类目位, 是否限定本类目, 请求中位价, 阶段编码, 是否有货, 名额, 当前季节编码)
+_ReqTuple = Tuple[int, bool, int, int, bool, int, int]
+
+# 工作进程只挂载共享内存并做 numpy 计算；spawn 会在子进程重新导入入口模块（启动预热与存储恢复），
+# 因此优先使用 fork
+_START_METHOD = "fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn"
+
+_worker_shm: Optional[shared_memory.SharedMemory] = None
+_worker_columns: Dict[str, Any] = {}
+
+
+def _require_numpy() -> None:
+    if np is None:
+        raise RuntimeError("numpy is not installed, parallel scoring is unavailable")
+
+
+def _layout(size: int) -> Tuple[Dict[str, Tuple[str, int]], int]:
+    offsets: Dict[str, Tuple[str, int]] = {}
+    offset = 0
+    for name, dtype in _COLUMNS:
+        offsets[name] = (dtype, offset)
+        offset += np.dtype(dtype).itemsize * size
+        offset = (offset + 7) // 8 * 8
+    return offsets, max(offset, 8)
+
+
+def _views(buf: Any, size: int, offsets: Dict[str, Tuple[str, int]]) -> Dict[str, Any]:
+    return {
+        name: np.ndarray((size,), dtype=dtype, buffer=buf, offset=offset)
+        for name, (dtype, offset) in offsets.items()
+    }
+
+
+def _attach(shm_name: str, size: int, offsets: Dict[str, Tuple[str, int]]) -> None:
+    '''
+    功能：
+    进程池初始化：挂载共享内存中的目录列（每个工作进程只执行一次）。
+
+    :param shm_name: 共享内存名称
+    :type shm_name: str
+    :param size: 候选数
+    :type size: int
+    :param offsets: 列布局 {列名: (dtype, 偏移)}
+    :type offsets: Dict[str, Tuple[str, int]]
+    :return: 无
+    :rtype: None
+    '''
+    global _worker_shm, _worker_columns
+    # 工作进程与主进程共用同一个 resource_tracker，共享内存由主进程 close() 时统一回收
+    _worker_shm = shared_memory.SharedMemory(name=shm_name)
+    _worker_columns = _views(_worker_shm.buf, size, offsets)
+
+
+def _top_keys(keys: Any, k: int) -> List[int]:
+    if keys.size > k:
+        keys = keys[np.argpartition(keys, k - 1)[:k]]
+    return np.sort(keys).tolist()
+
+
+def _score_shard(
+    columns: Dict[str, Any], lo: int, hi: int, reqs: Sequence[_ReqTuple], k: int
+) -> List[Tuple[int, int, List[int]]]:
+    '''
+    功能：
+    对目录分片 [lo, hi) 逐个请求计算过滤与分数。
+
+    :param columns: 目录列
+    :type columns: Dict[str, Any]
+    :param lo: 分片起始下标
+    :type lo: int
+    :param hi: 分片结束下标（不含）
+    :type hi: int
+    :param reqs: 请求元组列表
+    :type reqs: Sequence[_ReqTuple]
+    :param k: 每个请求返回的条数
+    :type k: int
+    :return: 每个请求一项 (范围内候选数, 通过过滤数, 排序键列表)；
+             通过过滤数为 0 时排序键取自范围内全部候选（兜底），否则只含通过过滤的候选
+    :rtype: List[Tuple[int, int, List[int]]]
+    '''
+    price = columns["price_mid"][lo:hi]
+    stage = columns["stage"][lo:hi]
+    risk = columns["risk"][lo:hi]
+    season = columns["season"][lo:hi]
+    categories = columns["categories"][lo:hi]
+    index = np.arange(lo, hi, dtype=np.int64)
+
+    results: List[Tuple[int, int, List[int]]] = []
+    for cat_bit, category_scope, price_req, stage_req, in_stock, slots, season_req in reqs:
+        in_category = (categories & np.uint64(cat_bit)) != 0
+
+        score = np.minimum(np.abs(price - price_req) // 10, 10)
+        score = 50 - score
+        score += np.where(stage == stage_req, 10, -5)
+        score -= np.where(risk & _RISK_RETURN, 5, 0)
+        score -= np.where(risk & _RISK_HOMOGENEOUS, 3, 0)
+        score += np.where(in_category, 15, 0)
+        score += (5 if in_stock else 0) - (3 if slots == 1 else 0)
+
+        if not in_stock and slots <= 1:
+            passed = np.zeros(hi - lo, dtype=bool)
+        else:
+            passed = season == season_req
+            if stage_req == 0:
+                passed &= (risk & (_RISK_RETURN | _RISK_HOMOGENEOUS)) == 0
+
+        scope = in_category if category_scope else np.ones(hi - lo, dtype=bool)
+        selected = scope & passed
+        n_scope = int(np.count_nonzero(scope))
+        n_passed = int(np.count_nonzero(selected))
+        if not n_passed:
+            selected = scope
+        keys = ((_SCORE_CEIL - score[selected]).astype(np.int64) << 32) | index[selected]
+        results.append((n_scope, n_passed, _top_keys(keys, k)))
+    return results
+
+
+def _score_worker(lo: int, hi: int, reqs: Sequence[_ReqTuple], k: int) -> List[Tuple[int, int, List[int]]]:
+    return _score_shard(_worker_columns, lo, hi, reqs, k)
+
+
+class ParallelScorer:
+    '''
+    功能：
+    共享内存目录 + 常驻进程池的并行打分器；workers 为 0 时在当前进程内按同样的列式算法计算。
+    '''
+
+    def __init__(self, candidates: List[Dict[str, Any]], workers: int = 0, shards: int = 0) -> None:
+        _require_numpy()
+        self.candidates = list(candidates)
+        self.size = len(self.candidates)
+        self.workers = max(0, workers)
+        self.shards = max(1, shards or self.workers or 1)
+        self._lock = threading.Lock()
+        self._counts = {"requests": 0, "batches": 0, "elapsed_ms": 0.0}
+
+        vocab = sorted({cat for c in self.candidates for cat in c["categories"]})
+        if len(vocab) > _MAX_CATEGORIES:
+            raise RuntimeError(f"parallel scoring supports at most {_MAX_CATEGORIES} categories, got {len(vocab)}")
+        self._category_bits = {cat: 1 << i for i, cat in enumerate(vocab)}
+
+        self._offsets, nbytes = _layout(self.size)
+        self._shm = shared_memory.SharedMemory(create=True, size=nbytes)
+        self._columns = _views(self._shm.buf, self.size, self._offsets)
+        self._fill()
+
+        self._executor: Optional[ProcessPoolExecutor] = None
+        if self.workers:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context(_START_METHOD),
+                initializer=_attach,
+                initargs=(self._shm.name, self.size, self._offsets),
+            )
+        step = -(-self.size // self.shards) if self.size else 0
+        self._bounds = [(lo, min(lo + step, self.size)) for lo in range(0, self.size, step)] if step else []
+
+    def _fill(self) -> None:
+        season_code = {s: i for i, s in enumerate(SEASONS)}
+        stage_code = {s: i for i, s in enumerate(STAGES)}
+        cols = self._columns
+        for i, c in enumerate(self.candidates):
+            tags = c["risk_tags"]
+            cols["price_mid"][i] = c["price_mid"]
+            cols["stage"][i] = stage_code.get(c["stage_fit"], len(STAGES))
+            cols["risk"][i] = (_RISK_RETURN if "return_risk" in tags else 0) | (
+                _RISK_HOMOGENEOUS if "homogeneous" in tags else 0
+            )
+            cols["season"][i] = season_code.get(c["season"], len(SEASONS))
+            mask = 0
+            for cat in c["categories"]:
+                mask |= self._category_bits[cat]
+            cols["categories"][i] = mask
+
+    def _encode(self, req: DecisionRequest, scope: str, season: str) -> _ReqTuple:
+        cat_bit = self._category_bits.get(req.category, 0)
+        return (
+            cat_bit,
+            # 本类目没有候选时与 DecisionTable 一致，退回全部候选
+            scope == "category" and cat_bit != 0,
+            parse_price_mid(req.price_band),
+            STAGES.index(req.account_stage) if req.account_stage in STAGES else -1,
+            bool(req.in_stock),
+            req.daily_slots,
+            SEASONS.index(season),
+        )
+
+    def _merge(self, parts: List[Tuple[int, int, List[int]]], k: int) -> Tuple[List[Tuple[int, Dict[str, Any]]], bool]:
+        fallback = not any(n_passed for _, n_passed, _ in parts)
+        keys: List[int] = []
+        for _, n_passed, part_keys in parts:
+            if fallback or n_passed:
+                keys.extend(part_keys)
+        keys.sort()
+        ranked = [(_SCORE_CEIL - (key >> 32), self.candidates[key & 0xFFFFFFFF]) for key in keys[:k]]
+        return ranked, fallback
+
+    def rank_many(
+        self, reqs: Sequence[DecisionRequest], k: int = 10, scope: str = "category"
+    ) -> List[Tuple[List[Tuple[int, Dict[str, Any]]], bool]]:
+        '''
+        功能：
+        批量打分：每个分片一次处理整批请求，摊薄进程间通信开销。
+
+        :param reqs: 请求列表
+        :type reqs: Sequence[DecisionRequest]
+        :param k: 每个请求返回的条数
+        :type k: int
+        :param scope: category（本类目候选）或 all（全部候选）
+        :type scope: str
+        :return: 每个请求一项 (按分数降序的 [(分数, 候选)]，是否全部被过滤而兜底)
+        :rtype: List[Tuple[List[Tuple[int, Dict[str, Any]]], bool]]
+        '''
+        if not reqs or not self._bounds or k <= 0:
+            return [([], True) for _ in reqs]
+        started = time.perf_counter()
+        season = season_now()
+        encoded = [self._encode(req, scope, season) for req in reqs]
+        if self._executor is None:
+            shard_results = [_score_shard(self._columns, lo, hi, encoded, k) for lo, hi in self._bounds]
+        else:
+            futures = [self._executor.submit(_score_worker, lo, hi, encoded, k) for lo, hi in self._bounds]
+            shard_results = [f.result() for f in futures]
+        merged = [self._merge([shard[i] for shard in shard_results], k) for i in range(len(reqs))]
+        with self._lock:
+            self._counts["requests"] += len(reqs)
+            self._counts["batches"] += 1
+            self._counts["elapsed_ms"] += (time.perf_counter() - started) * 1000
+        return merged
+
+    def rank(
+        self, req: DecisionRequest, k: int = 10, scope: str = "category"
+    ) -> Tuple[List[Tuple[int, Dict[str, Any]]], bool]:
+        '''
+        功能：
+        单个请求打分，返回前 k 个候选。
+
+        :param req: 用户请求参数
+        :type req: DecisionRequest
+        :param k: 返回条数
+        :type k: int
+        :param scope: category（本类目候选）或 all（全部候选）
+        :type scope: str
+        :return: (按分数降序的 [(分数, 候选)]，是否全部被过滤而兜底)
+        :rtype: Tuple[List[Tuple[int, Dict[str, Any]]], bool]
+        '''
+        return self.rank_many([req], k, scope)[0]
+
+    def snapshot(self) -> Dict[str, Any]:
+        '''
+        功能：
+        返回并行打分指标。
+
+        :return: 指标字典
+        :rtype: Dict[str, Any]
+        '''
+        with self._lock:
+            counts = dict(self._counts)
+        counts["elapsed_ms"] = round(counts["elapsed_ms"], 1)
+        return dict(counts, candidates=self.size, workers=self.workers, shards=len(self._bounds))
+
+    def close(self) -> None:
+        '''
+        功能：
+        关闭进程池并释放共享内存。
+
+        :return: 无
+        :rtype: None
+        '''
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+        if self._shm is not None:
+            self._columns = {}
+            self._shm.close()
+            try:
+                self._shm.unlink()
+            except FileNotFoundError:
+                pass
+            self._shm = None
@@ -0,0 +1,601 @@
+﻿# -*- coding: utf-8 -*-
+"""
+memory 后端的可选持久化：追加日志（AOF）+ 定期二进制快照。
+
+- 每次 set_state / append_chat_history / 决策记录 / 类目×价位档统计写入追加一条记录到 appendonly.<gen>.aof，
+  fsync 策略 always（每条）/ everysec（后台每秒）/ no（交给操作系统）。
+- 快照时先切换到新一代日志，再把当时的内存数据写入 snapshot.bin（写临时文件后原子替换），
+  成功后删除旧一代日志。
+- 启动恢复：mmap 读取快照（值保留为原始字节，首次访问时才解码），再按代次 mmap 回放日志尾部；
+  日志末尾的半条记录（崩溃时未写完）会被截断。
+
+快照格式（小端）：
+    header  "DYSN" u16 版本 u64 代次 u64 条目数
+    entry   u8 类型(1 状态/2 聊天/3 决策记录/4 类目×价位档统计) u32 key 长度 u32 值长度 key 值(JSON)
+    footer  "DYSE" u32 所有 entry 字节的 CRC32
+日志记录：u32 值长度 u32 CRC32(key+值) u8 类型 u16 key 长度 key 值(JSON)
+"""
+from __future__ import annotations
+
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger("agent")
+
+KIND_STATE = 1
+KIND_CHAT = 2
+KIND_DECISION = 3
+KIND_SEGMENT = 4
+
+_SNAP_MAGIC = b"DYSN"
+_SNAP_FOOTER = b"DYSE"
+_SNAP_VERSION = 1
+_SNAP_HEADER = struct.Struct("<4sHQQ")
+_SNAP_ENTRY = struct.Struct("<BII")
+_SNAP_TAIL = struct.Struct("<4sI")
+_AOF_RECORD = struct.Struct("<IIBH")
+
+SNAPSHOT_NAME = "snapshot.bin"
+FSYNC_POLICIES = ("always", "everysec", "no")
+
+# 返回 (日志代次, 状态, 聊天[, 决策记录[, 类目×价位档统计]])
+SnapshotSource = Callable[[], Tuple[Any, ...]]
+
+
+def encode_value(value: Any) -> bytes:
+    '''
+    功能：
+    将状态/聊天记录编码为紧凑 JSON 字节；尚未解码的原始字节直接返回。
+
+    :param value: 状态字典、聊天列表或原始字节
+    :type value: Any
+    :return: JSON 字节
+    :rtype: bytes
+    '''
+    if isinstance(value, bytes):
+        return value
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def decode_value(value: Any) -> Any:
+    '''
+    功能：
+    解码快照/日志中保留的原始字节，已解码的值原样返回。
+
+    :param value: 原始字节或已解码的值
+    :type value: Any
+    :return: 解码后的值
+    :rtype: Any
+    '''
+    if isinstance(value, bytes):
+        return json.loads(value)
+    return value
+
+
+def _aof_name(generation: int) -> str:
+    return f"appendonly.{generation:08d}.aof"
+
+
+def _fsync_dir(path: str) -> None:
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def write_snapshot(
+    path: str,
+    generation: int,
+    states: Dict[str, Any],
+    chats: Dict[str, Any],
+    decisions: Optional[Dict[str, Any]] = None,
+    segments: Optional[Dict[str, Any]] = None,
+) -> int:
+    '''
+    功能：
+    将状态、聊天记录、决策记录与类目×价位档统计写入二进制快照（临时文件 + fsync + 原子替换）。
+
+    :param path: 快照文件路径
+    :type path: str
+    :param generation: 快照之后生效的日志代次
+    :type generation: int
+    :param states: 用户状态（值为字典或原始字节）
+    :type states: Dict[str, Any]
+    :param chats: 聊天记录（值为列表或原始字节）
+    :type chats: Dict[str, Any]
+    :param decisions: 决策记录（值为字典或原始字节）
+    :type decisions: Optional[Dict[str, Any]]
+    :param segments: 类目×价位档统计（值为列表或原始字节）
+    :type segments: Optional[Dict[str, Any]]
+    :return: 快照字节数
+    :rtype: int
+    '''
+    tmp_path = f"{path}.tmp"
+    crc = 0
+    count = 0
+    with open(tmp_path, "wb") as f:
+        f.write(_SNAP_HEADER.pack(_SNAP_MAGIC, _SNAP_VERSION, generation, 0))
+        for kind, items in (
+            (KIND_STATE, states),
+            (KIND_CHAT, chats),
+            (KIND_DECISION, decisions or {}),
+            (KIND_SEGMENT, segments or {}),
+        ):
+            for key, value in items.items():
+                key_bytes = key.encode("utf-8")
+                value_bytes = encode_value(value)
+                chunk = _SNAP_ENTRY.pack(kind, len(key_bytes), len(value_bytes)) + key_bytes + value_bytes
+                crc = zlib.crc32(chunk, crc)
+                f.write(chunk)
+                count += 1
+        f.write(_SNAP_TAIL.pack(_SNAP_FOOTER, crc))
+        size = f.tell()
+        f.seek(0)
+        f.write(_SNAP_HEADER.pack(_SNAP_MAGIC, _SNAP_VERSION, generation, count))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    _fsync_dir(os.path.dirname(path) or ".")
+    return size
+
+
+def load_snapshot(
+    path: str,
+    states: Dict[str, Any],
+    chats: Dict[str, Any],
+    decisions: Optional[Dict[str, Any]] = None,
+    segments: Optional[Dict[str, Any]] = None,
+) -> Tuple[int, int]:
+    '''
+    功能：
+    通过 mmap 读取快照，值以原始字节存入 states/chats/decisions/segments（延迟解码）。
+
+    :param path: 快照文件路径
+    :type path: str
+    :param states: 用户状态字典（原地写入）
+    :type states: Dict[str, Any]
+    :param chats: 聊天记录字典（原地写入）
+    :type chats: Dict[str, Any]
+    :param decisions: 决策记录字典（原地写入，None 时跳过决策记录）
+    :type decisions: Optional[Dict[str, Any]]
+    :param segments: 类目×价位档统计字典（原地写入，None 时跳过）
+    :type segments: Optional[Dict[str, Any]]
+    :return: (快照对应的日志代次, 条目数)，无快照时返回 (0, 0)
+    :rtype: Tuple[int, int]
+    '''
+    if not os.path.exists(path) or os.path.getsize(path) < _SNAP_HEADER.size + _SNAP_TAIL.size:
+        return 0, 0
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            magic, version, generation, count = _SNAP_HEADER.unpack_from(mm, 0)
+            if magic != _SNAP_MAGIC or version != _SNAP_VERSION:
+                raise RuntimeError(f"invalid snapshot file: {path}")
+            body_end = len(mm) - _SNAP_TAIL.size
+            footer, expected_crc = _SNAP_TAIL.unpack_from(mm, body_end)
+            if footer != _SNAP_FOOTER or zlib.crc32(mm[_SNAP_HEADER.size:body_end]) != expected_crc:
+                raise RuntimeError(f"snapshot checksum mismatch: {path}")
+
+            targets = {
+                KIND_STATE: states,
+                KIND_CHAT: chats,
+                KIND_DECISION: decisions,
+                KIND_SEGMENT: segments,
+            }
+            unpack_entry = _SNAP_ENTRY.unpack_from
+            entry_size = _SNAP_ENTRY.size
+            offset = _SNAP_HEADER.size
+            for _ in range(count):
+                kind, key_len, value_len = unpack_entry(mm, offset)
+                offset += entry_size
+                key = mm[offset:offset + key_len].decode("utf-8")
+                offset += key_len
+                value = mm[offset:offset + value_len]
+                offset += value_len
+                target = targets.get(kind)
+                if target is not None:
+                    target[key] = value
+    return generation, count
+
+
+class MemoryPersistence:
+    '''
+    功能：
+    memory 后端的追加日志与快照管理。记录在加锁前编码；write 在日志锁内执行内存更新并追加记录，
+    由日志锁保证日志顺序与内存一致，存储锁只在内存更新时短暂持有，fsync 不占用存储锁。
+    '''
+
+    def __init__(self, directory: str, fsync: str = "everysec") -> None:
+        if fsync not in FSYNC_POLICIES:
+            raise RuntimeError(f"MEMORY_FSYNC must be one of {FSYNC_POLICIES}, got {fsync!r}")
+        self.directory = directory
+        self.fsync = fsync
+        self.snapshot_path = os.path.join(directory, SNAPSHOT_NAME)
+        self.generation = 0
+        self._lock = threading.Lock()
+        self._file = None
+        self._dirty = False
+        self._ops_since_snapshot = 0
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._snapshotting = threading.Lock()
+        self.last_recovery: Dict[str, Any] = {}
+        self.last_snapshot: Dict[str, Any] = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def _aof_generations(self) -> List[int]:
+        generations = []
+        for name in os.listdir(self.directory):
+            if name.startswith("appendonly.") and name.endswith(".aof"):
+                try:
+                    generations.append(int(name[len("appendonly."):-len(".aof")]))
+                except ValueError:
+                    continue
+        return sorted(generations)
+
+    def _open_generation(self, generation: int) -> None:
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+        self.generation = generation
+        self._file = open(os.path.join(self.directory, _aof_name(generation)), "ab")
+        _fsync_dir(self.directory)
+
+    def _replay_aof(
+        self,
+        path: str,
+        states: Dict[str, Any],
+        chats: Dict[str, Any],
+        chat_max: int,
+        truncate: bool,
+        decisions: Optional[Dict[str, Any]] = None,
+        segments: Optional[Dict[str, Any]] = None,
+    ) -> int:
+        applied = 0
+        size = os.path.getsize(path)
+        if size == 0:
+            return 0
+        offset = 0
+        header_size = _AOF_RECORD.size
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            while offset + header_size <= size:
+                value_len, crc, kind, key_len = _AOF_RECORD.unpack_from(data, offset)
+                start = offset + header_size
+                end = start + key_len + value_len
+                if end > size:
+                    break
+                payload = data[start:end]
+                if zlib.crc32(payload) != crc:
+                    break
+                key = payload[:key_len].decode("utf-8")
+                value = payload[key_len:]
+                if kind == KIND_STATE:
+                    states[key] = value
+                elif kind == KIND_CHAT:
+                    history = decode_value(chats.get(key)) or []
+                    history = history + [json.loads(value)]
+                    chats[key] = history[-chat_max:]
+                elif kind == KIND_DECISION and decisions is not None:
+                    decisions[key] = value
+                elif kind == KIND_SEGMENT and segments is not None:
+                    segments[key] = value
+                applied += 1
+                offset = end
+        if offset < size:
+            logger.warning(
+                "aof tail discarded path=%s offset=%d bytes=%d", path, offset, size - offset
+            )
+            if truncate:
+                with open(path, "r+b") as f:
+                    f.truncate(offset)
+        return applied
+
+    def recover(
+        self,
+        states: Dict[str, Any],
+        chats: Dict[str, Any],
+        chat_max: int,
+        decisions: Optional[Dict[str, Any]] = None,
+        segments: Optional[Dict[str, Any]] = None,
+    ) -> Dict[str, Any]:
+        '''
+        功能：
+        启动恢复：加载快照并回放其后的日志，然后打开新一代日志继续追加。
+
+        :param states: 用户状态字典（原地写入）
+        :type states: Dict[str, Any]
+        :param chats: 聊天记录字典（原地写入）
+        :type chats: Dict[str, Any]
+        :param chat_max: 每个用户保留的聊天条数
+        :type chat_max: int
+        :param decisions: 决策记录字典（原地写入）
+        :type decisions: Optional[Dict[str, Any]]
+        :param segments: 类目×价位档统计字典（原地写入）
+        :type segments: Optional[Dict[str, Any]]
+        :return: 恢复统计
+        :rtype: Dict[str, Any]
+        '''
+        started = time.perf_counter()
+        snap_generation, snap_entries = load_snapshot(
+            self.snapshot_path, states, chats, decisions, segments
+        )
+        snapshot_sec = time.perf_counter() - started
+
+        generations = self._aof_generations()
+        replay_generations = [g for g in generations if g >= snap_generation]
+        records = 0
+        for g in replay_generations:
+            records += self._replay_aof(
+                os.path.join(self.directory, _aof_name(g)),
+                states,
+                chats,
+                chat_max,
+                truncate=(g == replay_generations[-1]),
+                decisions=decisions,
+                segments=segments,
+            )
+        for g in generations:
+            if g < snap_generation:
+                os.remove(os.path.join(self.directory, _aof_name(g)))
+
+        # 回放过的日志保留到下一次快照，新写入追加到新一代
+        next_generation = max([snap_generation] + generations) + 1
+        self._open_generation(next_generation)
+        self.last_recovery = {
+            "snapshot_generation": snap_generation,
+            "snapshot_entries": snap_entries,
+            "snapshot_sec": round(snapshot_sec, 4),
+            "aof_generations": replay_generations,
+            "aof_records": records,
+            "total_sec": round(time.perf_counter() - started, 4),
+        }
+        logger.info("memory store recovered %s", self.last_recovery)
+        return self.last_recovery
+
+    @staticmethod
+    def _pack(kind: int, key: str, value: bytes) -> bytes:
+        key_bytes = key.encode("utf-8")
+        payload = key_bytes + value
+        return _AOF_RECORD.pack(len(value), zlib.crc32(payload), kind, len(key_bytes)) + payload
+
+    def _write_locked(self, record: bytes) -> None:
+        self._file.write(record)
+        self._file.flush()
+        if self.fsync == "always":
+            os.fsync(self._file.fileno())
+        else:
+            self._dirty = True
+        self._ops_since_snapshot += 1
+
+    def _append(self, kind: int, key: str, value: bytes) -> None:
+        record = self._pack(kind, key, value)
+        with self._lock:
+            self._write_locked(record)
+
+    def write(self, kind: int, key: str, apply: Callable[[], Any], value: Any = None) -> Any:
+        '''
+        功能：
+        在日志锁内执行内存更新 apply 并追加对应记录，日志顺序与内存更新顺序一致。
+        value 不为 None 时在加锁前编码；否则记录 apply 的返回值（返回 None 表示未写入，不追加记录）。
+
+        :param kind: 记录类型（KIND_*）
+        :type kind: int
+        :param key: 记录键
+        :type key: str
+        :param apply: 内存更新函数（内部自行持有存储锁）
+        :type apply: Callable[[], Any]
+        :param value: 预先确定的记录值
+        :type value: Any
+        :return: apply 的返回值
+        :rtype: Any
+        '''
+        record = None if value is None else self._pack(kind, key, encode_value(value))
+        with self._lock:
+            result = apply()
+            if record is None:
+                if result is None:
+                    return None
+                record = self._pack(kind, key, encode_value(result))
+            self._write_locked(record)
+        return result
+
+    def log_state(self, user_id: str, state: Dict[str, Any]) -> None:
+        '''
+        功能：
+        追加一条状态写入记录。
+
+        :param user_id: 用户唯一标识
+        :type user_id: str
+        :param state: 用户状态
+        :type state: Dict[str, Any]
+        :return: 无
+        :rtype: None
+        '''
+        self._append(KIND_STATE, user_id, encode_value(state))
+
+    def log_chat(self, user_id: str, item: Dict[str, Any]) -> None:
+        '''
+        功能：
+        追加一条聊天记录。
+
+        :param user_id: 用户唯一标识
+        :type user_id: str
+        :param item: 聊天条目（role/content/ts）
+        :type item: Dict[str, Any]
+        :return: 无
+        :rtype: None
+        '''
+        self._append(KIND_CHAT, user_id, encode_value(item))
+
+    def log_decision(self, decision_id: str, record: Dict[str, Any]) -> None:
+        '''
+        功能：
+        追加一条决策记录写入（新建或回填结果时整条重写）。
+
+        :param decision_id: 决策 ID
+        :type decision_id: str
+        :param record: 决策记录
+        :type record: Dict[str, Any]
+        :return: 无
+        :rtype: None
+        '''
+        self._append(KIND_DECISION, decision_id, encode_value(record))
+
+    def log_segment(self, key: str, counters: List[float]) -> None:
+        '''
+        功能：
+        追加一条类目×价位档统计写入（整条重写）。
+
+        :param key: 统计键
+        :type key: str
+        :param counters: [成功, 失败, 时间戳]
+        :type counters: List[float]
+        :return: 无
+        :rtype: None
+        '''
+        self._append(KIND_SEGMENT, key, encode_value(counters))
+
+    def rotate(self, copy: Optional[Callable[[], Any]] = None) -> Tuple[int, Any]:
+        '''
+        功能：
+        切换到新一代日志，并在日志锁内执行 copy 拷贝数据：write 在同一把锁内更新内存，
+        拷贝与日志切换点因此一致。
+
+        :param copy: 数据拷贝函数（内部自行持有存储锁）
+        :type copy: Optional[Callable[[], Any]]
+        :return: (新的日志代次, copy 的返回值)
+        :rtype: Tuple[int, Any]
+        '''
+        with self._lock:
+            self._open_generation(self.generation + 1)
+            self._ops_since_snapshot = 0
+            self._dirty = False
+            return self.generation, (copy() if copy is not None else None)
+
+    def snapshot(self, source: SnapshotSource) -> Dict[str, Any]:
+        '''
+        功能：
+        生成一次快照：source 切换日志并返回数据浅拷贝（见 rotate），之后在锁外编码写盘。
+
+        :param source: 返回 (新日志代次, 状态拷贝, 聊天拷贝[, 决策记录拷贝[, 统计拷贝]]) 的函数
+        :type source: SnapshotSource
+        :return: 快照统计
+        :rtype: Dict[str, Any]
+        '''
+        with self._snapshotting:
+            started = time.perf_counter()
+            generation, states, chats, *rest = source()
+            decisions = rest[0] if rest else {}
+            segments = rest[1] if len(rest) > 1 else {}
+            size = write_snapshot(self.snapshot_path, generation, states, chats, decisions, segments)
+            for g in self._aof_generations():
+                if g < generation:
+                    os.remove(os.path.join(self.directory, _aof_name(g)))
+            self.last_snapshot = {
+                "generation": generation,
+                "users": len(states),
+                "chats": len(chats),
+                "decisions": len(decisions),
+                "bytes": size,
+                "sec": round(time.perf_counter() - started, 4),
+            }
+            logger.info("memory store snapshot %s", self.last_snapshot)
+            return self.last_snapshot
+
+    def start(self, source: SnapshotSource, interval: float, min_ops: int) -> None:
+        '''
+        功能：
+        启动后台线程：everysec 策略下每秒 fsync；每 interval 秒在写入数达到 min_ops 时生成快照。
+
+        :param source: 快照数据来源
+        :type source: SnapshotSource
+        :param interval: 快照检查间隔（秒），<=0 关闭定期快照
+        :type interval: float
+        :param min_ops: 触发快照的最少写入数
+        :type min_ops: int
+        :return: 无
+        :rtype: None
+        '''
+        if self.fsync == "everysec":
+            self._spawn("memory-aof-fsync", self._fsync_loop)
+        if interval > 0:
+            self._spawn("memory-snapshot", lambda: self._snapshot_loop(source, interval, min_ops))
+
+    def _spawn(self, name: str, target: Callable[[], None]) -> None:
+        thread = threading.Thread(target=target, name=name, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def _fsync_loop(self) -> None:
+        while not self._stop.wait(1.0):
+            self.sync()
+
+    def _snapshot_loop(self, source: SnapshotSource, interval: float, min_ops: int) -> None:
+        while not self._stop.wait(interval):
+            if self._ops_since_snapshot < max(min_ops, 1):
+                continue
+            try:
+                self.snapshot(source)
+            except Exception:
+                logger.exception("memory store snapshot failed")
+
+    def sync(self) -> None:
+        '''
+        功能：
+        将已写入的日志 fsync 到磁盘。
+
+        :return: 无
+        :rtype: None
+        '''
+        with self._lock:
+            if self._dirty and self._file is not None:
+                os.fsync(self._file.fileno())
+                self._dirty = False
+
+    def stats(self) -> Dict[str, Any]:
+        '''
+        功能：
+        返回持久化状态（当前日志代次、待快照写入数、最近恢复与快照信息）。
+
+        :return: 统计字典
+        :rtype: Dict[str, Any]
+        '''
+        return {
+            "directory": self.directory,
+            "fsync": self.fsync,
+            "generation": self.generation,
+            "ops_since_snapshot": self._ops_since_snapshot,
+            "last_recovery": self.last_recovery,
+            "last_snapshot": self.last_snapshot,
+        }
+
+    def close(self) -> None:
+        '''
+        功能：
+        停止后台线程并关闭日志文件。
+
+        :return: 无
+        :rtype: None
+        '''
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout=2.0)
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._file.close()
+                self._file = None
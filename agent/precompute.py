@@ -0,0 +1,454 @@
+﻿# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import copy
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from .admission import AdmissionRejected
+from .config import (
+    PRECOMPUTE_ACTIVE_DAYS,
+    PRECOMPUTE_CHECK_INTERVAL,
+    PRECOMPUTE_ENABLED,
+    PRECOMPUTE_TTL,
+    PRECOMPUTE_WINDOW,
+    PRECOMPUTE_WORKERS,
+)
+from .decision_engine import rule_decision
+from .llm_agent import run_langchain_agent
+from .memory_store import (
+    get_precomputed_decision,
+    iter_states,
+    leader_lock,
+    put_precomputed_decision,
+    shm_workers,
+)
+from .models import DecisionRequest
+from .state import clone_state, utc_now, utc_now_dt
+
+logger = logging.getLogger("agent")
+
+# 草案中每次决策都不同的字段，比较草案是否一致时忽略
+_VOLATILE_KEYS = ("decision_id",)
+
+
+def _digest(payload: Any) -> str:
+    return hashlib.sha1(
+        json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str).encode("utf-8")
+    ).hexdigest()
+
+
+def _strip_volatile(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {k: _strip_volatile(v) for k, v in value.items() if k not in _VOLATILE_KEYS}
+    if isinstance(value, list):
+        return [_strip_volatile(v) for v in value]
+    return value
+
+
+def params_fingerprint(req: DecisionRequest) -> str:
+    '''
+    功能：
+    决策请求参数的指纹（不含 user_id 与 progressive，字符串去除首尾空白）。
+
+    :param req: 决策请求
+    :type req: DecisionRequest
+    :return: 指纹
+    :rtype: str
+    '''
+    params = req.model_dump(exclude={"user_id", "progressive"})
+    return _digest({k: (v.strip() if isinstance(v, str) else v) for k, v in params.items() if v is not None})
+
+
+def state_version(state: Dict[str, Any]) -> str:
+    '''
+    功能：
+    用户状态的版本（规范化 JSON 的摘要）：决策、反馈或任何状态写入都会改变版本。
+
+    :param state: 用户状态
+    :type state: Dict[str, Any]
+    :return: 版本摘要
+    :rtype: str
+    '''
+    return _digest(state)
+
+
+def draft_fingerprint(draft: Dict[str, Any]) -> str:
+    '''
+    功能：
+    规则草案的指纹（忽略 decision_id）：草案一致时 LLM 的润色结果可以复用。
+
+    :param draft: 规则草案
+    :type draft: Dict[str, Any]
+    :return: 指纹
+    :rtype: str
+    '''
+    return _digest(_strip_volatile(draft))
+
+
+def parse_window(spec: str) -> Tuple[int, int]:
+    '''
+    功能：
+    解析低峰时段 "HH:MM-HH:MM"（UTC，结束早于开始表示跨零点）。
+
+    :param spec: 时段配置
+    :type spec: str
+    :return: (开始分钟, 结束分钟)
+    :rtype: Tuple[int, int]
+    '''
+    try:
+        start, end = (part.strip() for part in spec.split("-", 1))
+        minutes = []
+        for part in (start, end):
+            hour, minute = (int(x) for x in part.split(":", 1))
+            if not (0 <= hour < 24 and 0 <= minute < 60):
+                raise ValueError(part)
+            minutes.append(hour * 60 + minute)
+    except ValueError as exc:
+        raise RuntimeError(f"invalid PRECOMPUTE_WINDOW: {spec}") from exc
+    return minutes[0], minutes[1]
+
+
+def window_day(now: datetime, window: Tuple[int, int]) -> Optional[str]:
+    '''
+    功能：
+    当前时间所在的低峰时段（以开始日期标识，跨零点的时段后半段仍归属前一天），不在时段内返回 None。
+
+    :param now: 当前 UTC 时间
+    :type now: datetime
+    :param window: (开始分钟, 结束分钟)
+    :type window: Tuple[int, int]
+    :return: 时段开始日期（YYYY-MM-DD）
+    :rtype: Optional[str]
+    '''
+    start, end = window
+    minute = now.hour * 60 + now.minute
+    if start <= end:
+        return now.date().isoformat() if start <= minute < end else None
+    if minute >= start:
+        return now.date().isoformat()
+    if minute < end:
+        return (now.date() - timedelta(days=1)).isoformat()
+    return None
+
+
+def _is_active(state: Dict[str, Any], cutoff: datetime) -> bool:
+    last_reco = state.get("last_reco") or {}
+    if not state.get("last_request") or not last_reco.get("ts"):
+        return False
+    try:
+        return datetime.fromisoformat(last_reco["ts"]) >= cutoff
+    except (TypeError, ValueError):
+        return False
+
+
+def precompute_user(state: Dict[str, Any]) -> str:
+    '''
+    功能：
+    按用户上次的请求参数预生成一次决策（规则草案 + LLM 润色），不写入用户状态；
+    已有参数与状态版本一致的预生成结果时跳过。
+
+    :param state: 用户状态
+    :type state: Dict[str, Any]
+    :return: 结果（generated/fresh/no_request/invalid_request/rejected/fallback）
+    :rtype: str
+    '''
+    user_id = state["user_id"]
+    try:
+        req = DecisionRequest(user_id=user_id, **(state.get("last_request") or {}))
+    except Exception:
+        return "invalid_request" if state.get("last_request") else "no_request"
+    fingerprint = params_fingerprint(req)
+    version = state_version(state)
+    existing = get_precomputed_decision(user_id)
+    if existing and existing.get("params") == fingerprint and existing.get("state_version") == version:
+        return "fresh"
+
+    # rule_decision 会原地更新状态，在副本上生成草案
+    draft, _, _ = rule_decision(req, clone_state(state))
+    try:
+        output, agent_flags = run_langchain_agent(draft, user_id=user_id, usage_route="precompute")
+    except AdmissionRejected:
+        return "rejected"
+    if "agent:ok" not in agent_flags:
+        # 润色失败时早高峰重新生成，不保存回退的草案
+        return "fallback"
+    put_precomputed_decision(
+        user_id,
+        {
+            "params": fingerprint,
+            "state_version": version,
+            "draft": draft_fingerprint(draft),
+            "output": output,
+            "agent_flags": agent_flags,
+            "created_at": utc_now(),
+        },
+        PRECOMPUTE_TTL,
+    )
+    return "generated"
+
+
+def take_precomputed(req: DecisionRequest, state: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    '''
+    功能：
+    取出（并删除）用户的预生成决策，请求参数或状态版本与预生成时不一致返回 None。
+    本次请求之后状态必然变化，预生成结果无论是否可用都只取一次。
+
+    :param req: 决策请求
+    :type req: DecisionRequest
+    :param state: 当前用户状态（生成草案前）
+    :type state: Dict[str, Any]
+    :return: 预生成结果
+    :rtype: Optional[Dict[str, Any]]
+    '''
+    entry = get_precomputed_decision(req.user_id, consume=True)
+    if entry is None:
+        scheduler.count("miss:none")
+        return None
+    if entry.get("params") != params_fingerprint(req):
+        scheduler.count("miss:params")
+        return None
+    if entry.get("state_version") != state_version(state):
+        scheduler.count("miss:state")
+        return None
+    return entry
+
+
+def reuse_precomputed(entry: Dict[str, Any], draft: Dict[str, Any]) -> Optional[Tuple[Dict[str, Any], List[str]]]:
+    '''
+    功能：
+    本次草案与预生成时一致（忽略 decision_id）时复用预生成的最终决策，decision_id 改为本次草案的 ID；
+    草案受日期等因素影响发生变化时返回 None，由调用方正常调用 LLM。
+
+    :param entry: take_precomputed 返回的预生成结果
+    :type entry: Dict[str, Any]
+    :param draft: 本次规则草案
+    :type draft: Dict[str, Any]
+    :return: (最终决策, agent 标记列表)
+    :rtype: Optional[Tuple[Dict[str, Any], List[str]]]
+    '''
+    if entry.get("draft") != draft_fingerprint(draft):
+        scheduler.count("miss:draft")
+        return None
+    output = copy.deepcopy(entry["output"])
+    output["decision_id"] = draft["decision_id"]
+    scheduler.count("served")
+    return output, list(entry.get("agent_flags") or []) + ["agent:precomputed"]
+
+
+class PrecomputeScheduler:
+    '''
+    功能：
+    低峰预生成调度：后台线程每 PRECOMPUTE_CHECK_INTERVAL 秒检查一次，进入 PRECOMPUTE_WINDOW 时段后
+    为最近 PRECOMPUTE_ACTIVE_DAYS 天内有决策的用户按上次请求参数预生成决策（每个时段只执行一轮，
+    PRECOMPUTE_WORKERS 个线程并发），时段结束时停止提交剩余用户。
+    多个 worker 同时开启时，只有持有调度锁的 worker 按时段执行，其余 worker 定期重试接管；
+    每一轮（含手动触发）另持执行锁，其他 worker 正在执行时直接跳过。
+    '''
+
+    def __init__(self, window: str, workers: int, active_days: float, check_interval: float) -> None:
+        self.window_spec = window
+        self.window = parse_window(window)
+        self.workers = max(1, workers)
+        self.active_days = active_days
+        self.check_interval = max(1.0, check_interval)
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+        self._leader = False
+        self._last_window: Optional[str] = None
+        self._last_run: Optional[Dict[str, Any]] = None
+        self._counts: Dict[str, int] = {"runs": 0, "served": 0}
+
+    def count(self, name: str) -> None:
+        with self._lock:
+            self._counts[name] = self._counts.get(name, 0) + 1
+
+    def start(self) -> None:
+        '''
+        功能：
+        启动后台调度线程（只启动一次）。
+
+        :return: 无
+        :rtype: None
+        '''
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._loop, name="precompute", daemon=True)
+            self._thread.start()
+        logger.info("precompute scheduler started window=%s (UTC)", self.window_spec)
+
+    def _loop(self) -> None:
+        while True:
+            try:
+                with leader_lock("precompute:scheduler") as held:
+                    if held is not None:
+                        self._lead(held)
+            except Exception:
+                logger.exception("precompute scheduler lock failed")
+            time.sleep(self.check_interval)
+
+    def _lead(self, held: Callable[[], bool]) -> None:
+        logger.info("precompute scheduler leader pid=%s", os.getpid())
+        with self._lock:
+            self._leader = True
+        try:
+            while held():
+                day = window_day(utc_now_dt(), self.window)
+                if day is not None and day != self._last_window:
+                    self._last_window = day
+                    try:
+                        self.run_once()
+                    except Exception:
+                        logger.exception("precompute run failed")
+                time.sleep(self.check_interval)
+        finally:
+            with self._lock:
+                self._leader = False
+        logger.warning("precompute scheduler lost leadership pid=%s", os.getpid())
+
+    def run_once(self, force: bool = False) -> Dict[str, Any]:
+        '''
+        功能：
+        执行一轮预生成；force=True 时忽略低峰时段（手动触发），否则离开时段后停止提交。
+        本进程已有一轮在执行时直接返回其状态，其他 worker 正在执行时返回 skipped。
+
+        :param force: 是否忽略低峰时段
+        :type force: bool
+        :return: 本轮统计
+        :rtype: Dict[str, Any]
+        '''
+        with self._lock:
+            if self._running:
+                return dict(self._last_run or {}, status="running")
+            self._running = True
+        try:
+            with leader_lock("precompute:run") as held:
+                if held is None:
+                    logger.info("precompute run skipped: running in another worker")
+                    self.count("skipped")
+                    return {"status": "skipped", "reason": "running_elsewhere"}
+                return self._run(force)
+        finally:
+            with self._lock:
+                self._running = False
+
+    def _run(self, force: bool) -> Dict[str, Any]:
+        workers = shm_workers()
+        if len(workers) > 1:
+            # shm 后端的预生成结果保存在进程内，只有本 worker 收到的请求能复用
+            logger.warning(
+                "precompute on shm store shared by %d workers: results stay in pid=%s, "
+                "use sticky routing or STORE_BACKEND=postgres",
+                len(workers),
+                os.getpid(),
+            )
+        with self._lock:
+            self._counts["runs"] += 1
+            run: Dict[str, Any] = {
+                "status": "running",
+                "forced": force,
+                "started_at": utc_now(),
+                "finished_at": None,
+                "scanned": 0,
+                "active": 0,
+                "results": {},
+                "stopped_early": False,
+            }
+            self._last_run = run
+        started = time.perf_counter()
+        cutoff = utc_now_dt() - timedelta(days=self.active_days)
+        inflight: Set[Any] = set()
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="precompute") as pool:
+                for state in iter_states(updated_since=cutoff):
+                    if not force and window_day(utc_now_dt(), self.window) is None:
+                        run["stopped_early"] = True
+                        break
+                    run["scanned"] += 1
+                    if not _is_active(state, cutoff):
+                        continue
+                    run["active"] += 1
+                    # 只保留有限的在途任务，避免把全部用户状态一次性排进队列
+                    if len(inflight) >= self.workers * 2:
+                        done, inflight = wait(inflight, return_when=FIRST_COMPLETED)
+                        self._collect(run, done)
+                    inflight.add(pool.submit(precompute_user, state))
+                done, _ = wait(inflight)
+                self._collect(run, done)
+        finally:
+            with self._lock:
+                run.update(
+                    status="done",
+                    finished_at=utc_now(),
+                    elapsed_s=round(time.perf_counter() - started, 1),
+                )
+        logger.info("precompute run done %s", run)
+        return dict(run)
+
+    def _collect(self, run: Dict[str, Any], futures: Set[Any]) -> None:
+        for future in futures:
+            try:
+                result = future.result()
+            except Exception as exc:
+                logger.warning("precompute user failed: %s", exc)
+                result = "error"
+            with self._lock:
+                run["results"][result] = run["results"].get(result, 0) + 1
+
+    def trigger(self) -> Dict[str, Any]:
+        '''
+        功能：
+        在后台线程立即执行一轮预生成（忽略低峰时段）。
+
+        :return: 触发时的状态
+        :rtype: Dict[str, Any]
+        '''
+        with self._lock:
+            if self._running:
+                return dict(self._last_run or {}, status="running")
+        threading.Thread(target=self.run_once, kwargs={"force": True}, name="precompute-manual", daemon=True).start()
+        return {"status": "started"}
+
+    def snapshot(self) -> Dict[str, Any]:
+        '''
+        功能：
+        返回调度状态、最近一轮统计与早高峰命中情况（served/miss:*）。
+
+        :return: 指标字典
+        :rtype: Dict[str, Any]
+        '''
+        with self._lock:
+            last_run = copy.deepcopy(self._last_run) if self._last_run is not None else None
+            return {
+                "enabled": PRECOMPUTE_ENABLED,
+                "window_utc": self.window_spec,
+                "running": self._running,
+                "leader": self._leader,
+                "last_window": self._last_window,
+                "last_run": last_run,
+                "counts": dict(self._counts),
+            }
+
+
+scheduler = PrecomputeScheduler(PRECOMPUTE_WINDOW, PRECOMPUTE_WORKERS, PRECOMPUTE_ACTIVE_DAYS, PRECOMPUTE_CHECK_INTERVAL)
+
+
+def start_precompute_scheduler() -> None:
+    '''
+    功能：
+    PRECOMPUTE_ENABLED 时启动低峰预生成调度；多个 worker/实例同时开启时由调度锁选出一个执行。
+
+    :return: 无
+    :rtype: None
+    '''
+    if PRECOMPUTE_ENABLED:
+        scheduler.start()
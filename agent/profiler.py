@@ -0,0 +1,124 @@
+﻿# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from types import FrameType
+from typing import Dict, Optional, Tuple
+
+
+def _frame_name(frame: FrameType) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}".replace(" ", "_").replace(";", ":")
+
+
+def collapse_stack(frame: Optional[FrameType]) -> str:
+    '''
+    功能：
+    将线程栈折叠为 flamegraph collapsed 格式（根在前，分号分隔）。
+
+    :param frame: 栈顶帧
+    :type frame: Optional[FrameType]
+    :return: 折叠后的栈字符串
+    :rtype: str
+    '''
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    names.reverse()
+    return ";".join(names)
+
+
+class SamplingProfiler:
+    '''
+    功能：
+    按需启动的采样分析器：在有限时间窗口内定时抓取所有请求线程的调用栈并聚合。
+    未运行时不启动任何线程，请求钩子只做一次布尔判断。
+    '''
+
+    def __init__(self) -> None:
+        self._run_lock = threading.Lock()
+        self.active = False
+        self._threads: Dict[int, Tuple[str, str]] = {}
+
+    def mark_request(self, rule: str, path: str) -> None:
+        '''
+        功能：
+        采样期间登记当前线程正在处理的路由。
+
+        :param rule: 路由规则（如 /v1/decision）
+        :type rule: str
+        :param path: 实际请求路径
+        :type path: str
+        :return: 无
+        :rtype: None
+        '''
+        self._threads[threading.get_ident()] = (rule, path)
+
+    def clear_request(self) -> None:
+        '''
+        功能：
+        请求结束时注销当前线程。
+
+        :return: 无
+        :rtype: None
+        '''
+        self._threads.pop(threading.get_ident(), None)
+
+    def run(
+        self,
+        seconds: float,
+        interval: float,
+        route: Optional[str] = None,
+        all_threads: bool = False,
+    ) -> Tuple[str, Dict[str, int]]:
+        '''
+        功能：
+        在当前线程内执行一次采样窗口，返回 collapsed 格式文本与采样统计。
+
+        :param seconds: 采样时长（秒）
+        :type seconds: float
+        :param interval: 采样间隔（秒）
+        :type interval: float
+        :param route: 只采样处理该路由（规则或路径）的线程
+        :type route: Optional[str]
+        :param all_threads: 是否包含未在处理请求的线程（后台线程、空闲 worker）
+        :type all_threads: bool
+        :return: (collapsed 文本, 统计信息)
+        :rtype: Tuple[str, Dict[str, int]]
+        '''
+        if not self._run_lock.acquire(blocking=False):
+            raise RuntimeError("profiler_busy")
+        counts: Counter = Counter()
+        ticks = 0
+        me = threading.get_ident()
+        try:
+            self.active = True
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                ticks += 1
+                for ident, frame in sys._current_frames().items():
+                    if ident == me:
+                        continue
+                    serving = self._threads.get(ident)
+                    if route is not None:
+                        if serving is None or route not in serving:
+                            continue
+                    elif serving is None and not all_threads:
+                        continue
+                    counts[collapse_stack(frame)] += 1
+                time.sleep(interval)
+        finally:
+            self.active = False
+            self._threads.clear()
+            self._run_lock.release()
+
+        text = "\n".join(f"{stack} {n}" for stack, n in counts.most_common())
+        return text, {"ticks": ticks, "samples": sum(counts.values()), "stacks": len(counts)}
+
+
+profiler = SamplingProfiler()
@@ -0,0 +1,169 @@
+﻿# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .config import PROGRESSIVE_MAX_PENDING, PROGRESSIVE_RESULT_TTL, PROGRESSIVE_WORKERS
+
+logger = logging.getLogger("agent")
+
+_MAX_RESULTS = 10000
+
+
+class RefinementRegistry:
+    '''
+    功能：
+    渐进式决策的后台 LLM 润色任务：先返回规则草案，润色在线程池中执行，
+    结果按 decision_id 保存在进程内（超过 TTL 或数量上限淘汰），供轮询与 SSE 读取。
+    '''
+
+    def __init__(self, workers: int, max_pending: int, ttl: float) -> None:
+        self.max_pending = max(1, max_pending)
+        self.ttl = ttl
+        self._cond = threading.Condition()
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._pending = 0
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="refine")
+        self._counts = {"submitted": 0, "done": 0, "failed": 0, "rejected": 0}
+
+    def _evict_locked(self) -> None:
+        cutoff = time.time() - self.ttl
+        while self._entries:
+            decision_id, entry = next(iter(self._entries.items()))
+            if entry["status"] == "pending" or (entry["created_at"] >= cutoff and len(self._entries) <= _MAX_RESULTS):
+                break
+            self._entries.pop(decision_id)
+
+    def submit(
+        self,
+        decision_id: str,
+        user_id: str,
+        draft: Dict[str, Any],
+        refine: Callable[[], Tuple[Dict[str, Any], List[str]]],
+    ) -> Dict[str, Any]:
+        '''
+        功能：
+        登记并提交一次后台润色；排队任务已满时直接以草案完成（标记 agent:degraded:refine_queue_full）。
+        返回提交时刻的任务快照，rejected 为 True 表示因排队已满未提交（此时草案即最终结果）。
+
+        :param decision_id: 决策 ID
+        :type decision_id: str
+        :param user_id: 用户唯一标识
+        :type user_id: str
+        :param draft: 已返回给调用方的规则草案
+        :type draft: Dict[str, Any]
+        :param refine: 润色函数，返回 (最终决策, agent 标记列表)
+        :type refine: Callable[[], Tuple[Dict[str, Any], List[str]]]
+        :return: 任务状态
+        :rtype: Dict[str, Any]
+        '''
+        now = time.time()
+        entry = {
+            "decision_id": decision_id,
+            "user_id": user_id,
+            "status": "pending",
+            "output": None,
+            "agent_flags": [],
+            "created_at": now,
+            "updated_at": now,
+        }
+        with self._cond:
+            self._evict_locked()
+            self._entries[decision_id] = entry
+            if self._pending >= self.max_pending:
+                self._counts["rejected"] += 1
+                entry.update(status="done", output=draft, agent_flags=["agent:degraded:refine_queue_full"])
+                return dict(entry, rejected=True)
+            self._pending += 1
+            self._counts["submitted"] += 1
+            # 提交前在锁内取快照：提交后 _run 可能立即完成并改写 entry
+            job = dict(entry, rejected=False)
+        self._executor.submit(self._run, decision_id, draft, refine)
+        return job
+
+    def _run(
+        self,
+        decision_id: str,
+        draft: Dict[str, Any],
+        refine: Callable[[], Tuple[Dict[str, Any], List[str]]],
+    ) -> None:
+        try:
+            output, agent_flags = refine()
+            status = "done"
+        except Exception as exc:
+            logger.exception("decision refinement failed decision_id=%s", decision_id)
+            output, agent_flags, status = draft, [f"agent:error:{type(exc).__name__}"], "failed"
+        with self._cond:
+            self._pending -= 1
+            self._counts[status] += 1
+            entry = self._entries.get(decision_id)
+            if entry is not None:
+                entry.update(status=status, output=output, agent_flags=agent_flags, updated_at=time.time())
+            self._cond.notify_all()
+
+    def get(self, decision_id: str) -> Optional[Dict[str, Any]]:
+        '''
+        功能：
+        读取润色任务状态。
+
+        :param decision_id: 决策 ID
+        :type decision_id: str
+        :return: 任务状态，未知或已淘汰返回 None
+        :rtype: Optional[Dict[str, Any]]
+        '''
+        with self._cond:
+            entry = self._entries.get(decision_id)
+            return dict(entry) if entry is not None else None
+
+    def wait(self, decision_id: str, timeout: float) -> Optional[Dict[str, Any]]:
+        '''
+        功能：
+        等待润色完成（最多 timeout 秒），返回当前状态。
+
+        :param decision_id: 决策 ID
+        :type decision_id: str
+        :param timeout: 最长等待秒数
+        :type timeout: float
+        :return: 任务状态，未知或已淘汰返回 None
+        :rtype: Optional[Dict[str, Any]]
+        '''
+        deadline = time.monotonic() + max(timeout, 0.0)
+        with self._cond:
+            while True:
+                entry = self._entries.get(decision_id)
+                if entry is None or entry["status"] != "pending":
+                    return dict(entry) if entry is not None else None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return dict(entry)
+                self._cond.wait(remaining)
+
+    def items(self) -> List[Tuple[str, Dict[str, Any]]]:
+        '''
+        功能：
+        返回已保存的润色任务 (decision_id, 状态) 浅拷贝列表（内存占用分析用）。
+
+        :return: 任务列表
+        :rtype: List[Tuple[str, Dict[str, Any]]]
+        '''
+        with self._cond:
+            return list(self._entries.items())
+
+    def snapshot(self) -> Dict[str, Any]:
+        '''
+        功能：
+        返回后台润色任务指标。
+
+        :return: 指标字典
+        :rtype: Dict[str, Any]
+        '''
+        with self._cond:
+            return dict(self._counts, pending=self._pending, max_pending=self.max_pending, stored=len(self._entries))
+
+
+refinements = RefinementRegistry(PROGRESSIVE_WORKERS, PROGRESSIVE_MAX_PENDING, PROGRESSIVE_RESULT_TTL)
@@ -0,0 +1,228 @@
+﻿# -*- coding: utf-8 -*-
+"""
+在线分片迁移：新增（或移除）分片后，把归属发生变化的用户从旧分片搬到新分片。
+
+步骤：
+1. 所有服务进程改为 POSTGRES_SHARD_DSNS=<新列表>、POSTGRES_SHARD_PREVIOUS_DSNS=<旧列表> 并重启；
+   此后写入只进新归属分片，读取在新分片未命中时回退到旧分片。
+2. 使用同样的环境变量运行：
+       python -m agent.rebalance [--dry-run] [--batch-size 500]
+   逐个分片按 user_id 分页扫描，对归属变化的用户：先复制到目标分片（目标已有状态则保留目标上的新数据，
+   目标没有聊天记录时才复制聊天记录，决策记录按 decision_id 去重），提交后再从源分片删除。可重复执行，中途中断后重跑即可。
+3. 完成后去掉 POSTGRES_SHARD_PREVIOUS_DSNS 并滚动重启。
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+import time
+from collections import Counter
+from typing import Any, Dict, Iterator, List, Optional
+
+from . import memory_store
+from .config import POSTGRES_SCHEMA
+
+
+def _sql():
+    try:
+        from psycopg2 import sql
+    except ImportError as exc:
+        raise RuntimeError("psycopg2-binary is not installed") from exc
+    return sql
+
+
+def iter_user_ids(shard: str, batch_size: int) -> Iterator[str]:
+    '''
+    功能：
+    按 user_id 分页（keyset）扫描分片上的用户（状态表、聊天表与决策记录表的并集），每批独立事务，不长时间持有快照。
+
+    :param shard: 分片名称
+    :type shard: str
+    :param batch_size: 每批用户数
+    :type batch_size: int
+    :return: 用户 ID 迭代器
+    :rtype: Iterator[str]
+    '''
+    sql = _sql()
+    schema = sql.Identifier(POSTGRES_SCHEMA)
+    query = sql.SQL(
+        """
+        SELECT user_id FROM (
+            SELECT user_id FROM {}.user_state WHERE user_id > %s
+            UNION
+            SELECT DISTINCT user_id FROM {}.chat_history WHERE user_id > %s
+            UNION
+            SELECT DISTINCT user_id FROM {}.decision_record WHERE user_id > %s
+        ) u
+        ORDER BY user_id
+        LIMIT %s
+        """
+    ).format(schema, schema, schema)
+    last = ""
+    while True:
+        with memory_store._pg_conn(shard) as conn:
+            with conn:
+                with conn.cursor() as cur:
+                    cur.execute(query, (last, last, last, batch_size))
+                    batch = [row[0] for row in cur.fetchall()]
+        if not batch:
+            return
+        yield from batch
+        last = batch[-1]
+
+
+def move_user(source: str, target: str, user_id: str) -> Dict[str, Any]:
+    '''
+    功能：
+    将一个用户从源分片迁到目标分片：目标事务提交成功后再删除源数据。
+
+    :param source: 源分片
+    :type source: str
+    :param target: 目标分片
+    :type target: str
+    :param user_id: 用户唯一标识
+    :type user_id: str
+    :return: 迁移结果
+    :rtype: Dict[str, Any]
+    '''
+    sql = _sql()
+    from psycopg2.extras import Json
+
+    schema = sql.Identifier(POSTGRES_SCHEMA)
+    with memory_store._pg_conn(source) as conn:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    sql.SQL("SELECT state, updated_at FROM {}.user_state WHERE user_id=%s").format(schema),
+                    (user_id,),
+                )
+                state_row = cur.fetchone()
+                cur.execute(
+                    sql.SQL(
+                        "SELECT role, content, created_at FROM {}.chat_history WHERE user_id=%s ORDER BY id"
+                    ).format(schema),
+                    (user_id,),
+                )
+                chat_rows = cur.fetchall() or []
+                cur.execute(
+                    sql.SQL(
+                        "SELECT decision_id, record, outcome, created_at, updated_at "
+                        "FROM {}.decision_record WHERE user_id=%s"
+                    ).format(schema),
+                    (user_id,),
+                )
+                decision_rows = cur.fetchall() or []
+
+    result = {"state": "absent", "chat": "absent", "decisions": 0}
+    with memory_store._pg_conn(target) as conn:
+        with conn:
+            with conn.cursor() as cur:
+                if state_row is not None:
+                    cur.execute(
+                        sql.SQL(
+                            """
+                            INSERT INTO {}.user_state (user_id, state, updated_at)
+                            VALUES (%s, %s, %s)
+                            ON CONFLICT (user_id) DO NOTHING
+                            """
+                        ).format(schema),
+                        (user_id, Json(state_row[0]), state_row[1]),
+                    )
+                    result["state"] = "copied" if cur.rowcount else "kept_target"
+                if chat_rows:
+                    cur.execute(
+                        sql.SQL("SELECT 1 FROM {}.chat_history WHERE user_id=%s LIMIT 1").format(schema),
+                        (user_id,),
+                    )
+                    if cur.fetchone() is None:
+                        for role, content, created_at in chat_rows:
+                            cur.execute(
+                                sql.SQL(
+                                    "INSERT INTO {}.chat_history (user_id, role, content, created_at) "
+                                    "VALUES (%s, %s, %s, %s)"
+                                ).format(schema),
+                                (user_id, role, content, created_at),
+                            )
+                        result["chat"] = "copied"
+                    else:
+                        result["chat"] = "kept_target"
+                for decision_id, record, outcome, created_at, updated_at in decision_rows:
+                    cur.execute(
+                        sql.SQL(
+                            """
+                            INSERT INTO {}.decision_record
+                                (decision_id, user_id, record, outcome, created_at, updated_at)
+                            VALUES (%s, %s, %s, %s, %s, %s)
+                            ON CONFLICT (decision_id) DO NOTHING
+                            """
+                        ).format(schema),
+                        (decision_id, user_id, Json(record), outcome, created_at, updated_at),
+                    )
+                    result["decisions"] += cur.rowcount
+
+    with memory_store._pg_conn(source) as conn:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute(sql.SQL("DELETE FROM {}.user_state WHERE user_id=%s").format(schema), (user_id,))
+                cur.execute(sql.SQL("DELETE FROM {}.chat_history WHERE user_id=%s").format(schema), (user_id,))
+                cur.execute(sql.SQL("DELETE FROM {}.decision_record WHERE user_id=%s").format(schema), (user_id,))
+    return result
+
+
+def rebalance(dry_run: bool = False, batch_size: int = 500, pause: float = 0.0) -> Dict[str, Any]:
+    '''
+    功能：
+    扫描全部分片，迁移归属变化的用户。
+
+    :param dry_run: 只统计不迁移
+    :type dry_run: bool
+    :param batch_size: 扫描分页大小
+    :type batch_size: int
+    :param pause: 每迁移一个用户后的停顿（秒），用于限制对线上库的压力
+    :type pause: float
+    :return: 迁移报告
+    :rtype: Dict[str, Any]
+    '''
+    if not memory_store._SHARDS:
+        raise RuntimeError("POSTGRES_SHARD_DSNS is not configured")
+    started = time.perf_counter()
+    report: Dict[str, Any] = {"dry_run": dry_run, "shards": {}}
+    for shard in memory_store._all_shards():
+        memory_store._pg_init(shard)
+    for shard in memory_store._all_shards():
+        counts: Counter = Counter()
+        for user_id in iter_user_ids(shard, batch_size):
+            counts["scanned"] += 1
+            target = memory_store._shard_for(user_id)
+            if target == shard:
+                continue
+            counts[f"to:{target}"] += 1
+            if dry_run:
+                continue
+            result = move_user(shard, target, user_id)
+            counts["moved"] += 1
+            counts[f"state_{result['state']}"] += 1
+            counts[f"chat_{result['chat']}"] += 1
+            counts["decisions_copied"] += result["decisions"]
+            if pause > 0:
+                time.sleep(pause)
+        report["shards"][shard] = dict(counts)
+    report["elapsed_sec"] = round(time.perf_counter() - started, 2)
+    return report
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Postgres 分片在线迁移")
+    parser.add_argument("--dry-run", action="store_true", help="只统计需要迁移的用户数")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--pause", type=float, default=0.0, help="每个用户迁移后的停顿秒数")
+    args = parser.parse_args(argv)
+    report = rebalance(dry_run=args.dry_run, batch_size=args.batch_size, pause=args.pause)
+    json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+    sys.stdout.write("\n")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
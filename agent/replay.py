@@ -0,0 +1,497 @@
+﻿# -*- coding: utf-8 -*-
+"""
+离线回放：读取线上记录的决策请求与反馈结果（NDJSON），在进程内驱动
+rule_decision 与反馈状态流转（LLM 使用桩、时钟使用事件时间），
+输出吞吐、决策分布，以及两个引擎版本之间的差异。
+
+事件格式（每行一个 JSON）：
+    {"type": "decision", "ts": "2026-02-09T08:00:00", "decision_id": "<线上ID>",
+     "request": {"user_id": "u1", "category": "top", "price_band": "79-129",
+                 "account_stage": "explore", "daily_slots": 2, "in_stock": true}}
+    {"type": "feedback", "ts": "2026-02-10T08:00:00", "user_id": "u1",
+     "decision_id": "<线上ID>", "outcome": "no_volume"}
+
+用法：
+    python -m agent.replay events.ndjson
+    git show HEAD~1:agent/decision_engine.py > /tmp/engine_old.py
+    python -m agent.replay events.ndjson --compare /tmp/engine_old.py --workers 4
+
+注意：对比引擎需使用 agent.state 的 utc_now/utc_now_dt 取时间，
+否则其季节与环境判断仍按真实时钟计算。每个引擎的初始状态按该引擎自身的格式构造
+（见 initial_state），早于按款式去重回避/暂缓池的版本使用列表池。
+"""
+from __future__ import annotations
+
+import argparse
+import importlib.util
+import json
+import sys
+import time
+import zlib
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from types import ModuleType
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from . import decision_engine
+from .feedback_engine import apply_feedback
+from .label_stats import SegmentStats, set_segment_stats
+from .models import DecisionRequest
+from .state import default_state, set_clock
+
+
+def load_engine(path: str, name: str = "agent._replay_engine") -> ModuleType:
+    '''
+    功能：
+    从文件路径加载另一个版本的决策引擎（作为 agent 包内模块，支持相对导入）。
+
+    :param path: decision_engine.py 文件路径
+    :type path: str
+    :param name: 模块名（需位于 agent 包下）
+    :type name: str
+    :return: 引擎模块
+    :rtype: ModuleType
+    '''
+    spec = importlib.util.spec_from_file_location(name, path)
+    if spec is None or spec.loader is None:
+        raise RuntimeError(f"cannot load engine from {path}")
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    if not hasattr(module, "rule_decision"):
+        raise RuntimeError(f"{path} does not define rule_decision")
+    return module
+
+
+def iter_events(paths: Iterable[str]) -> Iterator[Dict[str, Any]]:
+    '''
+    功能：
+    逐行读取 NDJSON 事件文件，跳过空行与无法解析的行。
+
+    :param paths: 事件文件路径列表（"-" 表示标准输入）
+    :type paths: Iterable[str]
+    :return: 事件字典迭代器
+    :rtype: Iterator[Dict[str, Any]]
+    '''
+    for path in paths:
+        f = sys.stdin if path == "-" else open(path, "r", encoding="utf-8")
+        try:
+            for raw in f:
+                line = raw.strip()
+                if not line:
+                    continue
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(event, dict):
+                    yield event
+        finally:
+            if f is not sys.stdin:
+                f.close()
+
+
+def partition_events(
+    events: Iterable[Dict[str, Any]], index: int, workers: int
+) -> Iterator[Dict[str, Any]]:
+    '''
+    功能：
+    按 user_id 哈希切分事件流，同一用户的事件总是落在同一分片且保持原有顺序。
+
+    :param events: 事件迭代器
+    :type events: Iterable[Dict[str, Any]]
+    :param index: 分片序号
+    :type index: int
+    :param workers: 分片总数
+    :type workers: int
+    :return: 属于该分片的事件迭代器
+    :rtype: Iterator[Dict[str, Any]]
+    '''
+    for event in events:
+        user_id = event.get("user_id") or (event.get("request") or {}).get("user_id") or ""
+        if zlib.crc32(str(user_id).encode("utf-8")) % workers == index:
+            yield event
+
+
+def stub_agent(draft: Dict[str, Any]) -> Tuple[Dict[str, Any], List[str]]:
+    '''
+    功能：
+    LLM 桩：直接返回规则草案，等价于线上 agent:fallback 路径。
+
+    :param draft: 规则草案
+    :type draft: Dict[str, Any]
+    :return: (最终决策, agent 标记列表)
+    :rtype: Tuple[Dict[str, Any], List[str]]
+    '''
+    return draft, ["agent:stub"]
+
+
+def decision_key(output: Dict[str, Any], state: Dict[str, Any]) -> Tuple[Any, ...]:
+    '''
+    功能：
+    提取用于比较两个引擎输出的关键字段。
+
+    :param output: 决策输出
+    :type output: Dict[str, Any]
+    :param state: 决策后的用户状态
+    :type state: Dict[str, Any]
+    :return: 关键字段元组
+    :rtype: Tuple[Any, ...]
+    '''
+    meta = output.get("meta", {})
+    return (
+        (state.get("last_reco") or {}).get("label"),
+        meta.get("mode"),
+        meta.get("confidence_style"),
+        (output.get("failure_expectation") or {}).get("likely"),
+        tuple(it.get("label") for it in output.get("dont_do", [])),
+    )
+
+
+def initial_state(engine: ModuleType, user_id: str) -> Dict[str, Any]:
+    '''
+    功能：
+    按引擎自身的状态格式构造初始用户状态：引擎模块定义了 default_state 时直接使用；
+    否则使用 agent.state.default_state，且引擎没有 normalize_pool（池为列表的旧版本）时将回避/暂缓池改为列表。
+
+    :param engine: 引擎模块
+    :type engine: ModuleType
+    :param user_id: 用户唯一标识
+    :type user_id: str
+    :return: 初始状态
+    :rtype: Dict[str, Any]
+    '''
+    engine_default = getattr(engine, "default_state", None)
+    if callable(engine_default):
+        return engine_default(user_id)
+    state = default_state(user_id)
+    if not hasattr(engine, "normalize_pool"):
+        state["avoid_pool"] = []
+        state["defer_pool"] = []
+    return state
+
+
+class ReplaySession:
+    '''
+    功能：
+    单个引擎版本的回放会话，持有独立的用户状态与统计。
+    '''
+
+    def __init__(self, engine: ModuleType, agent=stub_agent) -> None:
+        self.engine = engine
+        self.agent = agent
+        self.segment_stats = SegmentStats()
+        self.states: Dict[str, Dict[str, Any]] = {}
+        self.id_map: Dict[str, str] = {}
+        self.decisions = 0
+        self.feedbacks = 0
+        self.unmatched_feedback = 0
+        self.labels: Counter = Counter()
+        self.confidence: Counter = Counter()
+        self.modes: Counter = Counter()
+        self.risks: Counter = Counter()
+        self.rules: Counter = Counter()
+
+    def _state(self, user_id: str) -> Dict[str, Any]:
+        state = self.states.get(user_id)
+        if state is None:
+            state = initial_state(self.engine, user_id)
+            self.states[user_id] = state
+        return state
+
+    def decide(
+        self, req: DecisionRequest, recorded_id: Optional[str]
+    ) -> Tuple[Any, ...]:
+        '''
+        功能：
+        回放一条决策请求，返回用于差异比较的关键字段。
+
+        :param req: 决策请求
+        :type req: DecisionRequest
+        :param recorded_id: 线上记录的 decision_id
+        :type recorded_id: Optional[str]
+        :return: 关键字段元组
+        :rtype: Tuple[Any, ...]
+        '''
+        state = self._state(req.user_id)
+        set_segment_stats(self.segment_stats)
+        draft, state, rules_fired = self.engine.rule_decision(req, state)
+        output, _ = self.agent(draft)
+        self.states[req.user_id] = state
+        if recorded_id:
+            self.id_map[recorded_id] = output.get("decision_id") or draft["decision_id"]
+
+        key = decision_key(output, state)
+        self.decisions += 1
+        self.labels[key[0]] += 1
+        self.modes[key[1]] += 1
+        self.confidence[key[2]] += 1
+        self.risks[key[3]] += 1
+        self.rules.update(rules_fired)
+        return key
+
+    def feedback(self, user_id: str, recorded_id: Optional[str], outcome: str) -> None:
+        '''
+        功能：
+        回放一条反馈，按线上 decision_id 映射到回放生成的 decision_id。
+
+        :param user_id: 用户唯一标识
+        :type user_id: str
+        :param recorded_id: 线上记录的 decision_id（为空时弱关联最近决策）
+        :type recorded_id: Optional[str]
+        :param outcome: 反馈结果
+        :type outcome: str
+        :return: 无
+        :rtype: None
+        '''
+        state = self._state(user_id)
+        if recorded_id:
+            decision_id = self.id_map.get(recorded_id)
+        else:
+            decision_id = (state.get("last_reco") or {}).get("decision_id")
+        set_segment_stats(self.segment_stats)
+        if apply_feedback(state, decision_id, outcome) is None:
+            self.unmatched_feedback += 1
+        self.feedbacks += 1
+
+    def summary(self) -> Dict[str, Any]:
+        '''
+        功能：
+        汇总决策分布与反馈统计。
+
+        :return: 汇总字典
+        :rtype: Dict[str, Any]
+        '''
+        success = sum(s.get("stats", {}).get("success", 0) for s in self.states.values())
+        fail = sum(s.get("stats", {}).get("fail", 0) for s in self.states.values())
+        return {
+            "users": len(self.states),
+            "decisions": self.decisions,
+            "feedbacks": self.feedbacks,
+            "unmatched_feedback": self.unmatched_feedback,
+            "success": success,
+            "fail": fail,
+            "labels": dict(self.labels.most_common()),
+            "modes": dict(self.modes),
+            "confidence_style": dict(self.confidence),
+            "primary_risk": dict(self.risks),
+            "rules_fired": dict(self.rules.most_common()),
+        }
+
+
+def _parse_ts(value: Any) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00")).replace(tzinfo=None)
+    except ValueError:
+        return None
+
+
+def replay(
+    events: Iterable[Dict[str, Any]],
+    engines: List[ModuleType],
+    max_events: int = 0,
+    sample_diffs: int = 20,
+) -> Dict[str, Any]:
+    '''
+    功能：
+    在模拟时钟下按顺序回放事件，驱动一个或多个引擎版本并统计差异。
+
+    :param events: 事件迭代器
+    :type events: Iterable[Dict[str, Any]]
+    :param engines: 引擎模块列表（第一个为基准）
+    :type engines: List[ModuleType]
+    :param max_events: 最多回放的事件数（0 表示不限制）
+    :type max_events: int
+    :param sample_diffs: 报告中保留的差异样本数
+    :type sample_diffs: int
+    :return: 回放报告
+    :rtype: Dict[str, Any]
+    '''
+    sessions = [ReplaySession(engine) for engine in engines]
+    clock = {"now": datetime.utcnow()}
+    set_clock(lambda: clock["now"])
+
+    total = 0
+    invalid = 0
+    diff_count = 0
+    diff_samples: List[Dict[str, Any]] = []
+    started = time.perf_counter()
+    try:
+        for event in events:
+            if max_events and total >= max_events:
+                break
+            total += 1
+            ts = _parse_ts(event.get("ts"))
+            if ts is not None:
+                clock["now"] = ts
+
+            kind = event.get("type")
+            if kind == "decision":
+                try:
+                    req = DecisionRequest.model_validate(event.get("request") or event)
+                except Exception:
+                    invalid += 1
+                    continue
+                keys = [s.decide(req, event.get("decision_id")) for s in sessions]
+                if len(keys) > 1 and any(k != keys[0] for k in keys[1:]):
+                    diff_count += 1
+                    if len(diff_samples) < sample_diffs:
+                        diff_samples.append({
+                            "ts": event.get("ts"),
+                            "user_id": req.user_id,
+                            "decision_id": event.get("decision_id"),
+                            "outputs": [list(k) for k in keys],
+                        })
+            elif kind == "feedback":
+                user_id = event.get("user_id")
+                outcome = event.get("outcome")
+                if not user_id or outcome not in ("no_volume", "some_volume", "scaled"):
+                    invalid += 1
+                    continue
+                for s in sessions:
+                    s.feedback(user_id, event.get("decision_id"), outcome)
+            else:
+                invalid += 1
+    finally:
+        set_clock(None)
+
+    elapsed = time.perf_counter() - started
+    report: Dict[str, Any] = {
+        "events": total,
+        "invalid_events": invalid,
+        "elapsed_sec": round(elapsed, 3),
+        "events_per_sec": round(total / elapsed, 1) if elapsed > 0 else None,
+        "engines": [
+            {"engine": getattr(s.engine, "__file__", s.engine.__name__), **s.summary()}
+            for s in sessions
+        ],
+    }
+    if len(sessions) > 1:
+        report["diff"] = {
+            "decisions_compared": sessions[0].decisions,
+            "decisions_differ": diff_count,
+            "diff_rate": round(diff_count / sessions[0].decisions, 6)
+            if sessions[0].decisions
+            else 0.0,
+            "samples": diff_samples,
+        }
+    return report
+
+
+def _merge_counts(items: List[Dict[str, int]]) -> Dict[str, int]:
+    total: Counter = Counter()
+    for item in items:
+        total.update(item)
+    return dict(total.most_common())
+
+
+def merge_reports(reports: List[Dict[str, Any]], elapsed: float, sample_diffs: int) -> Dict[str, Any]:
+    '''
+    功能：
+    合并多个分片的回放报告（计数相加，吞吐按总耗时重新计算）。
+
+    :param reports: 分片报告列表
+    :type reports: List[Dict[str, Any]]
+    :param elapsed: 总耗时（秒）
+    :type elapsed: float
+    :param sample_diffs: 保留的差异样本数
+    :type sample_diffs: int
+    :return: 合并后的报告
+    :rtype: Dict[str, Any]
+    '''
+    total = sum(r["events"] for r in reports)
+    merged: Dict[str, Any] = {
+        "events": total,
+        "invalid_events": sum(r["invalid_events"] for r in reports),
+        "elapsed_sec": round(elapsed, 3),
+        "events_per_sec": round(total / elapsed, 1) if elapsed > 0 else None,
+        "workers": len(reports),
+        "engines": [],
+    }
+    for idx, base in enumerate(reports[0]["engines"]):
+        parts = [r["engines"][idx] for r in reports]
+        engine: Dict[str, Any] = {"engine": base["engine"]}
+        for field in ("users", "decisions", "feedbacks", "unmatched_feedback", "success", "fail"):
+            engine[field] = sum(p[field] for p in parts)
+        for field in ("labels", "modes", "confidence_style", "primary_risk", "rules_fired"):
+            engine[field] = _merge_counts([p[field] for p in parts])
+        merged["engines"].append(engine)
+    if "diff" in reports[0]:
+        compared = sum(r["diff"]["decisions_compared"] for r in reports)
+        differ = sum(r["diff"]["decisions_differ"] for r in reports)
+        samples = [s for r in reports for s in r["diff"]["samples"]]
+        merged["diff"] = {
+            "decisions_compared": compared,
+            "decisions_differ": differ,
+            "diff_rate": round(differ / compared, 6) if compared else 0.0,
+            "samples": samples[:sample_diffs],
+        }
+    return merged
+
+
+def _replay_shard(
+    paths: List[str],
+    baseline: Optional[str],
+    compare: Optional[str],
+    index: int,
+    workers: int,
+    max_events: int,
+    sample_diffs: int,
+) -> Dict[str, Any]:
+    engines = [load_engine(baseline, "agent._replay_engine_base") if baseline else decision_engine]
+    if compare:
+        engines.append(load_engine(compare, "agent._replay_engine_compare"))
+    events = partition_events(iter_events(paths), index, workers)
+    return replay(events, engines, max_events=max_events, sample_diffs=sample_diffs)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="离线回放决策/反馈事件")
+    parser.add_argument("events", nargs="+", help="NDJSON 事件文件，- 表示标准输入")
+    parser.add_argument("--baseline", help="基准引擎文件路径（默认当前 agent/decision_engine.py）")
+    parser.add_argument("--compare", help="对比引擎文件路径")
+    parser.add_argument("--max-events", type=int, default=0, help="每个分片最多回放的事件数")
+    parser.add_argument("--workers", type=int, default=1, help="按 user_id 分片的并行进程数")
+    parser.add_argument("--sample-diffs", type=int, default=20)
+    parser.add_argument("--output", help="报告输出文件（默认标准输出）")
+    args = parser.parse_args(argv)
+
+    if "-" in args.events and args.workers > 1:
+        parser.error("--workers 不支持从标准输入读取")
+
+    if args.workers <= 1:
+        report = _replay_shard(
+            args.events, args.baseline, args.compare, 0, 1, args.max_events, args.sample_diffs
+        )
+    else:
+        started = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            futures = [
+                pool.submit(
+                    _replay_shard,
+                    args.events,
+                    args.baseline,
+                    args.compare,
+                    index,
+                    args.workers,
+                    args.max_events,
+                    args.sample_diffs,
+                )
+                for index in range(args.workers)
+            ]
+            reports = [f.result() for f in futures]
+        report = merge_reports(reports, time.perf_counter() - started, args.sample_diffs)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
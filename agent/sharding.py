@@ -0,0 +1,89 @@
+﻿# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import bisect
+import hashlib
+from typing import Iterable, List, Optional, Tuple
+
+
+def parse_shards(spec: str) -> List[Tuple[str, str]]:
+    '''
+    功能：
+    解析分片配置：分号分隔，每项为 "名称|DSN" 或仅 DSN（此时名称即 DSN）。
+    一致性哈希按名称计算，DSN 变化（如改密码）不影响数据归属。
+
+    :param spec: 分片配置字符串
+    :type spec: str
+    :return: [(名称, DSN)]
+    :rtype: List[Tuple[str, str]]
+    '''
+    shards: List[Tuple[str, str]] = []
+    seen = set()
+    for item in (spec or "").split(";"):
+        item = item.strip()
+        if not item:
+            continue
+        name, sep, dsn = item.partition("|")
+        if not sep:
+            name, dsn = item, item
+        name, dsn = name.strip(), dsn.strip()
+        if name in seen:
+            raise RuntimeError(f"duplicate shard name: {name}")
+        seen.add(name)
+        shards.append((name, dsn))
+    return shards
+
+
+def _hash64(value: str) -> int:
+    return int.from_bytes(hashlib.md5(value.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    '''
+    功能：
+    带虚拟节点的一致性哈希环。新增一个分片时只有约 1/N 的 key 改变归属。
+    '''
+
+    def __init__(self, nodes: Iterable[str], vnodes: int = 160) -> None:
+        self.nodes = list(nodes)
+        if not self.nodes:
+            raise RuntimeError("hash ring requires at least one node")
+        points: List[Tuple[int, str]] = []
+        for node in self.nodes:
+            for i in range(vnodes):
+                points.append((_hash64(f"{node}#{i}"), node))
+        points.sort()
+        self._keys = [p[0] for p in points]
+        self._owners = [p[1] for p in points]
+
+    def node_for(self, key: str) -> str:
+        '''
+        功能：
+        返回 key 归属的节点。
+
+        :param key: 路由键（user_id）
+        :type key: str
+        :return: 节点名称
+        :rtype: str
+        '''
+        if len(self.nodes) == 1:
+            return self.nodes[0]
+        idx = bisect.bisect_right(self._keys, _hash64(key))
+        if idx == len(self._keys):
+            idx = 0
+        return self._owners[idx]
+
+
+def build_ring(shards: List[Tuple[str, str]]) -> Optional[HashRing]:
+    '''
+    功能：
+    根据分片列表构建哈希环，未配置分片时返回 None。
+
+    :param shards: [(名称, DSN)]
+    :type shards: List[Tuple[str, str]]
+    :return: 哈希环或 None
+    :rtype: Optional[HashRing]
+    '''
+    if not shards:
+        return None
+    return HashRing([name for name, _ in shards])
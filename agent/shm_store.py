@@ -0,0 +1,380 @@
+﻿# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows 无 fcntl，shm 后端不可用
+    fcntl = None
+
+_MAGIC = b"DYSHM001"
+_HEADER_FMT = "<8sIIII"
+_HEADER_SIZE = 64
+# seq, used, key_len, state_len, chat_len, crc32
+_SLOT_HEAD_FMT = "<IB3xIIII"
+_SLOT_HEAD_SIZE = struct.calcsize(_SLOT_HEAD_FMT)
+_KEY_BYTES = 128
+_THREAD_STRIPES = 64
+_READ_RETRIES = 64
+# 内部元数据槽位的 key 前缀（用户 ID 不会以 NUL 开头），遍历用户时跳过
+_META_PREFIX = b"\x00"
+
+
+def _dumps(value: Any) -> bytes:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _hash_key(key: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "little")
+
+
+class ShmStore:
+    '''
+    功能：
+    单机多进程共享的用户状态/聊天历史存储。
+
+    数据放在 mmap 文件（默认 /dev/shm）中的定长槽位哈希表里（线性探测，槽位只增不删）：
+    - 写入：进程内按槽位分段的线程锁 + 跨进程 fcntl 字节区间锁，仅锁住单个槽位；
+    - 读取：无锁 seqlock（序号 + CRC 校验），与写入冲突时重试，多次失败才退化为加锁读。
+    '''
+
+    def __init__(
+        self,
+        path: str,
+        slots: int,
+        state_bytes: int,
+        chat_bytes: int,
+        chat_max_items: int,
+    ) -> None:
+        if fcntl is None:
+            raise RuntimeError("STORE_BACKEND=shm requires a POSIX platform (fcntl)")
+        self.path = path
+        self.slots = slots
+        self.state_bytes = state_bytes
+        self.chat_bytes = chat_bytes
+        self.chat_max_items = chat_max_items
+        self.slot_size = _SLOT_HEAD_SIZE + _KEY_BYTES + state_bytes + chat_bytes
+        self.size = _HEADER_SIZE + slots * self.slot_size
+        self._thread_locks = [threading.Lock() for _ in range(_THREAD_STRIPES)]
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            current = os.fstat(self._fd).st_size
+            if current == 0:
+                os.ftruncate(self._fd, self.size)
+                os.pwrite(
+                    self._fd,
+                    struct.pack(_HEADER_FMT, _MAGIC, slots, _KEY_BYTES, state_bytes, chat_bytes),
+                    0,
+                )
+            else:
+                head = os.pread(self._fd, struct.calcsize(_HEADER_FMT), 0)
+                magic, f_slots, f_key, f_state, f_chat = struct.unpack(_HEADER_FMT, head)
+                if magic != _MAGIC or (f_slots, f_key, f_state, f_chat) != (
+                    slots,
+                    _KEY_BYTES,
+                    state_bytes,
+                    chat_bytes,
+                ):
+                    raise RuntimeError(
+                        f"shm store {path} was created with a different layout; "
+                        "remove it or align SHM_STORE_SLOTS/SHM_STATE_BYTES/SHM_CHAT_BYTES"
+                    )
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._mm = mmap.mmap(self._fd, self.size)
+
+    def close(self) -> None:
+        '''
+        功能：
+        关闭映射与文件句柄（不删除共享文件）。
+
+        :return: 无
+        :rtype: None
+        '''
+        self._mm.close()
+        os.close(self._fd)
+
+    # ---- 槽位读写 ----
+
+    def _offset(self, idx: int) -> int:
+        return _HEADER_SIZE + idx * self.slot_size
+
+    @contextmanager
+    def _locked(self, idx: int) -> Iterator[None]:
+        offset = self._offset(idx)
+        with self._thread_locks[idx % _THREAD_STRIPES]:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, self.slot_size, offset)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, self.slot_size, offset)
+
+    def _read_slot(
+        self, idx: int, key: bytes, with_payload: bool = True
+    ) -> Tuple[bool, bool, bytes, bytes]:
+        '''
+        功能：
+        无锁读取槽位（seqlock），返回 (是否占用, 键是否匹配, 状态字节, 聊天字节)。
+        '''
+        mm = self._mm
+        offset = self._offset(idx)
+        key_off = offset + _SLOT_HEAD_SIZE
+        state_off = key_off + _KEY_BYTES
+        chat_off = state_off + self.state_bytes
+        for _ in range(_READ_RETRIES):
+            seq, used, key_len, state_len, chat_len, crc = struct.unpack_from(
+                _SLOT_HEAD_FMT, mm, offset
+            )
+            if seq & 1:
+                time.sleep(0)
+                continue
+            if not used:
+                if struct.unpack_from("<I", mm, offset)[0] == seq:
+                    return False, False, b"", b""
+                continue
+            slot_key = mm[key_off : key_off + key_len]
+            if slot_key != key:
+                if struct.unpack_from("<I", mm, offset)[0] == seq:
+                    return True, False, b"", b""
+                continue
+            if not with_payload:
+                return True, True, b"", b""
+            state = mm[state_off : state_off + state_len]
+            chat = mm[chat_off : chat_off + chat_len]
+            if struct.unpack_from("<I", mm, offset)[0] != seq:
+                continue
+            if zlib.crc32(chat, zlib.crc32(state, zlib.crc32(slot_key))) != crc:
+                continue
+            return True, True, state, chat
+
+        with self._locked(idx):
+            return self._read_slot_locked(idx, key)
+
+    def _read_slot_locked(self, idx: int, key: bytes) -> Tuple[bool, bool, bytes, bytes]:
+        # 调用方需持有槽位锁
+        mm = self._mm
+        offset = self._offset(idx)
+        key_off = offset + _SLOT_HEAD_SIZE
+        state_off = key_off + _KEY_BYTES
+        chat_off = state_off + self.state_bytes
+        _, used, key_len, state_len, chat_len, _ = struct.unpack_from(_SLOT_HEAD_FMT, mm, offset)
+        if not used:
+            return False, False, b"", b""
+        if mm[key_off : key_off + key_len] != key:
+            return True, False, b"", b""
+        return True, True, mm[state_off : state_off + state_len], mm[chat_off : chat_off + chat_len]
+
+    def _write_slot(self, idx: int, key: bytes, state: bytes, chat: bytes) -> None:
+        # 调用方需持有槽位锁
+        mm = self._mm
+        offset = self._offset(idx)
+        key_off = offset + _SLOT_HEAD_SIZE
+        state_off = key_off + _KEY_BYTES
+        chat_off = state_off + self.state_bytes
+        # 写入进程若中途崩溃会留下奇数序号，这里先对齐到偶数
+        seq = struct.unpack_from("<I", mm, offset)[0] & ~1
+        struct.pack_into("<I", mm, offset, (seq + 1) & 0xFFFFFFFF)
+        mm[key_off : key_off + len(key)] = key
+        mm[state_off : state_off + len(state)] = state
+        mm[chat_off : chat_off + len(chat)] = chat
+        crc = zlib.crc32(chat, zlib.crc32(state, zlib.crc32(key)))
+        struct.pack_into(
+            _SLOT_HEAD_FMT, mm, offset, (seq + 1) & 0xFFFFFFFF, 1, len(key), len(state), len(chat), crc
+        )
+        struct.pack_into("<I", mm, offset, (seq + 2) & 0xFFFFFFFF)
+
+    def _encode_key(self, user_id: str) -> bytes:
+        key = user_id.encode("utf-8")
+        if len(key) > _KEY_BYTES:
+            raise ValueError(f"user_id too long for shm store (max {_KEY_BYTES} bytes)")
+        if key.startswith(_META_PREFIX):
+            raise ValueError("user_id must not start with NUL")
+        return key
+
+    def _find(self, key: bytes) -> Tuple[Optional[int], bytes, bytes]:
+        start = _hash_key(key) % self.slots
+        for step in range(self.slots):
+            idx = (start + step) % self.slots
+            used, match, state, chat = self._read_slot(idx, key)
+            if not used:
+                return None, b"", b""
+            if match:
+                return idx, state, chat
+        return None, b"", b""
+
+    def _update(self, key: bytes, mutate) -> None:
+        '''
+        功能：
+        在槽位锁内读取当前值并写回 mutate(state_bytes, chat_bytes) 的结果，不存在则占用新槽位。
+        '''
+        start = _hash_key(key) % self.slots
+        for step in range(self.slots):
+            idx = (start + step) % self.slots
+            used, match, _, _ = self._read_slot(idx, key, with_payload=False)
+            if used and not match:
+                continue
+            with self._locked(idx):
+                used, match, state, chat = self._read_slot_locked(idx, key)
+                if used and not match:
+                    continue
+                new_state, new_chat = mutate(state, chat)
+                self._write_slot(idx, key, new_state, new_chat)
+                return
+        raise RuntimeError("shm store is full; increase SHM_STORE_SLOTS")
+
+    # ---- 对外接口（与 memory_store 一致） ----
+
+    def get_state(self, user_id: str) -> Optional[Dict[str, Any]]:
+        '''
+        功能：
+        读取用户状态，不存在返回 None。
+
+        :param user_id: 用户唯一标识
+        :type user_id: str
+        :return: 用户状态字典
+        :rtype: Optional[Dict[str, Any]]
+        '''
+        idx, state, _ = self._find(self._encode_key(user_id))
+        if idx is None or not state:
+            return None
+        return json.loads(state)
+
+    def set_state(self, state: Dict[str, Any]) -> None:
+        '''
+        功能：
+        写入用户状态（保留该用户的聊天历史）。
+
+        :param state: 用户状态字典
+        :type state: Dict[str, Any]
+        :return: 无
+        :rtype: None
+        '''
+        payload = _dumps(state)
+        if len(payload) > self.state_bytes:
+            raise RuntimeError(
+                f"state of {state['user_id']} is {len(payload)} bytes; increase SHM_STATE_BYTES"
+            )
+        self._update(self._encode_key(state["user_id"]), lambda _s, chat: (payload, chat))
+
+    def get_chat_history(self, user_id: str) -> List[dict]:
+        '''
+        功能：
+        读取用户聊天历史。
+
+        :param user_id: 用户唯一标识
+        :type user_id: str
+        :return: 聊天历史列表
+        :rtype: List[dict]
+        '''
+        idx, _, chat = self._find(self._encode_key(user_id))
+        if idx is None or not chat:
+            return []
+        return json.loads(chat)
+
+    def append_chat_history(self, user_id: str, item: Dict[str, Any]) -> None:
+        '''
+        功能：
+        追加一条聊天记录，超过最大条数或槽位容量时丢弃最早的记录。
+
+        :param user_id: 用户唯一标识
+        :type user_id: str
+        :param item: 聊天记录
+        :type item: Dict[str, Any]
+        :return: 无
+        :rtype: None
+        '''
+
+        def mutate(state: bytes, chat: bytes) -> Tuple[bytes, bytes]:
+            history = json.loads(chat) if chat else []
+            history.append(item)
+            history = history[-self.chat_max_items :]
+            payload = _dumps(history)
+            while len(payload) > self.chat_bytes and history:
+                history.pop(0)
+                payload = _dumps(history)
+            return state, payload
+
+        self._update(self._encode_key(user_id), mutate)
+
+    def get_meta(self, name: str) -> Optional[Any]:
+        '''
+        功能：
+        读取内部元数据（存放在保留槽位的状态区，所有进程共享）。
+
+        :param name: 元数据名称
+        :type name: str
+        :return: 元数据值，不存在返回 None
+        :rtype: Optional[Any]
+        '''
+        idx, state, _ = self._find(_META_PREFIX + name.encode("utf-8"))
+        if idx is None or not state:
+            return None
+        return json.loads(state)
+
+    def update_meta(self, name: str, mutate: Callable[[Optional[Any]], Any]) -> None:
+        '''
+        功能：
+        在槽位锁内读取-修改-写回内部元数据，跨进程原子。
+
+        :param name: 元数据名称
+        :type name: str
+        :param mutate: 接收当前值（不存在为 None）并返回新值的函数
+        :type mutate: Callable[[Optional[Any]], Any]
+        :return: 无
+        :rtype: None
+        '''
+
+        def apply(state: bytes, chat: bytes) -> Tuple[bytes, bytes]:
+            payload = _dumps(mutate(json.loads(state) if state else None))
+            if len(payload) > self.state_bytes:
+                raise RuntimeError(f"shm meta {name} is {len(payload)} bytes; increase SHM_STATE_BYTES")
+            return payload, chat
+
+        self._update(_META_PREFIX + name.encode("utf-8"), apply)
+
+    def iter_user_ids(self) -> Iterator[str]:
+        '''
+        功能：
+        遍历已占用槽位的用户 ID（无锁快照，可能与并发写入交错）。
+
+        :return: 用户 ID 迭代器
+        :rtype: Iterator[str]
+        '''
+        mm = self._mm
+        for idx in range(self.slots):
+            offset = self._offset(idx)
+            _, used, key_len, _, _, _ = struct.unpack_from(_SLOT_HEAD_FMT, mm, offset)
+            key_off = offset + _SLOT_HEAD_SIZE
+            if used and mm[key_off : key_off + 1] != _META_PREFIX:
+                yield bytes(mm[key_off : key_off + key_len]).decode("utf-8", "replace")
+
+    def iter_slot_sizes(self) -> Iterator[Tuple[str, int, int]]:
+        '''
+        功能：
+        遍历已占用槽位的 (用户 ID, 状态字节数, 聊天字节数)，只读槽位头（无锁快照，不解码负载）。
+
+        :return: (用户 ID, 状态字节数, 聊天字节数) 迭代器
+        :rtype: Iterator[Tuple[str, int, int]]
+        '''
+        mm = self._mm
+        for idx in range(self.slots):
+            offset = self._offset(idx)
+            _, used, key_len, state_len, chat_len, _ = struct.unpack_from(_SLOT_HEAD_FMT, mm, offset)
+            key_off = offset + _SLOT_HEAD_SIZE
+            if used and mm[key_off : key_off + 1] != _META_PREFIX:
+                yield bytes(mm[key_off : key_off + key_len]).decode("utf-8", "replace"), state_len, chat_len
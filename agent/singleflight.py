@@ -0,0 +1,141 @@
+﻿# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from .config import SINGLEFLIGHT_ENABLED, SINGLEFLIGHT_WAIT_TIMEOUT
+from .memory_store import pg_coalesce
+
+logger = logging.getLogger("agent")
+
+
+class _Call:
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    '''
+    功能：
+    进程内请求合并：同一个 key 同时只执行一次，其余并发调用等待并共享结果（或异常）。
+    '''
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+
+    def do(
+        self,
+        key: str,
+        fn: Callable[[], Any],
+        wait_timeout: Optional[float] = None,
+        on_timeout: Optional[Callable[[], Any]] = None,
+    ) -> Tuple[Any, bool]:
+        '''
+        功能：
+        执行或等待 key 对应的计算。等待超过 wait_timeout 秒时不再合并，改为自行计算
+        （使用 on_timeout，未提供时使用 fn），避免执行者卡住时所有等待者一起卡住。
+
+        :param key: 合并键
+        :type key: str
+        :param fn: 计算函数
+        :type fn: Callable[[], Any]
+        :param wait_timeout: 等待执行者的最长秒数，None 表示一直等待
+        :type wait_timeout: Optional[float]
+        :param on_timeout: 等待超时后使用的计算函数
+        :type on_timeout: Optional[Callable[[], Any]]
+        :return: (结果, 是否为等待其他调用得到的共享结果)
+        :rtype: Tuple[Any, bool]
+        '''
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not leader:
+            if not call.done.wait(wait_timeout):
+                logger.warning("singleflight wait timed out key=%s, computing independently", key)
+                return (on_timeout or fn)(), False
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as exc:
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+        return call.result, False
+
+    def inflight(self) -> int:
+        '''
+        功能：
+        返回正在执行中的 key 数量。
+
+        :return: 执行中的数量
+        :rtype: int
+        '''
+        with self._lock:
+            return len(self._calls)
+
+
+_decision_flight = SingleFlight()
+
+
+def request_key(prefix: str, user_id: str, payload: Dict[str, Any]) -> str:
+    '''
+    功能：
+    根据 user_id 与规范化后的请求参数生成合并键。
+
+    :param prefix: 键前缀（区分接口）
+    :type prefix: str
+    :param user_id: 用户唯一标识
+    :type user_id: str
+    :param payload: 请求参数（已校验）
+    :type payload: Dict[str, Any]
+    :return: 合并键
+    :rtype: str
+    '''
+    normalized = {
+        k: (v.strip() if isinstance(v, str) else v) for k, v in payload.items() if v is not None
+    }
+    digest = hashlib.sha1(
+        json.dumps(normalized, ensure_ascii=False, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    ).hexdigest()
+    return f"{prefix}:{user_id}:{digest}"
+
+
+def coalesce_decision(key: str, compute: Callable[[], dict]) -> Tuple[dict, bool]:
+    '''
+    功能：
+    合并相同的决策请求：进程内用 SingleFlight，Postgres 后端再通过 advisory lock 跨进程合并。
+    两种等待都以 SINGLEFLIGHT_WAIT_TIMEOUT 为上限，超时后自行计算。
+
+    :param key: 合并键
+    :type key: str
+    :param compute: 计算函数
+    :type compute: Callable[[], dict]
+    :return: (结果, 是否复用了其他请求的结果)
+    :rtype: Tuple[dict, bool]
+    '''
+    if not SINGLEFLIGHT_ENABLED:
+        return compute(), False
+    (result, shared_remote), shared_local = _decision_flight.do(
+        key,
+        lambda: pg_coalesce(key, compute, SINGLEFLIGHT_WAIT_TIMEOUT),
+        wait_timeout=SINGLEFLIGHT_WAIT_TIMEOUT,
+        on_timeout=lambda: (compute(), False),
+    )
+    return result, shared_local or shared_remote
@@ -3,7 +3,34 @@ from __future__ import annotations
 
 import json
 from datetime import datetime
-from typing import Any, Dict
+from typing import Any, Callable, Dict, Optional
+
+_clock: Callable[[], datetime] = datetime.utcnow
+
+
+def set_clock(clock: Optional[Callable[[], datetime]]) -> None:
+    '''
+    功能：
+    替换全局 UTC 时钟（离线回放使用模拟时钟），传入 None 恢复系统时钟。
+
+    :param clock: 返回 UTC datetime 的可调用对象
+    :type clock: Optional[Callable[[], datetime]]
+    :return: 无
+    :rtype: None
+    '''
+    global _clock
+    _clock = clock or datetime.utcnow
+
+
+def utc_now_dt() -> datetime:
+    '''
+    功能：
+    获取当前 UTC 时间（受 set_clock 控制）。
+
+    :return: UTC datetime
+    :rtype: datetime
+    '''
+    return _clock()
 
 
 def utc_now() -> str:
@@ -14,7 +41,7 @@ def utc_now() -> str:
     :return: ISO 时间字符串
     :rtype: str
     '''
-    return datetime.utcnow().isoformat()
+    return _clock().isoformat()
 
 
 def default_state(user_id: str) -> Dict[str, Any]:
@@ -35,8 +62,8 @@ def default_state(user_id: str) -> Dict[str, Any]:
         "account_stage": "explore",
         "daily_slots": 1,
         "last_reco": None,
-        "avoid_pool": [],
-        "defer_pool": [],
+        "avoid_pool": {},
+        "defer_pool": {},
         "stats": {
             "success": 0,
             "fail": 0,
@@ -44,6 +71,7 @@ def default_state(user_id: str) -> Dict[str, Any]:
             "env_trigger_count": 0,
         },
         "history": [],
+        "label_stats": {},
     }
 
 
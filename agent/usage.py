@@ -0,0 +1,403 @@
+﻿# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import atexit
+import contextvars
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from .admission import AdmissionRejected
+from .config import LLM_MODEL, LLM_PRICING, LLM_PROFILES, LLM_USAGE_FLUSH_INTERVAL
+from .memory_store import USAGE_KEY_FIELDS, add_usage_rows, merge_usage_row
+
+logger = logging.getLogger("agent")
+
+_current_call: contextvars.ContextVar[Optional["UsageCallback"]] = contextvars.ContextVar(
+    "llm_usage_call", default=None
+)
+
+
+def parse_pricing(spec: str) -> Dict[str, Tuple[float, float]]:
+    '''
+    功能：
+    解析模型单价配置：分号分隔，每项为 "模型=输入单价:输出单价"（每 1K tokens），"*" 为默认单价。
+
+    :param spec: 单价配置字符串
+    :type spec: str
+    :return: {模型: (输入单价, 输出单价)}
+    :rtype: Dict[str, Tuple[float, float]]
+    '''
+    pricing: Dict[str, Tuple[float, float]] = {}
+    for item in (spec or "").split(";"):
+        model, sep, prices = item.strip().partition("=")
+        if not sep:
+            continue
+        prompt_price, _, completion_price = prices.partition(":")
+        try:
+            pricing[model.strip()] = (float(prompt_price or 0), float(completion_price or 0))
+        except ValueError:
+            logger.warning("invalid LLM_PRICING entry: %s", item)
+    return pricing
+
+
+_PRICING = parse_pricing(LLM_PRICING)
+
+
+def call_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    '''
+    功能：
+    按配置单价估算一次调用的费用，未配置单价的模型返回 0。
+
+    :param model: 模型名称
+    :type model: str
+    :param prompt_tokens: 输入 tokens
+    :type prompt_tokens: int
+    :param completion_tokens: 输出 tokens
+    :type completion_tokens: int
+    :return: 费用
+    :rtype: float
+    '''
+    prompt_price, completion_price = _PRICING.get(model) or _PRICING.get("*") or (0.0, 0.0)
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000.0
+
+
+class UsageCallback(BaseCallbackHandler):
+    '''
+    功能：
+    单次逻辑调用（一次决策或一次问答）的用量采集：汇总其中每次模型请求的 tokens、模型名、
+    错误与重试次数（LangChain 重试 + OpenAI 客户端内部 HTTP 重试）。
+    '''
+
+    def __init__(self, route: str, user_id: str) -> None:
+        self.route = route
+        self.user_id = user_id
+        self.model = ""
+        self.llm_calls = 0
+        self.http_requests = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.retries = 0
+        self.errors = 0
+        self.fallback = ""
+        self.queue_ms = 0.0
+        self.latency_ms = 0.0
+        self._started = time.perf_counter()
+        self._admitted: Optional[float] = None
+
+    def admitted(self) -> None:
+        '''
+        功能：
+        标记已通过准入控制，之前的时间计为排队耗时。
+
+        :return: 无
+        :rtype: None
+        '''
+        self._admitted = time.perf_counter()
+        self.queue_ms = (self._admitted - self._started) * 1000
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: Any, **kwargs: Any) -> None:
+        self.llm_calls += 1
+        params = kwargs.get("invocation_params") or {}
+        self.model = self.model or str(params.get("model_name") or params.get("model") or "")
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], **kwargs: Any) -> None:
+        self.llm_calls += 1
+
+    def on_llm_end(self, response: Any, **kwargs: Any) -> None:
+        llm_output = getattr(response, "llm_output", None) or {}
+        token_usage = llm_output.get("token_usage") or {}
+        if token_usage:
+            self.prompt_tokens += int(token_usage.get("prompt_tokens") or 0)
+            self.completion_tokens += int(token_usage.get("completion_tokens") or 0)
+        else:
+            for generations in getattr(response, "generations", None) or []:
+                for generation in generations:
+                    usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                    self.prompt_tokens += int(usage.get("input_tokens") or 0)
+                    self.completion_tokens += int(usage.get("output_tokens") or 0)
+        if llm_output.get("model_name"):
+            self.model = str(llm_output["model_name"])
+
+    def on_llm_error(self, error: BaseException, **kwargs: Any) -> None:
+        self.errors += 1
+
+    def on_retry(self, retry_state: Any, **kwargs: Any) -> None:
+        self.retries += 1
+
+    def finish(self) -> Dict[str, Any]:
+        '''
+        功能：
+        结束计时并生成一行用量记录。
+
+        :return: 用量行
+        :rtype: Dict[str, Any]
+        '''
+        self.latency_ms = (time.perf_counter() - (self._admitted or self._started)) * 1000
+        model = self.model or LLM_PROFILES.get(self.route, {}).get("model") or LLM_MODEL or "unknown"
+        retries = self.retries + max(0, self.http_requests - self.llm_calls)
+        return {
+            "day": datetime.now(timezone.utc).date().isoformat(),
+            "user_id": self.user_id,
+            "route": self.route,
+            "model": model,
+            "calls": 1,
+            "llm_calls": self.llm_calls,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "total_tokens": self.prompt_tokens + self.completion_tokens,
+            "cost": call_cost(model, self.prompt_tokens, self.completion_tokens),
+            "latency_ms": round(self.latency_ms, 1),
+            "latency_ms_max": round(self.latency_ms, 1),
+            "queue_ms": round(self.queue_ms, 1),
+            "retries": retries,
+            "errors": self.errors,
+            "fallbacks": {self.fallback: 1} if self.fallback else {},
+        }
+
+
+def count_http_request(_request: Any) -> None:
+    '''
+    功能：
+    httpx 请求钩子：统计当前逻辑调用发出的 HTTP 请求数（多于模型调用数的部分即客户端重试）。
+
+    :param _request: httpx 请求
+    :type _request: Any
+    :return: 无
+    :rtype: None
+    '''
+    call = _current_call.get()
+    if call is not None:
+        call.http_requests += 1
+
+
+def usage_http_client() -> Any:
+    '''
+    功能：
+    构建挂载请求计数钩子的 OpenAI 默认 HTTP 客户端（openai 版本过旧时返回 None，不统计客户端重试）。
+
+    :return: httpx.Client 或 None
+    :rtype: Any
+    '''
+    try:
+        from openai import DefaultHttpxClient
+    except ImportError:
+        return None
+    return DefaultHttpxClient(event_hooks={"request": [count_http_request]})
+
+
+class UsageAggregator:
+    '''
+    功能：
+    进程内按 (日期, 用户, 路由, 模型) 聚合用量，后台定期批量写入存储；写入失败时保留待下次重试。
+    '''
+
+    def __init__(self, flush_interval: float) -> None:
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending: Dict[Tuple[str, ...], Dict[str, Any]] = {}
+        self._totals: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self._flushed_rows = 0
+        self._flush_errors = 0
+        self._last_flush: Optional[str] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def record(self, row: Dict[str, Any]) -> None:
+        '''
+        功能：
+        累加一行用量（按聚合键合并），首次调用时启动后台刷写线程。
+
+        :param row: 用量行
+        :type row: Dict[str, Any]
+        :return: 无
+        :rtype: None
+        '''
+        key = tuple(row[f] for f in USAGE_KEY_FIELDS)
+        with self._lock:
+            self._merge(self._pending, key, row)
+            self._merge(self._totals, (row["route"], row["model"]), row)
+            if self._thread is None and self.flush_interval > 0:
+                self._thread = threading.Thread(target=self._loop, name="llm-usage-flush", daemon=True)
+                self._thread.start()
+
+    @staticmethod
+    def _merge(target: Dict[Tuple[str, ...], Dict[str, Any]], key: Tuple[str, ...], row: Dict[str, Any]) -> None:
+        entry = target.get(key)
+        if entry is None:
+            entry = {f: row[f] for f in USAGE_KEY_FIELDS}
+            target[key] = entry
+        merge_usage_row(entry, row)
+
+    def flush(self) -> int:
+        '''
+        功能：
+        将待写入的聚合行写入存储。
+
+        :return: 写入行数
+        :rtype: int
+        '''
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+            rows = list(pending.values())
+            try:
+                add_usage_rows(rows)
+            except Exception as exc:
+                with self._lock:
+                    for key, row in pending.items():
+                        self._merge(self._pending, key, row)
+                    self._flush_errors += 1
+                logger.warning("llm usage flush failed rows=%s: %s", len(rows), exc)
+                return 0
+            with self._lock:
+                self._flushed_rows += len(rows)
+                self._last_flush = datetime.now(timezone.utc).isoformat()
+            logger.info("llm usage flushed rows=%s", len(rows))
+            return len(rows)
+
+    def _loop(self) -> None:
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def snapshot(self) -> Dict[str, Any]:
+        '''
+        功能：
+        返回本进程启动以来按 (路由, 模型) 汇总的用量与刷写状态。
+
+        :return: 指标字典
+        :rtype: Dict[str, Any]
+        '''
+        with self._lock:
+            totals = [dict(entry, fallbacks=dict(entry["fallbacks"])) for entry in self._totals.values()]
+            for entry in totals:
+                del entry["day"], entry["user_id"]
+            return {
+                "pending_rows": len(self._pending),
+                "flushed_rows": self._flushed_rows,
+                "flush_errors": self._flush_errors,
+                "last_flush": self._last_flush,
+                "by_route_model": totals,
+            }
+
+
+usage_aggregator = UsageAggregator(LLM_USAGE_FLUSH_INTERVAL)
+atexit.register(usage_aggregator.flush)
+
+
+@contextmanager
+def track_usage(route: str, user_id: str = "") -> Iterator[UsageCallback]:
+    '''
+    功能：
+    采集一次逻辑调用的用量：返回的回调需传给 LangChain 调用（config={"callbacks": [...]}），
+    通过准入后调用 admitted()；结束时记录延迟、回退原因并写日志与聚合。
+    准入拒绝记为回退原因，其他异常记为错误，异常继续向上抛出。
+
+    :param route: 调用来源（decision/qa/warmup）
+    :type route: str
+    :param user_id: 用户唯一标识
+    :type user_id: str
+    :return: 用量回调
+    :rtype: Iterator[UsageCallback]
+    '''
+    call = UsageCallback(route, user_id)
+    token = _current_call.set(call)
+    try:
+        yield call
+    except AdmissionRejected as exc:
+        call.fallback = call.fallback or exc.reason
+        raise
+    except Exception as exc:
+        call.errors = max(call.errors, 1)
+        call.fallback = call.fallback or f"error:{type(exc).__name__}"
+        raise
+    finally:
+        _current_call.reset(token)
+        row = call.finish()
+        logger.info(
+            "llm_usage route=%s user_id=%s model=%s llm_calls=%s prompt_tokens=%s completion_tokens=%s "
+            "cost=%.6f latency_ms=%s queue_ms=%s retries=%s errors=%s fallback=%s",
+            route,
+            user_id,
+            row["model"],
+            row["llm_calls"],
+            row["prompt_tokens"],
+            row["completion_tokens"],
+            row["cost"],
+            row["latency_ms"],
+            row["queue_ms"],
+            row["retries"],
+            row["errors"],
+            call.fallback or "-",
+        )
+        usage_aggregator.record(row)
+
+
+def usage_stats() -> Dict[str, Any]:
+    '''
+    功能：
+    返回本进程 LLM 用量指标。
+
+    :return: 指标字典
+    :rtype: Dict[str, Any]
+    '''
+    return usage_aggregator.snapshot()
+
+
+def query_usage(
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    user_id: Optional[str] = None,
+    route: Optional[str] = None,
+    model: Optional[str] = None,
+    group_by: Tuple[str, ...] = ("route", "model"),
+) -> List[Dict[str, Any]]:
+    '''
+    功能：
+    先刷写本进程待写入的用量，再从存储读取并按指定维度汇总（附平均延迟）。
+
+    :param since: 起始日期（含，YYYY-MM-DD）
+    :type since: Optional[str]
+    :param until: 结束日期（含，YYYY-MM-DD）
+    :type until: Optional[str]
+    :param user_id: 只统计该用户
+    :type user_id: Optional[str]
+    :param route: 只统计该路由
+    :type route: Optional[str]
+    :param model: 只统计该模型
+    :type model: Optional[str]
+    :param group_by: 汇总维度（day/user_id/route/model 的子集）
+    :type group_by: Tuple[str, ...]
+    :return: 汇总行
+    :rtype: List[Dict[str, Any]]
+    '''
+    from .memory_store import iter_usage_rows
+
+    usage_aggregator.flush()
+    groups: Dict[Tuple[str, ...], Dict[str, Any]] = {}
+    for row in iter_usage_rows(since, until, user_id):
+        if route and row["route"] != route:
+            continue
+        if model and row["model"] != model:
+            continue
+        key = tuple(row[f] for f in group_by)
+        entry = groups.get(key)
+        if entry is None:
+            entry = {f: row[f] for f in group_by}
+            groups[key] = entry
+        merge_usage_row(entry, row)
+    result = list(groups.values())
+    for entry in result:
+        calls = entry.get("calls") or 0
+        entry["cost"] = round(entry.get("cost", 0.0), 6)
+        entry["latency_ms"] = round(entry.get("latency_ms", 0.0), 1)
+        entry["latency_ms_avg"] = round(entry["latency_ms"] / calls, 1) if calls else 0.0
+    return result
@@ -0,0 +1,146 @@
+﻿# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+from .config import LLM_WARMUP_PING, WARMUP_RETRY_INTERVAL
+from .decision_engine import build_decision_table
+from .label_stats import warm_segment_stats
+from .memory_store import warm_store
+
+logger = logging.getLogger("agent")
+
+_ready = threading.Event()
+_status_lock = threading.Lock()
+_status: Dict[str, Any] = {"started_at": None, "finished_at": None, "attempts": 0, "steps": {}}
+_started = False
+
+
+def _warm_decision_table() -> Dict[str, Any]:
+    table = build_decision_table()
+    return {"season": table.season, "entries": len(table)}
+
+
+def _warm_llm() -> Dict[str, Any]:
+    from .llm_agent import ping_llm, warm_llm_clients
+
+    clients = warm_llm_clients()
+    if not LLM_WARMUP_PING:
+        return {"clients": clients, "ping": "skipped"}
+    pings: Dict[str, Any] = {}
+    for name in clients:
+        route, endpoint = name.split(":", 1)
+        started = time.perf_counter()
+        try:
+            ping_llm(route, endpoint)
+        except Exception as exc:
+            # 模型服务不可用时决策仍可降级为规则草案，不阻塞就绪
+            logger.warning("llm warm-up ping failed endpoint=%s: %s", name, exc)
+            pings[name] = f"failed: {exc}"
+            continue
+        pings[name] = round((time.perf_counter() - started) * 1000, 1)
+    return {"clients": clients, "ping_ms": pings}
+
+
+# (名称, 函数, 失败是否阻塞就绪)
+WARMUP_STEPS: List[Tuple[str, Callable[[], Dict[str, Any]], bool]] = [
+    ("store", warm_store, True),
+    ("segment_stats", warm_segment_stats, False),
+    ("decision_table", _warm_decision_table, True),
+    ("llm", _warm_llm, False),
+]
+
+
+def run_warmup() -> bool:
+    '''
+    功能：
+    依次执行预热步骤（已成功的步骤不重复执行），全部必需步骤成功后标记就绪。
+
+    :return: 是否就绪
+    :rtype: bool
+    '''
+    with _status_lock:
+        _status["attempts"] += 1
+        if _status["started_at"] is None:
+            _status["started_at"] = time.time()
+    ok = True
+    for name, step, required in WARMUP_STEPS:
+        with _status_lock:
+            if _status["steps"].get(name, {}).get("ok"):
+                continue
+        started = time.perf_counter()
+        try:
+            detail = step()
+            result = {"ok": True, "detail": detail}
+        except Exception as exc:
+            logger.warning("warm-up step %s failed: %s", name, exc)
+            result = {"ok": False, "error": str(exc)}
+            if required:
+                ok = False
+        result["ms"] = round((time.perf_counter() - started) * 1000, 1)
+        with _status_lock:
+            _status["steps"][name] = result
+    if ok:
+        with _status_lock:
+            _status["finished_at"] = time.time()
+        _ready.set()
+        logger.info("warm-up done %s", warmup_status())
+    return ok
+
+
+def _warmup_loop() -> None:
+    while not run_warmup():
+        time.sleep(WARMUP_RETRY_INTERVAL)
+
+
+def start_warmup(background: bool = True) -> None:
+    '''
+    功能：
+    启动预热（只执行一次）；后台模式下失败会按 WARMUP_RETRY_INTERVAL 重试，期间 /readyz 返回 503。
+
+    :param background: 是否在后台线程执行
+    :type background: bool
+    :return: 无
+    :rtype: None
+    '''
+    global _started
+    with _status_lock:
+        if _started:
+            return
+        _started = True
+    if background:
+        threading.Thread(target=_warmup_loop, name="warmup", daemon=True).start()
+    else:
+        _warmup_loop()
+
+
+def is_ready() -> bool:
+    '''
+    功能：
+    是否已完成预热。
+
+    :return: 是否就绪
+    :rtype: bool
+    '''
+    return _ready.is_set()
+
+
+def warmup_status() -> Dict[str, Any]:
+    '''
+    功能：
+    返回预热状态（各步骤结果与耗时）。
+
+    :return: 状态字典
+    :rtype: Dict[str, Any]
+    '''
+    with _status_lock:
+        return {
+            "ready": _ready.is_set(),
+            "attempts": _status["attempts"],
+            "started_at": _status["started_at"],
+            "finished_at": _status["finished_at"],
+            "steps": {name: dict(result) for name, result in _status["steps"].items()},
+        }
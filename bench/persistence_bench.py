@@ -0,0 +1,132 @@
+﻿# -*- coding: utf-8 -*-
+"""
+memory 后端持久化基准：快照写入、不同 fsync 策略下的日志追加吞吐，以及
+“快照 + 日志尾部”启动恢复耗时（默认一百万用户）。
+
+用法：
+    python -m bench.persistence_bench --users 1000000 --aof-records 100000
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+from typing import Any, Dict, Iterator, Tuple
+
+from bench.store_bench import _seed_state
+
+
+class _SeedStates:
+    '''按需生成用户状态字节，写快照时不需要在内存中持有全部用户。'''
+
+    def __init__(self, users: int, history: int) -> None:
+        from agent.persistence import encode_value
+
+        self.users = users
+        self.template = encode_value(_bench_state("bench-0", history))
+
+    def __len__(self) -> int:
+        return self.users
+
+    def items(self) -> Iterator[Tuple[str, bytes]]:
+        for i in range(self.users):
+            user_id = f"bench-{i}"
+            yield user_id, self.template.replace(b"bench-0", user_id.encode("utf-8"))
+
+
+def _bench_state(user_id: str, history: int) -> Dict[str, Any]:
+    state = _seed_state(user_id)
+    state["history"] = state["history"][-history:] if history else []
+    return state
+
+
+def bench_aof(directory: str, policy: str, records: int, users: int, history: int) -> Dict[str, Any]:
+    from agent.persistence import MemoryPersistence
+
+    persist = MemoryPersistence(directory, policy)
+    persist.recover({}, {}, 24)
+    state = _bench_state("bench-0", history)
+    started = time.perf_counter()
+    for i in range(records):
+        state["user_id"] = f"bench-{i % users}"
+        state["onboarding_step"] = i
+        persist.log_state(state["user_id"], state)
+    persist.sync()
+    elapsed = time.perf_counter() - started
+    persist.close()
+    return {
+        "fsync": policy,
+        "records": records,
+        "records_per_sec": round(records / elapsed, 1),
+        "us_per_record": round(elapsed / records * 1e6, 1),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="memory store persistence benchmark")
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--aof-records", type=int, default=100_000, help="恢复时回放的日志条数")
+    parser.add_argument("--always-records", type=int, default=2000, help="fsync=always 下测试的条数")
+    parser.add_argument("--history", type=int, default=5, help="每个用户状态中的历史决策条数")
+    parser.add_argument("--dir", default="")
+    args = parser.parse_args()
+
+    from agent.persistence import MemoryPersistence, decode_value, write_snapshot
+
+    directory = args.dir or tempfile.mkdtemp(prefix="dysmartselect-persist-")
+    os.makedirs(directory, exist_ok=True)
+    try:
+        for policy, records in (("no", args.aof_records), ("everysec", args.aof_records), ("always", args.always_records)):
+            sub = os.path.join(directory, f"aof-{policy}")
+            print(json.dumps(bench_aof(sub, policy, records, args.users, args.history), ensure_ascii=False))
+            shutil.rmtree(sub, ignore_errors=True)
+
+        data_dir = os.path.join(directory, "data")
+        os.makedirs(data_dir, exist_ok=True)
+        states = _SeedStates(args.users, args.history)
+        started = time.perf_counter()
+        size = write_snapshot(os.path.join(data_dir, "snapshot.bin"), 1, states, {})
+        snapshot_sec = time.perf_counter() - started
+        print(json.dumps({
+            "snapshot_users": args.users,
+            "state_bytes": len(states.template),
+            "snapshot_mb": round(size / 1e6, 1),
+            "snapshot_write_sec": round(snapshot_sec, 2),
+        }))
+
+        writer = MemoryPersistence(data_dir, "no")
+        writer.recover({}, {}, 24)
+        state = _bench_state("bench-0", args.history)
+        for i in range(args.aof_records):
+            state["user_id"] = f"bench-{i % args.users}"
+            state["onboarding_step"] = i
+            writer.log_state(state["user_id"], state)
+        writer.close()
+
+        recovered: Dict[str, Any] = {}
+        started = time.perf_counter()
+        stats = MemoryPersistence(data_dir, "no").recover(recovered, {}, 24)
+        recover_sec = time.perf_counter() - started
+
+        started = time.perf_counter()
+        sample = [decode_value(recovered[f"bench-{i}"]) for i in range(0, args.users, max(args.users // 10000, 1))]
+        decode_sec = (time.perf_counter() - started) / len(sample)
+        print(json.dumps({
+            "recover_sec": round(recover_sec, 2),
+            "snapshot_load_sec": stats["snapshot_sec"],
+            "aof_records": stats["aof_records"],
+            "users": len(recovered),
+            "first_access_decode_us": round(decode_sec * 1e6, 1),
+            "full_decode_estimate_sec": round(decode_sec * len(recovered), 1),
+        }))
+    finally:
+        if not args.dir:
+            shutil.rmtree(directory, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
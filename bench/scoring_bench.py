@@ -0,0 +1,138 @@
+﻿# -*- coding: utf-8 -*-
+"""
+大目录并行打分基准：生成合成候选目录，先校验 ParallelScorer 与逐个 score_candidate
+（按 DecisionTable 的过滤、兜底与稳定排序）的结果完全一致，再对比单进程逐个打分与
+1..N 个工作进程的单请求延迟、批量吞吐与加速比。
+
+用法：
+    python -m bench.scoring_bench --candidates 300000 --workers 1,2,4,8
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import random
+import time
+from typing import Any, Dict, List, Tuple
+
+CATEGORIES = ("top", "pants", "outer", "set")
+
+
+def _catalog(size: int, seed: int) -> List[Dict[str, Any]]:
+    from agent.parallel_scoring import SEASONS, STAGES
+
+    rnd = random.Random(seed)
+    risk_choices = ([], [], ["return_risk"], ["homogeneous"], ["return_risk", "homogeneous"])
+    catalog = []
+    for i in range(size):
+        catalog.append({
+            "label": f"sku-{i:07d}",
+            "categories": rnd.sample(CATEGORIES, rnd.randint(1, 2)),
+            "price_mid": rnd.randint(30, 400),
+            "stage_fit": rnd.choice(STAGES),
+            "risk_tags": rnd.choice(risk_choices),
+            "season": rnd.choice(SEASONS),
+        })
+    return catalog
+
+
+def _requests(count: int, seed: int) -> List[Any]:
+    from agent.models import DecisionRequest
+
+    rnd = random.Random(seed)
+    reqs = []
+    for _ in range(count):
+        low = rnd.randint(30, 380)
+        reqs.append(DecisionRequest(
+            user_id="bench",
+            category=rnd.choice(CATEGORIES),
+            price_band=f"{low}-{low + rnd.randint(0, 80)}",
+            account_stage=rnd.choice(("explore", "converge")),
+            daily_slots=rnd.randint(1, 3),
+            in_stock=rnd.random() < 0.8,
+        ))
+    return reqs
+
+
+def _reference(req: Any, catalog: List[Dict[str, Any]], k: int, scope: str) -> Tuple[List[Tuple[int, str]], bool]:
+    from agent.decision_engine import hard_filters, score_candidate, timing_heuristic
+
+    candidates = catalog
+    if scope == "category":
+        candidates = [c for c in catalog if req.category in c["categories"]] or catalog
+    passed = [c for c in candidates if not hard_filters(req, c)[0] and not timing_heuristic(c)[0]]
+    fallback = not passed
+    scored = [(score_candidate(req, c), c) for c in (candidates if fallback else passed)]
+    ranked = sorted(scored, key=lambda x: x[0], reverse=True)[:k]
+    return [(score, c["label"]) for score, c in ranked], fallback
+
+
+def _labels(result: Tuple[List[Tuple[int, Dict[str, Any]]], bool]) -> Tuple[List[Tuple[int, str]], bool]:
+    ranked, fallback = result
+    return [(score, c["label"]) for score, c in ranked], fallback
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="parallel scoring benchmark")
+    parser.add_argument("--candidates", type=int, default=300000)
+    parser.add_argument("--workers", default="1,2,4", help="逗号分隔的工作进程数")
+    parser.add_argument("--requests", type=int, default=20, help="单请求延迟测试的请求数")
+    parser.add_argument("--batch", type=int, default=64, help="批量吞吐测试的批大小")
+    parser.add_argument("--verify", type=int, default=5, help="与 score_candidate 逐个比对的请求数")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    from agent.parallel_scoring import ParallelScorer
+
+    catalog = _catalog(args.candidates, args.seed)
+    reqs = _requests(max(args.requests, args.verify), args.seed + 1)
+    batch = _requests(args.batch, args.seed + 2)
+    results: Dict[str, Any] = {"candidates": args.candidates, "cpu_count": os.cpu_count(), "k": args.k}
+
+    # 基线：单进程逐个 score_candidate
+    started = time.perf_counter()
+    expected = {
+        (i, scope): _reference(req, catalog, args.k, scope)
+        for i, req in enumerate(reqs[: args.verify])
+        for scope in ("category", "all")
+    }
+    baseline_ms = (time.perf_counter() - started) * 1000 / max(len(expected), 1)
+    results["score_candidate_ms_per_request"] = round(baseline_ms, 1)
+
+    runs = []
+    for workers in [int(w) for w in args.workers.split(",") if w.strip()]:
+        scorer = ParallelScorer(catalog, workers)
+        try:
+            scorer.rank(reqs[0], args.k)  # 启动进程池并挂载共享内存
+            mismatches = sum(
+                _labels(scorer.rank(reqs[i], args.k, scope)) != want for (i, scope), want in expected.items()
+            )
+
+            started = time.perf_counter()
+            for req in reqs[: args.requests]:
+                scorer.rank(req, args.k)
+            single_ms = (time.perf_counter() - started) * 1000 / args.requests
+
+            started = time.perf_counter()
+            scorer.rank_many(batch, args.k)
+            batch_sec = time.perf_counter() - started
+        finally:
+            scorer.close()
+        runs.append({
+            "workers": workers,
+            "mismatches": mismatches,
+            "ms_per_request": round(single_ms, 2),
+            "batch_requests_per_sec": round(len(batch) / batch_sec, 1),
+        })
+    base = runs[0]["batch_requests_per_sec"] if runs else 0
+    for run in runs:
+        run["speedup"] = round(run["batch_requests_per_sec"] / base, 2) if base else None
+    results["runs"] = runs
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+    return 1 if any(run["mismatches"] for run in runs) else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,128 @@
+﻿# -*- coding: utf-8 -*-
+"""
+存储后端基准：对比 memory（进程内）、shm（单机共享内存）与 postgres 后端的
+get_state/set_state/聊天历史吞吐与延迟。
+
+用法：
+    python -m bench.store_bench --backends memory,shm --processes 4
+    STORE_BACKEND=postgres POSTGRES_DSN=... python -m bench.store_bench --backends postgres
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from multiprocessing import Pool
+from typing import Any, Dict, List
+
+
+def _seed_state(user_id: str) -> Dict[str, Any]:
+    from agent.state import default_state, utc_now
+
+    state = default_state(user_id)
+    for i in range(30):
+        state["history"].append({
+            "ts": utc_now(),
+            "decision_id": f"{user_id}-{i:04d}",
+            "label": "基础短袖T恤",
+            "category": "top",
+            "price_band": "79-129",
+            "in_stock": True,
+            "decision": "strong",
+            "outcome": None,
+        })
+    state["defer_pool"]["加绒卫衣"] = {
+        "reason": "季节不匹配，时机不足",
+        "first_seen": utc_now(),
+        "last_seen": utc_now(),
+        "hits": 10,
+    }
+    return state
+
+
+def _configure(backend: str, shm_path: str) -> None:
+    from agent import memory_store
+
+    memory_store.STORE_BACKEND = backend
+    memory_store.SHM_STORE_PATH = shm_path
+
+
+def _worker(args) -> List[float]:
+    backend, shm_path, users, ops, read_ratio, seed = args
+    _configure(backend, shm_path)
+    from agent.memory_store import append_chat_history, get_chat_history, get_state, set_state
+
+    rnd = random.Random(seed)
+    latencies: List[float] = []
+    for _ in range(ops):
+        user_id = f"bench-{rnd.randrange(users)}"
+        started = time.perf_counter()
+        roll = rnd.random()
+        if roll < read_ratio:
+            get_state(user_id)
+        elif roll < read_ratio + (1 - read_ratio) / 2:
+            state = get_state(user_id)
+            state["onboarding_step"] = state.get("onboarding_step", 0) + 1
+            set_state(state)
+        else:
+            get_chat_history(user_id)
+            append_chat_history(user_id, "user", "今天拍哪一款？")
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def run_backend(
+    backend: str, users: int, ops: int, processes: int, read_ratio: float
+) -> Dict[str, Any]:
+    shm_path = os.path.join(tempfile.gettempdir(), f"dysmartselect-bench-{os.getpid()}.store")
+    _configure(backend, shm_path)
+    from agent.memory_store import set_state
+
+    for i in range(users):
+        set_state(_seed_state(f"bench-{i}"))
+
+    started = time.perf_counter()
+    tasks = [(backend, shm_path, users, ops, read_ratio, seed) for seed in range(processes)]
+    if processes == 1:
+        results = [_worker(tasks[0])]
+    else:
+        with Pool(processes) as pool:
+            results = pool.map(_worker, tasks)
+    elapsed = time.perf_counter() - started
+
+    if os.path.exists(shm_path):
+        os.remove(shm_path)
+
+    latencies = sorted(x for r in results for x in r)
+    total = len(latencies)
+    return {
+        "backend": backend,
+        "processes": processes,
+        "ops": total,
+        "ops_per_sec": round(total / elapsed, 1),
+        "p50_us": round(latencies[total // 2] * 1e6, 1),
+        "p99_us": round(latencies[int(total * 0.99)] * 1e6, 1),
+        "note": "memory 后端各进程数据互相独立" if backend == "memory" and processes > 1 else "",
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="store backend benchmark")
+    parser.add_argument("--backends", default="memory,shm")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--ops", type=int, default=20000, help="每个进程的操作数")
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--read-ratio", type=float, default=0.8)
+    args = parser.parse_args()
+
+    for backend in args.backends.split(","):
+        result = run_backend(backend.strip(), args.users, args.ops, args.processes, args.read_ratio)
+        print(json.dumps(result, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())